@@ -87,6 +87,27 @@ def do_not_recurse(value):
     return value
 
 
+def _is_preprocessed_dataset(callable, kwargs):
+    """
+    Returns True if `callable` is a dataset class called with a
+    `preprocessor` argument, and the preprocessed dataset cache is
+    enabled.
+
+    Parameters
+    ----------
+    callable : callable
+        The function/class called to instantiate a node.
+    kwargs : dict
+        The instantiated keyword arguments of the call.
+    """
+    if kwargs.get('preprocessor') is None or not isinstance(callable, type):
+        return False
+    from pylearn2.datasets import preprocessed_cache
+    from pylearn2.datasets.dataset import Dataset
+    return (issubclass(callable, Dataset) and
+            preprocessed_cache.get_cache() is not None)
+
+
 def _instantiate_proxy_tuple(proxy, bindings=None):
     """
     Helper function for `_instantiate` that handles objects of the `Proxy`
@@ -119,7 +140,13 @@ def _instantiate_proxy_tuple(proxy, bindings=None):
                                           'supported in proxy instantiation')
             kwargs = dict((k, _instantiate(v, bindings))
                           for k, v in six.iteritems(proxy.keywords))
-            obj = checked_call(proxy.callable, kwargs)
+            if _is_preprocessed_dataset(proxy.callable, kwargs):
+                # Reuse the result of preprocessing from the cache
+                from pylearn2.datasets import preprocessed_cache
+                obj = preprocessed_cache.instantiate(proxy.callable, kwargs,
+                                                     proxy.yaml_src)
+            else:
+                obj = checked_call(proxy.callable, kwargs)
         try:
             obj.yaml_src = proxy.yaml_src
         except AttributeError:  # Some classes won't allow this.
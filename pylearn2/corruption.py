@@ -1,6 +1,17 @@
 """
 Corruptor classes: classes that encapsulate the noise process for the DAE
 training criterion.
+
+By default, the noise is drawn from Theano random streams for every
+minibatch, which can take a large share of each update on the CPU. The
+Binomial, Dropout, Gaussian, SaltPepper and OneHot corruptors accept a
+`pool_size` argument: they then draw a pool of noise values with NumPy
+once, ahead of time, and corrupt each minibatch with a window of
+consecutive values of the pool starting at a random position. Only one
+random number is generated per minibatch. The noise of each minibatch
+has the same distribution as without a pool, but the noise of
+different minibatches is correlated, since they reuse values of the
+same pool. The pool can be drawn again with `Corruptor.refresh_pool`.
 """
 # Third-party imports
 from __future__ import print_function
@@ -8,6 +19,7 @@ from __future__ import print_function
 import numpy
 import theano
 from theano import tensor
+from theano.tensor.opt import Assert
 T = tensor
 from pylearn2.utils.rng import make_np_rng
 
@@ -23,6 +35,67 @@ else:
 
 from pylearn2.expr.activations import rescaled_softmax
 
+
+class NoisePool(object):
+    """
+    A vector of noise values drawn ahead of time, from which windows of
+    consecutive values are taken at random positions.
+
+    Parameters
+    ----------
+    draw : callable
+        `draw(rng, size)` returns a vector of `size` noise values.
+    size : int
+        The number of values in the pool. It must be at least the
+        number of values in a window.
+    rng : RandomState object
+        NumPy random number generator used to draw the values.
+    """
+
+    def __init__(self, draw, size, rng):
+        self.draw = draw
+        self.size = size
+        self.rng = rng
+        self.values = theano.shared(self._draw_values(), name='noise_pool')
+
+    def _draw_values(self):
+        """
+        Draws the values of the pool, repeated twice so that every
+        window is a contiguous slice.
+        """
+        values = self.draw(self.rng, self.size)
+        return numpy.concatenate([values, values])
+
+    def refresh(self):
+        """
+        Draws new values into the pool.
+        """
+        self.values.set_value(self._draw_values())
+
+    def window(self, s_rng, num):
+        """
+        Returns a window of the pool starting at a random position.
+
+        Parameters
+        ----------
+        s_rng : RandomStreams
+            Theano random streams used to draw the position.
+        num : scalar tensor_like
+            The number of values in the window.
+
+        Returns
+        -------
+        window : tensor_like
+            Theano symbolic vector of `num` consecutive values of the
+            pool.
+        """
+        num = Assert("The batch is larger than the noise pool")(
+            num, T.le(num, self.size))
+        position = s_rng.uniform(size=(1,), dtype='float64')[0] * self.size
+        start = T.minimum(T.cast(position, 'int64'), self.size - 1)
+        return self.values[start:start + num]
+
+
 class Corruptor(object):
     """
     .. todo::
@@ -37,14 +110,77 @@ class Corruptor(object):
     rng : RandomState object or seed, optional
         NumPy random number generator object (or seed for creating one)
         used to initialize a `RandomStreams`.
+    pool_size : int, optional
+        If not None, the number of noise values drawn ahead of time
+        (see the module docstring). It must be at least the number of
+        noise values of a minibatch, and should be several times
+        larger, to reduce the correlation between minibatches. Only
+        supported by the corruptors whose `supports_pool` is True.
     """
 
-    def __init__(self, corruption_level, rng=2001):
+    supports_pool = False
+
+    def __init__(self, corruption_level, rng=2001, pool_size=None):
         # The default rng should be build in a deterministic way
         rng = make_np_rng(rng, which_method=['randn', 'randint'])
         seed = int(rng.randint(2 ** 30))
         self.s_rng = RandomStreams(seed)
         self.corruption_level = corruption_level
+        if pool_size is not None and not self.supports_pool:
+            raise ValueError("%s does not support noise pools" %
+                             type(self).__name__)
+        self.pool_size = pool_size
+        self._pool = None
+        if pool_size is not None:
+            self._pool_rng = numpy.random.RandomState(rng.randint(2 ** 30))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The pool is drawn again when the corruptor is next used
+        state['_pool'] = None
+        return state
+
+    def _use_pool(self):
+        """
+        Returns True if the noise is taken from a pool.
+        """
+        return getattr(self, 'pool_size', None) is not None
+
+    def _pool_window(self, num):
+        """
+        Returns a window of `num` values of the noise pool, drawing
+        the pool with `self._draw_pool` if needed.
+        """
+        if self._pool is None:
+            self._pool = NoisePool(self._draw_pool, self.pool_size,
+                                   self._pool_rng)
+        return self._pool.window(self.s_rng, num)
+
+    def _draw_pool(self, rng, size):
+        """
+        Draws the values of the noise pool.
+
+        Parameters
+        ----------
+        rng : RandomState object
+            NumPy random number generator.
+        size : int
+            The number of values to draw.
+
+        Returns
+        -------
+        values : numpy.ndarray
+            Vector of `size` noise values.
+        """
+        raise NotImplementedError()
+
+    def refresh_pool(self):
+        """
+        Draws new values into the noise pool, if it is used. Functions
+        already compiled use the new values.
+        """
+        if getattr(self, '_pool', None) is not None:
+            self._pool.refresh()
 
     def __call__(self, inputs):
         """
@@ -122,6 +258,16 @@ class BinomialCorruptor(Corruptor):
     0 < `corruption_level` < 1.
     """
 
+    supports_pool = True
+
+    def _draw_pool(self, rng, size):
+        """
+        Draws a pool of binary masks, equal to 1 with probability
+        1 - `corruption_level`.
+        """
+        return numpy.asarray(rng.random_sample(size) <
+                             1 - self.corruption_level, dtype='int8')
+
     def _corrupt(self, x):
         """
         Corrupts a single tensor_like object.
@@ -138,6 +284,9 @@ class BinomialCorruptor(Corruptor):
         corrupted : tensor_like
             Theano symbolic representing the corresponding corrupted input.
         """
+        if self._use_pool():
+            mask = self._pool_window(x.size).reshape(x.shape, ndim=x.ndim)
+            return T.cast(mask, theano.config.floatX) * x
         return self.s_rng.binomial(
             size=x.shape,
             n=1,
@@ -186,11 +335,23 @@ class GaussianCorruptor(Corruptor):
     ----------
     stdev : WRITEME
     rng : WRITEME
+    pool_size : int, optional
+        See `Corruptor`.
     """
 
-    def __init__(self, stdev, rng=2001):
+    supports_pool = True
+
+    def __init__(self, stdev, rng=2001, pool_size=None):
         super(GaussianCorruptor, self).__init__(corruption_level=stdev,
-                                                rng=rng)
+                                                rng=rng,
+                                                pool_size=pool_size)
+
+    def _draw_pool(self, rng, size):
+        """
+        Draws a pool of Gaussian noise values.
+        """
+        return numpy.asarray(rng.normal(0., self.corruption_level, size),
+                             dtype=theano.config.floatX)
 
     def _corrupt(self, x):
         """
@@ -208,6 +369,10 @@ class GaussianCorruptor(Corruptor):
         corrupted : tensor_like
             Theano symbolic representing the corresponding corrupted input.
         """
+        if self._use_pool():
+            noise = self._pool_window(x.size).reshape(x.shape, ndim=x.ndim)
+            return noise + x
+
         noise = self.s_rng.normal(
             size=x.shape,
             avg=0.,
@@ -238,6 +403,22 @@ class SaltPepperCorruptor(Corruptor):
     Sets some elements of the tensor to 0 or 1. Only really makes sense
     to use on binary valued matrices.
     """
+
+    supports_pool = True
+
+    def _draw_pool(self, rng, size):
+        """
+        Draws a pool of codes: 1 (keep the input) with probability
+        1 - `corruption_level`, and otherwise 0 or 2 (set the input to 0
+        or to 1) with equal probability.
+        """
+        u = rng.random_sample(size)
+        keep = 1 - self.corruption_level
+        codes = numpy.ones(size, dtype='int8')
+        codes[u >= keep] = 0
+        codes[u >= keep + self.corruption_level / 2.] = 2
+        return codes
+
     def _corrupt(self, x):
         """
         Corrupts a single tensor_like object.
@@ -254,6 +435,12 @@ class SaltPepperCorruptor(Corruptor):
         corrupted : tensor_like
             Theano symbolic representing the corresponding corrupted input.
         """
+        if self._use_pool():
+            codes = self._pool_window(x.size).reshape(x.shape, ndim=x.ndim)
+            a = T.cast(T.eq(codes, 1), theano.config.floatX)
+            c = T.cast(T.eq(codes, 2), theano.config.floatX)
+            return x * a + c
+
         a = self.s_rng.binomial(
             size=x.shape,
             p=(1 - self.corruption_level),
@@ -275,6 +462,17 @@ class OneHotCorruptor(Corruptor):
     Corrupts a one-hot vector by changing active element with some
     probability.
     """
+
+    supports_pool = True
+
+    def _draw_pool(self, rng, size):
+        """
+        Draws a pool of uniform values in [0, 1), used both to decide
+        which rows are kept and to pick the new active elements.
+        """
+        return numpy.asarray(rng.random_sample(size),
+                             dtype=theano.config.floatX)
+
     def _corrupt(self, x):
         """
         Corrupts a single tensor_like object.
@@ -294,6 +492,18 @@ class OneHotCorruptor(Corruptor):
         num_examples = x.shape[0]
         num_classes = x.shape[1]
 
+        if self._use_pool():
+            u = self._pool_window(2 * num_examples)
+            keep_mask = T.lt(u[:num_examples], 1 - self.corruption_level)
+            keep_mask = keep_mask.dimshuffle(0, 'x')
+            # the new active elements, drawn uniformly
+            active = T.minimum(T.cast(u[num_examples:] * num_classes,
+                                      'int64'),
+                               num_classes - 1)
+            one_hot = T.eq(T.arange(num_classes).dimshuffle('x', 0),
+                           active.dimshuffle(0, 'x'))
+            return keep_mask * x + (1 - keep_mask) * one_hot
+
         keep_mask = T.addbroadcast(
             self.s_rng.binomial(
                 size=(num_examples, 1),
@@ -303,9 +513,11 @@ class OneHotCorruptor(Corruptor):
             1
         )
 
-        # generate random one-hot matrix
-        pvals = T.alloc(1.0 / num_classes, num_classes)
-        one_hot = self.s_rng.multinomial(size=(num_examples,), pvals=pvals)
+        # generate random one-hot matrix, one row of pvals per example
+        pvals = T.alloc(numpy.asarray(1.0, dtype=theano.config.floatX) /
+                        T.cast(num_classes, theano.config.floatX),
+                        num_examples, num_classes)
+        one_hot = self.s_rng.multinomial(pvals=pvals, dtype=x.dtype)
 
         return keep_mask * x + (1 - keep_mask) * one_hot
 
@@ -15,12 +15,40 @@ __maintainer__ = "Steven Kearnes"
 
 from copy import deepcopy
 import os
+import shutil
+import tempfile
 
 from pylearn2.cross_validation.mlp import PretrainedLayerCV
 from pylearn2.train import Train, SerializationGuard
+from pylearn2.utils import array_pickle
 from pylearn2.utils import serial
 
 
+def _train_fold(args):
+    """
+    Trains one fold in a worker process of `TrainCV.main_loop`.
+
+    Parameters
+    ----------
+    args : tuple
+        The array pickle file holding the list of Train objects, the
+        index of the fold to train and the time budget.
+
+    Returns
+    -------
+    model : Model
+        The trained model.
+    extensions : list
+        The extensions of the trainer, with their state after training.
+    """
+    path, k, time_budget = args
+    # The datasets are memory-mapped from the file, and shared with
+    # the other workers through the page cache
+    trainer = array_pickle.load(path, mmap_mode='c')[k]
+    trainer.main_loop(time_budget)
+    return trainer.model, trainer.extensions
+
+
 class TrainCV(object):
     """
     Wrapper for Train that partitions the dataset according to a given
@@ -114,7 +142,7 @@ class TrainCV(object):
             extension.setup(self.trainers)
 
     def main_loop(self, time_budget=None, parallel=False, client_kwargs=None,
-                  view_flags=None):
+                  view_flags=None, num_workers=None):
         """
         Run main_loop of each trainer.
 
@@ -126,16 +154,23 @@ class TrainCV(object):
         time_budget : int, optional
             The maximum number of seconds before interrupting
             training. Default is `None`, no time limit.
-        parallel : bool, optional
+        parallel : bool or str, optional
             Whether to train subtrainers in parallel using
-            IPython.parallel (default False).
+            IPython.parallel (default False). If 'local', subtrainers are
+            trained in parallel by a pool of local processes instead (see
+            `train_local`).
         client_kwargs : dict, optional
             Keyword arguments for IPython.parallel Client.
         view_flags : dict, optional
             Flags for IPython.parallel LoadBalancedView.
+        num_workers : int, optional
+            Number of processes used when `parallel` is 'local'. Defaults
+            to the number of CPUs.
         """
         self.setup()
-        if parallel:
+        if parallel == 'local':
+            self.train_local(time_budget, num_workers)
+        elif parallel:
             from IPython.parallel import Client
 
             def _train(trainer, time_budget=None):
@@ -170,6 +205,52 @@ class TrainCV(object):
                 trainer.main_loop(time_budget)
         self.save()
 
+    def train_local(self, time_budget=None, num_workers=None):
+        """
+        Run main_loop of each trainer in a pool of local processes.
+
+        The trainers are saved once to a temporary array pickle file
+        (see `pylearn2.utils.array_pickle`), from which each worker
+        memory-maps the datasets of its fold instead of receiving a
+        pickled copy of them. Arrays shared by several folds are stored
+        once. The trained models and the extensions of each trainer are
+        sent back to this process, so that TrainCV extensions such as
+        `MonitorBasedSaveBestCV` can use them.
+
+        Parameters
+        ----------
+        time_budget : int, optional
+            The maximum number of seconds before interrupting
+            training. Default is `None`, no time limit.
+        num_workers : int, optional
+            Number of processes. Defaults to the number of CPUs.
+        """
+        from multiprocessing import Pool, cpu_count
+
+        if num_workers is None:
+            num_workers = cpu_count()
+        num_workers = max(1, min(num_workers, len(self.trainers)))
+        tmp_dir = tempfile.mkdtemp(prefix='train_cv-')
+        try:
+            path = os.path.join(tmp_dir, 'trainers.apkl')
+            array_pickle.dump(self.trainers, path)
+            # Use a new process for each fold, so that no state is shared
+            # between the folds trained by the same worker
+            pool = Pool(num_workers, maxtasksperchild=1)
+            try:
+                results = pool.map(_train_fold,
+                                   [(path, k, time_budget)
+                                    for k in range(len(self.trainers))],
+                                   chunksize=1)
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            shutil.rmtree(tmp_dir)
+        for trainer, (model, extensions) in zip(self.trainers, results):
+            trainer.model = model
+            trainer.extensions = extensions
+
     def save(self):
         """
         Call on_save for Train and TrainCV extensions and serialize trained
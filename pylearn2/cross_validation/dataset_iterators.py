@@ -7,6 +7,7 @@ __copyright__ = "Copyright 2014, Stanford University"
 __license__ = "3-clause BSD"
 __maintainer__ = "Steven Kearnes"
 
+import functools
 import numpy as np
 import warnings
 
@@ -25,6 +26,187 @@ from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
 from pylearn2.datasets.transformer_dataset import TransformerDataset
 
 
+class DenseDesignMatrixView(DenseDesignMatrix):
+    """
+    A DenseDesignMatrix holding a subset of the examples of a design
+    matrix (and targets) without copying them.
+
+    Batches are gathered from the original arrays by composing the
+    indices of the subset with those requested by the subset iterator,
+    so the memory used by a view is only that of its index array.
+    `get_design_matrix`, `get_topological_view`, `get_data` and
+    `get_targets` return copies of the subset's examples. Accessing `X`
+    or `y` directly replaces the view with such a copy, made once, so
+    that the arrays can be modified in place. Assigning to them (e.g.
+    when applying a preprocessor) replaces the view with the assigned
+    data.
+
+    Parameters
+    ----------
+    X : ndarray
+        The full design matrix.
+    indices : array_like
+        Indices (or boolean mask) of the examples in the subset.
+    y : ndarray, optional
+        The full targets.
+    view_converter, X_labels, y_labels, rng :
+        See `DenseDesignMatrix`.
+    """
+    def __init__(self, X, indices, y=None, view_converter=None,
+                 X_labels=None, y_labels=None,
+                 rng=DenseDesignMatrix._default_seed):
+        self.indices = None
+        self._X = None
+        self._y = None
+        super(DenseDesignMatrixView, self).__init__(
+            X=X, y=y, view_converter=view_converter, X_labels=X_labels,
+            y_labels=y_labels, rng=rng)
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        self.indices = indices
+
+    @property
+    def X(self):
+        """
+        The design matrix of the subset (the view is detached first).
+        """
+        self._detach()
+        return self._X
+
+    @X.setter
+    def X(self, X):
+        self._detach()
+        self._X = X
+
+    @property
+    def y(self):
+        """
+        The targets of the subset (the view is detached first).
+        """
+        self._detach()
+        return self._y
+
+    @y.setter
+    def y(self, y):
+        self._detach()
+        self._y = y
+
+    def _detach(self):
+        """
+        Replaces the original arrays by copies of the subset's examples.
+        """
+        if self.indices is not None:
+            self._X, self._y = self._gather(self._X), self._gather(self._y)
+            self.indices = None
+
+    def _gather(self, data):
+        """
+        Returns the subset's examples of one of the original arrays.
+        """
+        if self.indices is None or data is None:
+            return data
+        return data[self.indices]
+
+    def get_design_matrix(self, topo=None):
+        """
+        Returns the design matrix of the subset, or converts `topo` to a
+        design matrix.
+
+        Parameters
+        ----------
+        topo : ndarray, optional
+            See `DenseDesignMatrix.get_design_matrix`.
+
+        Returns
+        -------
+        X : ndarray
+            The design matrix. For a view, the examples are gathered
+            through `indices` on each call, without detaching the view.
+        """
+        if topo is not None or self.indices is None:
+            return super(DenseDesignMatrixView, self).get_design_matrix(topo)
+        return np.asarray(self._gather(self._X))
+
+    def get_topological_view(self, mat=None):
+        """
+        Converts `mat` (or the examples of the subset) to a topological
+        view.
+
+        Parameters
+        ----------
+        mat : ndarray, optional
+            See `DenseDesignMatrix.get_topological_view`.
+        """
+        if mat is None:
+            mat = self.get_design_matrix()
+        return super(DenseDesignMatrixView, self).get_topological_view(mat)
+
+    def get_data(self):
+        """
+        Returns copies of the examples of the subset.
+
+        Returns
+        -------
+        data : ndarray or 2-tuple of ndarrays
+            The design matrix, and the targets if there are any.
+        """
+        if self._y is None:
+            return self.get_design_matrix()
+        return (self.get_design_matrix(), self.get_targets())
+
+    def get_targets(self):
+        """
+        Returns the targets of the subset (a copy, for a view).
+        """
+        return self._gather(self._y)
+
+    def get(self, source, indexes):
+        """
+        Returns a batch of examples of the subset.
+
+        Parameters
+        ----------
+        source : tuple of str
+            The sources to return, 'features' and/or 'targets'.
+        indexes : slice or array_like
+            The indices of the examples, relative to the subset.
+
+        Returns
+        -------
+        batch : tuple
+            The batch of each source.
+        """
+        if self.indices is not None:
+            indexes = self.indices[indexes]
+        data = {'features': self._X, 'targets': self._y}
+        rval = []
+        for so in source:
+            if data.get(so) is None:
+                raise ValueError("The dataset does not provide a source "
+                                 "with name: %s." % so)
+            rval.append(data[so][indexes])
+        return tuple(rval)
+
+    @functools.wraps(DenseDesignMatrix.get_num_examples)
+    def get_num_examples(self):
+        if self.indices is None:
+            return self._X.shape[0]
+        return len(self.indices)
+
+    def has_targets(self):
+        """
+        Returns True if the dataset has targets.
+        """
+        return self._y is not None
+
+    def __getstate__(self):
+        return self.__dict__.copy()
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+
+
 class DatasetCV(object):
     """
     Construct a new DenseDesignMatrix for each subset.
@@ -74,10 +256,10 @@ class DatasetCV(object):
             self.which_set = which_set
         self.return_dict = return_dict
 
-    def get_data_subsets(self):
+    def get_subset_indices(self):
         """
-        Partition the dataset according to cross-validation subsets and
-        return the raw data in each subset.
+        Return the indices of the examples in each cross-validation
+        subset.
         """
         for subsets in self.subset_iterator:
             labels = None
@@ -85,31 +267,53 @@ class DatasetCV(object):
                 labels = ['train', 'valid', 'test']
             elif len(subsets) == 2:
                 labels = ['train', 'test']
+            # indices is an OrderedDict to maintain label order
+            indices = OrderedDict()
+            for i, subset in enumerate(subsets):
+                indices[labels[i]] = subset
+            yield indices
+
+    def get_data_subsets(self):
+        """
+        Partition the dataset according to cross-validation subsets and
+        return the raw data in each subset.
+        """
+        for indices in self.get_subset_indices():
             # data_subsets is an OrderedDict to maintain label order
             data_subsets = OrderedDict()
-            for i, subset in enumerate(subsets):
+            for label, subset in indices.items():
                 subset_data = tuple(data[subset] for data in self._data)
                 if len(subset_data) == 2:
                     X, y = subset_data
                 else:
                     X, = subset_data
                     y = None
-                data_subsets[labels[i]] = (X, y)
+                data_subsets[label] = (X, y)
             yield data_subsets
 
     def __iter__(self):
         """
-        Create a DenseDesignMatrix for each dataset subset and apply any
-        preprocessing to the child datasets.
+        Create a DenseDesignMatrixView for each dataset subset and apply
+        any preprocessing to the child datasets.
+
+        The views index into the data of the full dataset, so the
+        subsets are not copied unless they are preprocessed.
         """
-        for data_subsets in self.get_data_subsets():
+        if len(self._data) == 2:
+            X, y = self._data
+        else:
+            X, = self._data
+            y = None
+        for data_subsets in self.get_subset_indices():
             datasets = {}
-            for label, data in data_subsets.items():
-                X, y = data
-                datasets[label] = DenseDesignMatrix(X=X, y=y)
+            for label, subset in data_subsets.items():
+                datasets[label] = DenseDesignMatrixView(X, subset, y=y)
 
             # preprocessing
             if self.preprocessor is not None:
+                # Preprocessors may modify the data in place
+                for dataset in datasets.values():
+                    dataset._detach()
                 self.preprocessor.apply(datasets['train'],
                                         can_fit=self.fit_preprocessor)
                 for label, dataset in datasets.items():
@@ -48,6 +48,20 @@ def test_train_cv():
     os.remove(layer0_filename)
     os.remove(layer1_filename)
 
+
+def test_train_cv_local_parallel():
+    """Test TrainCV with folds trained by local processes."""
+    skip_if_no_sklearn()
+    handle, layer0_filename = tempfile.mkstemp()
+    trainer = yaml_parse.load(test_yaml_layer0 %
+                              {'layer0_filename': layer0_filename})
+    trainer.main_loop(parallel='local', num_workers=2)
+    for fold in trainer.trainers:
+        monitor = fold.model.monitor
+        assert monitor.get_epochs_seen() == 1
+        assert 'train_objective' in monitor.channels
+    os.remove(layer0_filename)
+
 test_yaml_layer0 = """
 !obj:pylearn2.cross_validation.TrainCV {
     dataset_iterator:
@@ -1,7 +1,13 @@
 """
 Test cross-validation dataset iterators.
 """
+import numpy as np
+
 from pylearn2.config import yaml_parse
+from pylearn2.cross_validation.dataset_iterators import (
+    DatasetKFold, DenseDesignMatrixView, StratifiedDatasetKFold)
+from pylearn2.datasets.preprocessing import Standardize
+from pylearn2.testing.datasets import random_one_hot_dense_design_matrix
 from pylearn2.testing.skip import skip_if_no_sklearn
 
 
@@ -115,6 +121,54 @@ def test_no_targets():
     trainer = yaml_parse.load(test_yaml_no_targets)
     trainer.main_loop()
 
+
+def test_dataset_views():
+    """Test that DatasetCV subsets are views of the full dataset."""
+    skip_if_no_sklearn()
+    rng = np.random.RandomState(0)
+    dataset = random_one_hot_dense_design_matrix(rng, 30, 4, 3)
+    iterator = StratifiedDatasetKFold(dataset, n_folds=3)
+    seen = []
+    for datasets in iterator:
+        for label, fold in datasets.items():
+            assert isinstance(fold, DenseDesignMatrixView)
+            # The examples are not copied
+            assert np.may_share_memory(fold._X, dataset.X)
+            batches = list(fold.iterator(mode='shuffled_sequential',
+                                         batch_size=4,
+                                         data_specs=fold.data_specs))
+            X = np.concatenate([X for X, y in batches])
+            y = np.concatenate([y for X, y in batches])
+            assert X.shape == (fold.get_num_examples(), 4)
+            assert np.array_equal(np.sort(X, axis=0),
+                                  np.sort(dataset.X[fold.indices], axis=0))
+            assert np.array_equal(y.sum(axis=0),
+                                  dataset.y[fold.indices].sum(axis=0))
+            # Reading the subset does not detach the view
+            assert np.array_equal(fold.get_design_matrix(),
+                                  dataset.X[fold.indices])
+            assert np.array_equal(fold.get_targets(),
+                                  dataset.y[fold.indices])
+            assert fold.indices is not None
+        seen.extend(datasets['test'].indices)
+    assert sorted(seen) == list(range(30))
+
+    # Accessing X copies the subset once, so that it can be modified
+    fold = datasets['train']
+    indices = fold.indices
+    fold.X[0] = 42.
+    assert fold.indices is None
+    assert np.all(fold.X[0] == 42.)
+    assert not np.any(dataset.X[indices[0]] == 42.)
+
+    # Preprocessing copies the subsets
+    iterator = DatasetKFold(dataset, n_folds=3,
+                            preprocessor=Standardize(), fit_preprocessor=True)
+    X = dataset.X.copy()
+    for datasets in iterator:
+        assert np.allclose(datasets['train'].X.mean(axis=0), 0, atol=1e-5)
+    assert np.array_equal(dataset.X, X)
+
 test_yaml_dataset_iterator = """
 !obj:pylearn2.cross_validation.TrainCV {
     dataset_iterator:
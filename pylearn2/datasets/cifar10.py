@@ -259,3 +259,16 @@ class CIFAR10(dense_design_matrix.DenseDesignMatrix):
                        rescale=self.rescale, gcn=self.gcn,
                        toronto_prepro=self.toronto_prepro,
                        axes=self.axes)
+
+    @classmethod
+    def get_source_files(cls, **kwargs):
+        """
+        Returns the CIFAR-10 batches, which are all read whatever the
+        set.
+        """
+        datapath = os.path.join(
+            string_utils.preprocess('${PYLEARN2_DATA_PATH}'),
+            'cifar10', 'cifar-10-batches-py')
+        return [os.path.join(datapath, name)
+                for name in ['data_batch_%i' % i for i in range(1, 6)] +
+                ['test_batch']]
@@ -12,6 +12,7 @@ __email__ = "pylearn-dev@googlegroups"
 
 
 load_data = [True]
+mmap_mode = [None]
 
 
 def pop_load_data():
@@ -38,8 +39,51 @@ def push_load_data(setting):
 
 def get_load_data():
     """
-    .. todo::
+    Returns the current load_data setting.
 
-        WRITEME
+    Returns
+    -------
+    load_data : bool or str
+        If True, datasets load their data when they are unpickled. If
+        False, they do not load it at all. If 'lazy', datasets that
+        support it defer loading until the data is first needed (e.g.
+        on the first call to `iterator`).
     """
     return load_data[-1]
+
+
+def pop_mmap_mode():
+    """
+    Restores the previous mmap_mode setting.
+    """
+    global mmap_mode
+
+    del mmap_mode[-1]
+
+
+def push_mmap_mode(setting):
+    """
+    Sets the mode used to memory-map arrays stored in separate files
+    (e.g. the `design_loc` of a DenseDesignMatrix) when they are loaded.
+
+    Parameters
+    ----------
+    setting : str or None
+        Any `mmap_mode` accepted by `numpy.load` ('r', 'r+', 'w+', 'c'),
+        or None to read the arrays into memory.
+    """
+    global mmap_mode
+
+    mmap_mode.append(setting)
+
+
+def get_mmap_mode():
+    """
+    Returns the current mmap_mode setting.
+
+    Returns
+    -------
+    mmap_mode : str or None
+        See `push_mmap_mode`.
+    """
+    return mmap_mode[-1]
@@ -2,6 +2,12 @@
 """
 A simple general csv dataset wrapper for pylearn2.
 Can do automatic one-hot encoding based on labels present in a file.
+
+CSV files are parsed a chunk of lines at a time, optionally by several
+worker processes. `CSVDataset` can save the parsed data in a binary
+.npy file next to the CSV file, which later runs memory-map instead of
+parsing the CSV file again. `CSVStreamDataset` never holds the whole
+file in memory: it parses the file while iterating over it.
 """
 __authors__ = "Zygmunt Zając"
 __copyright__ = "Copyright 2013, Zygmunt Zając"
@@ -10,15 +16,215 @@ __license__ = "3-clause BSD"
 __maintainer__ = "?"
 __email__ = "zygmunt@fastml.com"
 
+import collections
 import csv
+import hashlib
+import logging
+import multiprocessing
 import numpy as np
 import os
+from theano.compat.six.moves import xrange
 
+from pylearn2.datasets.dataset import Dataset
 from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
+from pylearn2.space import CompositeSpace, IndexSpace, VectorSpace
 from pylearn2.utils import serial
+from pylearn2.utils.iteration import (FiniteDatasetIterator,
+                                      SequentialSubsetIterator)
 from pylearn2.utils.string_utils import preprocess
 
 
+log = logging.getLogger(__name__)
+
+# Default number of lines parsed at a time
+CHUNK_SIZE = 10000
+
+
+def _parse_lines(lines, delimiter, dtype):
+    """
+    Parses a list of CSV lines into a 2D array.
+    """
+    return np.loadtxt(lines, delimiter=delimiter, dtype=dtype, ndmin=2)
+
+
+def _read_lines(path, skiprows, chunk_size):
+    """
+    Yields the lines of a file, `chunk_size` at a time, after skipping
+    the first `skiprows` lines.
+    """
+    with open(path, 'r') as f:
+        for i in xrange(skiprows):
+            f.readline()
+        lines = []
+        for line in f:
+            lines.append(line)
+            if len(lines) == chunk_size:
+                yield lines
+                lines = []
+        if lines:
+            yield lines
+
+
+def iter_csv_chunks(path, delimiter=',', skiprows=0, dtype='float64',
+                    chunk_size=CHUNK_SIZE, num_workers=None):
+    """
+    Parses a CSV file of numbers a chunk of lines at a time.
+
+    Parameters
+    ----------
+    path : str
+        The path to the CSV file.
+    delimiter : str, optional
+        The CSV file's delimiter.
+    skiprows : int, optional
+        Number of lines to skip at the beginning of the file (e.g. 1 for
+        a header line).
+    dtype : str or dtype, optional
+        The dtype of the parsed arrays.
+    chunk_size : int, optional
+        Number of lines parsed at a time.
+    num_workers : int, optional
+        If given, the chunks are parsed by this many worker processes
+        while the file is read. At most `2 * num_workers` chunks are
+        read ahead.
+
+    Returns
+    -------
+    chunks : generator
+        Yields the rows of the file as 2D arrays of `dtype`, in order.
+    """
+    lines = _read_lines(path, skiprows, chunk_size)
+    if not num_workers:
+        for chunk in lines:
+            chunk = _parse_lines(chunk, delimiter, dtype)
+            if len(chunk) > 0:
+                yield chunk
+        return
+
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        pending = collections.deque()
+        for chunk in lines:
+            pending.append(pool.apply_async(_parse_lines,
+                                            (chunk, delimiter, dtype)))
+            if len(pending) >= 2 * num_workers:
+                chunk = pending.popleft().get()
+                if len(chunk) > 0:
+                    yield chunk
+        while pending:
+            chunk = pending.popleft().get()
+            if len(chunk) > 0:
+                yield chunk
+    finally:
+        pool.terminate()
+
+
+def _cache_path(path, delimiter, skiprows, dtype):
+    """
+    Returns the path of the binary cache of a CSV file. It depends on
+    the size and modification time of the file and on the parsing
+    options, so that a stale cache is never used.
+    """
+    stat = os.stat(path)
+    key = repr((stat.st_size, stat.st_mtime, delimiter, skiprows,
+                np.dtype(dtype).str))
+    key = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return '%s.cache-%s.npy' % (path, key)
+
+
+def load_csv(path, delimiter=',', skiprows=0, dtype='float64',
+             chunk_size=CHUNK_SIZE, num_workers=None, cache=False):
+    """
+    Loads a CSV file of numbers into a 2D array.
+
+    Parameters
+    ----------
+    path : str
+        The path to the CSV file.
+    delimiter : str, optional
+        The CSV file's delimiter.
+    skiprows : int, optional
+        Number of lines to skip at the beginning of the file.
+    dtype : str or dtype, optional
+        The dtype of the array.
+    chunk_size : int, optional
+        Number of lines parsed at a time.
+    num_workers : int, optional
+        Number of worker processes parsing the file.
+    cache : bool, optional
+        If True, the array is saved in a .npy file next to the CSV file
+        while it is parsed, and memory-mapped (in copy-on-write mode)
+        from this file. If this file already exists and is up to date,
+        the CSV file is not parsed at all.
+
+    Returns
+    -------
+    data : ndarray
+        The contents of the file.
+    """
+    chunks = iter_csv_chunks(path, delimiter, skiprows, dtype, chunk_size,
+                             num_workers)
+    if not cache:
+        chunks = list(chunks)
+        if not chunks:
+            return np.zeros((0, 0), dtype=dtype)
+        return np.concatenate(chunks)
+
+    cache_path = _cache_path(path, delimiter, skiprows, dtype)
+    if os.path.exists(cache_path):
+        log.info("Loading %s from its cache %s", path, cache_path)
+        return np.load(cache_path, mmap_mode='c')
+
+    # The number of rows is only known at the end, so the rows are
+    # first written to a raw file, then copied after the .npy header.
+    raw_path = '%s.%d.raw' % (cache_path, os.getpid())
+    tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+    try:
+        num_rows = 0
+        num_columns = 0
+        with open(raw_path, 'wb') as f:
+            for chunk in chunks:
+                if num_rows == 0:
+                    num_columns = chunk.shape[1]
+                elif chunk.shape[1] != num_columns:
+                    raise ValueError("Rows of %s have different numbers of "
+                                     "columns: %d and %d" %
+                                     (path, num_columns, chunk.shape[1]))
+                f.write(np.ascontiguousarray(chunk).tobytes())
+                num_rows += len(chunk)
+        data = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype,
+                                         shape=(num_rows, num_columns))
+        if num_rows > 0:
+            raw = np.memmap(raw_path, dtype=dtype, mode='r',
+                            shape=(num_rows, num_columns))
+            for start in xrange(0, num_rows, chunk_size):
+                data[start:start + chunk_size] = raw[start:start + chunk_size]
+            del raw
+        data.flush()
+        del data
+        if os.name == 'nt' and os.path.exists(cache_path):
+            os.remove(cache_path)
+        os.rename(tmp_path, cache_path)
+    finally:
+        for filename in [raw_path, tmp_path]:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    # Remove the caches of previous versions of the file
+    directory, prefix = os.path.split(path)
+    prefix += '.cache-'
+    for filename in os.listdir(directory or os.curdir):
+        filename = os.path.join(directory, filename)
+        if (os.path.basename(filename).startswith(prefix) and
+                filename.endswith('.npy') and filename != cache_path):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+    log.info("Cached %s in %s", path, cache_path)
+    return np.load(cache_path, mmap_mode='c')
+
+
 class CSVDataset(DenseDesignMatrix):
 
     """A generic class for accessing CSV files
@@ -57,6 +263,21 @@ class CSVDataset(DenseDesignMatrix):
 
     end_fraction : float
       The fraction of rows, starting at the end of the file, to load.
+
+    dtype : str
+      The dtype of the loaded data.
+
+    chunk_size : int
+      The number of lines parsed at a time.
+
+    num_workers : int
+      If given, the file is parsed by this many worker processes.
+
+    cache : bool
+      Whether to save the parsed data in a binary file next to the CSV
+      file, and to memory-map it from there. Later runs load this file
+      instead of parsing the CSV file, as long as the CSV file and the
+      parsing options do not change.
     """
     def __init__(self,
                  path='train.csv',
@@ -67,7 +288,11 @@ class CSVDataset(DenseDesignMatrix):
                  start=None,
                  stop=None,
                  start_fraction=None,
-                 end_fraction=None):
+                 end_fraction=None,
+                 dtype='float64',
+                 chunk_size=CHUNK_SIZE,
+                 num_workers=None,
+                 cache=False):
         """
         .. todo::
 
@@ -82,6 +307,10 @@ class CSVDataset(DenseDesignMatrix):
         self.stop = stop
         self.start_fraction = start_fraction
         self.end_fraction = end_fraction
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.num_workers = num_workers
+        self.cache = cache
 
         self.view_converter = None
 
@@ -134,12 +363,13 @@ class CSVDataset(DenseDesignMatrix):
         """
         assert self.path.endswith('.csv')
 
-        if self.expect_headers:
-            data = np.loadtxt(self.path,
-                              delimiter=self.delimiter,
-                              skiprows=1)
-        else:
-            data = np.loadtxt(self.path, delimiter=self.delimiter)
+        data = load_csv(self.path,
+                        delimiter=self.delimiter,
+                        skiprows=1 if self.expect_headers else 0,
+                        dtype=self.dtype,
+                        chunk_size=self.chunk_size,
+                        num_workers=self.num_workers,
+                        cache=self.cache)
 
         def take_subset(X, y):
             if self.start_fraction is not None:
@@ -170,3 +400,258 @@ class CSVDataset(DenseDesignMatrix):
         X, y = take_subset(X, y)
 
         return X, y
+
+
+class CSVStreamDataset(Dataset):
+
+    """
+    A dataset reading a CSV file while iterating over it, without ever
+    holding the whole file in memory. It can only be iterated over
+    sequentially.
+
+    Labels, if present, should be in the first column.
+
+    Parameters
+    ----------
+    path : str
+      The path to the CSV file.
+
+    task : str
+      The type of task in which the dataset will be used -- either
+      "classification" or "regression".
+
+    expect_labels : bool
+      Whether the CSV file contains a target variable in the first column.
+
+    expect_headers : bool
+      Whether the CSV file contains column headers.
+
+    delimiter : str
+      The CSV file's delimiter.
+
+    dtype : str
+      The dtype of the data.
+
+    chunk_size : int
+      The number of lines parsed at a time.
+
+    num_workers : int
+      If given, the file is parsed by this many worker processes while
+      the batches are consumed.
+
+    y_labels : int
+      For classification, the number of classes. If not given, it is
+      found by reading the whole file once.
+
+    Notes
+    -----
+    The number of examples is found by reading the whole file once, the
+    first time it is needed.
+
+    Each iterator reads the file from the beginning. Iterating over
+    several iterators at the same time is correct but slow, since the
+    file is then read again from the beginning each time an iterator
+    falls behind another.
+    """
+
+    def __init__(self,
+                 path='train.csv',
+                 task='classification',
+                 expect_labels=True,
+                 expect_headers=True,
+                 delimiter=',',
+                 dtype='float64',
+                 chunk_size=CHUNK_SIZE,
+                 num_workers=None,
+                 y_labels=None):
+        if task not in ['classification', 'regression']:
+            raise ValueError('task must be either "classification" or '
+                             '"regression"; got ' + str(task))
+        self.path = preprocess(path)
+        self.task = task
+        self.expect_labels = expect_labels
+        self.expect_headers = expect_headers
+        self.delimiter = delimiter
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.num_workers = num_workers
+        self._num_examples = None
+        self._reset()
+
+        first = next(iter_csv_chunks(self.path, delimiter, self._skiprows,
+                                     dtype, chunk_size=1))
+        num_features = first.shape[1] - int(expect_labels)
+        if expect_labels:
+            if task == 'classification':
+                if y_labels is None:
+                    y_labels = self._scan()
+                y_space = IndexSpace(dim=1, max_labels=y_labels)
+            else:
+                y_space = VectorSpace(dim=1, dtype=dtype)
+            self.data_specs = (CompositeSpace((VectorSpace(dim=num_features,
+                                                           dtype=dtype),
+                                               y_space)),
+                               ('features', 'targets'))
+        else:
+            self.data_specs = (VectorSpace(dim=num_features, dtype=dtype),
+                               'features')
+        self.y_labels = y_labels
+
+    @property
+    def _skiprows(self):
+        return 1 if self.expect_headers else 0
+
+    def _reset(self):
+        """
+        Forgets the parsed rows, so that the next rows are read from the
+        beginning of the file.
+        """
+        chunks = getattr(self, '_chunks', None)
+        if chunks is not None:
+            chunks.close()
+        self._chunks = None
+        self._buffer = None
+        self._buffer_start = 0
+
+    def _scan(self):
+        """
+        Reads the whole file to count the examples.
+
+        Returns
+        -------
+        y_labels : int or None
+            The number of classes, if the file has labels.
+        """
+        num_examples = 0
+        max_label = -1
+        for chunk in iter_csv_chunks(self.path, self.delimiter,
+                                     self._skiprows, self.dtype,
+                                     self.chunk_size, self.num_workers):
+            num_examples += len(chunk)
+            if self.expect_labels:
+                max_label = max(max_label, int(chunk[:, 0].max()))
+        self._num_examples = num_examples
+        if self.expect_labels:
+            return max_label + 1
+        return None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_chunks'] = None
+        state['_buffer'] = None
+        state['_buffer_start'] = 0
+        return state
+
+    def get_num_examples(self):
+        """
+        Returns the number of examples, reading the whole file the first
+        time it is called.
+        """
+        if self._num_examples is None:
+            self._scan()
+        return self._num_examples
+
+    def has_targets(self):
+        """
+        Returns True if the CSV file has labels.
+        """
+        return self.expect_labels
+
+    def get_data_specs(self):
+        """
+        Returns the data_specs specifying how the data is internally
+        stored.
+        """
+        return self.data_specs
+
+    def get(self, source, indexes):
+        """
+        Returns the batches of examples selected by a slice, reading the
+        file as far as needed.
+
+        Parameters
+        ----------
+        source : tuple of str
+            The sources to return, among 'features' and 'targets'.
+        indexes : slice
+            The examples to return. Examples before `indexes.start` are
+            discarded, unless they are requested again, in which case
+            the file is read again from the beginning.
+
+        Returns
+        -------
+        batches : tuple
+            One batch per source.
+        """
+        if not isinstance(indexes, slice):
+            raise ValueError("CSVStreamDataset can only return slices of "
+                             "examples, got %s" % str(indexes))
+        start, stop = indexes.start, indexes.stop
+        if start < self._buffer_start or self._buffer is None:
+            self._reset()
+            self._chunks = iter_csv_chunks(self.path, self.delimiter,
+                                           self._skiprows, self.dtype,
+                                           self.chunk_size, self.num_workers)
+            self._buffer = np.zeros((0, 0), dtype=self.dtype)
+
+        # Discard the rows before start, and read the rows up to stop
+        new_start = max(start, self._buffer_start)
+        parts = [self._buffer[new_start - self._buffer_start:]]
+        buffer_stop = self._buffer_start + len(self._buffer)
+        while buffer_stop < stop:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                break
+            if buffer_stop + len(chunk) > new_start:
+                parts.append(chunk[max(0, new_start - buffer_stop):])
+            buffer_stop += len(chunk)
+        if stop > buffer_stop:
+            raise ValueError("Examples %d to %d requested from a file with "
+                             "%d examples" % (start, stop, buffer_stop))
+        if len(parts) > 1:
+            # The initial buffer has no columns
+            parts = [part for part in parts if len(part) > 0]
+            self._buffer = np.concatenate(parts)
+        else:
+            self._buffer = parts[0]
+        self._buffer_start = new_start
+
+        rows = self._buffer[start - self._buffer_start:
+                            stop - self._buffer_start]
+        rval = []
+        for so in source:
+            if so == 'features':
+                rval.append(rows[:, int(self.expect_labels):])
+            elif so == 'targets' and self.expect_labels:
+                # The labels of a classification task are integers
+                y_space = self.data_specs[0].components[1]
+                rval.append(rows[:, :1].astype(y_space.dtype))
+            else:
+                raise ValueError("CSVStreamDataset does not provide a "
+                                 "source with name: %s." % so)
+        return tuple(rval)
+
+    def iterator(self, mode=None, batch_size=None, num_batches=None,
+                 rng=None, data_specs=None, return_tuple=False):
+        """
+        Returns an iterator reading the file sequentially.
+
+        Only the 'sequential' mode is supported. See
+        `Dataset.iterator` for the other parameters.
+        """
+        if mode is None:
+            mode = 'sequential'
+        if mode != 'sequential':
+            raise ValueError("CSVStreamDataset can only be iterated over "
+                             "sequentially, got mode %s" % str(mode))
+        if batch_size is None and num_batches is None:
+            batch_size = self.chunk_size
+        if data_specs is None:
+            data_specs = self.data_specs
+        return FiniteDatasetIterator(
+            self,
+            SequentialSubsetIterator(self.get_num_examples(), batch_size,
+                                     num_batches),
+            data_specs=data_specs,
+            return_tuple=return_tuple)
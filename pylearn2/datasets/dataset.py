@@ -228,3 +228,26 @@ class Dataset(object):
         Infinite datasets have float('inf') examples.
         """
         raise NotImplementedError()
+
+    @classmethod
+    def get_source_files(cls, **kwargs):
+        """
+        Returns the files read by the constructor when it is called with
+        `kwargs`, if they are known.
+
+        Used by `pylearn2.datasets.preprocessed_cache` to detect that a
+        cached preprocessed dataset is stale, for datasets that find
+        their files through `${PYLEARN2_DATA_PATH}` rather than through
+        a path given as an argument.
+
+        Parameters
+        ----------
+        kwargs : dict
+            The arguments of the constructor.
+
+        Returns
+        -------
+        files : list of str or None
+            The paths of the source files, or None if they are unknown.
+        """
+        return None
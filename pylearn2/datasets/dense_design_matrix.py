@@ -17,6 +17,7 @@ __email__ = "pylearn-dev@googlegroups"
 import functools
 
 import logging
+import os
 import warnings
 
 import numpy as np
@@ -57,6 +58,78 @@ def ensure_tables():
         import tables
 
 
+class CompressedDesignMatrix(object):
+
+    """
+    A read-only view of a design matrix stored as 8-bit integers (see
+    `DenseDesignMatrix.enable_compression`), typically memory-mapped.
+
+    Rows are only converted back to float32 when they are indexed, so a
+    `FiniteDatasetIterator` over a `DenseDesignMatrix` holding one of
+    these decompresses one batch at a time and never needs the full
+    float32 design matrix in memory.
+
+    Parameters
+    ----------
+    data : ndarray or numpy.memmap, 2-dimensional, uint8
+        The compressed design matrix.
+    compress_min : ndarray, 1-dimensional
+        Per-feature minimum subtracted before compression.
+    compress_max : ndarray, 1-dimensional
+        Per-feature range used to scale the features to [0, 255].
+    """
+
+    def __init__(self, data, compress_min, compress_max):
+        assert data.ndim == 2
+        self.data = data
+        self.compress_min = compress_min
+        self.compress_max = compress_max
+        self.dtype = np.result_type(np.float32, compress_min, compress_max)
+
+    @property
+    def shape(self):
+        """
+        The shape of the design matrix.
+        """
+        return self.data.shape
+
+    @property
+    def ndim(self):
+        """
+        The number of dimensions of the design matrix.
+        """
+        return self.data.ndim
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def _decompress(self, X, cols):
+        return (np.cast['float32'](X) * self.compress_max[cols] / 255. +
+                self.compress_min[cols])
+
+    def __getitem__(self, key):
+        # The per-feature constants must be indexed like the columns.
+        if isinstance(key, tuple) and len(key) > 1:
+            cols = key[1]
+        else:
+            cols = slice(None)
+        return self._decompress(self.data[key], cols)
+
+    def __setitem__(self, key, value):
+        # Recompressing the values with the stored per-feature range
+        # would silently clip the ones outside of it.
+        raise TypeError("CompressedDesignMatrix is read-only. To modify "
+                        "the design matrix in place, decompress it first "
+                        "with dataset.set_design_matrix("
+                        "dataset.get_design_matrix()).")
+
+    def __array__(self, dtype=None):
+        rval = self[:]
+        if dtype is not None:
+            rval = rval.astype(dtype)
+        return rval
+
+
 class DenseDesignMatrix(Dataset):
 
     """
@@ -269,6 +342,7 @@ class DenseDesignMatrix(Dataset):
                  rng=None, data_specs=None,
                  return_tuple=False):
 
+        self._load_deferred()
         if data_specs is None:
             data_specs = self._iter_data_specs
 
@@ -312,7 +386,7 @@ class DenseDesignMatrix(Dataset):
         if rng is None and mode.stochastic:
             rng = self.rng
         return FiniteDatasetIterator(self,
-                                     mode(self.X.shape[0],
+                                     mode(self.get_num_examples(),
                                           batch_size,
                                           num_batches,
                                           rng),
@@ -331,6 +405,7 @@ class DenseDesignMatrix(Dataset):
         data : numpy matrix or 2-tuple of matrices
             The data
         """
+        self._load_deferred()
         if self.y is None:
             return self.X
         else:
@@ -393,11 +468,20 @@ class DenseDesignMatrix(Dataset):
 
             WRITEME
         """
+        self._load_deferred()
         rval = copy.copy(self.__dict__)
         # TODO: Not sure this should be implemented as something a base dataset
         # does. Perhaps as a mixin that specific datasets (i.e. CIFAR10)
         # inherit from.
-        if self.compress:
+        if isinstance(rval['X'], CompressedDesignMatrix):
+            if self.compress:
+                # Already compressed, no need to lose more precision
+                rval['compress_min'] = rval['X'].compress_min
+                rval['compress_max'] = rval['X'].compress_max
+                rval['X'] = rval['X'].data
+            else:
+                rval['X'] = np.asarray(rval['X'])
+        elif self.compress:
             rval['compress_min'] = rval['X'].min(axis=0)
             # important not to do -= on this line, as that will modify the
             # original object
@@ -410,7 +494,17 @@ class DenseDesignMatrix(Dataset):
         if self.design_loc is not None:
             # TODO: Get rid of this logic, use custom array-aware picklers
             # (joblib, custom pylearn2 serialization format).
-            np.save(self.design_loc, rval['X'])
+            X = rval['X']
+            if (isinstance(X, np.memmap) and X.filename is not None and
+                    os.path.realpath(X.filename) ==
+                    os.path.realpath(self.design_loc)):
+                # The design matrix is memory-mapped from design_loc, so
+                # it is already saved there, and overwriting the file
+                # while it is mapped would corrupt it.
+                if X.mode == 'r+':
+                    X.flush()
+            else:
+                np.save(self.design_loc, X)
             del rval['X']
 
         return rval
@@ -421,10 +515,17 @@ class DenseDesignMatrix(Dataset):
 
             WRITEME
         """
+        deferred = None
         if d['design_loc'] is not None:
-            if control.get_load_data():
-                fname = cache.datasetCache.cache_file(d['design_loc'])
-                d['X'] = np.load(fname)
+            load_data = control.get_load_data()
+            if load_data == 'lazy':
+                # Remember how to load the design matrix, along with the
+                # mmap_mode in effect now, and only do it when needed.
+                deferred = (d['design_loc'], control.get_mmap_mode())
+                d['X'] = None
+            elif load_data:
+                d['X'] = self._load_design_loc(d['design_loc'],
+                                               control.get_mmap_mode())
             else:
                 d['X'] = None
 
@@ -437,11 +538,19 @@ class DenseDesignMatrix(Dataset):
             d['X'] = 0
             self.__dict__.update(d)
             if X is not None:
-                self.X = np.cast['float32'](X) * mx / 255. + mn
+                self.X = self._decompress(X, mn, mx)
             else:
                 self.X = None
+            if deferred is not None:
+                deferred += (mn, mx)
         else:
             self.__dict__.update(d)
+        self._deferred_design_loc = deferred
+        if deferred is not None and not all(
+                m in d for m in ('data_specs', 'X_space',
+                                 '_iter_data_specs', 'X_topo_space')):
+            # The design matrix is needed to recover the data_specs
+            self._load_deferred()
 
         # To be able to unpickle older data after the addition of
         # the data_specs mechanism
@@ -476,6 +585,54 @@ class DenseDesignMatrix(Dataset):
                 # data_specs, and with "topo=True", which is deprecated.
                 self.X_topo_space = view_converter.topo_space
 
+    @staticmethod
+    def _load_design_loc(design_loc, mmap_mode=None):
+        """
+        Loads the design matrix saved at `design_loc`.
+
+        Parameters
+        ----------
+        design_loc : str
+            Path of the .npy file, see `use_design_loc`.
+        mmap_mode : str, optional
+            If not None, the file is memory-mapped with this mode instead
+            of being read into memory. See `numpy.load`.
+
+        Returns
+        -------
+        X : ndarray or numpy.memmap
+            The (possibly compressed) design matrix
+        """
+        fname = cache.datasetCache.cache_file(design_loc)
+        return np.load(fname, mmap_mode=mmap_mode)
+
+    @staticmethod
+    def _decompress(X, compress_min, compress_max):
+        """
+        Undoes the compression done by `__getstate__` when
+        `enable_compression` has been called.
+
+        A memory-mapped `X` is wrapped in a `CompressedDesignMatrix`
+        instead, so that it is decompressed one batch at a time.
+        """
+        if isinstance(X, np.memmap):
+            return CompressedDesignMatrix(X, compress_min, compress_max)
+        return np.cast['float32'](X) * compress_max / 255. + compress_min
+
+    def _load_deferred(self):
+        """
+        Loads the design matrix if unpickling it was deferred by setting
+        `control.push_load_data('lazy')`. Does nothing otherwise.
+        """
+        deferred = getattr(self, '_deferred_design_loc', None)
+        if deferred is None:
+            return
+        X = self._load_design_loc(*deferred[:2])
+        if len(deferred) > 2:
+            X = self._decompress(X, *deferred[2:])
+        self.X = X
+        self._deferred_design_loc = None
+
     def _apply_holdout(self, _mode="sequential", train_size=0, train_prop=0):
         """
         This function splits the dataset according to the number of
@@ -656,18 +813,22 @@ class DenseDesignMatrix(Dataset):
 
     def apply_preprocessor(self, preprocessor, can_fit=False):
         """
-        .. todo::
+        Applies a preprocessor to the dataset.
 
-            WRITEME
+        If the `PYLEARN2_PREPROCESSED_CACHE_PATH` environment variable
+        is set, the result is cached on disk and reused when the same
+        preprocessor is applied to the same data again (see
+        `pylearn2.datasets.preprocessed_cache`).
 
         Parameters
         ----------
         preprocessor : object
             preprocessor object
         can_fit : bool, optional
-            WRITEME
+            Whether the preprocessor may fit itself to the dataset.
         """
-        preprocessor.apply(self, can_fit)
+        from pylearn2.datasets import preprocessed_cache
+        preprocessed_cache.apply_preprocessor(self, preprocessor, can_fit)
 
     def get_topological_view(self, mat=None):
         """
@@ -688,7 +849,7 @@ class DenseDesignMatrix(Dataset):
             raise Exception("Tried to call get_topological_view on a dataset "
                             "that has no view converter")
         if mat is None:
-            mat = self.X
+            mat = self.get_design_matrix()
         return self.view_converter.design_mat_to_topo_view(mat)
 
     def get_formatted_view(self, mat, dspace):
@@ -769,6 +930,7 @@ class DenseDesignMatrix(Dataset):
         self.view_converter = DefaultViewConverter([rows, cols, channels],
                                                    axes=axes)
         self.X = self.view_converter.topo_view_to_design_mat(V)
+        self._deferred_design_loc = None
         # self.X_topo_space stores a "default" topological space that
         # will be used only when self.iterator is called without a
         # data_specs, and with "topo=True", which is deprecated.
@@ -816,6 +978,14 @@ class DenseDesignMatrix(Dataset):
         Returns
         -------
         WRITEME
+
+        Notes
+        -----
+        If the design matrix is a memory-mapped `CompressedDesignMatrix`,
+        the whole matrix is decompressed at each call and the result is
+        not cached, so callers should keep it rather than call this
+        method repeatedly. Iterators decompress one batch at a time
+        instead.
         """
         if topo is not None:
             if self.view_converter is None:
@@ -824,9 +994,12 @@ class DenseDesignMatrix(Dataset):
                                 "view converter")
             return self.view_converter.topo_view_to_design_mat(topo)
 
+        self._load_deferred()
+        if isinstance(self.X, CompressedDesignMatrix):
+            return np.asarray(self.X)
         return self.X
 
-    def set_design_matrix(self, X):
+    def set_design_matrix(self, X, start=None):
         """
         .. todo::
 
@@ -836,10 +1009,21 @@ class DenseDesignMatrix(Dataset):
         ----------
         X : ndarray
             WRITEME
+        start : int, optional
+            If specified, `X` is written in place into the rows of the
+            current design matrix starting at `start`, instead of
+            replacing it. This allows preprocessing the design matrix
+            chunk by chunk (e.g. when it is memory-mapped). Not
+            supported if the design matrix is a `CompressedDesignMatrix`.
         """
         assert len(X.shape) == 2
         assert not contains_nan(X)
-        self.X = X
+        if start is None:
+            self.X = X
+            self._deferred_design_loc = None
+        else:
+            self._load_deferred()
+            self.X[start:start + X.shape[0]] = X
 
     def get_targets(self):
         """
@@ -877,6 +1061,7 @@ class DenseDesignMatrix(Dataset):
         include_labels : bool
             WRITEME
         """
+        self._load_deferred()
         try:
             idx = self.rng.randint(self.X.shape[0] - batch_size + 1)
         except ValueError:
@@ -922,6 +1107,7 @@ class DenseDesignMatrix(Dataset):
 
     @functools.wraps(Dataset.get_num_examples)
     def get_num_examples(self):
+        self._load_deferred()
         return self.X.shape[0]
 
     def view_shape(self):
@@ -969,6 +1155,7 @@ class DenseDesignMatrix(Dataset):
             return
         assert start >= 0
         assert stop > start
+        self._load_deferred()
         assert stop <= self.X.shape[0]
         assert self.X.shape[0] == self.y.shape[0]
         self.X = self.X[start:stop, :]
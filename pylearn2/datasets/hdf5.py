@@ -11,6 +11,7 @@ try:
     import h5py
 except ImportError:
     h5py = None
+from collections import OrderedDict
 import numpy as np
 from theano.compat.six.moves import xrange
 import warnings
@@ -18,7 +19,9 @@ import warnings
 from pylearn2.datasets.dense_design_matrix import (DenseDesignMatrix,
                                                    DefaultViewConverter)
 from pylearn2.space import CompositeSpace, VectorSpace
-from pylearn2.utils.iteration import FiniteDatasetIterator, safe_izip
+from pylearn2.utils.iteration import (FiniteDatasetIterator, safe_izip,
+                                      ChunkShuffledSubsetIterator,
+                                      as_chunk_shuffled)
 from pylearn2.utils import contains_nan
 
 
@@ -49,13 +52,26 @@ class HDF5Dataset(DenseDesignMatrix):
         batch size you wish to use. A rule of thumb is to make a chunk
         contain 100 - 1000 batches and make sure they encompass complete
         samples.
+    check_nan : bool, optional (default True)
+        If true, each batch read from the file is checked for NaNs.
+        This requires a full pass over each batch.
+    chunk_size : int, optional
+        Number of examples per chunk for the 'chunk_shuffled' iteration
+        mode. Defaults to the number of examples per HDF5 chunk of the
+        features, or to the batch size if they are not chunked.
+    chunk_buffer : int, optional (default 8)
+        Number of chunks kept in memory and shuffled together in the
+        'chunk_shuffled' iteration mode.
     kwargs : dict, optional
         Keyword arguments passed to `DenseDesignMatrix`.
     """
 
     def __init__(self, filename, X=None, topo_view=None, y=None,
-                 load_all=False, cache_size=None, **kwargs):
+                 load_all=False, cache_size=None, check_nan=True,
+                 chunk_size=None, chunk_buffer=8, **kwargs):
         self.load_all = load_all
+        self.check_nan = check_nan
+        self.chunk_buffer = chunk_buffer
         if h5py is None:
             raise RuntimeError("Could not import h5py.")
         if cache_size:
@@ -74,6 +90,18 @@ class HDF5Dataset(DenseDesignMatrix):
         if y is not None:
             y = self.get_dataset(y, load_all)
 
+        if chunk_size is None:
+            # Use the chunk layout of the features on disk, if any
+            if X is not None:
+                chunks, batch_axis = getattr(X, 'chunks', None), 0
+            else:
+                axes = kwargs.get('axes', ('b', 0, 1, 'c'))
+                chunks = getattr(topo_view, 'chunks', None)
+                batch_axis = axes.index('b')
+            if chunks is not None:
+                chunk_size = chunks[batch_axis]
+        self.chunk_size = chunk_size
+
         super(HDF5Dataset, self).__init__(X=X, topo_view=topo_view, y=y,
                                           **kwargs)
 
@@ -122,7 +150,7 @@ class HDF5Dataset(DenseDesignMatrix):
             data.ndim = len(data.shape)  # hdf5 handle has no ndim
         return data
 
-    def iterator(self, *args, **kwargs):
+    def iterator(self, mode=None, batch_size=None, *args, **kwargs):
         """
         Get an iterator for this dataset.
 
@@ -130,12 +158,26 @@ class HDF5Dataset(DenseDesignMatrix):
         HDF5 datasets, so we change the class to HDF5DatasetIterator to
         override the iterator.next method used in dataset iteration.
 
+        In addition to the usual iteration modes, the 'chunk_shuffled'
+        mode iterates randomly over the dataset while reading each chunk
+        of `chunk_size` examples only once per epoch.
+
         Parameters
         ----------
         WRITEME
         """
-        iterator = super(HDF5Dataset, self).iterator(*args, **kwargs)
+        if mode == 'chunk_shuffled':
+            chunk_size = self.chunk_size or batch_size
+            if chunk_size is not None:
+                mode = as_chunk_shuffled(chunk_size, self.chunk_buffer)
+        iterator = super(HDF5Dataset, self).iterator(mode, batch_size,
+                                                     *args, **kwargs)
         iterator.__class__ = HDF5DatasetIterator
+        iterator.check_nan = self.check_nan
+        subset_iterator = iterator._subset_iterator
+        if isinstance(subset_iterator, ChunkShuffledSubsetIterator):
+            iterator.set_chunk_cache(subset_iterator.chunk_size,
+                                     subset_iterator.buffer_chunks)
         return iterator
 
     def set_topological_view(self, V, axes=('b', 0, 1, 'c')):
@@ -214,35 +256,116 @@ class HDF5DatasetIterator(FiniteDatasetIterator):
         data_specs) that will be applied to each slice of the dataset.
     """
 
+    # Whether to check each batch for NaNs, set by HDF5Dataset.iterator
+    check_nan = True
+    # Indices of a shuffled batch that are at most this many examples
+    # apart are read with a single slice, reading the examples in between
+    # being cheaper than an additional HDF5 read.
+    max_gap = 16
+    # See set_chunk_cache
+    _chunk_size = None
+    _cached_chunks = 0
+
+    def set_chunk_cache(self, chunk_size, num_chunks):
+        """
+        Makes the iterator read whole chunks of examples and keep the
+        `num_chunks` most recently used ones in memory, for iteration
+        schemes that draw the examples of a batch from a few chunks.
+
+        Parameters
+        ----------
+        chunk_size : int
+            Number of examples per chunk.
+        num_chunks : int
+            Number of chunks to keep in memory, for each source.
+        """
+        self._chunk_size = chunk_size
+        self._cached_chunks = num_chunks
+        self._chunk_caches = [OrderedDict() for data in self._raw_data]
+
     def next(self):
         """
         Get the next subset of the dataset during dataset iteration.
 
-        Converts index selections for batches to boolean selections that
-        are supported by HDF5 datasets.
+        Slices are read directly. Lists of indices, which HDF5 datasets
+        only support through slow point selections, are sorted and read
+        as a few contiguous slices (or whole chunks, see
+        `set_chunk_cache`), then put back in the requested order.
         """
         next_index = self._subset_iterator.next()
-
-        # convert to boolean selection
-        sel = np.zeros(self.num_examples, dtype=bool)
-        sel[next_index] = True
-        next_index = sel
+        if not isinstance(next_index, slice):
+            next_index = np.asarray(next_index)
 
         rval = []
-        for data, fn in safe_izip(self._raw_data, self._convert):
-            try:
-                this_data = data[next_index]
-            except TypeError:
-                this_data = data[next_index, :]
+        for i, (data, fn) in enumerate(safe_izip(self._raw_data,
+                                                 self._convert)):
+            this_data = self._read(i, data, next_index)
             if fn:
                 this_data = fn(this_data)
-            assert not contains_nan(this_data)
+            if self.check_nan:
+                assert not contains_nan(this_data)
             rval.append(this_data)
         rval = tuple(rval)
         if not self._return_tuple and len(rval) == 1:
             rval, = rval
         return rval
 
+    def _read(self, source, data, index):
+        """
+        Reads the examples `index` of `data`, the `source`-th source.
+        """
+        if isinstance(index, slice) or isinstance(data, np.ndarray):
+            return data[index]
+        # Sorted, without duplicates
+        indices, inverse = np.unique(index, return_inverse=True)
+        if self._chunk_size:
+            rows = self._read_chunks(source, data, indices)
+        else:
+            rows = self._read_ranges(data, indices)
+        if len(indices) == len(index) and np.all(indices == index):
+            return rows
+        return rows[inverse]
+
+    def _read_ranges(self, data, indices):
+        """
+        Reads the examples `indices` (sorted, unique) of `data`, with one
+        slice per group of indices at most `max_gap` examples apart.
+        """
+        breaks = np.flatnonzero(np.diff(indices) > self.max_gap + 1) + 1
+        rval = []
+        for group in np.split(indices, breaks):
+            start = group[0]
+            rows = data[start:group[-1] + 1]
+            if len(rows) != len(group):
+                rows = rows[group - start]
+            rval.append(rows)
+        if len(rval) == 1:
+            return rval[0]
+        return np.concatenate(rval)
+
+    def _read_chunks(self, source, data, indices):
+        """
+        Reads the examples `indices` (sorted, unique) of `data` from the
+        chunk cache of `source`, reading the missing chunks.
+        """
+        cache = self._chunk_caches[source]
+        size = self._chunk_size
+        breaks = np.flatnonzero(np.diff(indices // size)) + 1
+        rval = []
+        for group in np.split(indices, breaks):
+            chunk = group[0] // size
+            rows = cache.pop(chunk, None)
+            if rows is None:
+                rows = data[chunk * size:(chunk + 1) * size]
+            # Most recently used chunks are at the end
+            cache[chunk] = rows
+            rval.append(rows[group - chunk * size])
+        while len(cache) > self._cached_chunks:
+            cache.popitem(last=False)
+        if len(rval) == 1:
+            return rval[0]
+        return np.concatenate(rval)
+
 
 class HDF5ViewConverter(DefaultViewConverter):
 
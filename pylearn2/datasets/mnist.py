@@ -198,6 +198,19 @@ class MNIST(dense_design_matrix.DenseDesignMatrix):
         args['fit_test_preprocessor'] = None
         return MNIST(**args)
 
+    @classmethod
+    def get_source_files(cls, **kwargs):
+        """
+        Returns the image and label files of `kwargs['which_set']`.
+        """
+        prefixes = {'train': 'train', 'test': 't10k'}
+        prefix = prefixes.get(kwargs.get('which_set'))
+        if prefix is None:
+            return None
+        path = serial.preprocess("${PYLEARN2_DATA_PATH}/mnist/")
+        return [path + prefix + '-images-idx3-ubyte',
+                path + prefix + '-labels-idx1-ubyte']
+
 
 class MNIST_rotated_background(dense_design_matrix.DenseDesignMatrix):
 
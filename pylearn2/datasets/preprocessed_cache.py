@@ -0,0 +1,407 @@
+"""
+A content-addressed on-disk cache of preprocessed datasets.
+
+Preprocessing a dataset (e.g. GCN followed by ZCA whitening) can take
+much longer than loading it, and it is usually redone identically by
+every job started from the same YAML file. This module stores the
+result of preprocessing in a cache directory, keyed by a hash of
+everything the result depends on, so that the next job only has to
+memory-map it.
+
+The cache is used by `DenseDesignMatrix.apply_preprocessor`, and by the
+YAML loader for datasets instantiated with a `preprocessor` argument.
+It is enabled by setting the `PYLEARN2_PREPROCESSED_CACHE_PATH`
+environment variable to the cache directory. The size of the directory
+is limited to `PYLEARN2_PREPROCESSED_CACHE_SIZE` gigabytes (10 by
+default): when it is exceeded, the least recently used entries are
+removed.
+
+Entries are saved in the format of `pylearn2.utils.array_pickle`, and
+their arrays are memory-mapped in copy-on-write mode when they are
+reused, so that modifying a cached dataset in memory does not modify
+the cache.
+
+The key of an entry is computed from:
+
+- For `DenseDesignMatrix.apply_preprocessor`: the contents of the
+  design matrix and of the targets, the class of the dataset and
+  `can_fit`.
+- For the YAML loader: the YAML source of the dataset (its constructor
+  and its arguments), the expanded `PYLEARN2_DATA_PATH`, and the
+  modification times of the files named in its arguments and of the
+  files listed by `Dataset.get_source_files`. If no source file can be
+  identified, the dataset is not cached, since the cache could not tell
+  when it becomes stale.
+
+and in both cases, the pickled preprocessor, which includes its
+configuration and, if it was already fitted, its fitted parameters.
+The preprocessor state saved with the entry is restored in the
+preprocessor passed in, so that it can be applied to other datasets
+(e.g. the test set) as if it had been fitted.
+"""
+import hashlib
+import logging
+import os
+
+import numpy as np
+from theano.compat import six
+from theano.compat.six.moves import cPickle, xrange
+
+from pylearn2.utils import array_pickle
+from pylearn2.utils import string_utils
+
+
+log = logging.getLogger(__name__)
+
+EXTENSION = '.apkl'
+# Number of bytes of an array hashed at a time
+HASH_BLOCK_SIZE = 2 ** 24
+
+
+class PreprocessedCache(object):
+
+    """
+    A directory of preprocessed datasets.
+
+    Parameters
+    ----------
+    directory : str
+        The directory where the entries are stored. It is created if
+        needed.
+    max_size : int, optional
+        Maximum total size of the entries, in bytes. If None, the size
+        is not limited.
+    """
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+
+    def path(self, key):
+        """
+        Returns the path of the entry with a given key.
+
+        Parameters
+        ----------
+        key : str
+            The key of the entry.
+
+        Returns
+        -------
+        path : str
+            The path of the file of the entry.
+        """
+        return os.path.join(self.directory, key + EXTENSION)
+
+    def load(self, key):
+        """
+        Loads an entry, and marks it as recently used.
+
+        Parameters
+        ----------
+        key : str
+            The key of the entry.
+
+        Returns
+        -------
+        entry : object or None
+            The cached object, or None if there is no entry with this
+            key (or if it could not be read).
+        """
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            entry = array_pickle.load(path, mmap_mode='c')
+            os.utime(path, None)
+        except (IOError, OSError, ValueError, EOFError,
+                cPickle.UnpicklingError) as e:
+            # The entry may have been evicted by another process
+            log.warning("Could not read preprocessed cache entry %s: %s",
+                        path, e)
+            return None
+        log.info("Loaded preprocessed dataset from %s", path)
+        return entry
+
+    def store(self, key, entry):
+        """
+        Stores an entry, then evicts the least recently used entries if
+        the cache is too big.
+
+        Parameters
+        ----------
+        key : str
+            The key of the entry.
+        entry : object
+            The object to cache. It must be picklable.
+        """
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+        path = self.path(key)
+        # Several processes may store the same entry at the same time:
+        # each one writes its own file, and renaming it is atomic.
+        tmp_path = '%s.%d' % (path, os.getpid())
+        try:
+            array_pickle.dump(entry, tmp_path)
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+        except (IOError, OSError, TypeError, AttributeError,
+                cPickle.PicklingError) as e:
+            log.warning("Could not store preprocessed cache entry %s: %s",
+                        path, e)
+            for filename in [tmp_path, tmp_path + '.tmp']:
+                if os.path.exists(filename):
+                    os.remove(filename)
+            return
+        log.info("Stored preprocessed dataset in %s", path)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries until the total size of
+        the cache is at most `self.max_size`.
+
+        Parameters
+        ----------
+        keep : str, optional
+            The path of an entry that must not be removed.
+        """
+        if self.max_size is None:
+            return
+        entries = []
+        total = 0
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(EXTENSION):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                # Datasets memory-mapped from this file remain valid
+                os.remove(path)
+            except OSError:
+                continue
+            log.info("Evicted preprocessed cache entry %s", path)
+            total -= size
+
+
+def get_cache():
+    """
+    Returns the cache configured by the environment.
+
+    Returns
+    -------
+    cache : PreprocessedCache or None
+        The cache in `${PYLEARN2_PREPROCESSED_CACHE_PATH}`, or None if
+        this variable is not set.
+    """
+    directory = os.environ.get('PYLEARN2_PREPROCESSED_CACHE_PATH')
+    if not directory:
+        return None
+    directory = string_utils.preprocess(directory)
+    max_size = float(os.environ.get('PYLEARN2_PREPROCESSED_CACHE_SIZE', 10))
+    return PreprocessedCache(directory, int(max_size * 2 ** 30))
+
+
+def _hash_array(h, X):
+    """
+    Updates a hash object with the contents of an array, a few rows at
+    a time to avoid copying it whole.
+    """
+    X = np.asarray(X)
+    h.update(str((X.dtype.str, X.shape)).encode('utf-8'))
+    if X.ndim == 0 or X.size == 0:
+        h.update(np.ascontiguousarray(X).tobytes())
+        return
+    rows = max(1, HASH_BLOCK_SIZE // max(1, X[0].nbytes))
+    for i in xrange(0, X.shape[0], rows):
+        h.update(np.ascontiguousarray(X[i:i + rows]).tobytes())
+
+
+def _hash_object(h, obj):
+    """
+    Updates a hash object with the pickle of an object.
+    """
+    h.update(cPickle.dumps(obj, 2))
+
+
+def _restore_preprocessor(preprocessor, cached, holders):
+    """
+    Copies the state of a cached preprocessor to `preprocessor`, and
+    makes the objects in `holders` refer to `preprocessor` instead of
+    the cached copy.
+
+    The items of a `Pipeline` are restored one by one, so that the
+    objects the caller holds are updated in place rather than replaced
+    by their cached copies.
+    """
+    # Imported here to avoid a circular import
+    from pylearn2.datasets.preprocessing import Pipeline
+
+    # Maps the id of each cached object to (cached object, original)
+    restored = {}
+
+    def restore(preprocessor, cached):
+        restored[id(cached)] = (cached, preprocessor)
+        state = dict(cached.__dict__)
+        if (isinstance(preprocessor, Pipeline) and
+                isinstance(cached, Pipeline) and
+                len(preprocessor.items) == len(cached.items)):
+            for item, cached_item in zip(preprocessor.items, cached.items):
+                restore(item, cached_item)
+            state['items'] = preprocessor.items
+        preprocessor.__dict__.update(state)
+
+    restore(preprocessor, cached)
+    for holder in holders:
+        for name, value in list(six.iteritems(holder.__dict__)):
+            copy, original = restored.get(id(value), (None, None))
+            if value is copy:
+                setattr(holder, name, original)
+
+
+def apply_preprocessor(dataset, preprocessor, can_fit=False, cache=None):
+    """
+    Applies a preprocessor to a dataset, reusing the result from the
+    cache when possible.
+
+    Parameters
+    ----------
+    dataset : DenseDesignMatrix
+        The dataset to preprocess in place.
+    preprocessor : Preprocessor
+        The preprocessor to apply.
+    can_fit : bool, optional
+        Whether the preprocessor may fit itself to the dataset.
+    cache : PreprocessedCache, optional
+        The cache to use. Defaults to the cache returned by
+        `get_cache`. If there is none, or if the dataset is not held
+        in memory, the preprocessor is simply applied.
+    """
+    if cache is None:
+        cache = get_cache()
+    dataset._load_deferred()
+    if cache is None or not isinstance(dataset.X, np.ndarray):
+        preprocessor.apply(dataset, can_fit)
+        return
+
+    h = hashlib.sha1()
+    h.update(b'apply_preprocessor')
+    _hash_object(h, (type(dataset).__module__, type(dataset).__name__,
+                     bool(can_fit)))
+    _hash_array(h, dataset.X)
+    y = getattr(dataset, 'y', None)
+    if y is not None:
+        _hash_array(h, y)
+    _hash_object(h, preprocessor)
+    key = h.hexdigest()
+
+    entry = cache.load(key)
+    if entry is not None:
+        dataset.__dict__.update(entry['state'])
+        _restore_preprocessor(preprocessor, entry['preprocessor'],
+                              [dataset])
+        return
+
+    preprocessor.apply(dataset, can_fit)
+    state = dict(dataset.__dict__)
+    state.pop('yaml_src', None)
+    if isinstance(dataset.X, np.ndarray):
+        cache.store(key, {'state': state, 'preprocessor': preprocessor})
+
+
+def _file_mtimes(value):
+    """
+    Returns the modification times of the existing files named by the
+    strings found in a (nested) constructor argument.
+    """
+    rval = []
+    if isinstance(value, six.string_types):
+        if os.path.exists(value):
+            rval.append((value, os.path.getmtime(value)))
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            rval.extend(_file_mtimes(v))
+    elif isinstance(value, dict):
+        for k in sorted(value):
+            rval.extend(_file_mtimes(value[k]))
+    return rval
+
+
+def instantiate(callable, kwargs, yaml_src, cache=None):
+    """
+    Instantiates a dataset with a `preprocessor` argument, reusing the
+    preprocessed dataset from the cache when possible. Used by the YAML
+    loader.
+
+    Parameters
+    ----------
+    callable : type
+        The class of the dataset.
+    kwargs : dict
+        The (instantiated) arguments of the constructor.
+    yaml_src : str
+        The YAML source of the dataset.
+    cache : PreprocessedCache, optional
+        The cache to use. Defaults to the cache returned by
+        `get_cache`.
+
+    Returns
+    -------
+    dataset : object
+        The result of `callable(**kwargs)`, or its cached copy.
+    """
+    from pylearn2.config.yaml_parse import checked_call
+
+    if cache is None:
+        cache = get_cache()
+    preprocessor = kwargs.get('preprocessor')
+    if cache is None or preprocessor is None:
+        return checked_call(callable, kwargs)
+
+    mtimes = _file_mtimes(list(kwargs.values()))
+    source_files = callable.get_source_files(**kwargs)
+    if source_files is not None:
+        mtimes.extend(_file_mtimes(list(source_files)))
+    if not mtimes:
+        log.warning("Not caching the preprocessed %s: its source files "
+                    "are unknown, so the cache could not detect when it "
+                    "is stale. Implement %s.get_source_files to cache it.",
+                    callable.__name__, callable.__name__)
+        return checked_call(callable, kwargs)
+
+    h = hashlib.sha1()
+    h.update(b'instantiate')
+    h.update(yaml_src.encode('utf-8'))
+    data_path = os.environ.get('PYLEARN2_DATA_PATH')
+    if data_path:
+        data_path = os.path.abspath(os.path.expanduser(data_path))
+    _hash_object(h, data_path)
+    _hash_object(h, mtimes)
+    _hash_object(h, preprocessor)
+    key = h.hexdigest()
+
+    entry = cache.load(key)
+    if entry is not None:
+        dataset = entry['dataset']
+        _restore_preprocessor(preprocessor, entry['preprocessor'],
+                              [dataset])
+        return dataset
+
+    dataset = checked_call(callable, kwargs)
+    cache.store(key, {'dataset': dataset, 'preprocessor': preprocessor})
+    return dataset
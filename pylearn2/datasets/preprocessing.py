@@ -12,13 +12,16 @@ __maintainer__ = "LISA Lab"
 __email__ = "pylearn-dev@googlegroups"
 
 
+import collections
 import copy
 import logging
+import multiprocessing
 import time
 import warnings
 import os
 import numpy
-from theano.compat.six.moves import xrange
+from numpy.lib.stride_tricks import as_strided
+from theano.compat.six.moves import xrange, zip as izip
 import scipy
 try:
     from scipy import linalg
@@ -43,6 +46,12 @@ log = logging.getLogger(__name__)
 
 convert_axes = Conv2DSpace.convert_numpy
 
+# Number of patches copied at a time by the patch extraction functions
+PATCH_BATCH_SIZE = 10000
+# Classes of pylearn2.models.pca used by the PCA preprocessor
+PCA_ALGORITHMS = {'cov_eig': 'CovEigPCA', 'svd': 'SVDPCA',
+                  'online': 'OnlinePCA', 'randomized': 'RandomizedPCA'}
+
 
 class Preprocessor(object):
 
@@ -120,6 +129,88 @@ class Preprocessor(object):
         """
         pass
 
+    # Whether this preprocessor implements `transform_design`, and can thus
+    # be applied chunk by chunk by a `Pipeline` with a `batch_size`.
+    supports_chunks = False
+
+    def transform_design(self, X, view_converter=None):
+        """
+        Returns the preprocessed version of a chunk of examples, with the
+        parameters fitted so far. Only implemented by preprocessors that
+        transform each example independently of the others once fitted
+        (see `supports_chunks`).
+
+        Parameters
+        ----------
+        X : ndarray
+            A chunk of the design matrix of a dataset. It may be modified
+            in place.
+        view_converter : object, optional
+            The view converter of the dataset, for preprocessors that
+            work on topological views.
+
+        Returns
+        -------
+        rval : ndarray
+            The preprocessed examples, as a design matrix. May be `X`.
+        """
+        raise NotImplementedError(str(type(self)) +
+                                  " does not implement transform_design.")
+
+    def fits(self, can_fit):
+        """
+        Returns True if `apply(dataset, can_fit)` would fit parameters to
+        the dataset. For preprocessors supporting chunks, the parameters
+        are then fitted from the sum of the statistics of each chunk, see
+        `chunk_statistics`.
+
+        Parameters
+        ----------
+        can_fit : bool
+            See `apply`.
+        """
+        return False
+
+    def chunk_statistics(self, X):
+        """
+        Returns the statistics of a chunk of examples needed to fit this
+        preprocessor.
+
+        Parameters
+        ----------
+        X : ndarray
+            A chunk of the design matrix, as preprocessed by the previous
+            preprocessors of the pipeline. It may be modified in place.
+        """
+        raise NotImplementedError(str(type(self)) +
+                                  " does not implement chunk_statistics.")
+
+    def merge_statistics(self, a, b):
+        """
+        Combines the statistics of two disjoint sets of examples.
+
+        Parameters
+        ----------
+        a, b : object
+            Values returned by `chunk_statistics` or `merge_statistics`.
+        """
+        raise NotImplementedError(str(type(self)) +
+                                  " does not implement merge_statistics.")
+
+    def fit_statistics(self, statistics):
+        """
+        Fits the parameters of this preprocessor from the statistics of
+        all the examples of a dataset.
+
+        Parameters
+        ----------
+        statistics : object
+            The statistics of all the chunks, as combined by
+            `merge_statistics`.
+        """
+        raise NotImplementedError(str(type(self)) +
+                                  " does not implement fit_statistics.")
+
 
 class ExamplewisePreprocessor(Preprocessor):
 
@@ -171,13 +262,50 @@ class Pipeline(Preprocessor):
     A Preprocessor that sequentially applies a list
     of other Preprocessors.
 
+    If `batch_size` is given, consecutive preprocessors that support
+    chunks (see `Preprocessor.supports_chunks`), such as `Standardize`,
+    `GlobalContrastNormalization` or `ZCA`, are fused: the design matrix
+    is read, transformed by all of them and written back one chunk of
+    `batch_size` examples at a time, instead of making one pass over the
+    whole dataset per preprocessor. Preprocessors that need to be fitted
+    first make one pass each to accumulate their statistics. The other
+    preprocessors are applied as usual.
+
     Parameters
     ----------
-    items : WRITEME
+    items : list, optional
+        The preprocessors to apply, in order.
+    batch_size : int, optional
+        Number of examples per chunk. If None, the preprocessors are
+        applied one after the other to the whole dataset.
+    num_workers : int, optional
+        If greater than 1, chunks are processed in parallel by a pool of
+        this many forked processes. The preprocessors should then not
+        use the GPU.
+
+    Notes
+    -----
+    When processing chunks, the results are written back in place into
+    the design matrix if it is a writable array of the right dtype
+    (including a memory-mapped file, which workers then write to
+    directly), or with `set_design_matrix(X, start=...)` for
+    `DenseDesignMatrixPyTables`. Otherwise, a new design matrix is
+    allocated.
     """
 
-    def __init__(self, items=None):
+    def __init__(self, items=None, batch_size=None, num_workers=None):
         self.items = items if items is not None else []
+        if batch_size is not None:
+            batch_size = int(batch_size)
+            assert batch_size > 0, "batch_size must be positive"
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Pipelines pickled before chunked processing was added
+        self.__dict__.setdefault('batch_size', None)
+        self.__dict__.setdefault('num_workers', None)
 
     def apply(self, dataset, can_fit=False):
         """
@@ -185,8 +313,434 @@ class Pipeline(Preprocessor):
 
             WRITEME
         """
-        for item in self.items:
-            item.apply(dataset, can_fit)
+        if self.batch_size is None:
+            for item in self.items:
+                item.apply(dataset, can_fit)
+            return
+
+        i = 0
+        while i < len(self.items):
+            j = i
+            while (j < len(self.items) and
+                   getattr(self.items[j], 'supports_chunks', False)):
+                j += 1
+            if j == i:
+                self.items[i].apply(dataset, can_fit)
+                i += 1
+            else:
+                self._apply_chunks(self.items[i:j], dataset, can_fit)
+                i = j
+
+    def _apply_chunks(self, items, dataset, can_fit):
+        """
+        Fits and applies preprocessors supporting chunks in one pass over
+        the design matrix (plus one pass for each preprocessor to fit).
+        """
+        X = dataset.get_design_matrix()
+        view_converter = getattr(dataset, 'view_converter', None)
+        num_examples = X.shape[0]
+        chunks = [(start, min(start + self.batch_size, num_examples))
+                  for start in xrange(0, num_examples, self.batch_size)]
+        # Workers read the chunks of in-memory arrays directly (forked
+        # processes share them), other arrays (e.g. PyTables) are read
+        # by this process.
+        shared = isinstance(X, numpy.ndarray)
+        # Workers may write directly to memory-mapped files
+        write_through = (isinstance(X, numpy.memmap) and X.mode == 'r+')
+
+        def tasks(kind, arg):
+            for start, stop in chunks:
+                yield (kind, arg, start, stop,
+                       None if shared else X[start:stop])
+
+        for k, item in enumerate(items):
+            if not item.fits(can_fit):
+                continue
+            log.info("Fitting %s from chunks" % type(item).__name__)
+            statistics = None
+            for chunk_statistics in self._map(tasks('fit', k), items,
+                                              X if shared else None,
+                                              view_converter):
+                if statistics is None:
+                    statistics = chunk_statistics
+                else:
+                    statistics = item.merge_statistics(statistics,
+                                                       chunk_statistics)
+            item.fit_statistics(statistics)
+
+        log.info("Applying %s by chunks" %
+                 ", ".join(type(item).__name__ for item in items))
+        results = self._map(tasks('transform', write_through), items,
+                            X if shared else None, view_converter)
+        new_X = None
+        for (start, stop), rows in izip(chunks, results):
+            if rows is None:
+                # Already written to X by the worker
+                continue
+            if new_X is None:
+                if (shared and X.flags.writeable and
+                        rows.dtype == X.dtype and
+                        rows.shape[1:] == X.shape[1:]):
+                    new_X = X
+                elif not shared and rows.shape[1:] == X.shape[1:]:
+                    new_X = dataset
+                else:
+                    new_X = numpy.empty((num_examples,) + rows.shape[1:],
+                                        dtype=rows.dtype)
+            if new_X is dataset:
+                dataset.set_design_matrix(rows, start=start)
+            else:
+                new_X[start:stop] = rows
+        if new_X is None:
+            new_X = X
+        if new_X is not dataset:
+            dataset.set_design_matrix(new_X)
+
+    def _map(self, tasks, items, X, view_converter):
+        """
+        Runs `_process_chunk` on each task, in a pool of `num_workers`
+        processes if there are several, and yields the results in order.
+        """
+        if self.num_workers is None or self.num_workers <= 1:
+            for task in tasks:
+                yield _process_chunk(task, items, X, view_converter)
+            return
+
+        # The pool is forked for each pass, so that the workers see the
+        # parameters fitted by the previous passes
+        workers = multiprocessing.Pool(self.num_workers, _init_chunk_worker,
+                                       (items, X, view_converter))
+        try:
+            # Only read a few chunks ahead
+            pending = collections.deque()
+            for task in tasks:
+                pending.append(workers.apply_async(_process_chunk_in_worker,
+                                                   (task,)))
+                if len(pending) >= 2 * self.num_workers:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            workers.terminate()
+            workers.join()
+
+
+# State of the processes of a Pipeline's worker pool, see _init_chunk_worker
+_chunk_worker_state = None
+
+
+def _init_chunk_worker(items, X, view_converter):
+    """
+    Initializes a process of the worker pool of a Pipeline.
+    """
+    global _chunk_worker_state
+    _chunk_worker_state = (items, X, view_converter)
+
+
+def _process_chunk_in_worker(task):
+    """
+    Processes a chunk in a process of the worker pool of a Pipeline.
+    """
+    items, X, view_converter = _chunk_worker_state
+    return _process_chunk(task, items, X, view_converter)
+
+
+def _process_chunk(task, items, X, view_converter):
+    """
+    Computes the statistics of a chunk for one preprocessor, or
+    preprocesses it with all of them.
+
+    Parameters
+    ----------
+    task : tuple
+        `(kind, arg, start, stop, rows)`. If `kind` is 'fit', returns the
+        statistics of the chunk for `items[arg]`, as preprocessed by the
+        previous items. If `kind` is 'transform', returns the chunk as
+        preprocessed by all the items, or writes it to `X` and returns
+        None if `arg` is True and the dtype allows it. `rows` is the
+        chunk, or None to read it from `X`.
+    items : list
+        The preprocessors of the pipeline.
+    X : ndarray or None
+        The design matrix, if shared with the workers.
+    view_converter : object
+        The view converter of the dataset.
+    """
+    kind, arg, start, stop, rows = task
+    if rows is None:
+        rows = X[start:stop]
+    # Preprocessors may modify their input in place
+    rows = numpy.array(rows)
+    if kind == 'fit':
+        for item in items[:arg]:
+            rows = item.transform_design(rows, view_converter)
+        return items[arg].chunk_statistics(rows)
+    for item in items:
+        rows = item.transform_design(rows, view_converter)
+    if arg and rows.dtype == X.dtype and rows.shape[1:] == X.shape[1:]:
+        X[start:stop] = rows
+        return None
+    return rows
+
+
+def _moments(X, covariance=False):
+    """
+    Returns the number of examples, the mean and the sum of squared
+    deviations from the mean (or the scatter matrix) of the features of a
+    design matrix, in float64.
+    """
+    X = numpy.array(X, dtype='float64')
+    mean = X.mean(axis=0)
+    X -= mean
+    if covariance:
+        m2 = numpy.dot(X.T, X)
+    else:
+        m2 = (X ** 2).sum(axis=0)
+    return (X.shape[0], mean, m2)
+
+
+def _merge_moments(a, b):
+    """
+    Combines the moments returned by `_moments` for two disjoint sets of
+    examples, with the pairwise update of Chan et al.
+    """
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    if n_a == 0 or n_b == 0:
+        return a if n_b == 0 else b
+    delta = mean_b - mean_a
+    if m2_a.ndim == 2:
+        correction = numpy.outer(delta, delta)
+    else:
+        correction = delta ** 2
+    m2 = m2_a + m2_b + correction * (n_a * n_b / float(n))
+    mean = mean_a + delta * (n_b / float(n))
+    return (n, mean, m2)
+
+
+def _patch_windows(X, patch_shape, patch_stride=None):
+    """
+    Returns a strided view of all the patches of a batch of images.
+
+    Parameters
+    ----------
+    X : ndarray
+        The images, in ('b', 0, 1, ..., 'c') format.
+    patch_shape : tuple
+        The shape of the patches along the topological axes.
+    patch_stride : tuple, optional
+        The distance between two consecutive patches along each
+        topological axis. A stride of 0 takes only the first patch.
+        Defaults to 1 along every axis.
+
+    Returns
+    -------
+    windows : ndarray
+        A view of `X` of shape (batch, positions along each topological
+        axis..., patch_shape..., channels).
+    """
+    X = numpy.asarray(X)
+    num_topological_dimensions = X.ndim - 2
+    if num_topological_dimensions != len(patch_shape):
+        raise ValueError("Patches with " + str(len(patch_shape)) +
+                         " topological dimensions requested from images " +
+                         "with " + str(num_topological_dimensions) + ".")
+    if patch_stride is None:
+        patch_stride = (1,) * num_topological_dimensions
+    shape = [X.shape[0]]
+    strides = [X.strides[0]]
+    for i in xrange(num_topological_dimensions):
+        patch_width = patch_shape[i]
+        data_width = X.shape[i + 1]
+        last_valid_coord = data_width - patch_width
+        if last_valid_coord < 0:
+            raise ValueError('On topological dimension ' + str(i) +
+                             ', the data has width ' + str(data_width) +
+                             ' but the requested patch width is ' +
+                             str(patch_width))
+        stride = patch_stride[i]
+        if stride == 0:
+            shape.append(1)
+        else:
+            shape.append(last_valid_coord // stride + 1)
+        strides.append(X.strides[i + 1] * stride)
+    shape.extend(patch_shape)
+    strides.extend(X.strides[1:-1])
+    shape.append(X.shape[-1])
+    strides.append(X.strides[-1])
+    return as_strided(X, shape=shape, strides=strides)
+
+
+def _make_output(shape, dtype, destination):
+    """
+    Returns an array to write images or patches into.
+
+    The array is a ('b', 0, 1, ..., 'c') view of a design matrix laid out
+    as `DenseDesignMatrix.set_topological_view` expects it, so that
+    setting it as the topological view of a dataset does not copy it.
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the array, in ('b', 0, 1, ..., 'c') format.
+    dtype : str or dtype
+        The dtype of the array.
+    destination : str or None
+        If not None, the path of a .npy file to create and memory-map
+        the design matrix to.
+    """
+    design_shape = (shape[0], int(numpy.prod(shape[1:])))
+    if destination is None:
+        design = numpy.empty(design_shape, dtype=dtype)
+    else:
+        design = numpy.lib.format.open_memmap(destination, mode='w+',
+                                              dtype=dtype, shape=design_shape)
+    topo = design.reshape((shape[0], shape[-1]) + tuple(shape[1:-1]))
+    return topo.transpose([0] + list(xrange(2, len(shape))) + [1])
+
+
+def extract_patches(X, patch_shape, num_patches, rng=None, out=None,
+                    batch_size=PATCH_BATCH_SIZE):
+    """
+    Extracts patches at random positions of random images.
+
+    All the coordinates are drawn at once, and the patches are gathered
+    `batch_size` at a time from a strided view of the images.
+
+    Parameters
+    ----------
+    X : ndarray
+        The images, in ('b', 0, 1, ..., 'c') format.
+    patch_shape : tuple
+        The shape of the patches along the topological axes.
+    num_patches : int
+        The number of patches to extract.
+    rng : numpy.random.RandomState object or seed, optional
+        A random number generator or seed used to create one.
+    out : array-like, optional
+        Where to write the patches: an array, a memmap, or any object
+        supporting slice assignment, such as an h5py or PyTables
+        dataset. Its shape must be (num_patches,) + patch_shape +
+        (channels,). A new array is created by default.
+    batch_size : int, optional
+        The number of patches gathered at a time.
+
+    Returns
+    -------
+    out : array-like
+        The patches.
+    """
+    rng = make_np_rng(rng, [1, 2, 3], which_method="randint")
+    windows = _patch_windows(X, patch_shape)
+    patch = windows.shape[len(patch_shape) + 1:]
+    if out is None:
+        out = numpy.empty((num_patches,) + patch, dtype=windows.dtype)
+    index = [rng.randint(X.shape[0], size=num_patches)]
+    for j in xrange(len(patch_shape)):
+        index.append(rng.randint(windows.shape[j + 1], size=num_patches))
+    for start in xrange(0, num_patches, batch_size):
+        stop = min(start + batch_size, num_patches)
+        # Read the images in order, which is much faster when they are
+        # memory-mapped, and put the patches back in random order.
+        order = numpy.argsort(index[0][start:stop], kind='mergesort')
+        patches = numpy.empty((stop - start,) + patch, dtype=windows.dtype)
+        patches[order] = windows[tuple(i[start:stop][order] for i in index)]
+        out[start:stop] = patches
+    return out
+
+
+def extract_grid_patches(X, patch_shape, patch_stride, out=None,
+                         batch_size=PATCH_BATCH_SIZE):
+    """
+    Extracts patches along a regular grid from each image. The patches
+    of each image are contiguous and in row-major order of their
+    positions.
+
+    Parameters
+    ----------
+    X : ndarray
+        The images, in ('b', 0, 1, ..., 'c') format.
+    patch_shape : tuple
+        The shape of the patches along the topological axes.
+    patch_stride : tuple
+        The distance between two consecutive patches along each
+        topological axis. A stride of 0 takes only the first patch.
+    out : array-like, optional
+        Where to write the patches (see `extract_patches`). A new array
+        is created by default.
+    batch_size : int, optional
+        Approximate number of patches copied at a time.
+
+    Returns
+    -------
+    out : array-like
+        The patches.
+    """
+    windows = _patch_windows(X, patch_shape, patch_stride)
+    grid = windows.shape[1:len(patch_shape) + 1]
+    patches_per_image = int(numpy.prod(grid))
+    patch = windows.shape[len(patch_shape) + 1:]
+    if out is None:
+        out = numpy.empty((X.shape[0] * patches_per_image,) + patch,
+                          dtype=windows.dtype)
+    images_per_batch = max(1, batch_size // patches_per_image)
+    for start in xrange(0, X.shape[0], images_per_batch):
+        stop = min(start + images_per_batch, X.shape[0])
+        out[start * patches_per_image:stop * patches_per_image] = \
+            windows[start:stop].reshape((-1,) + patch)
+    return out
+
+
+def reassemble_grid_patches(patches, orig_shape, patch_shape, out=None,
+                            batch_size=PATCH_BATCH_SIZE):
+    """
+    Reassembles images from non-overlapping patches, as extracted by
+    `extract_grid_patches` with `patch_stride` equal to `patch_shape`.
+
+    Parameters
+    ----------
+    patches : ndarray
+        The patches, in ('b', 0, 1, ..., 'c') format.
+    orig_shape : tuple
+        The shape of the images along the topological axes.
+    patch_shape : tuple
+        The shape of the patches along the topological axes.
+    out : array-like, optional
+        Where to write the images (see `extract_patches`). A new array
+        is created by default.
+    batch_size : int, optional
+        Approximate number of patches copied at a time.
+
+    Returns
+    -------
+    out : array-like
+        The images.
+    """
+    grid = tuple(im_dim // patch_dim
+                 for im_dim, patch_dim in zip(orig_shape, patch_shape))
+    patches_per_image = int(numpy.prod(grid))
+    num_examples = patches.shape[0] // patches_per_image
+    num_topological_dimensions = len(patch_shape)
+    channels = patches.shape[-1]
+    if out is None:
+        out = numpy.empty((num_examples,) + tuple(orig_shape) + (channels,),
+                          dtype=patches.dtype)
+    # (batch, grid..., patch..., channels) to
+    # (batch, grid[0], patch[0], grid[1], patch[1], ..., channels)
+    axes = [0]
+    for i in xrange(num_topological_dimensions):
+        axes.extend([i + 1, i + 1 + num_topological_dimensions])
+    axes.append(2 * num_topological_dimensions + 1)
+    images_per_batch = max(1, batch_size // patches_per_image)
+    for start in xrange(0, num_examples, images_per_batch):
+        stop = min(start + images_per_batch, num_examples)
+        batch = patches[start * patches_per_image:stop * patches_per_image]
+        batch = numpy.reshape(batch, (stop - start,) + grid +
+                              tuple(patch_shape) + (channels,))
+        out[start:stop] = batch.transpose(axes).reshape(
+            (stop - start,) + tuple(orig_shape) + (channels,))
+    return out
 
 
 class ExtractGridPatches(Preprocessor):
@@ -198,13 +752,23 @@ class ExtractGridPatches(Preprocessor):
 
     Parameters
     ----------
-    patch_shape : WRITEME
-    patch_stride : WRITEME
+    patch_shape : tuple
+        The shape of the patches along the topological axes.
+    patch_stride : tuple
+        The distance between two consecutive patches along each
+        topological axis.
+    destination : str, optional
+        If given, the patches are written to a memory-mapped .npy file
+        at this path instead of being held in memory.
+        The file is overwritten by every call to `apply`, so set
+        `destination` to None before saving a preprocessor meant to be
+        applied to other data.
     """
 
-    def __init__(self, patch_shape, patch_stride):
+    def __init__(self, patch_shape, patch_stride, destination=None):
         self.patch_shape = patch_shape
         self.patch_stride = patch_stride
+        self.destination = destination
 
     def apply(self, dataset, can_fit=False):
         """
@@ -220,63 +784,20 @@ class ExtractGridPatches(Preprocessor):
                              + " topological dimensions called on"
                              + " dataset with " +
                              str(num_topological_dimensions) + ".")
-        num_patches = X.shape[0]
-        max_strides = [X.shape[0] - 1]
-        for i in xrange(num_topological_dimensions):
-            patch_width = self.patch_shape[i]
-            data_width = X.shape[i + 1]
-            last_valid_coord = data_width - patch_width
-            if last_valid_coord < 0:
-                raise ValueError('On topological dimension ' + str(i) +
-                                 ', the data has width ' + str(data_width) +
-                                 ' but the requested patch width is ' +
-                                 str(patch_width))
-            stride = self.patch_stride[i]
-            if stride == 0:
-                max_stride_this_axis = 0
-            else:
-                max_stride_this_axis = last_valid_coord / stride
-            num_strides_this_axis = max_stride_this_axis + 1
-            max_strides.append(max_stride_this_axis)
-            num_patches *= num_strides_this_axis
-        # batch size
-        output_shape = [num_patches]
-        # topological dimensions
-        for dim in self.patch_shape:
-            output_shape.append(dim)
-        # number of channels
-        output_shape.append(X.shape[-1])
-        output = numpy.zeros(output_shape, dtype=X.dtype)
-        channel_slice = slice(0, X.shape[-1])
-        coords = [0] * (num_topological_dimensions + 1)
-        keep_going = True
-        i = 0
-        while keep_going:
-            args = [coords[0]]
-            for j in xrange(num_topological_dimensions):
-                coord = coords[j + 1] * self.patch_stride[j]
-                args.append(slice(coord, coord + self.patch_shape[j]))
-            args.append(channel_slice)
-            patch = X[args]
-            output[i, :] = patch
-            i += 1
-            # increment coordinates
-            j = 0
-            keep_going = False
-            while not keep_going:
-                if coords[-(j + 1)] < max_strides[-(j + 1)]:
-                    coords[-(j + 1)] += 1
-                    keep_going = True
-                else:
-                    coords[-(j + 1)] = 0
-                    if j == num_topological_dimensions:
-                        break
-                    j = j + 1
+        windows = _patch_windows(X, self.patch_shape, self.patch_stride)
+        patches_per_image = int(numpy.prod(
+            windows.shape[1:num_topological_dimensions + 1]))
+        output_shape = ((X.shape[0] * patches_per_image,) +
+                        windows.shape[num_topological_dimensions + 1:])
+        output = _make_output(output_shape, X.dtype,
+                              getattr(self, 'destination', None))
+        extract_grid_patches(X, self.patch_shape, self.patch_stride,
+                             out=output)
         dataset.set_topological_view(output)
 
         # fix lables
         if dataset.y is not None:
-            dataset.y = numpy.repeat(dataset.y, num_patches / X.shape[0])
+            dataset.y = numpy.repeat(dataset.y, patches_per_image, axis=0)
 
 
 class ReassembleGridPatches(Preprocessor):
@@ -288,13 +809,22 @@ class ReassembleGridPatches(Preprocessor):
 
     Parameters
     ----------
-    orig_shape : WRITEME
-    patch_shape : WRITEME
+    orig_shape : tuple
+        The shape of the examples along the topological axes.
+    patch_shape : tuple
+        The shape of the patches along the topological axes.
+    destination : str, optional
+        If given, the examples are written to a memory-mapped .npy file
+        at this path instead of being held in memory.
+        The file is overwritten by every call to `apply`, so set
+        `destination` to None before saving a preprocessor meant to be
+        applied to other data.
     """
 
-    def __init__(self, orig_shape, patch_shape):
+    def __init__(self, orig_shape, patch_shape, destination=None):
         self.patch_shape = patch_shape
         self.orig_shape = orig_shape
+        self.destination = destination
 
     def apply(self, dataset, can_fit=False):
         """
@@ -319,13 +849,13 @@ class ReassembleGridPatches(Preprocessor):
                 raise Exception('Trying to assemble patches of shape ' +
                                 str(self.patch_shape) + ' into images of ' +
                                 'shape ' + str(self.orig_shape))
-            patches_this_dim = im_dim / patch_dim
+            patches_this_dim = im_dim // patch_dim
             if num_examples % patches_this_dim != 0:
                 raise Exception('Trying to re-assemble ' + str(num_patches) +
                                 ' patches of shape ' + str(self.patch_shape) +
                                 ' into images of shape ' + str(self.orig_shape)
                                 )
-            num_examples /= patches_this_dim
+            num_examples //= patches_this_dim
 
         # batch size
         reassembled_shape = [num_examples]
@@ -334,51 +864,16 @@ class ReassembleGridPatches(Preprocessor):
             reassembled_shape.append(dim)
         # number of channels
         reassembled_shape.append(patches.shape[-1])
-        reassembled = numpy.zeros(reassembled_shape, dtype=patches.dtype)
-        channel_slice = slice(0, patches.shape[-1])
-        coords = [0] * (num_topological_dimensions + 1)
-        max_strides = [num_examples - 1]
-        for dim, pd in zip(self.orig_shape, self.patch_shape):
-            assert dim % pd == 0
-            max_strides.append(dim / pd - 1)
-        keep_going = True
-        i = 0
-        while keep_going:
-            args = [coords[0]]
-            for j in xrange(num_topological_dimensions):
-                coord = coords[j + 1]
-                args.append(slice(coord * self.patch_shape[j],
-                                  (coord + 1) * self.patch_shape[j]))
-                next_shape_coord = reassembled.shape[j + 1]
-                assert (coord + 1) * self.patch_shape[j] <= next_shape_coord
-
-            args.append(channel_slice)
-
-            try:
-                patch = patches[i, :]
-            except IndexError:
-                reraise_as(IndexError('Gave index of ' + str(i) +
-                                      ', : into thing of shape ' +
-                                      str(patches.shape)))
-            reassembled[args] = patch
-            i += 1
-            j = 0
-            keep_going = False
-            while not keep_going:
-                if coords[-(j + 1)] < max_strides[-(j + 1)]:
-                    coords[-(j + 1)] += 1
-                    keep_going = True
-                else:
-                    coords[-(j + 1)] = 0
-                    if j == num_topological_dimensions:
-                        break
-                    j = j + 1
+        reassembled = _make_output(reassembled_shape, patches.dtype,
+                                   getattr(self, 'destination', None))
+        reassemble_grid_patches(patches, self.orig_shape, self.patch_shape,
+                                out=reassembled)
 
         dataset.set_topological_view(reassembled)
 
         # fix labels
         if dataset.y is not None:
-            dataset.y = dataset.y[::patches.shape[0] / reassembled_shape[0]]
+            dataset.y = dataset.y[::num_patches // num_examples]
 
 
 class ExtractPatches(Preprocessor):
@@ -389,17 +884,28 @@ class ExtractPatches(Preprocessor):
 
     Parameters
     ----------
-    patch_shape : WRITEME
-    num_patches : WRITEME
-    rng : WRITEME
+    patch_shape : tuple
+        The shape of the patches along the topological axes.
+    num_patches : int
+        The number of patches to extract.
+    rng : numpy.random.RandomState object or seed, optional
+        A random number generator or seed used to create one. The same
+        patches are extracted every time the preprocessor is applied.
+    destination : str, optional
+        If given, the patches are written to a memory-mapped .npy file
+        at this path instead of being held in memory.
+        The file is overwritten by every call to `apply`, so set
+        `destination` to None before saving a preprocessor meant to be
+        applied to other data.
     """
 
-    def __init__(self, patch_shape, num_patches, rng=None):
+    def __init__(self, patch_shape, num_patches, rng=None, destination=None):
         self.patch_shape = patch_shape
         self.num_patches = num_patches
         self.start_rng = make_np_rng(copy.copy(rng),
                                      [1, 2, 3],
                                      which_method="randint")
+        self.destination = destination
 
     def apply(self, dataset, can_fit=False):
         """
@@ -427,18 +933,10 @@ class ExtractPatches(Preprocessor):
             output_shape.append(dim)
         # number of channels
         output_shape.append(X.shape[-1])
-        output = numpy.zeros(output_shape, dtype=X.dtype)
-        channel_slice = slice(0, X.shape[-1])
-        for i in xrange(self.num_patches):
-            args = []
-            args.append(rng.randint(X.shape[0]))
-
-            for j in xrange(num_topological_dimensions):
-                max_coord = X.shape[j + 1] - self.patch_shape[j]
-                coord = rng.randint(max_coord + 1)
-                args.append(slice(coord, coord + self.patch_shape[j]))
-            args.append(channel_slice)
-            output[i, :] = X[args]
+        output = _make_output(output_shape, X.dtype,
+                              getattr(self, 'destination', None))
+        extract_patches(X, self.patch_shape, self.num_patches, rng=rng,
+                        out=output)
         dataset.set_topological_view(output)
         dataset.y = None
 
@@ -509,6 +1007,8 @@ class MakeUnitNorm(ExamplewisePreprocessor):
         WRITEME
     """
 
+    supports_chunks = True
+
     def apply(self, dataset, can_fit=False):
         """
         .. todo::
@@ -516,9 +1016,15 @@ class MakeUnitNorm(ExamplewisePreprocessor):
             WRITEME
         """
         X = dataset.get_design_matrix()
+        dataset.set_design_matrix(self.transform_design(X))
+
+    def transform_design(self, X, view_converter=None):
+        """
+        Scales each example of X to unit L2 norm.
+        """
         X_norm = numpy.sqrt(numpy.sum(X ** 2, axis=1))
         X /= X_norm[:, None]
-        dataset.set_design_matrix(X)
+        return X
 
     def as_block(self):
         """
@@ -667,12 +1173,52 @@ class RemoveMean(ExamplewisePreprocessor):
         X = dataset.get_design_matrix()
         if can_fit:
             self._mean = X.mean(axis=self._axis)
-        else:
-            if self._mean is None:
-                raise ValueError("can_fit is False, but RemoveMean object "
-                                 "has no stored mean or standard deviation")
+        dataset.set_design_matrix(self.transform_design(X))
+
+    @property
+    def supports_chunks(self):
+        """
+        Only the means over examples or over everything can be computed
+        from chunks of examples.
+        """
+        return self._axis in (0, None)
+
+    def transform_design(self, X, view_converter=None):
+        """
+        Subtracts the stored mean from X.
+        """
+        if self._mean is None:
+            raise ValueError("can_fit is False, but RemoveMean object "
+                             "has no stored mean or standard deviation")
         X -= self._mean
-        dataset.set_design_matrix(X)
+        return X
+
+    def fits(self, can_fit):
+        """
+        Returns True if the mean should be fit, i.e. if `can_fit`.
+        """
+        return can_fit
+
+    def chunk_statistics(self, X):
+        """
+        Returns the example count, mean and sum of squared deviations of X.
+        """
+        return _moments(X)
+
+    def merge_statistics(self, a, b):
+        """
+        Merges the counts, means and squared deviations of two chunks.
+        """
+        return _merge_moments(a, b)
+
+    def fit_statistics(self, statistics):
+        """
+        Stores the mean, averaged over all features if `axis` is None.
+        """
+        n, mean, m2 = statistics
+        if self._axis is None:
+            mean = mean.mean()
+        self._mean = numpy.cast[theano.config.floatX](mean)
 
     def as_block(self):
         """
@@ -726,12 +1272,52 @@ class Standardize(ExamplewisePreprocessor):
         if can_fit:
             self._mean = X.mean() if self._global_mean else X.mean(axis=0)
             self._std = X.std() if self._global_std else X.std(axis=0)
+        dataset.set_design_matrix(self.transform_design(X))
+
+    supports_chunks = True
+
+    def transform_design(self, X, view_converter=None):
+        """
+        Subtracts the stored mean from X and divides by the stored std.
+        """
+        if self._mean is None or self._std is None:
+            raise ValueError("can_fit is False, but Standardize object "
+                             "has no stored mean or standard deviation")
+        return (X - self._mean) / (self._std_eps + self._std)
+
+    def fits(self, can_fit):
+        """
+        Returns True if the mean and std should be fit, i.e. if `can_fit`.
+        """
+        return can_fit
+
+    def chunk_statistics(self, X):
+        """
+        Returns the example count, mean and sum of squared deviations of X.
+        """
+        return _moments(X)
+
+    def merge_statistics(self, a, b):
+        """
+        Merges the counts, means and squared deviations of two chunks.
+        """
+        return _merge_moments(a, b)
+
+    def fit_statistics(self, statistics):
+        """
+        Stores the mean and std, per feature or global as configured.
+        """
+        n, mean, m2 = statistics
+        var = m2 / n
+        if self._global_std:
+            # Variance of all the elements around the global mean
+            std = numpy.sqrt(numpy.mean(var + (mean - mean.mean()) ** 2))
         else:
-            if self._mean is None or self._std is None:
-                raise ValueError("can_fit is False, but Standardize object "
-                                 "has no stored mean or standard deviation")
-        new = (X - self._mean) / (self._std_eps + self._std)
-        dataset.set_design_matrix(new)
+            std = numpy.sqrt(var)
+        if self._global_mean:
+            mean = mean.mean()
+        self._mean = numpy.cast[theano.config.floatX](mean)
+        self._std = numpy.cast[theano.config.floatX](std)
 
     def as_block(self):
         """
@@ -897,9 +1483,16 @@ class RemapInterval(ExamplewisePreprocessor):
             WRITEME
         """
         X = dataset.get_design_matrix()
+        dataset.set_design_matrix(self.transform_design(X))
+
+    supports_chunks = True
+
+    def transform_design(self, X, view_converter=None):
+        """
+        Maps X linearly from `map_from` to `map_to`.
+        """
         X = (X - self.map_from[0]) / numpy.diff(self.map_from)
-        X = X * numpy.diff(self.map_to) + self.map_to[0]
-        dataset.set_design_matrix(X)
+        return X * numpy.diff(self.map_to) + self.map_to[0]
 
 
 class PCA_ViewConverter(object):
@@ -992,11 +1585,21 @@ class PCA(object):
     whiten : bool, optional
         If False, whitening (or sphering) will not be performed (default).
         If True, the preprocessed data will have zero mean and unit covariance.
+    algorithm : str, optional
+        How the PCA is computed: 'cov_eig' (eigendecomposition of the
+        covariance matrix, the default), 'svd', 'online' or 'randomized'
+        (see `pylearn2.models.pca.RandomizedPCA`, which does not form the
+        covariance matrix and is much faster for high-dimensional data
+        when only a few components are kept).
     """
 
-    def __init__(self, num_components, whiten=False):
+    def __init__(self, num_components, whiten=False, algorithm='cov_eig'):
+        if algorithm not in PCA_ALGORITHMS:
+            raise ValueError("Unknown PCA algorithm %s, expected one of %s"
+                             % (algorithm, sorted(PCA_ALGORITHMS)))
         self._num_components = num_components
         self._whiten = whiten
+        self._algorithm = algorithm
         self._pca = None
         # TODO: Is storing these really necessary? This computation
         # can't really be merged since we're basically creating the
@@ -1015,8 +1618,10 @@ class PCA(object):
                 raise ValueError("can_fit is False, but PCA preprocessor "
                                  "object has no fitted model stored")
             from pylearn2.models import pca
-            self._pca = pca.CovEigPCA(num_components=self._num_components,
-                                      whiten=self._whiten)
+            algorithm = getattr(self, '_algorithm', 'cov_eig')
+            pca_class = getattr(pca, PCA_ALGORITHMS[algorithm])
+            self._pca = pca_class(num_components=self._num_components,
+                                  whiten=self._whiten)
             self._pca.train(dataset.get_design_matrix())
             self._transform_func = function([self._input],
                                             self._pca(self._input))
@@ -1101,7 +1706,7 @@ class Downsample(object):
         dataset.set_topological_view(X)
 
 
-class GlobalContrastNormalization(Preprocessor):
+class GlobalContrastNormalization(ExamplewisePreprocessor):
 
     """
     .. todo::
@@ -1142,12 +1747,7 @@ class GlobalContrastNormalization(Preprocessor):
             WRITEME
         """
         if self._batch_size is None:
-            X = global_contrast_normalize(dataset.get_design_matrix(),
-                                          scale=self._scale,
-                                          subtract_mean=self._subtract_mean,
-                                          use_std=self._use_std,
-                                          sqrt_bias=self._sqrt_bias,
-                                          min_divisor=self._min_divisor)
+            X = self.transform_design(dataset.get_design_matrix())
             dataset.set_design_matrix(X)
         else:
             data = dataset.get_design_matrix()
@@ -1157,16 +1757,22 @@ class GlobalContrastNormalization(Preprocessor):
             for i in xrange(0, data_size, self._batch_size):
                 stop = i + self._batch_size
                 log.info("GCN processing data from %d to %d" % (i, stop))
-                X = data[i:stop]
-                X = global_contrast_normalize(
-                    X,
-                    scale=self._scale,
-                    subtract_mean=self._subtract_mean,
-                    use_std=self._use_std,
-                    sqrt_bias=self._sqrt_bias,
-                    min_divisor=self._min_divisor)
+                X = self.transform_design(data[i:stop])
                 dataset.set_design_matrix(X, start=i)
 
+    supports_chunks = True
+
+    def transform_design(self, X, view_converter=None):
+        """
+        Returns the global contrast normalization of each example of X.
+        """
+        return global_contrast_normalize(X,
+                                         scale=self._scale,
+                                         subtract_mean=self._subtract_mean,
+                                         use_std=self._use_std,
+                                         sqrt_bias=self._sqrt_bias,
+                                         min_divisor=self._min_divisor)
+
 
 class ZCA(Preprocessor):
 
@@ -1189,10 +1795,18 @@ class ZCA(Preprocessor):
         When self.apply(dataset, can_fit=True) store not just the
         preprocessing matrix, but its inverse. This is necessary when
         using this preprocessor to instantiate a ZCA_Dataset.
+    batch_size : int or None, optional
+        If specified, fit the mean and covariance by accumulating them
+        (in float64) over chunks of at most `batch_size` examples, and
+        apply the transform chunk by chunk, writing the result back into
+        the dataset's design matrix with
+        `dataset.set_design_matrix(X, start=...)`. The design matrix is
+        then never copied as a whole, so it can be a memmap or an HDF5
+        array (e.g. in `DenseDesignMatrixPyTables`) larger than memory.
     """
 
     def __init__(self, n_components=None, n_drop_components=None,
-                 filter_bias=0.1, store_inverse=True):
+                 filter_bias=0.1, store_inverse=True, batch_size=None):
         warnings.warn("This ZCA preprocessor class is known to yield very "
                       "different results on different platforms. If you plan "
                       "to conduct experiments with this preprocessing on "
@@ -1214,6 +1828,10 @@ class ZCA(Preprocessor):
         self.store_inverse = store_inverse
         self.P_ = None  # set by fit()
         self.inv_P_ = None  # set by fit(), if self.store_inverse is True
+        if batch_size is not None:
+            batch_size = int(batch_size)
+            assert batch_size > 0, "batch_size must be positive"
+        self.batch_size = batch_size
 
         # Analogous to DenseDesignMatrix.design_loc. If not None, the
         # matrices P_ and inv_P_ will be saved together in <save_path>
@@ -1368,6 +1986,8 @@ class ZCA(Preprocessor):
         # Patch old pickle files
         if 'matrices_save_path' not in state:
             state['matrices_save_path'] = None
+        if 'batch_size' not in state:
+            state['batch_size'] = None
 
         if state['matrices_save_path'] is not None:
             matrices = numpy.load(state['matrices_save_path'])
@@ -1399,8 +2019,13 @@ class ZCA(Preprocessor):
         """
 
         assert X.dtype in ['float32', 'float64']
-        assert not contains_nan(X)
         assert len(X.shape) == 2
+        if self.batch_size is not None:
+            self.fit_batches(X[i:i + self.batch_size]
+                             for i in xrange(0, X.shape[0], self.batch_size))
+            return
+
+        assert not contains_nan(X)
         n_samples = X.shape[0]
         if self.copy:
             X = X.copy()
@@ -1411,12 +2036,103 @@ class ZCA(Preprocessor):
         log.info('computing zca of a {0} matrix'.format(X.shape))
         t1 = time.time()
 
-        bias = self.filter_bias * scipy.sparse.identity(X.shape[1],
-                                                        theano.config.floatX)
+        covariance = ZCA._gpu_matrix_dot(X.T, X) / X.shape[0]
+        t2 = time.time()
+        log.info("cov estimate took {0} seconds".format(t2 - t1))
+
+        self._fit_covariance(covariance)
+
+    def fit_batches(self, batches):
+        """
+        Fits this `ZCA` instance to the examples of a sequence of design
+        matrix batches, without ever holding more than one batch in
+        memory.
+
+        The mean and the covariance are accumulated in float64 with the
+        pairwise update of Chan et al., which stays accurate even when the
+        mean is large compared to the spread of the data.
 
-        covariance = ZCA._gpu_matrix_dot(X.T, X) / X.shape[0] + bias
+        Parameters
+        ----------
+        batches : iterable of ndarray
+            Matrices where each row is a datum, e.g. the batches returned
+            by `dataset.iterator(mode='sequential', batch_size=...,
+            data_specs=(VectorSpace(dim), 'features'))` for any dataset,
+            including `HDF5Dataset`.
+        """
+        statistics = None
+        t1 = time.time()
+        for batch in batches:
+            batch = numpy.asarray(batch)
+            assert batch.ndim == 2
+            if batch.shape[0] == 0:
+                continue
+            batch_statistics = self.chunk_statistics(batch)
+            if statistics is None:
+                statistics = batch_statistics
+            else:
+                statistics = self.merge_statistics(statistics,
+                                                   batch_statistics)
+            log.info('accumulated covariance of {0} examples'.format(
+                statistics[0]))
+        if statistics is None:
+            raise ValueError("ZCA.fit_batches received no examples")
         t2 = time.time()
         log.info("cov estimate took {0} seconds".format(t2 - t1))
+        self.fit_statistics(statistics)
+
+    supports_chunks = True
+
+    def fits(self, can_fit):
+        """
+        Returns True if the ZCA has not been fit yet.
+        """
+        if not self.has_fit_:
+            assert can_fit
+        return not self.has_fit_
+
+    def chunk_statistics(self, X):
+        """
+        Returns the example count, mean and scatter matrix of X.
+        """
+        assert not contains_nan(X)
+        return _moments(X, covariance=True)
+
+    def merge_statistics(self, a, b):
+        """
+        Merges the counts, means and scatter matrices of two chunks.
+        """
+        return _merge_moments(a, b)
+
+    def fit_statistics(self, statistics):
+        """
+        Stores the mean and computes the whitening matrix from the covariance.
+        """
+        n_samples, mean, m2 = statistics
+        self.mean_ = mean.astype(theano.config.floatX)
+        self._fit_covariance(m2 / n_samples)
+
+    def transform_design(self, X, view_converter=None):
+        """
+        Centers X and multiplies it by the whitening matrix.
+        """
+        assert X.dtype in ['float32', 'float64']
+        new_X = ZCA._gpu_matrix_dot(X - self.mean_, self.P_)
+        return new_X.astype(X.dtype)
+
+    def _fit_covariance(self, covariance):
+        """
+        Computes `self.P_` (and `self.inv_P_`) from the covariance of the
+        centered data.
+
+        Parameters
+        ----------
+        covariance : ndarray
+            The covariance matrix of the data, without filter bias.
+        """
+        bias = self.filter_bias * scipy.sparse.identity(covariance.shape[0],
+                                                        theano.config.floatX)
+        covariance = covariance + bias
 
         t1 = time.time()
         eigs, eigv = linalg.eigh(covariance)
@@ -1475,8 +2191,15 @@ class ZCA(Preprocessor):
             assert can_fit
             self.fit(X)
 
-        new_X = ZCA._gpu_matrix_dot(X - self.mean_, self.P_)
-        dataset.set_design_matrix(new_X)
+        if self.batch_size is None:
+            new_X = ZCA._gpu_matrix_dot(X - self.mean_, self.P_)
+            dataset.set_design_matrix(new_X)
+        else:
+            for i in xrange(0, X.shape[0], self.batch_size):
+                stop = i + self.batch_size
+                log.info("ZCA processing data from %d to %d" % (i, stop))
+                new_X = ZCA._gpu_matrix_dot(X[i:stop] - self.mean_, self.P_)
+                dataset.set_design_matrix(new_X.astype(X.dtype), start=i)
 
     def inverse(self, X):
         """
@@ -1606,6 +2329,19 @@ class LeCunLCN(ExamplewisePreprocessor):
             dataset.set_topological_view(transformed,
                                          dataset.view_converter.axes)
 
+    supports_chunks = True
+
+    def transform_design(self, X, view_converter=None):
+        """
+        Applies local contrast normalization to the topological view of X.
+        """
+        axes = ['b', 0, 1, 'c']
+        transformed = self.transform(convert_axes(
+            view_converter.design_mat_to_topo_view(X),
+            view_converter.axes, axes))
+        transformed = convert_axes(transformed, axes, view_converter.axes)
+        return view_converter.topo_view_to_design_mat(transformed)
+
 
 class RGB_YUV(ExamplewisePreprocessor):
 
@@ -1715,6 +2451,16 @@ class RGB_YUV(ExamplewisePreprocessor):
                                              dataset.view_converter.axes,
                                              start=i)
 
+    supports_chunks = True
+
+    def transform_design(self, X, view_converter=None):
+        """
+        Converts the topological view of X between RGB and YUV.
+        """
+        transformed = self.transform(
+            view_converter.design_mat_to_topo_view(X), view_converter.axes)
+        return view_converter.topo_view_to_design_mat(transformed)
+
 
 class CentralWindow(Preprocessor):
 
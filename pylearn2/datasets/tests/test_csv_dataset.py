@@ -1,6 +1,8 @@
 import os
+import shutil
+import tempfile
 import pylearn2
-from pylearn2.datasets.csv_dataset import CSVDataset
+from pylearn2.datasets.csv_dataset import CSVDataset, CSVStreamDataset
 import numpy as np
 
 
@@ -18,3 +20,51 @@ def test_loading_regression():
     d = CSVDataset(path=test_path, task="regression", expect_headers=False)
     assert(np.array_equal(d.X, np.array([[1., 2., 3.], [4., 5., 6.]])))
     assert(np.array_equal(d.y, np.array([[0.], [1.]])))
+
+
+def test_loading_chunks_and_cache():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'data.csv')
+        data = np.hstack([np.arange(25).reshape(25, 1) % 3,
+                          np.random.RandomState(0).rand(25, 4)])
+        with open(path, 'w') as f:
+            f.write('label,a,b,c,d\n')
+            np.savetxt(f, data, delimiter=',')
+        for num_workers in [None, 2]:
+            for i in range(2):
+                d = CSVDataset(path=path, chunk_size=4, dtype='float32',
+                               num_workers=num_workers, cache=True)
+                assert d.X.dtype == 'float32'
+                assert np.allclose(d.X, data[:, 1:])
+                assert np.array_equal(d.y, data[:, :1])
+        cache_files = [f for f in os.listdir(tmp_dir) if f.endswith('.npy')]
+        assert len(cache_files) == 1
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_stream():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'data.csv')
+        data = np.hstack([np.arange(25).reshape(25, 1) % 3,
+                          np.random.RandomState(0).rand(25, 4)])
+        with open(path, 'w') as f:
+            f.write('label,a,b,c,d\n')
+            np.savetxt(f, data, delimiter=',')
+        d = CSVStreamDataset(path=path, chunk_size=4)
+        assert d.get_num_examples() == 25
+        assert d.y_labels == 3
+        for batch_size in [3, 25]:
+            # Twice, to read the file again
+            for i in range(2):
+                batches = list(d.iterator(batch_size=batch_size,
+                                          data_specs=d.get_data_specs()))
+                X = np.concatenate([X for X, y in batches])
+                y = np.concatenate([y for X, y in batches])
+                assert np.allclose(X, data[:, 1:])
+                assert np.array_equal(y, data[:, :1])
+                assert y.dtype == d.get_data_specs()[0].components[1].dtype
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -106,3 +106,63 @@ def test_from_dataset():
     assert slice_d.X.shape[1] == d3.X.shape[1]
     assert slice_d.X.shape[0] == 5
     assert slice_d.y.shape[0] == 5
+
+
+def test_mmap_lazy_design_loc():
+    """
+    Tests loading a compressed design_loc memory-mapped and lazily.
+    """
+    import os
+    import shutil
+    import tempfile
+    from theano.compat.six.moves import cPickle
+    from pylearn2.datasets import control
+    from pylearn2.datasets.dense_design_matrix import CompressedDesignMatrix
+
+    rng = np.random.RandomState([2015, 3, 9])
+    X = rng.rand(20, 6).astype('float32')
+    ds = DenseDesignMatrix(X=X)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        ds.use_design_loc(os.path.join(tmp_dir, 'X.npy'))
+        ds.enable_compression()
+        pickled = cPickle.dumps(ds)
+        expected = cPickle.loads(pickled).get_design_matrix()
+
+        control.push_mmap_mode('r')
+        try:
+            mmapped = cPickle.loads(pickled)
+        finally:
+            control.pop_mmap_mode()
+        assert isinstance(mmapped.X, CompressedDesignMatrix)
+        assert np.allclose(mmapped.get_design_matrix(), expected)
+        it = mmapped.iterator(mode='shuffled_sequential', batch_size=7,
+                              rng=rng)
+        seen = np.concatenate([batch for batch in it])
+        assert np.allclose(np.sort(seen, axis=0),
+                           np.sort(expected, axis=0))
+        # Pickling again must not overwrite the file being mapped
+        mmapped = cPickle.loads(cPickle.dumps(mmapped))
+        assert np.allclose(mmapped.get_design_matrix(), expected)
+
+        # Writing rows in place needs the decompressed matrix
+        try:
+            mmapped.set_design_matrix(expected[:5] + 1, start=5)
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("Wrote into a compressed design matrix")
+        mmapped.set_design_matrix(mmapped.get_design_matrix())
+        mmapped.set_design_matrix(expected[:5] + 1, start=5)
+        assert np.allclose(mmapped.X[5:10], expected[:5] + 1)
+
+        control.push_load_data('lazy')
+        try:
+            lazy = cPickle.loads(pickled)
+        finally:
+            control.pop_load_data()
+        assert lazy.X is None
+        assert lazy.get_num_examples() == 20
+        assert np.allclose(lazy.get_design_matrix(), expected)
+    finally:
+        shutil.rmtree(tmp_dir)
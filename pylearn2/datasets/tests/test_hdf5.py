@@ -99,6 +99,34 @@ def test_hdf5_load_all():
     # cleanup
     os.remove(filename)
 
+
+def test_hdf5_iterator_modes():
+    """Check the batches read from an HDF5 dataset in every mode."""
+    skip_if_no_h5py()
+    import h5py
+    from pylearn2.datasets.hdf5 import HDF5Dataset
+
+    handle, filename = tempfile.mkstemp()
+    X = np.arange(1000, dtype='float32').reshape(200, 5)
+    y = np.arange(200).reshape(200, 1)
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('X', data=X, chunks=(16, 5))
+        f.create_dataset('y', data=y)
+
+    dataset = HDF5Dataset(filename, X='X', y='y', check_nan=False,
+                          chunk_buffer=2)
+    assert dataset.chunk_size == 16
+    for mode in ['sequential', 'shuffled_sequential', 'random_uniform',
+                 'chunk_shuffled']:
+        iterator = dataset.iterator(mode=mode, batch_size=7, num_batches=20,
+                                    data_specs=dataset.get_data_specs(),
+                                    rng=np.random.RandomState(0))
+        for X_batch, y_batch in iterator:
+            assert np.all(X_batch == X[y_batch.ravel()])
+
+    os.remove(filename)
+
+
 design_matrix_yaml = """
 !obj:pylearn2.train.Train {
     dataset: &train !obj:pylearn2.datasets.hdf5.HDF5Dataset {
@@ -0,0 +1,167 @@
+"""
+Tests for pylearn2.datasets.preprocessed_cache
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from pylearn2.config import yaml_parse
+from pylearn2.datasets import preprocessed_cache
+from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
+from pylearn2.datasets.preprocessing import Pipeline, Standardize
+from pylearn2.datasets.preprocessed_cache import PreprocessedCache
+
+
+class CountingStandardize(Standardize):
+
+    """
+    A Standardize preprocessor counting how many times it is applied.
+    """
+
+    applied = 0
+
+    def apply(self, dataset, can_fit=False):
+        CountingStandardize.applied += 1
+        super(CountingStandardize, self).apply(dataset, can_fit)
+
+
+class PreprocessedDataset(DenseDesignMatrix):
+
+    """
+    A random dataset applying a preprocessor in its constructor.
+    """
+
+    # The file the dataset pretends to read, if any
+    source_file = None
+
+    def __init__(self, seed, preprocessor=None):
+        rng = np.random.RandomState(seed)
+        super(PreprocessedDataset, self).__init__(
+            X=rng.normal(size=(20, 3)).astype('float32'))
+        self.preprocessor = preprocessor
+        if preprocessor:
+            preprocessor.apply(self, can_fit=True)
+
+    @classmethod
+    def get_source_files(cls, **kwargs):
+        """
+        Returns `source_file`, if it is set.
+        """
+        if cls.source_file is None:
+            return None
+        return [cls.source_file]
+
+
+def test_apply_preprocessor():
+    """
+    Tests that a preprocessed dataset and the fitted preprocessor are
+    reused from the cache.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        cache = PreprocessedCache(tmp_dir)
+        X = np.random.RandomState(0).normal(size=(20, 3)).astype('float32')
+        CountingStandardize.applied = 0
+        results = []
+        for i in range(2):
+            dataset = DenseDesignMatrix(X=X.copy())
+            preprocessor = CountingStandardize()
+            preprocessed_cache.apply_preprocessor(dataset, preprocessor,
+                                                  can_fit=True, cache=cache)
+            results.append((dataset.X, preprocessor._mean))
+        assert CountingStandardize.applied == 1
+        assert np.all(results[0][0] == results[1][0])
+        assert np.all(results[0][1] == results[1][1])
+
+        # A fitted preprocessor is a different key
+        test = DenseDesignMatrix(X=X.copy())
+        preprocessed_cache.apply_preprocessor(test, preprocessor, cache=cache)
+        assert CountingStandardize.applied == 2
+        assert len(os.listdir(tmp_dir)) == 2
+
+        # Only one entry fits
+        cache.max_size = max(os.path.getsize(os.path.join(tmp_dir, f))
+                             for f in os.listdir(tmp_dir))
+        cache.evict()
+        assert len(os.listdir(tmp_dir)) == 1
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_apply_pipeline():
+    """
+    Tests that the items of a cached Pipeline are restored in place.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        cache = PreprocessedCache(tmp_dir)
+        X = np.random.RandomState(0).normal(size=(20, 3)).astype('float32')
+        CountingStandardize.applied = 0
+        means = []
+        for i in range(2):
+            dataset = DenseDesignMatrix(X=X.copy())
+            item = CountingStandardize()
+            pipeline = Pipeline([item])
+            items = pipeline.items
+            preprocessed_cache.apply_preprocessor(dataset, pipeline,
+                                                  can_fit=True, cache=cache)
+            assert pipeline.items is items
+            assert pipeline.items[0] is item
+            means.append(item._mean)
+        assert CountingStandardize.applied == 1
+        assert np.all(means[0] == means[1])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_yaml_preprocessed_cache():
+    """
+    Tests that datasets instantiated from YAML with a preprocessor are
+    reused from the cache.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    source_dir = tempfile.mkdtemp()
+    os.environ['PYLEARN2_PREPROCESSED_CACHE_PATH'] = tmp_dir
+    try:
+        source_file = os.path.join(source_dir, 'source')
+        with open(source_file, 'w') as f:
+            f.write('1')
+        os.utime(source_file, (1000, 1000))
+        PreprocessedDataset.source_file = source_file
+        CountingStandardize.applied = 0
+        yaml_src = dataset_yaml % {'module': __name__}
+        loaded = [yaml_parse.load(yaml_src) for i in range(2)]
+        assert CountingStandardize.applied == 1
+        assert np.all(loaded[0]['dataset'].X == loaded[1]['dataset'].X)
+        assert np.all(loaded[0]['preprocessor']._std ==
+                      loaded[1]['preprocessor']._std)
+        assert loaded[1]['dataset'].preprocessor is loaded[1]['preprocessor']
+
+        # Modifying a source file invalidates the entry
+        os.utime(source_file, (2000, 2000))
+        yaml_parse.load(yaml_src)
+        assert CountingStandardize.applied == 2
+
+        # Datasets whose source files are unknown are not cached
+        PreprocessedDataset.source_file = None
+        for i in range(2):
+            yaml_parse.load(yaml_src)
+        assert CountingStandardize.applied == 4
+    finally:
+        PreprocessedDataset.source_file = None
+        del os.environ['PYLEARN2_PREPROCESSED_CACHE_PATH']
+        shutil.rmtree(tmp_dir)
+        shutil.rmtree(source_dir)
+
+
+dataset_yaml = """
+{
+    preprocessor: &preprocessor !obj:%(module)s.CountingStandardize {},
+    dataset: !obj:%(module)s.PreprocessedDataset {
+        seed: 1,
+        preprocessor: *preprocessor,
+    },
+}
+"""
@@ -3,6 +3,10 @@ Unit tests for ./preprocessing.py
 """
 
 import copy
+import os
+import shutil
+import tempfile
+
 import numpy as np
 
 from theano import config
@@ -15,11 +19,16 @@ from pylearn2.datasets import dense_design_matrix
 from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
 from pylearn2.datasets.preprocessing import (GlobalContrastNormalization,
                                              ExtractGridPatches,
+                                             ExtractPatches,
                                              ReassembleGridPatches,
                                              LeCunLCN,
                                              RGB_YUV,
                                              ZCA,
-                                             PCA)
+                                             PCA,
+                                             Pipeline,
+                                             Standardize,
+                                             RemoveMean,
+                                             MakeUnitNorm)
 
 
 class testGlobalContrastNormalization:
@@ -107,6 +116,45 @@ def test_extract_reassemble():
         assert False
 
 
+def test_extract_grid_patches_stride():
+    """ Tests ExtractGridPatches with overlapping patches against a
+    patch-by-patch extraction """
+
+    rng = np.random.RandomState([1, 3, 7])
+    topo = rng.randn(3, 8, 9, 2)
+    dataset = DenseDesignMatrix(topo_view=topo, y=np.arange(3).reshape(3, 1))
+    dataset.apply_preprocessor(ExtractGridPatches((3, 4), (2, 5)))
+
+    expected = [topo[i, r:r + 3, c:c + 4]
+                for i in range(3) for r in (0, 2, 4) for c in (0, 5)]
+    assert np.all(dataset.get_topological_view() == np.array(expected))
+    assert np.all(dataset.y.ravel() == np.repeat(np.arange(3), 6))
+
+
+def test_extract_patches():
+    """ Tests that ExtractPatches extracts reproducible patches of the
+    images, in memory or in a memory-mapped file """
+
+    rng = np.random.RandomState([1, 3, 7])
+    topo = rng.randn(5, 8, 9, 2)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        results = []
+        for destination in [None, os.path.join(tmp_dir, 'patches.npy')]:
+            dataset = DenseDesignMatrix(topo_view=topo)
+            dataset.apply_preprocessor(ExtractPatches((3, 4), 40, rng=1,
+                                                      destination=destination))
+            results.append(dataset.get_topological_view())
+        assert isinstance(results[1], np.memmap)
+        assert np.all(results[0] == results[1])
+        assert results[0].shape == (40, 3, 4, 2)
+        for patch in results[0]:
+            assert any(np.all(patch == topo[i, r:r + 3, c:c + 4])
+                       for i in range(5) for r in range(6) for c in range(6))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
 class testLeCunLCN:
 
     """
@@ -256,6 +304,76 @@ def test_zca_dtypes():
         config.floatX = orig_floatX
 
 
+def test_zca_batch_size():
+    """
+    Confirm that ZCA fitted and applied by chunks gives the same result
+    as the one-shot version, writing the result in place.
+    """
+    rng = np.random.RandomState([1, 2, 3])
+    # A large mean makes naive accumulation of X^T X inaccurate
+    X = as_floatX(rng.randn(47, 10) + 100.)
+
+    preprocessor = ZCA()
+    dataset = DenseDesignMatrix(X=X.copy())
+    preprocessor.apply(dataset, can_fit=True)
+
+    batch_preprocessor = ZCA(batch_size=10)
+    batch_X = X.copy()
+    batch_dataset = DenseDesignMatrix(X=batch_X)
+    batch_preprocessor.apply(batch_dataset, can_fit=True)
+
+    assert batch_dataset.get_design_matrix() is batch_X
+    assert_allclose(preprocessor.mean_, batch_preprocessor.mean_,
+                    rtol=1e-5)
+    assert_allclose(preprocessor.P_, batch_preprocessor.P_, rtol=1e-3,
+                    atol=1e-3)
+    assert_allclose(dataset.get_design_matrix(), batch_X, rtol=1e-3,
+                    atol=1e-3)
+
+    # fitting from an iterator over batches
+    iterator_preprocessor = ZCA()
+    iterator_preprocessor.fit_batches(X[i:i + 13] for i in range(0, 47, 13))
+    assert_allclose(batch_preprocessor.P_, iterator_preprocessor.P_,
+                    rtol=1e-5, atol=1e-5)
+
+
+def test_pipeline_chunks():
+    """
+    Confirm that a Pipeline processing chunks, in this process or in a
+    pool of workers, gives the same result as applying each preprocessor
+    to the whole dataset.
+    """
+    rng = np.random.RandomState([1, 2, 4])
+    X = as_floatX(rng.randn(103, 10) * 3. + 10.)
+
+    def make_items():
+        return [Standardize(global_std=True),
+                GlobalContrastNormalization(scale=2.),
+                RemoveMean(),
+                ZCA(),
+                MakeUnitNorm()]
+
+    items = make_items()
+    dataset = DenseDesignMatrix(X=X.copy())
+    Pipeline(items).apply(dataset, can_fit=True)
+
+    for num_workers in [None, 2]:
+        chunk_items = make_items()
+        chunk_X = X.copy()
+        chunk_dataset = DenseDesignMatrix(X=chunk_X)
+        pipeline = Pipeline(chunk_items, batch_size=20,
+                            num_workers=num_workers)
+        pipeline.apply(chunk_dataset, can_fit=True)
+        assert chunk_dataset.get_design_matrix() is chunk_X
+        assert_allclose(dataset.get_design_matrix(), chunk_X, rtol=1e-3,
+                        atol=1e-3)
+
+        # The fitted parameters are reused
+        other_dataset = DenseDesignMatrix(X=X.copy())
+        pipeline.apply(other_dataset, can_fit=False)
+        assert_allclose(other_dataset.get_design_matrix(), chunk_X)
+
+
 class testPCA:
     """
     Tests for PCA preprocessor
@@ -3,11 +3,17 @@ Unit tests for ../transformer_dataset.py
 """
 
 import os
+import shutil
+import tempfile
+
+import numpy as np
 
 import pylearn2
 from pylearn2.blocks import Block
 from pylearn2.datasets.csv_dataset import CSVDataset
+from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
 from pylearn2.datasets.transformer_dataset import TransformerDataset
+from pylearn2.space import CompositeSpace, VectorSpace
 
 
 def test_transformer_iterator():
@@ -25,3 +31,76 @@ def test_transformer_iterator():
         iter(iterator)
     except TypeError:
         assert False, "TransformerIterator isn't iterable"
+
+
+class CountingBlock(Block):
+    """
+    A Block doubling its inputs, counting the examples it transforms.
+    """
+
+    def __init__(self, dim):
+        super(CountingBlock, self).__init__()
+        self.space = VectorSpace(dim)
+        self.count = 0
+
+    def perform(self, X):
+        self.count += len(X)
+        return 2 * X
+
+    def get_input_space(self):
+        return self.space
+
+    def get_output_space(self):
+        return self.space
+
+
+def test_transformer_cache():
+    """
+    Tests that cached TransformerDatasets transform the raw data once, and
+    return the same batches as uncached ones.
+    """
+    rng = np.random.RandomState(0)
+    raw = DenseDesignMatrix(X=rng.normal(size=(25, 3)).astype('float32'),
+                            y=rng.normal(size=(25, 1)).astype('float32'))
+    data_specs = (CompositeSpace([VectorSpace(1), VectorSpace(3)]),
+                  ('targets', 'features'))
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for cache in [True, os.path.join(tmp_dir, 'cache.npy')]:
+            block = CountingBlock(3)
+            dataset = TransformerDataset(raw, block, cache=cache)
+            for epoch in range(3):
+                batches = list(dataset.iterator(mode='sequential',
+                                                batch_size=10,
+                                                data_specs=data_specs))
+                y = np.concatenate([y for y, X in batches])
+                X = np.concatenate([X for y, X in batches])
+                assert np.allclose(X, 2 * raw.X)
+                assert np.allclose(y, raw.y)
+            assert block.count == 25
+
+            # Shuffled batches come from the cache too
+            batches = dataset.iterator(mode='shuffled_sequential',
+                                       batch_size=10, data_specs=data_specs)
+            for y, X in batches:
+                rows = [np.flatnonzero(raw.y[:, 0] == t)[0] for t in y[:, 0]]
+                assert np.allclose(X, 2 * raw.X[rows])
+            assert block.count == 25
+            del dataset, batches
+
+        # Caches bigger than max_cache_size are disabled
+        block = CountingBlock(3)
+        dataset = TransformerDataset(raw, block, cache=True,
+                                     max_cache_size=100)
+        for epoch in range(2):
+            batches = list(dataset.iterator(mode='sequential',
+                                            batch_size=10,
+                                            data_specs=data_specs))
+            # Uncached batches follow the requested source order too
+            y = np.concatenate([y for y, X in batches])
+            X = np.concatenate([X for y, X in batches])
+            assert np.allclose(X, 2 * raw.X)
+            assert np.allclose(y, raw.y)
+        assert block.count == 50
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,67 @@
+"""
+Tests for pylearn2.datasets.window_flip
+"""
+import numpy as np
+
+from pylearn2.datasets.dense_design_matrix import (DenseDesignMatrix,
+                                                   DefaultViewConverter)
+from pylearn2.datasets.window_flip import WindowAndFlipDataset
+from pylearn2.space import Conv2DSpace
+
+
+def check_window_and_flip_dataset(axes, num_threads):
+    """
+    Checks that each example is a (possibly flipped) window of the
+    zero-padded original image.
+
+    Parameters
+    ----------
+    axes : tuple
+        The axes of the topological view of the raw dataset.
+    num_threads : int
+        The number of threads of the WindowAndFlipDataset.
+    """
+    rng = np.random.RandomState([2015, 3, 17])
+    X = rng.normal(size=(10, 5 * 5 * 2)).astype('float32')
+    view_converter = DefaultViewConverter((5, 5, 2), axes=axes)
+    raw = DenseDesignMatrix(X=X, view_converter=view_converter)
+    dataset = WindowAndFlipDataset(raw, window_shape=(4, 4), pad=1,
+                                   num_threads=num_threads)
+
+    # All the windows of the padded images, in b01c format
+    topo = raw.get_topological_view()
+    topo = topo.transpose([axes.index(axis) for axis in ('b', 0, 1, 'c')])
+    padded = np.zeros((10, 7, 7, 2), dtype='float32')
+    padded[:, 1:-1, 1:-1] = topo
+    windows = [set() for i in range(10)]
+    for i in range(10):
+        for r in range(4):
+            for c in range(4):
+                window = padded[i, r:r + 4, c:c + 4]
+                windows[i].add(window.tobytes())
+                windows[i].add(window[:, ::-1].tobytes())
+
+    space = Conv2DSpace(shape=(4, 4), num_channels=2,
+                        axes=('b', 0, 1, 'c'), dtype='float32')
+    seen = [set() for i in range(10)]
+    for epoch in range(20):
+        iterator = dataset.iterator(mode='sequential', batch_size=4,
+                                    data_specs=(space, 'features'))
+        batches = np.concatenate(list(iterator))
+        assert batches.shape == (10, 4, 4, 2)
+        for i in range(10):
+            window = batches[i].tobytes()
+            assert window in windows[i]
+            seen[i].add(window)
+    # The windows are drawn again each time
+    assert all(len(s) > 1 for s in seen)
+
+
+def test_window_and_flip_dataset():
+    """
+    Tests WindowAndFlipDataset with both supported axes, with and
+    without threads.
+    """
+    for axes in [('b', 0, 1, 'c'), ('c', 0, 1, 'b')]:
+        for num_threads in [1, 3]:
+            yield check_window_and_flip_dataset, axes, num_threads
@@ -9,22 +9,47 @@ __license__ = "3-clause BSD"
 __maintainer__ = "LISA Lab"
 __email__ = "pylearn-dev@googlegroups"
 
+import itertools
+import logging
+
+import numpy as np
+from theano.compat import six
 from theano.compat.six import Iterator
 
 from pylearn2.datasets.dataset import Dataset
-from pylearn2.space import CompositeSpace
+from pylearn2.space import CompositeSpace, VectorSpace
 from pylearn2.utils.data_specs import is_flat_specs
+from pylearn2.utils.iteration import (FiniteDatasetIterator,
+                                      resolve_iterator_class)
+from pylearn2.utils.rng import make_np_rng
 from pylearn2.utils import wraps
 
 
+log = logging.getLogger(__name__)
+
+# Default limit on the size of in-memory caches, in bytes
+MAX_CACHE_SIZE = 2 ** 31
+# Default number of raw examples transformed at a time to fill a cache
+PRECOMPUTE_BATCH_SIZE = 1000
+
+
 class TransformerDataset(Dataset):
     """
     A dataset that applies a transformation on the fly
     as examples are requested.
+
+    If the transformer does not change during training (e.g. a frozen
+    lower layer during greedy layer-wise pretraining), its outputs can
+    be cached: with `cache` set, the whole raw dataset is transformed
+    the first time an iterator is requested (see `precompute`), and
+    later batches are read from the cache instead of being transformed
+    again. Do not use a cache with a transformer that is stochastic or
+    still being trained.
     """
 
     def __init__(self, raw, transformer, cpu_only=False,
-                 space_preserving=False):
+                 space_preserving=False, cache=False,
+                 max_cache_size=MAX_CACHE_SIZE, num_workers=1):
         """
             .. todo::
 
@@ -36,9 +61,149 @@ class TransformerDataset(Dataset):
                 Provides raw data
             transformer: pylearn2 Block
                 To transform the data
+            cache : bool or str, optional
+                If True, the transformed features are kept in memory. If
+                a string, they are stored in this .npy file, which is
+                memory-mapped. If False (the default), the features are
+                transformed every time they are requested.
+            max_cache_size : int, optional
+                Maximum size in bytes of an in-memory cache. If the
+                transformed features are bigger, they are not cached.
+            num_workers : int, optional
+                Number of processes transforming the raw data in
+                parallel when the cache is filled.
         """
         self.__dict__.update(locals())
         del self.self
+        self._cache = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The cache can be rebuilt, and may be big
+        state['_cache'] = None
+        return state
+
+    def precompute(self, batch_size=PRECOMPUTE_BATCH_SIZE,
+                   num_workers=None):
+        """
+        Transforms the whole raw dataset and stores the result in the
+        cache, along with the other sources of the raw dataset.
+
+        Parameters
+        ----------
+        batch_size : int, optional
+            Number of raw examples transformed at a time.
+        num_workers : int, optional
+            Number of processes transforming batches in parallel.
+            Defaults to `self.num_workers`.
+
+        Returns
+        -------
+        cached : bool
+            False if the features were not cached because an in-memory
+            cache would exceed `self.max_cache_size`, in which case
+            caching is disabled.
+        """
+        if num_workers is None:
+            num_workers = getattr(self, 'num_workers', 1)
+        raw_space, raw_source = self.raw.get_data_specs()
+        if isinstance(raw_space, CompositeSpace):
+            raw_spaces = raw_space.components
+        else:
+            raw_spaces, raw_source = (raw_space,), (raw_source,)
+        others = [(space, source)
+                  for space, source in zip(raw_spaces, raw_source)
+                  if source != 'features']
+        spaces = ((self.transformer.get_input_space(),) +
+                  tuple(space for space, source in others))
+        sources = ('features',) + tuple(source for space, source in others)
+        output_space = self.transformer.get_output_space()
+        cache_space = VectorSpace(dim=output_space.get_total_dimension())
+
+        num_examples = self.raw.get_num_examples()
+        nbytes = (num_examples * cache_space.dim *
+                  np.dtype(output_space.dtype or 'float64').itemsize)
+        in_memory = not isinstance(self.cache, six.string_types)
+        if in_memory and nbytes > self.max_cache_size:
+            log.warning("Not caching the transformed features: they would "
+                        "use %d bytes, more than max_cache_size", nbytes)
+            self.cache = False
+            return False
+
+        iterator = self.raw.iterator(
+            mode='sequential', batch_size=batch_size,
+            data_specs=(CompositeSpace(spaces), sources), return_tuple=True)
+        pool = None
+        if num_workers > 1:
+            from multiprocessing import Pool
+            pool = Pool(num_workers, initializer=_init_worker,
+                        initargs=(self.transformer, output_space,
+                                  cache_space))
+        else:
+            _init_worker(self.transformer, output_space, cache_space)
+
+        features = None
+        other_batches = [[] for space, source in others]
+        start = 0
+        pending = []
+        try:
+            for batch in itertools.chain(iterator, [None]):
+                if batch is not None:
+                    pending.append(batch)
+                    # Bound the number of raw batches held in memory
+                    if len(pending) < 2 * num_workers:
+                        continue
+                if not pending:
+                    break
+                inputs = [b[0] for b in pending]
+                if pool is None:
+                    outputs = [_transform_batch(X) for X in inputs]
+                else:
+                    outputs = pool.map(_transform_batch, inputs)
+                for b, output in zip(pending, outputs):
+                    if features is None:
+                        features = self._allocate_cache(
+                            (num_examples, cache_space.dim), output.dtype)
+                    features[start:start + len(output)] = output
+                    start += len(output)
+                    for i, other in enumerate(b[1:]):
+                        other_batches[i].append(other)
+                pending = []
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            else:
+                _worker_state.clear()
+        assert start == num_examples
+        if isinstance(features, np.memmap):
+            features.flush()
+
+        cache_spaces = (cache_space,) + tuple(space for space, source
+                                              in others)
+        data = (features,) + tuple(np.concatenate(batches)
+                                   for batches in other_batches)
+        self._cache = _TransformedData(data, (CompositeSpace(cache_spaces),
+                                              sources))
+        return True
+
+    def _allocate_cache(self, shape, dtype):
+        """
+        Allocates the array holding the transformed features, in memory
+        or in the memory-mapped file named by `self.cache`.
+        """
+        if isinstance(self.cache, six.string_types):
+            return np.lib.format.open_memmap(self.cache, mode='w+',
+                                             dtype=dtype, shape=shape)
+        return np.empty(shape, dtype=dtype)
+
+    def clear_cache(self):
+        """
+        Discards the cached features, e.g. after modifying the
+        transformer. They are transformed again when the next iterator
+        is requested.
+        """
+        self._cache = None
 
     def get_batch_design(self, batch_size, include_labels=False):
         """
@@ -87,6 +252,13 @@ class TransformerDataset(Dataset):
 
             WRITEME
         """
+        if getattr(self, 'cache', False) and data_specs is not None:
+            if self._cache is None:
+                self.precompute()
+            if self._cache is not None:
+                return self._cached_iterator(mode, batch_size, num_batches,
+                                             rng, data_specs, return_tuple)
+
         # Build the right data_specs to query self.raw
         if data_specs is not None:
             assert is_flat_specs(data_specs)
@@ -134,6 +306,29 @@ class TransformerDataset(Dataset):
 
         return final_iterator
 
+    def _cached_iterator(self, mode, batch_size, num_batches, rng,
+                         data_specs, return_tuple):
+        """
+        Returns an iterator over the cached data, with the same defaults
+        as the iterators of the raw dataset.
+        """
+        if mode is None:
+            mode = getattr(self.raw, '_iter_subset_class', 'sequential')
+        mode = resolve_iterator_class(mode)
+        if batch_size is None:
+            batch_size = getattr(self.raw, '_iter_batch_size', None)
+        if num_batches is None:
+            num_batches = getattr(self.raw, '_iter_num_batches', None)
+        if rng is None and mode.stochastic:
+            rng = getattr(self.raw, 'rng', None)
+            if rng is None:
+                rng = make_np_rng(None, which_method='random_integers')
+        subset_iterator = mode(self.get_num_examples(), batch_size,
+                               num_batches, rng)
+        return FiniteDatasetIterator(self._cache, subset_iterator,
+                                     data_specs=data_specs,
+                                     return_tuple=return_tuple)
+
     def has_targets(self):
         """
         .. todo::
@@ -221,12 +416,23 @@ class TransformerIterator(Iterator):
         """
         raw_batch = self.raw_iterator.next()
 
+        # The raw batch has 'features' first, put it back where the
+        # requested data_specs have it
+        out_space, source = self.data_specs
+        feature_idx = 0
+        if isinstance(source, tuple):
+            if 'features' not in source:
+                # The raw data was requested directly
+                return raw_batch
+            feature_idx = source.index('features')
+        elif source != 'features':
+            return raw_batch
+
         # Apply transformation on raw_batch, and format it
         # in the requested Space
         transformer = self.transformer_dataset.transformer
-        out_space = self.data_specs[0]
         if isinstance(out_space, CompositeSpace):
-            out_space = out_space.components[0]
+            out_space = out_space.components[feature_idx]
 
         if self.transformer_dataset.space_preserving:
             # If the space is preserved, then raw_batch is already provided
@@ -246,7 +452,9 @@ class TransformerIterator(Iterator):
             rval = transform(raw_batch)
         else:
             # Apply the transformer only on the first element
-            rval = (transform(raw_batch[0]),) + raw_batch[1:]
+            rval = (raw_batch[1:feature_idx + 1] +
+                    (transform(raw_batch[0]),) +
+                    raw_batch[feature_idx + 1:])
 
         return rval
 
@@ -258,3 +466,56 @@ class TransformerIterator(Iterator):
             WRITEME
         """
         return self.raw_iterator.num_examples
+
+
+class _TransformedData(object):
+    """
+    The cached data of a TransformerDataset: the transformed features,
+    and the other sources of the raw dataset, indexed by example.
+
+    Parameters
+    ----------
+    data : tuple
+        One array per source, with examples along the first axis.
+    data_specs : tuple
+        The (space, source) pair describing `data`.
+    """
+
+    def __init__(self, data, data_specs):
+        self.data = data
+        self.data_specs = data_specs
+
+    def get_data_specs(self):
+        """
+        Returns the data_specs of the cached data.
+        """
+        return self.data_specs
+
+    def get(self, source, indexes):
+        """
+        Returns a batch of examples for each of the requested sources.
+        """
+        sources = self.data_specs[1]
+        return tuple(self.data[sources.index(so)][indexes] for so in source)
+
+
+# The transformer used by _transform_batch, set in each process by
+# _init_worker
+_worker_state = {}
+
+
+def _init_worker(transformer, output_space, cache_space):
+    """
+    Sets the transformer used by `_transform_batch` in this process.
+    """
+    _worker_state['transformer'] = transformer
+    _worker_state['spaces'] = (output_space, cache_space)
+
+
+def _transform_batch(X):
+    """
+    Transforms a batch of raw features, and formats it as rows.
+    """
+    output_space, cache_space = _worker_state['spaces']
+    rval = _worker_state['transformer'].perform(X)
+    return output_space.np_format_as(rval, cache_space)
@@ -0,0 +1,201 @@
+"""
+On-the-fly random windowing and flipping of image batches.
+
+`pylearn2.train_extensions.window_flip.WindowAndFlip` rewrites the whole
+topological view of the datasets it randomizes after every epoch, from a
+zero-padded copy of the original images. The classes in this module
+instead window and flip each batch as it is requested from the dataset
+iterator, so that no copy of the dataset is kept and the random windows
+change at every batch rather than at every epoch.
+
+Batches are processed by the Cython routines of
+`pylearn2.utils._window_flip`, which release the GIL: the work can be
+split between several threads, and it overlaps with training when the
+iterator is prefetched (see the `prefetch` argument of `SGD`).
+"""
+import numpy as np
+from theano.compat.six.moves import xrange
+
+from pylearn2.blocks import Block
+from pylearn2.datasets.transformer_dataset import TransformerDataset
+from pylearn2.space import Conv2DSpace
+from pylearn2.utils.exc import reraise_as
+from pylearn2.utils.rng import make_np_rng
+
+try:
+    from pylearn2.utils._window_flip import random_window_and_flip_c01b
+    from pylearn2.utils._window_flip import random_window_and_flip_b01c
+except ImportError:
+    reraise_as(ImportError("Import of Cython module failed. Please make sure "
+                           "you have run 'python setup.py develop' in the "
+                           "pylearn2 directory"))
+
+
+class RandomWindowAndFlip(Block):
+
+    """
+    A Block extracting a randomly positioned window from each image of a
+    batch, and reflecting it horizontally with probability 0.5.
+
+    Parameters
+    ----------
+    input_space : Conv2DSpace
+        The space of the images. Its axes must be ('c', 0, 1, 'b') or
+        ('b', 0, 1, 'c').
+    window_shape : tuple
+        The (rows, cols) shape of the windows.
+    pad : int, optional
+        Amount of zero padding added to each side of the images before
+        windowing.
+    flip : bool, optional
+        Whether to reflect the windows horizontally with probability
+        0.5.
+    rng : numpy.random.RandomState object or seed, optional
+        A random number generator or seed used to create one.
+        Seeded deterministically by default.
+    num_threads : int, optional
+        Number of threads between which each batch is split.
+    """
+
+    def __init__(self, input_space, window_shape, pad=0, flip=True,
+                 rng=(2013, 2, 20), num_threads=1):
+        super(RandomWindowAndFlip, self).__init__()
+        axes = tuple(input_space.axes)
+        if axes not in (('c', 0, 1, 'b'), ('b', 0, 1, 'c')):
+            raise ValueError("Axes of input space are not supported: %s" %
+                             str(axes))
+        self.window_shape = tuple(window_shape)
+        for window, size in zip(self.window_shape, input_space.shape):
+            if window > size + 2 * pad:
+                raise ValueError("window_shape %s is larger than the padded "
+                                 "images" % str(self.window_shape))
+        self.input_space = input_space
+        self.output_space = Conv2DSpace(shape=self.window_shape,
+                                        num_channels=input_space.num_channels,
+                                        axes=axes, dtype='float32')
+        self.pad = pad
+        self.flip = flip
+        self.num_threads = num_threads
+        self.rng = make_np_rng(rng, which_method="random_integers")
+        self._pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
+    def perform(self, X):
+        """
+        Windows and flips a batch of images.
+
+        Parameters
+        ----------
+        X : ndarray
+            A batch of images, in `self.input_space`.
+
+        Returns
+        -------
+        rval : ndarray
+            The windowed images, a new float32 array in
+            `self.output_space`.
+        """
+        X = np.asarray(X, dtype='float32')
+        axes = self.input_space.axes
+        batch_axis = axes.index('b')
+        if self.pad:
+            shape = list(X.shape)
+            padded = [slice(None)] * X.ndim
+            for axis in (axes.index(0), axes.index(1)):
+                shape[axis] += 2 * self.pad
+                padded[axis] = slice(self.pad, -self.pad)
+            images = np.zeros(shape, dtype='float32')
+            images[tuple(padded)] = X
+            X = images
+        shape = list(X.shape)
+        shape[axes.index(0)], shape[axes.index(1)] = self.window_shape
+        rval = np.empty(shape, dtype='float32')
+
+        batch_size = X.shape[batch_axis]
+        num_parts = max(1, min(self.num_threads, batch_size))
+        bounds = np.linspace(0, batch_size, num_parts + 1).astype('int64')
+        # Draw the seeds here so that the result only depends on self.rng
+        seeds = self.rng.random_integers(2 ** 30, size=num_parts)
+        parts = []
+        for i in xrange(num_parts):
+            index = [slice(None)] * X.ndim
+            index[batch_axis] = slice(bounds[i], bounds[i + 1])
+            index = tuple(index)
+            parts.append((X[index], rval[index], seeds[i]))
+
+        if num_parts == 1:
+            self._window_and_flip(parts[0])
+        else:
+            if self._pool is None:
+                from multiprocessing.pool import ThreadPool
+                self._pool = ThreadPool(self.num_threads)
+            self._pool.map(self._window_and_flip, parts)
+        return rval
+
+    def _window_and_flip(self, part):
+        """
+        Windows and flips part of a batch.
+
+        Parameters
+        ----------
+        part : tuple
+            The images, the output array and the random seed to use.
+        """
+        images, out, seed = part
+        if tuple(self.input_space.axes) == ('c', 0, 1, 'b'):
+            window_flip = random_window_and_flip_c01b
+        else:
+            window_flip = random_window_and_flip_b01c
+        window_flip(images, self.window_shape, out=out, rng=seed,
+                    flip=self.flip)
+
+    def get_input_space(self):
+        """
+        Returns the space of the images.
+        """
+        return self.input_space
+
+    def get_output_space(self):
+        """
+        Returns the space of the windowed images.
+        """
+        return self.output_space
+
+
+class WindowAndFlipDataset(TransformerDataset):
+
+    """
+    A TransformerDataset that returns random windows of the images of an
+    image dataset, reflected horizontally with probability 0.5. A new
+    window is drawn for each example every time it is requested.
+
+    Parameters
+    ----------
+    raw : DenseDesignMatrix
+        The image dataset. Its view converter must use the axes
+        ('c', 0, 1, 'b') or ('b', 0, 1, 'c').
+    window_shape : tuple
+        The (rows, cols) shape of the windows.
+    pad : int, optional
+        Amount of zero padding added to each side of the images before
+        windowing.
+    flip : bool, optional
+        Whether to reflect the windows horizontally with probability
+        0.5.
+    rng : numpy.random.RandomState object or seed, optional
+        A random number generator or seed used to create one.
+        Seeded deterministically by default.
+    num_threads : int, optional
+        Number of threads between which each batch is split.
+    """
+
+    def __init__(self, raw, window_shape, pad=0, flip=True,
+                 rng=(2013, 2, 20), num_threads=1):
+        transformer = RandomWindowAndFlip(raw.view_converter.topo_space,
+                                          window_shape, pad=pad, flip=flip,
+                                          rng=rng, num_threads=num_threads)
+        super(WindowAndFlipDataset, self).__init__(raw, transformer)
@@ -1,10 +1,19 @@
 """
-.. todo::
+Parzen windows (aka kernel density) estimators with Gaussian kernels.
 
-    WRITEME
+`make_lpdf` and the default `ParzenWindows` backend build the estimator as a
+Theano graph. `parzen_log_likelihoods` and `cross_validate_sigma` are pure
+NumPy, blocked implementations: squared distances between tiles of test
+points and tiles of samples are computed with one matrix product per tile
+and reduced with a running, numerically stable log-sum-exp, so that memory
+is bounded by the tile sizes and tiles of test points can be processed by a
+pool of worker processes.
 """
+import multiprocessing
+
 import numpy
 import theano
+from theano.compat.six.moves import xrange
 T = theano.tensor
 
 
@@ -48,11 +57,179 @@ def make_lpdf(mu, sigma):
     return theano.function([x], E - Z)
 
 
-class ParzenWindows(object):
+def _log_mean_exp_blocked(x, samples, sigmas, sample_block):
     """
-    .. todo::
+    Computes, for every sigma and every row x_i of `x`,
+    log mean_j exp(-||x_i - mu_j||^2 / (2 sigma^2)) where mu_j are the rows
+    of `samples`, visiting `samples` by blocks of `sample_block` rows.
 
-        WRITEME
+    The squared distance tile of each block is computed once and reused
+    for all the values of sigma.
+
+    Returns
+    -------
+    rval : numpy.ndarray
+        Matrix of shape (len(sigmas), x.shape[0]).
+    """
+    x = numpy.asarray(x, dtype='float64')
+    x_sqnorms = numpy.square(x).sum(axis=1)
+    n_samples = samples.shape[0]
+    scales = [-0.5 / sigma ** 2 for sigma in sigmas]
+
+    # running maximum and sum of exp(a - maximum), per sigma and test point
+    maxes = numpy.empty((len(sigmas), x.shape[0]))
+    maxes.fill(-numpy.inf)
+    sums = numpy.zeros((len(sigmas), x.shape[0]))
+    for start in xrange(0, n_samples, sample_block):
+        mu = numpy.asarray(samples[start:start + sample_block],
+                           dtype='float64')
+        dists = numpy.dot(x, mu.T)
+        dists *= -2
+        dists += x_sqnorms[:, numpy.newaxis]
+        dists += numpy.square(mu).sum(axis=1)
+        # cancellation can make distances slightly negative
+        numpy.maximum(dists, 0, out=dists)
+        for i, scale in enumerate(scales):
+            a = dists * scale
+            new_max = numpy.maximum(maxes[i], a.max(axis=1))
+            a -= new_max[:, numpy.newaxis]
+            numpy.exp(a, out=a)
+            sums[i] *= numpy.exp(maxes[i] - new_max)
+            sums[i] += a.sum(axis=1)
+            maxes[i] = new_max
+    return maxes + numpy.log(sums) - numpy.log(n_samples)
+
+
+# Data shared with the worker processes of `parzen_log_likelihoods`. It is
+# set by the pool initializer, so that with the fork start method the
+# arrays are inherited rather than pickled for each task.
+_worker_data = {}
+
+
+def _init_worker(x, samples, sigmas, sample_block):
+    """
+    Initializer of the worker processes of `parzen_log_likelihoods`.
+    """
+    _worker_data['x'] = x
+    _worker_data['samples'] = samples
+    _worker_data['sigmas'] = sigmas
+    _worker_data['sample_block'] = sample_block
+
+
+def _worker_tile(bounds):
+    """
+    Computes `_log_mean_exp_blocked` for the rows `bounds[0]:bounds[1]`
+    of the test points given to `_init_worker`.
+    """
+    start, stop = bounds
+    return _log_mean_exp_blocked(_worker_data['x'][start:stop],
+                                 _worker_data['samples'],
+                                 _worker_data['sigmas'],
+                                 _worker_data['sample_block'])
+
+
+def parzen_log_likelihoods(x, samples, sigmas, x_block=1000,
+                           sample_block=1000, num_workers=1):
+    """
+    Evaluates the log likelihood of each row of `x` under the Parzen
+    windows estimators of bandwidths `sigmas` centered on `samples`,
+    without using Theano.
+
+    Parameters
+    ----------
+    x : numpy matrix
+        Test points, one per row.
+    samples : numpy matrix
+        The data points over which the distribution is based. Any
+        container supporting row slicing (e.g. a memmap or an HDF5
+        dataset) can be used.
+    sigmas : scalar or list of scalars
+        Standard deviation(s) of the Gaussian kernels. The squared
+        distances are computed once for all of them.
+    x_block : int, optional
+        Number of test points per tile.
+    sample_block : int, optional
+        Number of samples per tile. Memory use is roughly
+        `x_block * sample_block` doubles per worker.
+    num_workers : int, optional
+        Number of processes among which tiles of test points are
+        distributed. Defaults to 1 (no worker process).
+
+    Returns
+    -------
+    lls : numpy.ndarray
+        The log likelihoods, of shape (len(sigmas), x.shape[0]), or of
+        shape (x.shape[0],) if `sigmas` is a scalar.
+    """
+    scalar_sigma = numpy.isscalar(sigmas)
+    sigmas = numpy.atleast_1d(numpy.asarray(sigmas, dtype='float64'))
+    dim = samples.shape[1]
+    bounds = [(start, min(start + x_block, x.shape[0]))
+              for start in xrange(0, x.shape[0], x_block)]
+
+    if num_workers > 1 and len(bounds) > 1:
+        pool = multiprocessing.Pool(num_workers, initializer=_init_worker,
+                                    initargs=(x, samples, sigmas,
+                                              sample_block))
+        try:
+            tiles = pool.map(_worker_tile, bounds)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        tiles = [_log_mean_exp_blocked(x[start:stop], samples, sigmas,
+                                       sample_block)
+                 for start, stop in bounds]
+
+    lls = numpy.concatenate(tiles, axis=1)
+    lls -= dim * numpy.log(sigmas * numpy.sqrt(numpy.pi * 2))[:, None]
+    if scalar_sigma:
+        return lls[0]
+    return lls
+
+
+def cross_validate_sigma(samples, x, sigmas, x_block=1000,
+                         sample_block=1000, num_workers=1):
+    """
+    Picks the bandwidth of a Parzen windows estimator centered on
+    `samples` that maximizes the mean log likelihood of the validation
+    points `x`. The squared distances are computed once and shared by
+    all the candidate values.
+
+    Parameters
+    ----------
+    samples : numpy matrix
+        The data points over which the distribution is based.
+    x : numpy matrix
+        Validation points, one per row.
+    sigmas : list of scalars
+        Candidate standard deviations.
+    x_block : int, optional
+        See `parzen_log_likelihoods`.
+    sample_block : int, optional
+        See `parzen_log_likelihoods`.
+    num_workers : int, optional
+        See `parzen_log_likelihoods`.
+
+    Returns
+    -------
+    best_sigma : float
+        The candidate with the highest mean log likelihood.
+    mean_lls : numpy.ndarray
+        Mean log likelihood of `x` for each candidate.
+    """
+    sigmas = numpy.atleast_1d(numpy.asarray(sigmas, dtype='float64'))
+    lls = parzen_log_likelihoods(x, samples, sigmas, x_block=x_block,
+                                 sample_block=sample_block,
+                                 num_workers=num_workers)
+    mean_lls = lls.mean(axis=1)
+    return sigmas[numpy.argmax(mean_lls)], mean_lls
+
+
+class ParzenWindows(object):
+    """
+    Parzen windows estimator (aka kernel density estimator) with
+    Gaussian kernels.
 
     Parameters
     ----------
@@ -60,15 +237,32 @@ class ParzenWindows(object):
         See description for make_lpdf
     sigma : scalar
         See description for make_lpdf
+    backend : str, optional
+        'theano' (default) evaluates the estimator with the function
+        returned by `make_lpdf`. 'numpy' uses `parzen_log_likelihoods`,
+        which does not compile anything and bounds memory by tiling
+        both the samples and the test points.
+    sample_block : int, optional
+        Number of samples per tile with the 'numpy' backend.
+    num_workers : int, optional
+        Number of worker processes with the 'numpy' backend.
     """
-    def __init__(self, samples, sigma):
+    def __init__(self, samples, sigma, backend='theano', sample_block=1000,
+                 num_workers=1):
         # just keeping these for debugging/examination, not needed
         self._samples = samples
         self._sigma = sigma
 
-        self.lpdf = make_lpdf(samples, sigma)
+        if backend not in ('theano', 'numpy'):
+            raise ValueError("backend should be 'theano' or 'numpy', got "
+                             + str(backend))
+        self.backend = backend
+        self.sample_block = sample_block
+        self.num_workers = num_workers
+        if backend == 'theano':
+            self.lpdf = make_lpdf(samples, sigma)
 
-    def get_ll(self, x, batch_size=10):
+    def get_ll(self, x, batch_size=None):
         """
         Evaluates the log likelihood of a set of datapoints with respect to the
         probability distribution.
@@ -78,7 +272,20 @@ class ParzenWindows(object):
         x : numpy matrix
             The set of points for which you want to evaluate the log \
             likelihood.
+        batch_size : int, optional
+            Number of points evaluated at once. Defaults to 10 with the
+            'theano' backend and 1000 with the 'numpy' backend.
         """
+        if self.backend == 'numpy':
+            if batch_size is None:
+                batch_size = 1000
+            return parzen_log_likelihoods(
+                x, self._samples, self._sigma, x_block=batch_size,
+                sample_block=self.sample_block,
+                num_workers=self.num_workers).mean()
+
+        if batch_size is None:
+            batch_size = 10
         inds = range(x.shape[0])
         n_batches = int(numpy.ceil(float(len(inds)) / batch_size))
 
@@ -0,0 +1,77 @@
+"""
+Tests of ../parzen.py
+"""
+import numpy as np
+
+from pylearn2.distributions.parzen import (ParzenWindows,
+                                           cross_validate_sigma,
+                                           parzen_log_likelihoods)
+
+
+def brute_force_ll(x, samples, sigma):
+    """
+    Log likelihoods computed without blocking, for reference.
+
+    Parameters
+    ----------
+    x : ndarray
+        The points whose log likelihood is computed, one per row.
+    samples : ndarray
+        The samples on which the Parzen windows are centered.
+    sigma : float
+        The standard deviation of the Gaussian windows.
+    """
+    dists = np.square(x[:, np.newaxis, :] - samples[np.newaxis]).sum(axis=2)
+    a = -0.5 * dists / sigma ** 2
+    max_ = a.max(axis=1)
+    lme = max_ + np.log(np.exp(a - max_[:, np.newaxis]).mean(axis=1))
+    return lme - samples.shape[1] * np.log(sigma * np.sqrt(2 * np.pi))
+
+
+def test_blocked_ll():
+    """
+    Tests that the blocked NumPy evaluator matches the brute force
+    computation, with and without worker processes.
+    """
+    rng = np.random.RandomState(0)
+    samples = rng.randn(53, 4)
+    x = rng.randn(31, 4)
+    for sigma in [0.05, 0.5, 2.]:
+        expected = brute_force_ll(x, samples, sigma)
+        lls = parzen_log_likelihoods(x, samples, sigma, x_block=7,
+                                     sample_block=10)
+        assert lls.shape == (31,)
+        assert np.allclose(lls, expected)
+        lls = parzen_log_likelihoods(x, samples, [sigma], x_block=7,
+                                     sample_block=10, num_workers=2)
+        assert lls.shape == (1, 31)
+        assert np.allclose(lls[0], expected)
+
+
+def test_backends_agree():
+    """
+    Tests that ParzenWindows gives the same result with both backends.
+    """
+    rng = np.random.RandomState(1)
+    samples = rng.randn(40, 3)
+    x = rng.randn(25, 3)
+    theano_ll = ParzenWindows(samples, .5).get_ll(x)
+    numpy_ll = ParzenWindows(samples, .5, backend='numpy',
+                             sample_block=9).get_ll(x, batch_size=6)
+    assert np.allclose(theano_ll, numpy_ll)
+
+
+def test_cross_validate_sigma():
+    """
+    Tests that cross_validate_sigma returns the per-sigma mean log
+    likelihoods and the best candidate.
+    """
+    rng = np.random.RandomState(2)
+    samples = rng.randn(60, 2)
+    x = rng.randn(20, 2)
+    sigmas = [0.01, 0.3, 10.]
+    best, mean_lls = cross_validate_sigma(samples, x, sigmas, x_block=8,
+                                          sample_block=16)
+    expected = [brute_force_ll(x, samples, s).mean() for s in sigmas]
+    assert np.allclose(mean_lls, expected)
+    assert best == sigmas[int(np.argmax(expected))]
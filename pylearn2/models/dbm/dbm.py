@@ -591,6 +591,45 @@ class DBM(Model):
 
         return rval
 
+    def make_sampling_chains(self, layer_to_state, theano_rng,
+                             layer_to_clamp=None, thinning=1,
+                             samples_per_call=100):
+        """
+        Returns persistent chains advanced by steps of
+        `self.sampling_procedure`, run in a compiled loop. Unlike the
+        updates returned by `get_sampling_updates`, a single call to
+        the compiled function can run any number of steps, and record
+        the visible samples every `thinning` steps.
+
+        Parameters
+        ----------
+        layer_to_state : dict
+            Dictionary mapping the SuperDBM_Layer instances contained in
+            self to shared variables representing batches of samples of
+            them, one per chain. (you can allocate one by calling
+            self.make_layer_to_state)
+        theano_rng : MRG_RandomStreams
+            Random number generator
+        layer_to_clamp : dict, optional
+            Dictionary mapping layers to bools. If a layer is not in the
+            dictionary, defaults to False. True indicates that this layer
+            should be clamped.
+        thinning : int, optional
+            Number of sampling steps between two recorded samples.
+        samples_per_call : int, optional
+            Maximum number of samples of each chain recorded by each call
+            to the compiled function.
+
+        Returns
+        -------
+        chains : pylearn2.models.gibbs_chains.GibbsChains
+            The chains. Their `advance`, `sample` and `save` methods
+            update the shared variables of `layer_to_state`.
+        """
+        return self.sampling_procedure.make_chains(
+            layer_to_state, theano_rng, layer_to_clamp, thinning=thinning,
+            samples_per_call=samples_per_call)
+
     def get_monitoring_channels(self, data):
         """
         .. todo::
@@ -9,6 +9,8 @@ __maintainer__ = "LISA Lab"
 
 from theano.compat.six.moves import xrange
 from pylearn2.compat import OrderedDict
+from pylearn2.models.dbm import flatten
+from pylearn2.models.gibbs_chains import GibbsChains
 from pylearn2.utils import py_integer_types
 
 
@@ -58,6 +60,58 @@ class SamplingProcedure(object):
         raise NotImplementedError(str(type(self))+" does not implement " +
                                   "sample.")
 
+    def make_chains(self, layer_to_state, theano_rng, layer_to_clamp=None,
+                    thinning=1, samples_per_call=100):
+        """
+        Returns persistent chains advanced by steps of this sampling
+        procedure, run in a compiled loop.
+
+        Parameters
+        ----------
+        layer_to_state : dict
+            Maps the DBM's Layer instances to shared variables
+            representing batches of samples of them (see
+            `DBM.make_layer_to_state`). The first axis of the samples
+            indexes the chains.
+        theano_rng : theano.sandbox.rng_mrg.MRG_RandomStreams
+            Random number generator
+        layer_to_clamp : dict, optional
+            See `sample`.
+        thinning : int, optional
+            Number of sampling steps between two recorded samples.
+        samples_per_call : int, optional
+            See `GibbsChains`.
+
+        Returns
+        -------
+        chains : pylearn2.models.gibbs_chains.GibbsChains
+            The chains, recording the state of the visible layer.
+        """
+        layers = list(layer_to_state.keys())
+        template = [layer_to_state[layer] for layer in layers]
+        states = flatten(template)
+        vis_state = flatten(layer_to_state[self.dbm.visible_layer])[0]
+        output = [i for i, state in enumerate(states)
+                  if state is vis_state][0]
+
+        def unflatten(template, states):
+            if isinstance(template, (list, tuple)):
+                return type(template)(unflatten(elem, states)
+                                      for elem in template)
+            return next(states)
+
+        def step(states):
+            states = iter(states)
+            layer_to_new_state = OrderedDict(
+                (layer, unflatten(state, states))
+                for layer, state in zip(layers, template))
+            updated = self.sample(layer_to_new_state, theano_rng,
+                                  layer_to_clamp)
+            return flatten([updated[layer] for layer in layers])
+
+        return GibbsChains(states, step, output=output, thinning=thinning,
+                           samples_per_call=samples_per_call)
+
 
 class GibbsEvenOdd(SamplingProcedure):
     """
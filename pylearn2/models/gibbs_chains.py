@@ -0,0 +1,197 @@
+"""
+Persistent Gibbs chains running many sweeps per compiled call.
+
+The sampling updates of `pylearn2.models.rbm.BlockGibbsSampler` and
+`DBM.get_sampling_updates` perform a single Gibbs sweep per call of the
+compiled function, or unroll a fixed number of sweeps in the graph.
+`GibbsChains` instead runs the sweeps in a `theano.scan`, so that one
+call advances a batch of independent chains by any number of sweeps and
+returns their states recorded every `thinning` sweeps. The recorded
+samples can be written to a .npy, .h5 or .csv file as they are drawn
+(see `GibbsChains.save`), so that neither the samples nor the sampling
+loop have to go through Python at every sweep.
+"""
+import logging
+
+import numpy as np
+import theano
+from theano import tensor as T
+
+from pylearn2.utils.output_writer import OutputWriter
+
+
+logger = logging.getLogger(__name__)
+
+
+class GibbsChains(object):
+
+    """
+    A batch of persistent Markov chains, advanced by Gibbs sweeps run in
+    a compiled loop.
+
+    Parameters
+    ----------
+    states : list
+        Shared variables holding the states of the chains. The first
+        axis of each one indexes the chains.
+    step : callable
+        `step(states)` returns the list of the states after one Gibbs
+        sweep, given the list of the current (symbolic) states. Random
+        numbers must be drawn from Theano random streams, whose updates
+        are collected by the scan.
+    output : int, optional
+        Index in `states` of the state recorded as samples.
+    thinning : int, optional
+        Number of sweeps between two recorded samples.
+    samples_per_call : int, optional
+        Maximum number of samples (of each chain) recorded by each call
+        to the compiled function.
+    """
+
+    def __init__(self, states, step, output=0, thinning=1,
+                 samples_per_call=100):
+        assert thinning > 0
+        assert samples_per_call > 0
+        self.states = list(states)
+        self.step = step
+        self.output = output
+        self.thinning = thinning
+        self.samples_per_call = samples_per_call
+        self._function = None
+
+    @property
+    def num_chains(self):
+        """
+        The number of chains.
+        """
+        return self.states[self.output].get_value(borrow=True).shape[0]
+
+    def compile(self):
+        """
+        Compiles the sampling function, unless it is already compiled.
+
+        The function takes the number of samples `n` to record and the
+        number of sweeps `k` between two of them. It runs `n * k` sweeps,
+        updates the states and returns the recorded samples, as an
+        array whose first axis indexes the samples and whose second
+        axis indexes the chains.
+        """
+        if self._function is not None:
+            return
+        num_samples = T.iscalar('num_samples')
+        num_sweeps = T.iscalar('num_sweeps')
+
+        def sweep(*states):
+            new_states = self.step(list(states))
+            assert len(new_states) == len(states)
+            return [T.cast(new, old.dtype)
+                    for new, old in zip(new_states, states)]
+
+        def record(*states):
+            new_states, updates = theano.scan(sweep,
+                                              outputs_info=list(states),
+                                              n_steps=num_sweeps)
+            if len(states) == 1:
+                new_states = [new_states]
+            return [new[-1] for new in new_states], updates
+
+        samples, updates = theano.scan(record, outputs_info=self.states,
+                                       n_steps=num_samples)
+        if len(self.states) == 1:
+            samples = [samples]
+        for state, new in zip(self.states, samples):
+            updates[state] = new[-1]
+        self._function = theano.function([num_samples, num_sweeps],
+                                         samples[self.output],
+                                         updates=updates,
+                                         name='gibbs_chains')
+
+    def advance(self, num_sweeps):
+        """
+        Runs the chains for a number of sweeps without recording them,
+        e.g. for burn-in.
+
+        Parameters
+        ----------
+        num_sweeps : int
+            The number of Gibbs sweeps.
+        """
+        if num_sweeps > 0:
+            self.compile()
+            self._function(1, num_sweeps)
+
+    def iter_samples(self, num_samples, burn_in=0):
+        """
+        Runs the chains and yields the samples, up to
+        `samples_per_call` at a time.
+
+        Parameters
+        ----------
+        num_samples : int
+            The number of samples recorded from each chain.
+        burn_in : int, optional
+            The number of sweeps run before recording the first sample.
+
+        Returns
+        -------
+        samples : generator
+            Yields arrays whose first axis indexes the samples and whose
+            second axis indexes the chains.
+        """
+        self.advance(burn_in)
+        self.compile()
+        while num_samples > 0:
+            n = min(num_samples, self.samples_per_call)
+            yield self._function(n, self.thinning)
+            num_samples -= n
+
+    def sample(self, num_samples, burn_in=0):
+        """
+        Runs the chains and returns the samples.
+
+        Parameters
+        ----------
+        num_samples : int
+            The number of samples recorded from each chain.
+        burn_in : int, optional
+            The number of sweeps run before recording the first sample.
+
+        Returns
+        -------
+        samples : ndarray
+            The samples. The first axis indexes the samples and the
+            second one the chains.
+        """
+        return np.concatenate(list(self.iter_samples(num_samples, burn_in)))
+
+    def save(self, path, num_samples, burn_in=0, key='samples'):
+        """
+        Runs the chains and writes the samples to a file as they are
+        drawn. The samples of all chains recorded after a given sweep
+        are written in consecutive rows.
+
+        Parameters
+        ----------
+        path : str
+            A .npy, .h5, .hdf5 or .csv file. Only samples with one axis
+            (besides the batch axis) can be written to a .csv file.
+        num_samples : int
+            The number of samples recorded from each chain.
+        burn_in : int, optional
+            The number of sweeps run before recording the first sample.
+        key : str, optional
+            The name of the samples in an HDF5 file.
+
+        Returns
+        -------
+        num_rows : int
+            The number of samples written.
+        """
+        writer = OutputWriter(path, num_samples * self.num_chains, key)
+        try:
+            for samples in self.iter_samples(num_samples, burn_in):
+                writer.write(samples.reshape((-1,) + samples.shape[2:]))
+                logger.info("Wrote %d samples to %s", writer.written, path)
+        finally:
+            writer.close()
+        return writer.written
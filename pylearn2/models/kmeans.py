@@ -1,15 +1,17 @@
 """K-means as a postprocessing Block subclass."""
 
 import logging
+from multiprocessing.pool import ThreadPool
 import numpy
+import scipy.sparse
 from theano.compat.six.moves import xrange
 from pylearn2.blocks import Block
 from pylearn2.models.model import Model
 from pylearn2.space import VectorSpace
 from pylearn2.utils import sharedX
-from pylearn2.utils.mem import improve_memory_error_message
 from pylearn2.utils import wraps
 from pylearn2.utils import contains_nan
+from pylearn2.utils.rng import make_np_rng
 import warnings
 
 try:
@@ -22,12 +24,21 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Number of entries of the (examples x clusters) distance block computed at
+# once when `chunk_size` is not specified: 2 ** 22 doubles, i.e. 32 MB.
+_DEFAULT_BLOCK_SIZE = 2 ** 22
+
 
 class KMeans(Block, Model):
     """
     Block that outputs a vector of probabilities that a sample belong
     to means computed during training.
 
+    Distances between examples and centroids are computed as
+    :math:`||x||^2 - 2 x \\cdot \\mu + ||\\mu||^2`, i.e. with one matrix
+    product per chunk of examples, so that memory use is bounded by
+    `chunk_size` times `k` regardless of the size of the dataset.
+
     Parameters
     ----------
     k : int
@@ -38,13 +49,36 @@ class KMeans(Block, Model):
         Threshold of distance to clusters under which k-means stops
         iterating.
     max_iter : int, optional
-        Maximum number of iterations. Defaults to infinity.
+        Maximum number of iterations (epochs in mini-batch mode).
+        Defaults to infinity.
     verbose : bool
         WRITEME
+    init : str, optional
+        How to pick the initial centroids when they are not given to
+        `train_all`: 'random' (default) picks `k` random examples,
+        'k-means++' uses the seeding of Arthur and Vassilvitskii (2007).
+    batch_size : int, optional
+        If specified, use the mini-batch k-means of Sculley (2010):
+        centroids are updated from minibatches of this size drawn from
+        `dataset.iterator`, so the design matrix never needs to be
+        loaded in memory as a whole. Otherwise, run the full-batch
+        (Lloyd) algorithm.
+    chunk_size : int, optional
+        Number of examples whose distances to all centroids are
+        computed at once. Defaults to a value keeping the distance
+        block around 32 MB.
+    num_workers : int, optional
+        Number of threads used to compute the assignment step in
+        parallel over chunks. The work is done by BLAS and numpy
+        routines that release the GIL. Defaults to 1.
+    seed : int or list of ints, optional
+        Seed of the random number generator used for initialization
+        and for the order of the minibatches.
     """
 
     def __init__(self, k, nvis, convergence_th=1e-6, max_iter=None,
-                 verbose=False):
+                 verbose=False, init='random', batch_size=None,
+                 chunk_size=None, num_workers=1, seed=None):
         Block.__init__(self)
         Model.__init__(self)
 
@@ -62,6 +96,21 @@ class KMeans(Block, Model):
 
         self.verbose = verbose
 
+        if init not in ('random', 'k-means++'):
+            raise ValueError("KMeans init: init should be 'random' or "
+                             "'k-means++', got %s" % str(init))
+        self.init = init
+        self.batch_size = batch_size
+        if chunk_size is None:
+            chunk_size = max(1, _DEFAULT_BLOCK_SIZE // k)
+        self.chunk_size = chunk_size
+        if num_workers < 1:
+            raise ValueError('KMeans init: num_workers should be at '
+                             'least 1.')
+        self.num_workers = num_workers
+        self.rng = make_np_rng(seed, [2015, 3, 2],
+                               which_method=['randint', 'uniform'])
+
     def train_all(self, dataset, mu=None):
         """
         Process kmeans algorithm on the input to localize clusters.
@@ -79,119 +128,207 @@ class KMeans(Block, Model):
 
         # TODO-- why does this sometimes return X and sometimes return nothing?
 
+        if mu is not None and not len(mu) == self.k:
+            raise Exception("You gave %i clusters"
+                            ", but k=%i were expected"
+                            % (len(mu), self.k))
+
+        if self.batch_size is not None:
+            with self._pool() as pool:
+                mu = self._train_minibatch(dataset, mu, pool)
+            if mu is None:
+                return
+            self.mu = sharedX(mu)
+            self._params = [self.mu]
+            return
+
         X = dataset.get_design_matrix()
 
         n, m = X.shape
         k = self.k
 
-        if milk is not None:
+        if milk is not None and self.init == 'random':
             # use the milk implementation of k-means if it's available
             cluster_ids, mu = milk.kmeans(X, k)
         else:
             # our own implementation
+            with self._pool() as pool:
+                mu = self._train_lloyd(X, mu, pool)
+            if mu is None:
+                return X
+
+        self.mu = sharedX(mu)
+        self._params = [self.mu]
+
+    def _pool(self):
+        """
+        Returns a context manager providing the thread pool used to
+        parallelize the assignment step (None if `num_workers` is 1).
+        """
+        return _WorkerPool(self.num_workers)
+
+    def _initial_means(self, X, x_sqnorms, pool):
+        """
+        Picks `k` initial centroids among the rows of `X`.
+        """
+        if self.init == 'k-means++':
+            return _kmeans_plus_plus(X, x_sqnorms, self.k, self.rng,
+                                     self.chunk_size, pool)
+        indices = self.rng.randint(X.shape[0], size=self.k)
+        return numpy.array(X[indices])
+
+    def _train_lloyd(self, X, mu, pool):
+        """
+        Full-batch k-means. Returns the centroids, or None if NaNs
+        were encountered.
+        """
+        n, m = X.shape
+        k = self.k
 
-            # taking random inputs as initial clusters if user does not provide
-            # them.
-            if mu is not None:
-                if not len(mu) == k:
-                    raise Exception("You gave %i clusters"
-                                    ", but k=%i were expected"
-                                    % (len(mu), k))
-            else:
-                indices = numpy.random.randint(X.shape[0], size=k)
-                mu = X[indices]
-
-            try:
-                dists = numpy.zeros((n, k))
-            except MemoryError as e:
-                improve_memory_error_message(e, "dying trying to allocate "
-                                                "dists matrix for {0} "
-                                                "examples and {1} "
-                                                "means".format(n, k))
-
-            old_kills = {}
-
-            iter = 0
-            mmd = prev_mmd = float('inf')
-            while True:
-                if self.verbose:
-                    logger.info('kmeans iter {0}'.format(iter))
-
-                # print 'iter:',iter,' conv crit:',abs(mmd-prev_mmd)
-                # if numpy.sum(numpy.isnan(mu)) > 0:
+        x_sqnorms = _row_sqnorms(X, self.chunk_size)
+
+        # taking random inputs as initial clusters if user does not provide
+        # them.
+        if mu is None:
+            mu = self._initial_means(X, x_sqnorms, pool)
+        mu = numpy.array(mu, dtype=X.dtype)
+
+        old_kills = {}
+
+        iter = 0
+        mmd = prev_mmd = float('inf')
+        while True:
+            if self.verbose:
+                logger.info('kmeans iter {0}'.format(iter))
+
+            if contains_nan(mu):
+                logger.info('nan found')
+                return None
+
+            # computing distances, finding minimum distances and
+            # accumulating the new means in one pass over the data
+            min_dist_inds, min_dists, sums, counts = _assign(
+                X, x_sqnorms, mu, self.chunk_size, pool,
+                accumulate=True)
+
+            if iter > 0:
+                prev_mmd = mmd
+
+            # mean minimum distance:
+            mmd = min_dists.mean()
+
+            logger.info('cost: {0}'.format(mmd))
+
+            if iter > 0 and (iter >= self.max_iter or
+                             abs(mmd - prev_mmd) < self.convergence_th):
+                # converged
+                break
+
+            # computing means
+            nonempty = counts > 0
+            mu[nonempty] = (sums[nonempty] /
+                            counts[nonempty][:, None]).astype(mu.dtype)
+
+            # initializes empty clusters to be the mean of the d data
+            # points farthest from their corresponding means
+            empty = numpy.flatnonzero(~nonempty)
+            new_kills = {}
+            if len(empty) > 0:
+                ds = []
+                for i in empty:
+                    if i in old_kills:
+                        d = old_kills[i] - 1
+                        if d == 0:
+                            d = 50
+                        new_kills[i] = d
+                    else:
+                        d = 5
+                    ds.append(d)
+                total = min(sum(ds), n)
+                farthest = numpy.argsort(min_dists)[::-1][:total]
+                start = 0
+                for i, d in zip(empty, ds):
+                    chosen = farthest[start:start + d]
+                    if len(chosen) == 0:
+                        chosen = farthest[-1:]
+                    mu[i, :] = numpy.asarray(X[numpy.sort(chosen)]).mean(
+                        axis=0)
+                    start += d
+            if contains_nan(mu):
+                logger.info('nan found')
+                return None
+
+            old_kills = new_kills
+
+            iter += 1
+
+        return mu
+
+    def _train_minibatch(self, dataset, mu, pool):
+        """
+        Mini-batch k-means (Sculley, 2010). Each centroid is the running
+        mean of the examples assigned to it so far, which amounts to the
+        per-example update with learning rate 1 / count. Returns the
+        centroids, or None if NaNs were encountered.
+        """
+        k = self.k
+        data_specs = (self.input_space, 'features')
+        n = dataset.get_num_examples()
+        if n < k:
+            raise ValueError("KMeans: cannot find %d clusters in %d "
+                             "examples" % (k, n))
+
+        if mu is None:
+            init_size = min(n, max(3 * k, self.batch_size))
+            it = dataset.iterator(mode='shuffled_sequential',
+                                  batch_size=init_size, num_batches=1,
+                                  data_specs=data_specs, rng=self.rng)
+            sample = numpy.asarray(it.next())
+            mu = self._initial_means(sample,
+                                     _row_sqnorms(sample, self.chunk_size),
+                                     pool)
+        mu = numpy.array(mu, dtype='float64')
+        counts = numpy.zeros(k)
+
+        iter = 0
+        mmd = prev_mmd = float('inf')
+        while True:
+            if self.verbose:
+                logger.info('kmeans epoch {0}'.format(iter))
+
+            total_dist = 0.
+            seen = 0
+            iterator = dataset.iterator(mode='shuffled_sequential',
+                                        batch_size=self.batch_size,
+                                        data_specs=data_specs,
+                                        rng=self.rng)
+            for batch in iterator:
+                batch = numpy.asarray(batch)
+                _, min_dists, sums, batch_counts = _assign(
+                    batch, _row_sqnorms(batch, self.chunk_size),
+                    mu.astype(batch.dtype), self.chunk_size, pool,
+                    accumulate=True)
+                total_dist += min_dists.sum()
+                seen += len(min_dists)
+                counts += batch_counts
+                hit = batch_counts > 0
+                mu[hit] += ((sums[hit] - batch_counts[hit][:, None] *
+                             mu[hit]) / counts[hit][:, None])
                 if contains_nan(mu):
                     logger.info('nan found')
-                    return X
-
-                # computing distances
-                for i in xrange(k):
-                    dists[:, i] = numpy.square((X - mu[i, :])).sum(axis=1)
-
-                if iter > 0:
-                    prev_mmd = mmd
-
-                min_dists = dists.min(axis=1)
-
-                # mean minimum distance:
-                mmd = min_dists.mean()
-
-                logger.info('cost: {0}'.format(mmd))
-
-                if iter > 0 and (iter >= self.max_iter or
-                                 abs(mmd - prev_mmd) < self.convergence_th):
-                    # converged
-                    break
-
-                # finding minimum distances
-                min_dist_inds = dists.argmin(axis=1)
-
-                # computing means
-                i = 0
-                blacklist = []
-                new_kills = {}
-                while i < k:
-                    b = min_dist_inds == i
-                    if not numpy.any(b):
-                        killed_on_prev_iter = True
-                        # initializes empty cluster to be the mean of the d
-                        # data points farthest from their corresponding means
-                        if i in old_kills:
-                            d = old_kills[i] - 1
-                            if d == 0:
-                                d = 50
-                            new_kills[i] = d
-                        else:
-                            d = 5
-                        mu[i, :] = 0
-                        for j in xrange(d):
-                            idx = numpy.argmax(min_dists)
-                            min_dists[idx] = 0
-                            # chose point idx
-                            mu[i, :] += X[idx, :]
-                            blacklist.append(idx)
-                        mu[i, :] /= float(d)
-                        # cluster i was empty, reset it to d far out data
-                        # points recomputing distances for this cluster
-                        dists[:, i] = numpy.square((X - mu[i, :])).sum(axis=1)
-                        min_dists = dists.min(axis=1)
-                        for idx in blacklist:
-                            min_dists[idx] = 0
-                        min_dist_inds = dists.argmin(axis=1)
-                        # done
-                        i += 1
-                    else:
-                        mu[i, :] = numpy.mean(X[b, :], axis=0)
-                        if contains_nan(mu):
-                            logger.info('nan found at {0}'.format(i))
-                            return X
-                        i += 1
+                    return None
 
-                old_kills = new_kills
+            if iter > 0:
+                prev_mmd = mmd
+            mmd = total_dist / seen
+            logger.info('cost: {0}'.format(mmd))
 
-                iter += 1
+            iter += 1
+            if iter >= self.max_iter or (
+                    iter > 1 and abs(mmd - prev_mmd) < self.convergence_th):
+                break
 
-        self.mu = sharedX(mu)
-        self._params = [self.mu]
+        return mu
 
     @wraps(Model.continue_learning)
     def continue_learning(self):
@@ -254,3 +391,176 @@ class KMeans(Block, Model):
     # NotImplementedError).
     get_input_space = Model.get_input_space
     get_output_space = Model.get_output_space
+
+
+class _WorkerPool(object):
+    """
+    Context manager creating a `ThreadPool` of `num_workers` threads, or
+    providing None when a single worker is requested.
+
+    Parameters
+    ----------
+    num_workers : int
+        Number of threads.
+    """
+
+    def __init__(self, num_workers):
+        self.num_workers = num_workers
+        self.pool = None
+
+    def __enter__(self):
+        if self.num_workers > 1:
+            self.pool = ThreadPool(self.num_workers)
+        return self.pool
+
+    def __exit__(self, *args):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        return False
+
+
+def _map_chunks(fn, n, chunk_size, pool=None):
+    """
+    Applies `fn(start, stop)` to consecutive ranges of `chunk_size`
+    indices covering `range(n)`, in parallel if `pool` is given, and
+    returns the results in order.
+    """
+    ranges = [(start, min(start + chunk_size, n))
+              for start in xrange(0, n, chunk_size)]
+    if pool is None:
+        return [fn(start, stop) for start, stop in ranges]
+    return pool.map(lambda r: fn(*r), ranges)
+
+
+def _row_sqnorms(X, chunk_size):
+    """
+    Returns the squared L2 norm of every row of `X`, in float64.
+    """
+    return numpy.concatenate(_map_chunks(
+        lambda start, stop: numpy.square(
+            numpy.asarray(X[start:stop], dtype='float64')).sum(axis=1),
+        X.shape[0], chunk_size)) if X.shape[0] > 0 else numpy.zeros(0)
+
+
+def _assign(X, x_sqnorms, mu, chunk_size, pool=None, accumulate=False):
+    """
+    Finds the closest centroid of every row of `X`.
+
+    Parameters
+    ----------
+    X : array-like
+        Design matrix, or any container supporting row slicing.
+    x_sqnorms : numpy.ndarray
+        Squared norms of the rows of `X`.
+    mu : numpy.ndarray
+        Centroids, one per row.
+    chunk_size : int
+        Number of rows processed at once.
+    pool : ThreadPool, optional
+        If given, chunks are processed in parallel.
+    accumulate : bool, optional
+        If True, also return the sum and the number of the examples
+        assigned to each centroid.
+
+    Returns
+    -------
+    min_dist_inds : numpy.ndarray
+        Index of the closest centroid of each example.
+    min_dists : numpy.ndarray
+        Squared distance to the closest centroid.
+    sums : numpy.ndarray
+        Only if `accumulate`. Sum of the examples assigned to each
+        centroid, in float64.
+    counts : numpy.ndarray
+        Only if `accumulate`. Number of examples assigned to each
+        centroid.
+    """
+    k = mu.shape[0]
+    mu_sqnorms = numpy.square(mu.astype('float64')).sum(axis=1)
+
+    def process(start, stop):
+        chunk = numpy.asarray(X[start:stop])
+        # -2 x.mu + ||mu||^2 is enough to find the argmin, ||x||^2 is only
+        # needed for the value of the minimum
+        dists = numpy.dot(chunk, mu.T)
+        dists *= -2
+        dists += mu_sqnorms
+        inds = dists.argmin(axis=1)
+        mins = dists[numpy.arange(len(inds)), inds] + x_sqnorms[start:stop]
+        # cancellation can make distances slightly negative
+        numpy.maximum(mins, 0, out=mins)
+        if not accumulate:
+            return inds, mins, None, None
+        one_hot = scipy.sparse.csr_matrix(
+            (numpy.ones(len(inds)), (inds, numpy.arange(len(inds)))),
+            shape=(k, len(inds)))
+        sums = numpy.asarray(one_hot.dot(chunk.astype('float64')))
+        counts = numpy.bincount(inds, minlength=k)
+        return inds, mins, sums, counts
+
+    results = _map_chunks(process, X.shape[0], chunk_size, pool)
+    min_dist_inds = numpy.concatenate([r[0] for r in results])
+    min_dists = numpy.concatenate([r[1] for r in results])
+    if not accumulate:
+        return min_dist_inds, min_dists
+    sums = sum(r[2] for r in results)
+    counts = sum(r[3] for r in results)
+    return min_dist_inds, min_dists, sums, counts
+
+
+def _kmeans_plus_plus(X, x_sqnorms, k, rng, chunk_size, pool=None):
+    """
+    k-means++ seeding (Arthur and Vassilvitskii, 2007): every new
+    centroid is an example drawn with probability proportional to its
+    squared distance to the closest centroid already chosen.
+
+    Parameters
+    ----------
+    X : array-like
+        Design matrix, or any container supporting row slicing.
+    x_sqnorms : numpy.ndarray
+        Squared norms of the rows of `X`.
+    k : int
+        Number of centroids.
+    rng : numpy.random.RandomState
+        Random number generator.
+    chunk_size : int
+        Number of rows processed at once.
+    pool : ThreadPool, optional
+        If given, chunks are processed in parallel.
+
+    Returns
+    -------
+    mu : numpy.ndarray
+        The `k` initial centroids.
+    """
+    n, m = X.shape
+    mu = numpy.empty((k, m), dtype=X.dtype)
+
+    def sq_dists_to(center):
+        c = center.astype('float64')
+        c_sqnorm = numpy.square(c).sum()
+
+        def process(start, stop):
+            chunk = numpy.asarray(X[start:stop], dtype='float64')
+            return x_sqnorms[start:stop] - 2 * chunk.dot(c) + c_sqnorm
+
+        d = numpy.concatenate(_map_chunks(process, n, chunk_size, pool))
+        return numpy.maximum(d, 0, out=d)
+
+    mu[0] = X[rng.randint(n)]
+    closest = sq_dists_to(mu[0])
+    for i in xrange(1, k):
+        cumulative = numpy.cumsum(closest)
+        if cumulative[-1] <= 0:
+            # every example coincides with a centroid already
+            idx = rng.randint(n)
+        else:
+            idx = numpy.searchsorted(cumulative,
+                                     rng.uniform(0, cumulative[-1]),
+                                     side='right')
+            idx = min(idx, n - 1)
+        mu[i] = X[idx]
+        numpy.minimum(closest, sq_dists_to(mu[i]), out=closest)
+    return mu
@@ -48,6 +48,7 @@ from pylearn2.utils import wraps
 from pylearn2.utils import contains_inf
 from pylearn2.utils import isfinite
 from pylearn2.utils.data_specs import DataSpecsMapping
+from pylearn2.utils.iteration import prefetch
 
 from pylearn2.expr.nnet import (elemwise_kl, kl, compute_precision,
                                 compute_recall, compute_f1)
@@ -992,6 +993,137 @@ class MLP(Layer):
             return rlist
         return rval
 
+    def get_predict_function(self, output='raw'):
+        """
+        Returns a compiled function computing the output of the MLP for
+        a batch of inputs. The function is compiled the first time it is
+        requested, and kept (but not pickled) with the model.
+
+        Parameters
+        ----------
+        output : str, optional
+            'raw' for the output of the last layer, or 'argmax' for the
+            index of its largest component (e.g. the predicted class of
+            a Softmax layer).
+
+        Returns
+        -------
+        f : theano function
+            A function mapping a batch in the input space of the MLP to
+            the corresponding batch of outputs.
+        """
+        if output not in ('raw', 'argmax'):
+            raise ValueError("output must be 'raw' or 'argmax', got %s" %
+                             str(output))
+        functions = getattr(self, '_predict_functions', None)
+        if functions is None:
+            functions = self._predict_functions = {}
+            self.register_names_to_del(['_predict_functions'])
+        if output not in functions:
+            X = self.get_input_space().make_theano_batch()
+            Y = self.fprop(X)
+            if output == 'argmax':
+                Y = T.argmax(Y, axis=1)
+            functions[output] = function([X], Y, allow_input_downcast=True)
+        return functions[output]
+
+    def set_predict_function(self, f, output='raw'):
+        """
+        Sets the function returned by `get_predict_function`, e.g. a
+        previously compiled function loaded from disk.
+
+        Parameters
+        ----------
+        f : theano function
+            The function. It must have been compiled by
+            `get_predict_function` for this model (or a copy of it).
+        output : str, optional
+            See `get_predict_function`.
+        """
+        if getattr(self, '_predict_functions', None) is None:
+            self._predict_functions = {}
+            self.register_names_to_del(['_predict_functions'])
+        self._predict_functions[output] = f
+
+    def predict_batches(self, batches, output='raw'):
+        """
+        Computes the output of the MLP for each batch of a sequence.
+
+        Parameters
+        ----------
+        batches : iterable
+            Batches of inputs, formatted for the input space of the MLP.
+        output : str, optional
+            See `get_predict_function`.
+
+        Returns
+        -------
+        outputs : generator
+            Yields the output for each batch. If the MLP has a fixed
+            batch size, smaller batches are padded with zeros, and the
+            outputs for the padding are removed.
+        """
+        f = self.get_predict_function(output)
+        for batch in batches:
+            size = len(batch)
+            if self.force_batch_size and size < self.force_batch_size:
+                padded = np.zeros((self.force_batch_size,) + batch.shape[1:],
+                                  dtype=batch.dtype)
+                padded[:size] = batch
+                batch = padded
+            yield f(batch)[:size]
+
+    def predict(self, X, batch_size=None, output='raw', out=None):
+        """
+        Computes the output of the MLP for a set of inputs, one batch at
+        a time. While a batch is processed, the next one is read in the
+        background, so that inputs read lazily from disk (memmaps, h5py
+        or PyTables datasets) are read while computing.
+
+        Parameters
+        ----------
+        X : array-like
+            The inputs, formatted for the input space of the MLP with
+            the examples along the first axis. Only the current and the
+            next batch are held in memory.
+        batch_size : int, optional
+            The number of inputs processed at a time. Defaults to the
+            batch size of the MLP, or 1000.
+        output : str, optional
+            See `get_predict_function`.
+        out : array-like, optional
+            Where to write the outputs, e.g. a memmap or an h5py
+            dataset. A new array is created by default.
+
+        Returns
+        -------
+        out : array-like
+            The outputs.
+        """
+        if batch_size is None:
+            batch_size = self.force_batch_size or self.batch_size or 1000
+        num_examples = X.shape[0]
+
+        def read():
+            for start in xrange(0, num_examples, batch_size):
+                yield np.array(X[start:start + batch_size])
+
+        batches = prefetch(read(), depth=1)
+        chunks = []
+        start = 0
+        try:
+            for Y in self.predict_batches(batches, output):
+                if out is None:
+                    chunks.append(Y)
+                else:
+                    out[start:start + len(Y)] = Y
+                start += len(Y)
+        finally:
+            batches.close()
+        if out is None:
+            return np.concatenate(chunks)
+        return out
+
     def apply_dropout(self, state, include_prob, scale, theano_rng,
                       input_space, mask_value=0, per_example=True):
         """
@@ -29,6 +29,7 @@ except ImportError:
             warnings.warn('Cannot import any kind of symmetric eigen' \
                 ' decomposition function from scipy.sparse.linalg')
 from scipy.sparse.csr import csr_matrix
+from scipy.signal import lfilter
 import theano
 from theano import tensor
 from theano.sparse import SparseType, structured_dot
@@ -52,7 +53,9 @@ except ImportError:
 
 # Local imports
 from pylearn2.blocks import Block
+from pylearn2.space import CompositeSpace, VectorSpace
 from pylearn2.utils import sharedX
+from pylearn2.utils.rng import make_np_rng
 
 
 logger = logging.getLogger()
@@ -125,7 +128,22 @@ class _PCABase(Block):
 
         # Compute eigen{values,vectors} of the covariance matrix.
         v, W = self._cov_eigen(X)
+        self._set_components(v, W, mean)
 
+    def _set_components(self, v, W, mean):
+        """
+        Stores the result of training, keeping the components selected by
+        `num_components` and `min_variance`.
+
+        Parameters
+        ----------
+        v : numpy.ndarray
+            Eigenvalues in decreasing order
+        W : numpy.ndarray
+            Matrix containing the corresponding eigenvectors in its columns
+        mean : numpy.ndarray
+            Feature means of shape (d,)
+        """
         # Build Theano shared variables
         # For the moment, I do not use borrow=True because W and v are
         # subtensors, and I want the original memory to be freed
@@ -398,11 +416,8 @@ class OnlinePCA(_PCABase):
             centering=False
         )
 
-        logger.debug('*' * 50)
-        for i in range(X.shape[0]):
-            if (i + 1) % (X.shape[0] / 50) == 0:
-                logger.debug('|')  # suppresses newline/whitespace.
-            pca_estimator.observe(X[i, :])
+        for i in xrange(0, X.shape[0], self.minibatch_size):
+            pca_estimator.observe_batch(X[i:i + self.minibatch_size])
 
         v, W = pca_estimator.getLeadingEigen()
 
@@ -508,6 +523,159 @@ class SVDPCA(_PCABase):
         return s ** 2, Vh.T
 
 
+class RandomizedPCA(_PCABase):
+    """
+    PCA computed with a randomized range finder, without forming the
+    covariance matrix.
+
+    The leading eigenvectors of the covariance matrix :math:`C` are
+    estimated by subspace iteration (Halko, Martinsson and Tropp, 2011):
+    starting from a random Gaussian matrix :math:`Q` with `num_components +
+    oversampling` columns, each pass over the data computes :math:`CQ`
+    one batch at a time and orthonormalizes it. The eigendecomposition of
+    the small matrix :math:`Q^T C Q` then gives the components. Only
+    matrices of shape (d, num_components + oversampling) are kept in
+    memory besides the current batch, so `train` accepts memory-mapped
+    arrays and datasets, which are read in `n_iter + 2` passes.
+
+    Parameters
+    ----------
+    num_components : int
+        Number of components to estimate
+    oversampling : int, optional
+        Number of additional random directions, which make the estimate of
+        the last components more accurate
+    n_iter : int, optional
+        Number of power iterations, each of which is a pass over the data.
+        More iterations are needed when the eigenvalues decay slowly.
+    batch_size : int, optional
+        Number of examples processed at a time
+    rng : numpy.random.RandomState or seed, optional
+        Random number generator used to draw the initial directions
+    kwargs : dict
+        Passed on to `_PCABase`
+    """
+
+    def __init__(self, num_components, oversampling=10, n_iter=2,
+                 batch_size=1000, rng=(2015, 4, 1), **kwargs):
+        super(RandomizedPCA, self).__init__(num_components=num_components,
+                                            **kwargs)
+        self.oversampling = oversampling
+        self.n_iter = n_iter
+        self.batch_size = batch_size
+        self.rng = make_np_rng(rng, which_method='normal')
+
+    def train(self, X, mean=None):
+        """
+        Compute the PCA transformation matrix.
+
+        If mean is provided, :math:`X` is assumed to be centered already.
+
+        Parameters
+        ----------
+        X : numpy.ndarray or Dataset
+            Matrix of shape (n, d) on which to train PCA, or dataset whose
+            features are such rows. It is read one batch at a time.
+        mean : numpy.ndarray, optional
+            Feature means of shape (d,)
+        """
+        center = None
+        if mean is None:
+            mean = self._mean(X)
+            center = mean
+        v, W = self._cov_eigen(X, center)
+        self._set_components(v, W, mean)
+
+    def _batches(self, X):
+        """
+        Yields the rows of `X` (an array or a dataset), `self.batch_size`
+        at a time.
+        """
+        if hasattr(X, 'iterator'):
+            data_specs = (VectorSpace(dim=self._dim(X)), 'features')
+            for batch in X.iterator(mode='sequential',
+                                    batch_size=self.batch_size,
+                                    data_specs=data_specs):
+                yield batch
+        else:
+            for i in xrange(0, X.shape[0], self.batch_size):
+                yield X[i:i + self.batch_size]
+
+    @staticmethod
+    def _dim(X):
+        """
+        Returns the number of features of `X` (an array or a dataset).
+        """
+        if not hasattr(X, 'iterator'):
+            return X.shape[1]
+        space, source = X.get_data_specs()
+        if isinstance(space, CompositeSpace):
+            space = space.components[source.index('features')]
+        return space.get_total_dimension()
+
+    def _mean(self, X):
+        """
+        Computes the feature means of `X` in one pass.
+        """
+        total = numpy.zeros(self._dim(X))
+        n = 0
+        for batch in self._batches(X):
+            total += batch.sum(axis=0)
+            n += batch.shape[0]
+        return (total / n).astype(theano.config.floatX)
+
+    def _cov_product(self, X, Q, center):
+        """
+        Computes the product of the (unnormalized) covariance matrix of
+        `X` with `Q` in one pass, and the number of examples.
+        """
+        Z = numpy.zeros_like(Q)
+        n = 0
+        for batch in self._batches(X):
+            batch = numpy.asarray(batch, dtype=Q.dtype)
+            if center is not None:
+                batch = batch - center
+            Z += numpy.dot(batch.T, numpy.dot(batch, Q))
+            n += batch.shape[0]
+        return Z, n
+
+    def _cov_eigen(self, X, center=None):
+        """
+        Estimate the leading eigen{values,vectors} of the covariance
+        matrix of X.
+
+        Parameters
+        ----------
+        X : numpy.ndarray or Dataset
+            See `train`
+        center : numpy.ndarray, optional
+            Feature means subtracted from each batch, if X is not centered
+
+        Returns
+        -------
+        The `num_components` leading eigenvalues in decreasing order, and
+        matrix containing corresponding eigenvectors in its columns
+        """
+        dim = self._dim(X)
+        num_components = min(self.num_components, dim)
+        num_directions = min(num_components + self.oversampling, dim)
+
+        Q = self.rng.normal(size=(dim, num_directions))
+        Q = linalg.qr(Q, mode='economic')[0]
+        for i in xrange(self.n_iter):
+            Z, n = self._cov_product(X, Q, center)
+            Q = linalg.qr(Z, mode='economic')[0]
+        Z, n = self._cov_product(X, Q, center)
+
+        # Rayleigh-Ritz: eigendecomposition of C restricted to span(Q)
+        H = numpy.dot(Q.T, Z)
+        v, V = linalg.eigh((H + H.T) / 2.)
+        # The eigenvalues are in *ascending* order, so we reverse them
+        v = v[::-1][:num_components] / max(n - 1, 1)
+        W = numpy.dot(Q, V[:, ::-1][:, :num_components])
+        return v, W
+
+
 class SparsePCA(_PCABase):
     """
     .. todo::
@@ -732,6 +900,56 @@ class PcaOnlineEstimator(object):
         if self.minibatch_index == self.minibatch_size:
             self.reevaluate()
 
+    def observe_batch(self, X):
+        """
+        Observes the rows of `X`, with the same result as calling `observe`
+        on each of them, but updating the Gram matrix with one matrix
+        product per minibatch.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            Matrix of shape (n, n_dim) of observations.
+        """
+        X = numpy.asarray(X)
+        assert X.ndim == 2 and X.shape[1] == self.n_dim
+
+        start = 0
+        while start < X.shape[0]:
+            m = min(X.shape[0] - start,
+                    self.minibatch_size - self.minibatch_index)
+            rows = numpy.asarray(X[start:start + m], dtype='float64')
+            start += m
+            row = self.n_eigen + self.minibatch_index
+            Xt = self.Xt[row:row + m]
+            Xt[...] = rows
+
+            # The discounted sums of the observations after each row
+            # (x_sum <- gamma * x_sum + x), and their normalizers.
+            x_sums = lfilter([1.0], [1.0, -self.gamma], rows, axis=0,
+                             zi=self.gamma * self.x_sum[numpy.newaxis])[0]
+            self.x_sum = x_sums[-1].copy()
+            n_observations = self.n_observations + numpy.arange(1, m + 1)
+            self.n_observations += m
+            if self.centering:
+                normalizers = (1.0 - self.gamma ** n_observations) / \
+                    (1.0 - self.gamma)
+                Xt -= x_sums / normalizers[:, numpy.newaxis]
+
+            # Discount compensators, see observe
+            indices = self.minibatch_index + numpy.arange(1, m + 1)
+            Xt *= (self.gamma ** (-0.5 * indices))[:, numpy.newaxis]
+
+            # Update the Gram matrix: the new columns, and their symmetric
+            # rows.
+            self.G[:row + m, row:row + m] = numpy.dot(self.Xt[:row + m],
+                                                      Xt.T)
+            self.G[row:row + m, :row] = self.G[:row, row:row + m].T
+
+            self.minibatch_index += m
+            if self.minibatch_index == self.minibatch_size:
+                self.reevaluate()
+
 
     def reevaluate(self):
         """
@@ -833,7 +1051,8 @@ if __name__ == "__main__":
                         help='File where the PCA pickle will be saved')
     parser.add_argument('-a', '--algorithm', action='store',
                         type=str,
-                        choices=['cov_eig', 'svd', 'online'],
+                        choices=['cov_eig', 'svd', 'online',
+                                 'randomized'],
                         default='cov_eig',
                         required=False,
                         help='Which algorithm to use to compute the PCA')
@@ -883,6 +1102,8 @@ if __name__ == "__main__":
     elif args.algorithm == 'online':
         PCAImpl = OnlinePCA
         conf['minibatch_size'] = args.minibatch_size
+    elif args.algorithm == 'randomized':
+        PCAImpl = RandomizedPCA
     else:
         # This should never happen.
         raise NotImplementedError(args.algorithm)
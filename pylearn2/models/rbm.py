@@ -23,6 +23,7 @@ from pylearn2.blocks import Block, StackedBlocks
 from pylearn2.utils import as_floatX, safe_update, sharedX
 from pylearn2.models import Model
 from pylearn2.expr.nnet import inverse_sigmoid_numpy
+from pylearn2.models.gibbs_chains import GibbsChains
 from pylearn2.linear.matrixmul import MatrixMul
 from pylearn2.space import VectorSpace
 from pylearn2.utils import safe_union
@@ -178,24 +179,8 @@ class BlockGibbsSampler(Sampler):
         """
         steps = self.steps
         particles = self.particles
-        # TODO: do this with scan?
         for i in xrange(steps):
-            particles, _locals = self.rbm.gibbs_step_for_v(
-                particles,
-                self.s_rng
-            )
-            assert particles.type.dtype == self.particles.type.dtype
-            if self.particles_clip is not None:
-                p_min, p_max = self.particles_clip
-                # The clipped values should still have the same type
-                dtype = particles.dtype
-                p_min = tensor.as_tensor_variable(p_min)
-                if p_min.dtype != dtype:
-                    p_min = tensor.cast(p_min, dtype)
-                p_max = tensor.as_tensor_variable(p_max)
-                if p_max.dtype != dtype:
-                    p_max = tensor.cast(p_max, dtype)
-                particles = tensor.clip(particles, p_min, p_max)
+            particles, _locals = self._gibbs_step(particles)
         if not hasattr(self.rbm, 'h_sample'):
             self.rbm.h_sample = sharedX(numpy.zeros((0, 0)), 'h_sample')
         return {
@@ -205,6 +190,51 @@ class BlockGibbsSampler(Sampler):
             self.rbm.h_sample: _locals['h_mean']
         }
 
+    def _gibbs_step(self, particles):
+        """
+        Returns the particles after one (clipped) Gibbs step, and the
+        local variables of `gibbs_step_for_v`.
+        """
+        particles, _locals = self.rbm.gibbs_step_for_v(particles, self.s_rng)
+        assert particles.type.dtype == self.particles.type.dtype
+        if self.particles_clip is not None:
+            p_min, p_max = self.particles_clip
+            # The clipped values should still have the same type
+            dtype = particles.dtype
+            p_min = tensor.as_tensor_variable(p_min)
+            if p_min.dtype != dtype:
+                p_min = tensor.cast(p_min, dtype)
+            p_max = tensor.as_tensor_variable(p_max)
+            if p_max.dtype != dtype:
+                p_max = tensor.cast(p_max, dtype)
+            particles = tensor.clip(particles, p_min, p_max)
+        return particles, _locals
+
+    def make_chains(self, thinning=None, samples_per_call=100):
+        """
+        Returns the persistent chains of the sampler, advanced by Gibbs
+        steps run in a compiled loop.
+
+        Parameters
+        ----------
+        thinning : int, optional
+            Number of Gibbs steps between two recorded samples. Defaults
+            to `self.steps`.
+        samples_per_call : int, optional
+            See `GibbsChains`.
+
+        Returns
+        -------
+        chains : pylearn2.models.gibbs_chains.GibbsChains
+            The chains, whose state is `self.particles`.
+        """
+        if thinning is None:
+            thinning = self.steps
+        return GibbsChains([self.particles],
+                           lambda states: [self._gibbs_step(states[0])[0]],
+                           thinning=thinning,
+                           samples_per_call=samples_per_call)
+
 
 class RBM(Block, Model):
     """
@@ -0,0 +1,85 @@
+"""
+Tests for pylearn2.models.gibbs_chains
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from theano.sandbox.rng_mrg import MRG_RandomStreams
+
+from pylearn2.models.dbm.dbm import DBM
+from pylearn2.models.dbm.layer import BinaryVector, BinaryVectorMaxPool
+from pylearn2.models.gibbs_chains import GibbsChains
+from pylearn2.models.rbm import RBM, BlockGibbsSampler
+from pylearn2.utils import sharedX
+
+
+def test_gibbs_chains():
+    """
+    Tests burn-in, thinning and chunking with a deterministic "sampler",
+    and writing the samples to a file.
+    """
+    state = sharedX(np.zeros((3, 2)))
+    counter = sharedX(np.zeros(3))
+    chains = GibbsChains([counter, state],
+                         lambda states: [states[0] + 1, states[1] + 2],
+                         output=1, thinning=3, samples_per_call=3)
+    samples = chains.sample(4, burn_in=2)
+    assert samples.shape == (4, 3, 2)
+    expected = 2 * np.arange(5, 15, 3)
+    np.testing.assert_allclose(samples, np.tile(expected[:, None, None],
+                                                (1, 3, 2)))
+    np.testing.assert_allclose(counter.get_value(), 14)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'samples.npy')
+        assert chains.save(path, 5) == 15
+        saved = np.load(path)
+        assert saved.shape == (15, 2)
+        np.testing.assert_allclose(saved[::3, 0], 2 * np.arange(17, 30, 3))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_rbm_chains():
+    """
+    Tests the chains of a BlockGibbsSampler.
+    """
+    rbm = RBM(nvis=5, nhid=3)
+    rng = np.random.RandomState([2015, 4, 1])
+    sampler = BlockGibbsSampler(rbm, rng.randint(2, size=(10, 5)), rng,
+                                steps=2)
+    chains = sampler.make_chains(samples_per_call=4)
+    assert chains.thinning == 2
+    samples = chains.sample(6)
+    assert samples.shape == (6, 10, 5)
+    assert np.all((samples == 0) | (samples == 1))
+    np.testing.assert_equal(samples[-1], sampler.particles.get_value())
+
+
+def test_dbm_chains():
+    """
+    Tests the chains of a DBM, whose hidden layer state is a tuple.
+    """
+    hidden_layer = BinaryVectorMaxPool(detector_layer_dim=4, pool_size=1,
+                                       layer_name='h', irange=0.1)
+    model = DBM(8, BinaryVector(6), [hidden_layer], 1)
+    layer_to_state = model.make_layer_to_state(8)
+    chains = model.make_sampling_chains(layer_to_state,
+                                        MRG_RandomStreams(2015),
+                                        thinning=2, samples_per_call=3)
+    samples = chains.sample(5, burn_in=3)
+    assert samples.shape == (5, 8, 6)
+    assert np.all((samples == 0) | (samples == 1))
+    vis_state = layer_to_state[model.visible_layer].get_value()
+    np.testing.assert_equal(samples[-1], vis_state)
+
+    # Clamping the visible layer leaves it unchanged
+    clamped = model.make_sampling_chains(
+        layer_to_state, MRG_RandomStreams(2015),
+        layer_to_clamp={model.visible_layer: True})
+    clamped.advance(4)
+    np.testing.assert_equal(layer_to_state[model.visible_layer].get_value(),
+                            vis_state)
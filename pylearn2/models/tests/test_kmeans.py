@@ -26,3 +26,28 @@ def test_kmeans():
 
     train = Train(model=model, dataset=dataset)
     train.main_loop()
+
+
+def test_kmeans_options():
+    """
+    Tests k-means++ seeding, mini-batch mode and parallel chunked
+    assignment on well separated clusters.
+    """
+    rng = np.random.RandomState(0)
+    centers = np.eye(4) * 20.
+    X = np.vstack([c + rng.randn(50, 4) for c in centers])
+    dataset = DenseDesignMatrix(X=X)
+
+    def cost(mu):
+        dists = np.square(X[:, np.newaxis, :] - mu[np.newaxis]).sum(axis=2)
+        return dists.min(axis=1).mean()
+
+    optimal_cost = cost(centers)
+    for kwargs in [dict(init='k-means++'),
+                   dict(init='k-means++', chunk_size=17, num_workers=3),
+                   dict(init='k-means++', batch_size=20, max_iter=10)]:
+        model = KMeans(k=4, nvis=4, seed=1, **kwargs)
+        model.train_all(dataset)
+        mu = model.get_params()[0].get_value()
+        assert mu.shape == (4, 4)
+        assert cost(mu) < 1.5 * optimal_cost
@@ -861,3 +861,23 @@ def test_mean_pool():
                          [9, 11]], dtype=theano.config.floatX)
     actual = f(X)
     assert np.allclose(expected, actual)
+
+
+def test_predict():
+    """
+    Tests MLP.predict against a function compiled from fprop.
+    """
+    rng = np.random.RandomState([2015, 3, 20])
+    mlp = MLP(nvis=5, layers=[Sigmoid(dim=4, layer_name='h0', irange=0.5),
+                              Softmax(n_classes=3, layer_name='y',
+                                      irange=0.5)])
+    X = rng.normal(size=(23, 5)).astype(config.floatX)
+    inp = T.matrix()
+    expected = theano.function([inp], mlp.fprop(inp))(X)
+
+    np.testing.assert_allclose(mlp.predict(X, batch_size=4), expected,
+                               rtol=1e-5)
+    out = np.zeros(23, dtype='int64')
+    mlp.predict(X, batch_size=5, output='argmax', out=out)
+    np.testing.assert_equal(out, expected.argmax(axis=1))
+    assert mlp.get_predict_function() is mlp.get_predict_function('raw')
@@ -0,0 +1,94 @@
+"""
+Tests for pylearn2.models.pca
+"""
+import numpy as np
+
+from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
+from pylearn2.models.pca import (CovEigPCA, OnlinePCA, PcaOnlineEstimator,
+                                 RandomizedPCA)
+
+
+def test_observe_batch():
+    """
+    Tests that PcaOnlineEstimator.observe_batch gives the same estimate as
+    observe.
+    """
+    rng = np.random.RandomState(0)
+    X = np.dot(rng.randn(237, 12), rng.randn(12, 12))
+    for centering in [True, False]:
+        estimators = [PcaOnlineEstimator(12, n_eigen=4, minibatch_size=25,
+                                         gamma=0.99, centering=centering)
+                      for i in range(2)]
+        for x in X:
+            estimators[0].observe(x)
+        for i in range(0, X.shape[0], 37):
+            estimators[1].observe_batch(X[i:i + 37])
+        assert estimators[0].n_observations == estimators[1].n_observations
+        assert estimators[0].minibatch_index == estimators[1].minibatch_index
+        v0, W0 = estimators[0].getLeadingEigen()
+        v1, W1 = estimators[1].getLeadingEigen()
+        assert np.allclose(v0, v1)
+        # The eigenvectors are defined up to their sign
+        assert np.allclose(np.abs(W0), np.abs(W1))
+
+
+def check_leading_components(pca, X, num_components):
+    """
+    Checks that `pca` finds the leading components of `X`, as computed by
+    CovEigPCA.
+
+    Parameters
+    ----------
+    pca : PCA
+        A trained PCA.
+    X : ndarray
+        The data the PCA was trained on.
+    num_components : int
+        The number of components of the PCA.
+    """
+    reference = CovEigPCA(num_components=num_components)
+    reference.train(X)
+    W = pca.W.get_value()
+    W_ref = reference.W.get_value()
+    assert W.shape == W_ref.shape
+    assert np.allclose(np.abs(np.dot(W.T, W_ref)), np.eye(num_components),
+                       atol=1e-3)
+    assert np.allclose(pca.v.get_value(), reference.v.get_value(), rtol=1e-3)
+    assert np.allclose(pca.mean.get_value(), reference.mean.get_value(),
+                       atol=1e-5)
+
+
+def test_randomized_pca():
+    """
+    Tests that RandomizedPCA finds the leading components, from an array or
+    from a dataset.
+    """
+    rng = np.random.RandomState(1)
+    # Data with 5 dominant directions
+    scales = np.array([10., 8., 6., 4., 3.] + [0.1] * 45)
+    basis = np.linalg.qr(rng.randn(50, 50))[0]
+    X = np.dot(rng.randn(500, 50) * scales, basis.T) + 1.
+    X = X.astype('float32')
+
+    pca = RandomizedPCA(num_components=5, batch_size=64)
+    pca.train(X)
+    check_leading_components(pca, X, 5)
+
+    dataset = DenseDesignMatrix(X=X)
+    pca = RandomizedPCA(num_components=5, batch_size=64)
+    pca.train(dataset)
+    check_leading_components(pca, X, 5)
+
+
+def test_online_pca():
+    """
+    Tests that OnlinePCA finds the leading components of data with a
+    stationary distribution.
+    """
+    rng = np.random.RandomState(2)
+    scales = np.array([10., 5.] + [0.1] * 8)
+    X = (rng.randn(2000, 10) * scales).astype('float32')
+    pca = OnlinePCA(num_components=2, minibatch_size=100)
+    pca.train(X)
+    W = pca.W.get_value()
+    assert np.allclose(np.abs(W[:2]), np.eye(2), atol=0.05)
@@ -10,7 +10,9 @@ __maintainer__ = "LISA Lab"
 __email__ = "pylearn-dev@googlegroups"
 
 import copy
+import multiprocessing
 import time
+import traceback
 import warnings
 import logging
 import numpy as np
@@ -28,6 +30,9 @@ from pylearn2.space import Space, CompositeSpace, NullSpace
 from pylearn2.utils import function, sharedX, safe_zip, safe_izip
 from pylearn2.utils.exc import reraise_as
 from pylearn2.utils.iteration import is_stochastic
+from pylearn2.utils.iteration import PrefetchingIterator, prefetch
+from pylearn2.utils.iteration import as_index_plan, resolve_iterator_class
+from pylearn2.utils.rng import make_np_rng
 from pylearn2.utils.data_specs import DataSpecsMapping
 from pylearn2.utils.string_utils import number_aware_alphabetical_key
 from pylearn2.utils.timing import log_timing
@@ -78,6 +83,11 @@ class Monitor(object):
         self.t0 = time.time()
         self.theano_function_mode = None
         self.on_channel_conflict = 'error'
+        self.prefetch = None
+        self.prefetch_backend = 'thread'
+        self.index_plans = False
+        self.budget = None
+        self.budget_seed = None
 
         # Initialize self._nested_data_specs, self._data_specs_mapping,
         # and self._flat_data_specs
@@ -128,6 +138,53 @@ class Monitor(object):
             self._dirty = True
             self.theano_function_mode = mode
 
+    def set_prefetch(self, depth, backend='thread'):
+        """
+        Makes the monitor load its batches in the background.
+
+        Parameters
+        ----------
+        depth : int or None
+            Number of batches to load ahead of the monitoring functions.
+            None or 0 disables prefetching.
+        backend : str, optional
+            Either 'thread' or 'process'. See
+            `pylearn2.utils.iteration.PrefetchingIterator`.
+        """
+        self.prefetch = depth
+        self.prefetch_backend = backend
+
+    def set_index_plans(self, enabled=True, budget=None, seed=None):
+        """
+        Makes the monitor compute the batches it iterates over once, and
+        replay them each time it is called, instead of asking each
+        dataset for a new iterator.
+
+        Parameters
+        ----------
+        enabled : bool, optional
+            Whether to use index plans.
+        budget : int, optional
+            If specified, each monitoring dataset with more than `budget`
+            examples is monitored on a fixed random subset of `budget`
+            examples instead. If the dataset has discrete targets, the
+            subset is stratified, i.e. it has the same class proportions
+            as the whole dataset. Requires `enabled`.
+        seed : int or list, optional
+            Seed used to draw the subsets.
+
+        Notes
+        -----
+        The monitoring datasets must support iteration modes given as
+        `SubsetIterator` classes.
+        """
+        if budget is not None and not enabled:
+            raise ValueError("A monitoring budget requires index plans.")
+        self.index_plans = enabled
+        self.budget = budget
+        self.budget_seed = seed
+        self._dirty = True
+
     def add_dataset(self, dataset, mode='sequential', batch_size=None,
                     num_batches=None, seed=None):
         """
@@ -217,21 +274,32 @@ class Monitor(object):
         if self._dirty:
             self.redo_theano()
 
+        self._accumulate()
+        self._record(self._read_channel_values(), self._counters())
+
+    def _accumulate(self):
+        """
+        Runs the accumulation functions over all the monitoring datasets,
+        leaving the value of each channel in its `val_shared`.
+        """
         datasets = self._datasets
 
         # Set all channels' val_shared to 0
         self.begin_record_entry()
-        for d, i, b, n, a, sd, ne in safe_izip(datasets,
-                                               self._iteration_mode,
-                                               self._batch_size,
-                                               self._num_batches,
-                                               self.accum,
-                                               self._rng_seed,
-                                               self.num_examples):
+        for d, i, b, n, a, sd, ne, p in safe_izip(datasets,
+                                                  self._iteration_mode,
+                                                  self._batch_size,
+                                                  self._num_batches,
+                                                  self.accum,
+                                                  self._rng_seed,
+                                                  self.num_examples,
+                                                  self._index_plans):
             if isinstance(d, six.string_types):
                 d = yaml_parse.load(d)
                 raise NotImplementedError()
 
+            if p is not None:
+                i, sd = p, None
             # need to put d back into self._datasets
             myiterator = d.iterator(mode=i,
                                     batch_size=b,
@@ -251,12 +319,18 @@ class Monitor(object):
 
             else:
                 actual_ne = 0
-                for X in myiterator:
-                    # X is a flat (not nested) tuple
-                    self.run_prereqs(X, d)
-                    a(*X)
-                    actual_ne += self._flat_data_specs[0].np_batch_size(X)
-                # end for X
+                myiterator = prefetch(myiterator, self.prefetch,
+                                      self.prefetch_backend)
+                try:
+                    for X in myiterator:
+                        # X is a flat (not nested) tuple
+                        self.run_prereqs(X, d)
+                        a(*X)
+                        actual_ne += self._flat_data_specs[0].np_batch_size(X)
+                    # end for X
+                finally:
+                    if isinstance(myiterator, PrefetchingIterator):
+                        myiterator.close()
                 if actual_ne != ne:
                     raise RuntimeError("At compile time, your iterator said "
                                        "it had %d examples total, but at "
@@ -264,19 +338,51 @@ class Monitor(object):
                                        (ne, actual_ne))
         # end for d
 
+    def _read_channel_values(self):
+        """
+        Returns the values of all the channels, in the order of
+        `self.channels`.
+        """
+        if not self.channels:
+            return []
+        # Read all the channels at once
+        return self.read_channels()
+
+    def _counters(self):
+        """
+        Returns the training progress to record along with the channel
+        values: the number of epochs, batches and examples seen, and the
+        time since the creation of the monitor.
+        """
+        return (self._epochs_seen, self._num_batches_seen,
+                self._examples_seen, time.time() - self.t0)
+
+    def _record(self, values, counters):
+        """
+        Appends a data point to each of the channels.
+
+        Parameters
+        ----------
+        values : list
+            The values of the channels, in the order of `self.channels`.
+        counters : tuple
+            The training progress when the values were computed, as
+            returned by `_counters`.
+        """
+        epochs_seen, batches_seen, examples_seen, t = counters
         log.info("Monitoring step:")
-        log.info("\tEpochs seen: %d" % self._epochs_seen)
-        log.info("\tBatches seen: %d" % self._num_batches_seen)
-        log.info("\tExamples seen: %d" % self._examples_seen)
-        t = time.time() - self.t0
+        log.info("\tEpochs seen: %d" % epochs_seen)
+        log.info("\tBatches seen: %d" % batches_seen)
+        log.info("\tExamples seen: %d" % examples_seen)
+        values = dict(safe_zip(self.channels.keys(), values))
         for channel_name in sorted(self.channels.keys(),
                                    key=number_aware_alphabetical_key):
             channel = self.channels[channel_name]
             channel.time_record.append(t)
-            channel.batch_record.append(self._num_batches_seen)
-            channel.example_record.append(self._examples_seen)
-            channel.epoch_record.append(self._epochs_seen)
-            val = channel.val_shared.get_value()
+            channel.batch_record.append(batches_seen)
+            channel.example_record.append(examples_seen)
+            channel.epoch_record.append(epochs_seen)
+            val = np.asarray(values[channel_name])
             channel.val_record.append(val)
             # TODO: use logging infrastructure so that user can configure
             # formatting
@@ -287,6 +393,147 @@ class Monitor(object):
 
             log.info("\t%s: %s" % (channel_name, val_str))
 
+    def start_async(self, checkpointers=(), prefetchers=()):
+        """
+        Starts computing a new data point for each channel in a worker
+        process, and returns immediately.
+
+        The worker is forked from the current process, so it computes
+        the channels on a snapshot of the model taken now, while training
+        can continue to modify the parameters. The result is added to the
+        channels, with the epoch, batch and example counters of the
+        snapshot, by `collect_async`. A copy of the parameters of the
+        snapshot is kept until then, see `get_snapshot_param_values`.
+
+        Parameters
+        ----------
+        checkpointers : list, optional
+            The `Checkpointer` objects that may be writing a checkpoint
+            in a background thread. They are waited for before forking.
+        prefetchers : list, optional
+            The `PrefetchingIterator` objects that may be loading batches
+            in a background thread. A `RuntimeError` is raised if one of
+            them is still running.
+
+        Notes
+        -----
+        This relies on `fork`, and the worker cannot use the GPU, so it is
+        only supported when Theano runs on the CPU, on POSIX systems.
+
+        A thread holding a lock when the process forks would leave it
+        locked forever in the worker, which is why the background
+        threads of `checkpointers` and `prefetchers` must not be running.
+        """
+        if not config.device.startswith('cpu'):
+            raise RuntimeError("Asynchronous monitoring is only supported "
+                               "when Theano runs on the CPU, not on %s." %
+                               config.device)
+        for checkpointer in checkpointers:
+            checkpointer.wait()
+        for prefetcher in prefetchers:
+            if prefetcher.thread_alive():
+                raise RuntimeError("Cannot start asynchronous monitoring "
+                                   "while a PrefetchingIterator thread is "
+                                   "running, since the process forks. "
+                                   "Close the iterator first, or use the "
+                                   "'process' prefetching backend.")
+        # Compile the functions in this process, so that the workers
+        # inherit them
+        if self._dirty:
+            self.redo_theano()
+        if not hasattr(self, '_async_pending'):
+            self._async_pending = []
+            self.register_names_to_del(['_async_pending',
+                                        '_snapshot_param_values'])
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        worker = multiprocessing.Process(target=self._async_worker,
+                                         args=(sender,))
+        worker.daemon = True
+        worker.start()
+        sender.close()
+        self._async_pending.append((worker, receiver, self._counters(),
+                                    self.model.get_param_values()))
+
+    def _async_worker(self, sender):
+        """
+        Computes the channels in a worker process started by
+        `start_async`, and sends their values (or the error) back.
+        """
+        try:
+            self._accumulate()
+            sender.send((self._read_channel_values(), None))
+        except Exception:
+            sender.send((None, traceback.format_exc()))
+        finally:
+            sender.close()
+
+    def collect_async(self, block=False, max_pending=None):
+        """
+        Adds the data points computed by the workers started with
+        `start_async` to the channels, in the order they were started.
+
+        This is a generator: it yields after each data point is added, so
+        that callers can react to each new value (e.g. call the
+        `on_monitor` methods of the training extensions). Until the
+        generator is resumed, `get_snapshot_param_values` returns the
+        parameters the new values were computed with.
+
+        Parameters
+        ----------
+        block : bool, optional
+            If True, waits for all the workers to finish.
+        max_pending : int, optional
+            If specified, waits until at most this many workers are still
+            running.
+
+        Yields
+        ------
+        counters : tuple
+            The epochs, batches and examples seen when the data point
+            was started.
+        """
+        pending = getattr(self, '_async_pending', [])
+        while pending:
+            worker, receiver, counters, param_values = pending[0]
+            must_wait = block or (max_pending is not None and
+                                  len(pending) > max_pending)
+            if not must_wait and not receiver.poll():
+                break
+            try:
+                values, error = receiver.recv()
+            except EOFError:
+                values, error = None, ("the worker died with exit code %s" %
+                                       worker.exitcode)
+            finally:
+                receiver.close()
+                worker.join()
+                pending.pop(0)
+            if error is not None:
+                raise RuntimeError("Asynchronous monitoring failed: %s" %
+                                   error)
+            self._record(values, counters)
+            self._snapshot_param_values = param_values
+            try:
+                yield counters[:3]
+            finally:
+                self._snapshot_param_values = None
+
+    def get_snapshot_param_values(self):
+        """
+        Returns the parameters of the model the latest data point of the
+        channels was computed with, if they differ from the current ones.
+
+        Returns
+        -------
+        param_values : list or None
+            While `collect_async` yields a data point computed on an
+            earlier snapshot of the model, the values of the parameters
+            of that snapshot, in the order of `model.get_params()`.
+            None otherwise, in which case the channels describe the
+            current parameters.
+        """
+        return getattr(self, '_snapshot_param_values', None)
+
     def run_prereqs(self, data, dataset):
         """
         Runs all "prerequistie functions" on a batch of data. Always
@@ -405,6 +652,17 @@ class Monitor(object):
                 mode=self.theano_function_mode,
                 name='Monitor.begin_record_entry'
             )
+        if self.channels:
+            # Packs the values of all the channels in one vector, so that
+            # they are all read with a single call (and transfer).
+            with log_timing(log, "compiling read_channels"):
+                self.read_channels = function(
+                    inputs=[],
+                    outputs=T.stack(*[channel.val_shared for channel
+                                      in self.channels.values()]),
+                    mode=self.theano_function_mode,
+                    name='Monitor.read_channels'
+                )
         updates = OrderedDict()
         givens = OrderedDict()
         # Get the appropriate kind of theano variable to represent the data
@@ -432,10 +690,13 @@ class Monitor(object):
                 mode.record.handle_line('compiling monitor including ' +
                                         'channel ' + key + '\n')
             log.info('\t%s' % key)
+        self._index_plans = self._build_index_plans()
         it = []
-        for d, i, n, b in safe_izip(self._datasets, self._iteration_mode,
-                                    self._num_batches, self._batch_size):
-            it.append(d.iterator(mode=i, num_batches=n, batch_size=b,
+        for d, i, n, b, p in safe_izip(self._datasets, self._iteration_mode,
+                                       self._num_batches, self._batch_size,
+                                       self._index_plans):
+            it.append(d.iterator(mode=i if p is None else p,
+                                 num_batches=n, batch_size=b,
                                  data_specs=self._flat_data_specs,
                                  return_tuple=True))
         self.num_examples = [np.cast[config.floatX](float(i.num_examples))
@@ -525,6 +786,44 @@ class Monitor(object):
         self.register_names_to_del([name for name in final_names
                                     if name not in init_names])
 
+    def _build_index_plans(self):
+        """
+        Computes the batches to use for each dataset if index plans are
+        enabled, see `set_index_plans`.
+
+        Returns
+        -------
+        plans : list
+            For each dataset, an `IndexPlanIterator` class, or None if
+            index plans are disabled.
+        """
+        if not self.index_plans:
+            return [None] * len(self._datasets)
+        plans = []
+        for d, i, n, b, sd in safe_izip(self._datasets, self._iteration_mode,
+                                        self._num_batches, self._batch_size,
+                                        self._rng_seed):
+            mode = resolve_iterator_class(i)
+            dataset_size = d.get_num_examples()
+            if self.budget is None or dataset_size <= self.budget:
+                subset_iterator = mode(dataset_size, b, n, sd)
+                plans.append(as_index_plan(subset_iterator, dataset_size))
+                continue
+            rng = make_np_rng(self.budget_seed, [2015, 3, 10],
+                              which_method=['permutation'])
+            subset = _stratified_subsample(d, self.budget, rng)
+            if n is not None:
+                # Keep the batch size used on the whole dataset, and
+                # scale the number of batches
+                if b is None:
+                    b = int(np.ceil(dataset_size / float(n)))
+                n = int(np.ceil(n * float(self.budget) / dataset_size))
+                n = max(1, min(n, int(np.ceil(self.budget / float(b)))))
+            subset_iterator = mode(self.budget, b, n, sd)
+            batches = [subset[batch] for batch in subset_iterator]
+            plans.append(as_index_plan(batches, dataset_size))
+        return plans
+
     def register_names_to_del(self, names):
         """
         Register names of fields that should be deleted before pickling.
@@ -593,6 +892,11 @@ class Monitor(object):
         if '_dataset' in d:
             d['_datasets'] = [d['_dataset']]
             del d['_dataset']
+        d.setdefault('prefetch', None)
+        d.setdefault('prefetch_backend', 'thread')
+        d.setdefault('index_plans', False)
+        d.setdefault('budget', None)
+        d.setdefault('budget_seed', None)
 
         self.__dict__.update(d)
 
@@ -1274,3 +1578,52 @@ _err_no_data = "You tried to add a channel to a Monitor that has no dataset."
 _err_ambig_data = ("You added a channel to a Monitor that has multiple " +
                    "datasets, and did not specify which dataset to use it " +
                    "with.")
+
+
+def _stratified_subsample(dataset, budget, rng):
+    """
+    Draws a random subset of the examples of a dataset. If the dataset
+    has discrete targets, each class is represented in the subset in
+    the same proportion as in the whole dataset.
+
+    Parameters
+    ----------
+    dataset : Dataset
+        The dataset to subsample.
+    budget : int
+        Number of examples in the subset.
+    rng : numpy.random.RandomState
+        Random number generator used to draw the subset.
+
+    Returns
+    -------
+    subset : ndarray
+        The sorted indices of the examples in the subset.
+    """
+    num_examples = dataset.get_num_examples()
+    labels = None
+    if getattr(dataset, 'get_targets', None) is not None:
+        targets = dataset.get_targets()
+        if isinstance(targets, np.ndarray):
+            if targets.ndim == 2 and targets.shape[1] > 1:
+                if np.all((targets == 0) | (targets == 1)):
+                    # One-hot targets
+                    labels = targets.argmax(axis=1)
+            elif targets.dtype.kind in 'biu':
+                labels = targets.reshape(num_examples)
+    if labels is None:
+        return np.sort(rng.permutation(num_examples)[:budget])
+
+    classes, labels = np.unique(labels, return_inverse=True)
+    counts = np.bincount(labels)
+    # Largest remainder allocation of the budget to the classes
+    quotas = counts * float(budget) / num_examples
+    allocated = np.floor(quotas).astype('int64')
+    remainder = budget - allocated.sum()
+    allocated[np.argsort(allocated - quotas)[:remainder]] += 1
+    order = np.argsort(labels, kind='mergesort')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    subset = [rng.permutation(order[start:start + count])[:quota]
+              for start, count, quota in safe_izip(starts, counts,
+                                                   allocated)]
+    return np.sort(np.concatenate(subset))
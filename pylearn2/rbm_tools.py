@@ -1,4 +1,6 @@
 """Tools for estimating the partition function of an RBM"""
+import logging
+
 import numpy
 from theano.compat.six.moves import xrange
 import theano
@@ -9,6 +11,9 @@ from pylearn2.utils.rng import make_np_rng, make_theano_rng
 from pylearn2.utils.mem import improve_memory_error_message
 
 
+logger = logging.getLogger(__name__)
+
+
 def compute_log_z(rbm, free_energy_fn, max_bits=15):
     """
     Compute the log partition function of an (binary-binary) RBM.
@@ -56,10 +61,9 @@ def compute_log_z(rbm, free_energy_fn, max_bits=15):
                           (block_size, width, str(config.floatX))))
 
     # fill in the first block_bits, which will remain fixed for all
-    # 2**width configs
-    tensor_10D_idx = numpy.ndindex(*([2] * block_bits))
-    for i, j in enumerate(tensor_10D_idx):
-        logz_data_c[i, -block_bits:] = j
+    # 2**width configs: row i holds the binary digits of i
+    logz_data_c[:, width - block_bits:] = _binary_digits(
+        numpy.arange(block_size), block_bits)
     try:
         logz_data = numpy.array(logz_data_c, order='F', dtype=config.floatX)
     except MemoryError:
@@ -80,8 +84,10 @@ def compute_log_z(rbm, free_energy_fn, max_bits=15):
 
     # now loop 2**(width - block_bits) times, filling in the
     # most-significant bits
-    for bi, up_bits in enumerate(numpy.ndindex(*([2] * (width - block_bits)))):
-        logz_data[:, :width - block_bits] = up_bits
+    up_width = width - block_bits
+    for bi in xrange(2 ** up_width):
+        if up_width:
+            logz_data[:, :up_width] = _binary_digits(bi, up_width)
         nFE[bi * block_size:(bi + 1) * block_size] = -free_energy_fn(logz_data)
     alpha = nFE.max()
     # Do the subtraction and exponentiation in-place so as to not incur a copy.
@@ -91,6 +97,15 @@ def compute_log_z(rbm, free_energy_fn, max_bits=15):
     return log_z
 
 
+def _binary_digits(n, num_bits):
+    """
+    Returns the `num_bits` binary digits of `n` (an integer or a vector
+    of integers), most significant first, along the last axis.
+    """
+    shifts = numpy.arange(num_bits - 1, -1, -1)
+    return (numpy.asarray(n)[..., None] >> shifts) & 1
+
+
 def compute_nll(rbm, data, log_z, free_energy_fn, bufsize=1000, preproc=None):
     """
     .. todo::
@@ -113,7 +128,8 @@ def compute_nll(rbm, data, log_z, free_energy_fn, bufsize=1000, preproc=None):
 
 
 def rbm_ais(rbm_params, n_runs, visbias_a=None, data=None,
-            betas=None, key_betas=None, rng=None, seed=23098):
+            betas=None, key_betas=None, rng=None, seed=23098,
+            steps_per_call=100, n_jobs=1):
     """
     Implements Annealed Importance Sampling for Binary-Binary RBMs
 
@@ -146,6 +162,23 @@ def rbm_ais(rbm_params, n_runs, visbias_a=None, data=None,
         Random number generator object to use.
     seed : int, optional
         If rng is None, initialize rng with this seed.
+    steps_per_call : int, optional
+        Number of temperatures processed by each call to the compiled
+        AIS function. If 1, the Gibbs sampling and free-energy
+        functions are called once per temperature.
+    n_jobs : int, optional
+        Number of processes between which the AIS runs are split. Each
+        process compiles its own functions and samples with its own
+        random seed, drawn from `rng`. Only useful on the CPU.
+
+    Returns
+    -------
+    (log_zb, var_dlogz) : tuple
+        The estimate of the log-partition function of the RBM, and the
+        variance of the estimate of :math:`log(Z_b/Z_a)`.
+    ais : AIS
+        The AIS object holding the log AIS weights, and the estimates
+        at the key temperatures.
 
     References
     ----------
@@ -180,9 +213,30 @@ def rbm_ais(rbm_params, n_runs, visbias_a=None, data=None,
     v0 = numpy.tile(1. / (1 + numpy.exp(-visbias_a)), (n_runs, 1))
     v0 = numpy.array(v0 > rng.random_sample(v0.shape), dtype=config.floatX)
     # we now compute the log AIS weights for the ratio log(Zb/Za)
-    ais = rbm_z_ratio((weights_a, visbias_a, hidbias_a),
-                      rbm_params, n_runs, v0,
-                      betas=betas, key_betas=key_betas, rng=rng)
+    rbmA_params = (weights_a, visbias_a, hidbias_a)
+    n_jobs = max(1, min(n_jobs, n_runs))
+    if n_jobs == 1:
+        ais = rbm_z_ratio(rbmA_params, rbm_params, n_runs, v0,
+                          betas=betas, key_betas=key_betas, rng=rng,
+                          steps_per_call=steps_per_call)
+    else:
+        from multiprocessing import Pool
+
+        seeds = rng.randint(2 ** 30, size=n_jobs)
+        shards = [(rbmA_params, rbm_params, v0_shard, betas, key_betas,
+                   int(shard_seed), steps_per_call)
+                  for v0_shard, shard_seed in
+                  zip(numpy.array_split(v0, n_jobs), seeds)]
+        pool = Pool(n_jobs, maxtasksperchild=1)
+        try:
+            results = pool.map(_rbm_ais_shard, shards, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+        ais = AIS(None, None, v0, n_runs)
+        ais.set_betas(betas, key_betas=key_betas)
+        ais.merge_weights([log_ais_w for log_ais_w, _ in results],
+                          [key_log_ais_w for _, key_log_ais_w in results])
     dlogz, var_dlogz = ais.estimate_from_weights()
     # log Z = log_za + dlogz
     ais.log_za = weights_a.shape[1] * numpy.log(2) + \
@@ -191,8 +245,36 @@ def rbm_ais(rbm_params, n_runs, visbias_a=None, data=None,
     return (ais.log_zb, var_dlogz), ais
 
 
+def _rbm_ais_shard(args):
+    """
+    Runs part of the AIS runs of `rbm_ais` in a worker process.
+
+    Parameters
+    ----------
+    args : tuple
+        The parameters of the base-rate model and of the RBM, the
+        initial samples of the runs, the temperatures, the key
+        temperatures, the random seed and the number of temperatures
+        per call.
+
+    Returns
+    -------
+    log_ais_w : numpy.ndarray
+        The log AIS weights of the runs.
+    key_log_ais_w : list
+        The log AIS weights of the runs at each key temperature.
+    """
+    (rbmA_params, rbmB_params, v0, betas, key_betas, seed,
+     steps_per_call) = args
+    ais = rbm_z_ratio(rbmA_params, rbmB_params, len(v0), v0, betas=betas,
+                      key_betas=key_betas, seed=seed,
+                      sample_seed=seed, steps_per_call=steps_per_call)
+    return ais.log_ais_w, ais.key_log_ais_w
+
+
 def rbm_z_ratio(rbmA_params, rbmB_params, n_runs, v0=None,
-                betas=None, key_betas=None, rng=None, seed=23098):
+                betas=None, key_betas=None, rng=None, seed=23098,
+                sample_seed=23098, steps_per_call=100):
     """
     Computes the AIS log-weights :math:`log\:w^{(i)}`, such that
 
@@ -220,6 +302,13 @@ def rbm_z_ratio(rbmA_params, rbmB_params, n_runs, v0=None,
     rng : WRITEME
     seed : int
         WRITEME
+    sample_seed : int, optional
+        Seed of the random streams used for Gibbs sampling.
+    steps_per_call : int, optional
+        Number of temperatures processed by each call to the compiled
+        AIS function, which runs the Gibbs sampling and accumulates the
+        log AIS weights in a scan. If 1, a sampling function and a
+        free-energy function are called once per temperature instead.
 
     Notes
     -----
@@ -241,21 +330,45 @@ def rbm_z_ratio(rbmA_params, rbmB_params, n_runs, v0=None,
     v_sample = tensor.matrix('ais_v_sample')
     beta = tensor.scalar('ais_beta')
 
-    ### given current sample `v_sample`, generate new samples from inv.
-    ### temperature `beta`
-    new_v_sample = rbm_ais_gibbs_for_v(rbmA_params, rbmB_params,
-                                       beta, v_sample)
-    sample_fn = theano.function([beta, v_sample], new_v_sample)
-
-    ### build theano function to compute the free-energy
-    fe = rbm_ais_pk_free_energy(rbmA_params, rbmB_params, beta, v_sample)
-    free_energy_fn = theano.function([beta, v_sample],
-                                     fe, allow_input_downcast=False)
+    if steps_per_call > 1:
+        ### build theano function running AIS for a vector of temperatures
+        betas_var = tensor.vector('ais_betas')
+
+        def ais_step(bp, bp1, v, log_ais_w):
+            log_ais_w = log_ais_w + \
+                rbm_ais_pk_free_energy(rbmA_params, rbmB_params, bp, v) - \
+                rbm_ais_pk_free_energy(rbmA_params, rbmB_params, bp1, v)
+            new_v = rbm_ais_gibbs_for_v(rbmA_params, rbmB_params, bp1, v,
+                                        seed=sample_seed)
+            return new_v, log_ais_w
+
+        log_ais_w0 = tensor.zeros_like(v_sample[:, 0])
+        (v_samples, log_ais_ws), updates = theano.scan(
+            ais_step, sequences=[betas_var[:-1], betas_var[1:]],
+            outputs_info=[v_sample, log_ais_w0])
+        chunk_fn = theano.function([betas_var, v_sample],
+                                   [v_samples[-1], log_ais_ws[-1]],
+                                   updates=updates)
+        sample_fn = free_energy_fn = None
+    else:
+        ### given current sample `v_sample`, generate new samples from inv.
+        ### temperature `beta`
+        new_v_sample = rbm_ais_gibbs_for_v(rbmA_params, rbmB_params,
+                                           beta, v_sample, seed=sample_seed)
+        sample_fn = theano.function([beta, v_sample], new_v_sample)
+
+        ### build theano function to compute the free-energy
+        fe = rbm_ais_pk_free_energy(rbmA_params, rbmB_params, beta, v_sample)
+        free_energy_fn = theano.function([beta, v_sample],
+                                         fe, allow_input_downcast=False)
+        chunk_fn = None
 
     ### RUN AIS ###
-    weights_b = rbmB_params
+    weights_b = rbmB_params[0]
     v0 = rng.rand(n_runs, weights_b.shape[0]) if v0 is None else v0
-    ais = AIS(sample_fn, free_energy_fn, v0, n_runs)
+    v0 = numpy.asarray(v0, dtype=config.floatX)
+    ais = AIS(sample_fn, free_energy_fn, v0, n_runs, chunk_fn=chunk_fn,
+              steps_per_call=steps_per_call)
     ais.set_betas(betas, key_betas=key_betas)
     ais.run()
 
@@ -397,8 +510,18 @@ class AIS(object):
     n_runs : int
         Number of AIS runs (i.e. minibatch size)
     log_int : int
-        Log standard deviation of log ais weights every `log_int`
+        Log standard deviation of log ais weights, and the running
+        estimate of :math:`log(Z_\\beta/Z_a)`, every `log_int`
         temperatures.
+    chunk_fn : theano function, optional
+        `chunk_fn(betas, v_sample)` performs the AIS steps for the
+        consecutive temperatures `betas` starting from configuration
+        `v_sample`, and returns the new samples and the increment of
+        the log AIS weights. If given, `sample_fn` and
+        `free_energy_fn` are not used.
+    steps_per_call : int, optional
+        Maximum number of temperatures processed by each call to
+        `chunk_fn`.
     """
 
 
@@ -411,12 +534,14 @@ class AIS(object):
                                             dtype=config.floatX)))
 
     def __init__(self, sample_fn, free_energy_fn, v_sample0, n_runs,
-                 log_int=500):
+                 log_int=500, chunk_fn=None, steps_per_call=100):
         self.sample_fn = sample_fn
         self.free_energy_fn = free_energy_fn
         self.v_sample0 = v_sample0
         self.n_runs = n_runs
         self.log_int = log_int
+        self.chunk_fn = chunk_fn
+        self.steps_per_call = steps_per_call
 
         # initialize log importance weights
         self.log_ais_w = numpy.zeros(n_runs, dtype=config.floatX)
@@ -466,6 +591,14 @@ class AIS(object):
 
         recursively for all temperatures.
 
+        When `chunk_fn` is given, the temperatures are processed
+        `steps_per_call` at a time, the chunks ending at every
+        `log_int`-th temperature and at the key temperatures. The
+        running estimates of :math:`log(Z_\\beta/Z_a)` and of their
+        variance, every `log_int` temperatures and at the last one, are
+        appended to `self.logz_trace` as (beta, dlogz, var_dlogz)
+        tuples.
+
         Parameters
         ----------
         n_steps : int, optional
@@ -477,40 +610,92 @@ class AIS(object):
         self.std_ais_w = []  # used to log std of log_ais_w regularly
         self.logz_beta = []  # used to log log_ais_w at every `key_beta` value
         self.var_logz_beta = []  # used to log variance of log_ais_w as above
+        self.key_log_ais_w = []  # log_ais_w at every `key_beta` value
+        self.logz_trace = []  # running estimate every `log_int` steps
 
         # initial sample
         state = self.v_sample0
         ki = 0
+        i = 0
+        n_betas = len(self.betas)
 
         # loop over all temperatures from beta=0 to beta=1
-        for i in range(len(self.betas) - 1):
-            bp, bp1 = self.betas[i], self.betas[i + 1]
-            # log-ratio of (free) energies for two nearby temperatures
-            self.log_ais_w += \
-                self.free_energy_fn(bp, state) - \
-                self.free_energy_fn(bp1, state)
+        while i < n_betas - 1:
+            if self.chunk_fn is None:
+                j = i + 1
+                bp, bp1 = self.betas[i], self.betas[j]
+                # log-ratio of (free) energies for two nearby temperatures
+                self.log_ais_w += \
+                    self.free_energy_fn(bp, state) - \
+                    self.free_energy_fn(bp1, state)
+                # generate a new sample at temperature beta_{i+1}
+                state = self.sample_fn(bp1, state)
+            else:
+                # stop at the next logged step or key temperature
+                j = min(i + self.steps_per_call, n_betas - 1,
+                        (i // self.log_int + 1) * self.log_int)
+                if self.key_betas is not None and ki < len(self.key_betas):
+                    key = numpy.searchsorted(self.betas[i + 1:],
+                                             self.key_betas[ki])
+                    j = min(j, i + 1 + key)
+                betas = numpy.asarray(self.betas[i:j + 1],
+                                      dtype=config.floatX)
+                state, log_ais_w = self.chunk_fn(betas, state)
+                self.log_ais_w += log_ais_w
+            i = j
+
             # log standard deviation of AIS weights (kind of deprecated)
-            if (i + 1) % self.log_int == 0:
+            if i % self.log_int == 0:
                 m = numpy.max(self.log_ais_w)
                 std_ais = (numpy.log(numpy.std(numpy.exp(self.log_ais_w - m)))
                            + m - numpy.log(self.n_runs) / 2)
                 self.std_ais_w.append(std_ais)
+            if i % self.log_int == 0 or i == n_betas - 1:
+                dlogz, var_dlogz = self.estimate_from_weights()
+                self.logz_trace.append((self.betas[i], dlogz, var_dlogz))
+                logger.info('AIS beta=%f: log(Z_beta/Z_a)=%f, var=%f',
+                            self.betas[i], dlogz, var_dlogz)
 
             # whenever we reach a "key" beta value, log log_ais_w and
             # var(log_ais_w) so we can estimate log_Z_{beta=key_betas[i]} after
             # the fact.
             if self.key_betas is not None and \
                ki < len(self.key_betas) and \
-               bp1 == self.key_betas[ki]:
+               self.betas[i] == self.key_betas[ki]:
 
                 log_ais_w_bi, var_log_ais_w_bi = \
                     self.estimate_from_weights(self.log_ais_w)
                 self.logz_beta.insert(0, log_ais_w_bi)
                 self.var_logz_beta.insert(0, var_log_ais_w_bi)
+                self.key_log_ais_w.insert(0, self.log_ais_w.copy())
                 ki += 1
 
-            # generate a new sample at temperature beta_{i+1}
-            state = self.sample_fn(bp1, state)
+    def merge_weights(self, log_ais_w, key_log_ais_w=None):
+        """
+        Sets the log AIS weights to those of several independent sets of
+        AIS runs (e.g. run in different processes), and recomputes the
+        estimates at the key temperatures.
+
+        Parameters
+        ----------
+        log_ais_w : list
+            The log AIS weights of each set of runs.
+        key_log_ais_w : list, optional
+            For each set of runs, the list of its log AIS weights at the
+            key temperatures (see `run`).
+        """
+        self.log_ais_w = numpy.concatenate(log_ais_w)
+        self.n_runs = len(self.log_ais_w)
+        self.logz_beta = []
+        self.var_logz_beta = []
+        self.key_log_ais_w = []
+        if key_log_ais_w:
+            for weights in zip(*key_log_ais_w):
+                weights = numpy.concatenate(weights)
+                dlogz, var_dlogz = self.estimate_from_weights(weights)
+                self.logz_beta.append(dlogz)
+                self.var_logz_beta.append(var_dlogz)
+                self.key_log_ais_w.append(weights)
 
     def estimate_from_weights(self, log_ais_w=None):
         """
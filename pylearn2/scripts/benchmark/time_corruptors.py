@@ -0,0 +1,93 @@
+"""
+Benchmark of the corruptors of pylearn2.corruption, drawing their noise
+from Theano random streams for every minibatch or taking it from a pool
+drawn ahead of time (the `pool_size` argument).
+
+Each corruptor is applied to a minibatch of float32 inputs of shape
+(batch_size, dim) a number of times, by a compiled function that
+returns the sum of the corrupted inputs (so that the time is not spent
+transferring them).
+
+Usage: python time_corruptors.py [batch_size [dim [num_calls]]]
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+import numpy
+import theano
+import theano.tensor as T
+
+from pylearn2 import corruption
+
+
+CORRUPTORS = [
+    ('BinomialCorruptor', lambda **kwargs:
+        corruption.BinomialCorruptor(0.5, **kwargs)),
+    ('DropoutCorruptor', lambda **kwargs:
+        corruption.DropoutCorruptor(0.5, **kwargs)),
+    ('GaussianCorruptor', lambda **kwargs:
+        corruption.GaussianCorruptor(1., **kwargs)),
+    ('SaltPepperCorruptor', lambda **kwargs:
+        corruption.SaltPepperCorruptor(0.2, **kwargs)),
+    ('OneHotCorruptor', lambda **kwargs:
+        corruption.OneHotCorruptor(0.5, **kwargs)),
+]
+
+
+def time_corruptor(corruptor, X, num_calls):
+    """
+    Returns the average time of one call of a function corrupting X.
+
+    Parameters
+    ----------
+    corruptor : Corruptor
+        The corruptor.
+    X : numpy.ndarray
+        The minibatch.
+    num_calls : int
+        The number of calls to time.
+    """
+    x = T.matrix()
+    f = theano.function([x], corruptor(x).sum())
+    f(X)
+    t0 = time.time()
+    for i in range(num_calls):
+        f(X)
+    return (time.time() - t0) / num_calls
+
+
+def benchmark(batch_size=100, dim=784, num_calls=1000):
+    """
+    Prints the time of one call with and without a noise pool, for each
+    corruptor.
+
+    Parameters
+    ----------
+    batch_size : int, optional
+        The number of examples of a minibatch.
+    dim : int, optional
+        The number of inputs of an example.
+    num_calls : int, optional
+        The number of calls to time.
+    """
+    X = numpy.random.RandomState(0).uniform(
+        size=(batch_size, dim)).astype(theano.config.floatX)
+    # The pool holds the noise of 64 minibatches
+    pool_size = 64 * batch_size * dim
+    print('batch of %d x %d, %s, %s' % (batch_size, dim,
+                                        theano.config.floatX,
+                                        theano.config.device))
+    print('%-20s %12s %12s %8s' % ('corruptor', 'streams (ms)',
+                                   'pool (ms)', 'speedup'))
+    for name, make_corruptor in CORRUPTORS:
+        streams = time_corruptor(make_corruptor(), X, num_calls)
+        pool = time_corruptor(make_corruptor(pool_size=pool_size), X,
+                              num_calls)
+        print('%-20s %12.4f %12.4f %8.2f' % (name, 1000 * streams,
+                                             1000 * pool, streams / pool))
+
+
+if __name__ == '__main__':
+    benchmark(*[int(arg) for arg in sys.argv[1:]])
@@ -51,13 +51,19 @@ def main():
     README.close()
 
     print("Preprocessing the data...")
-    pipeline = preprocessing.Pipeline()
-    pipeline.items.append(preprocessing.ExtractPatches(patch_shape=(6, 6),
-                          num_patches=2*1000*1000))
+    # The patches are written directly to data.npy, and normalized and
+    # whitened in place, 100000 at a time
+    pipeline = preprocessing.Pipeline(batch_size=100000)
+    pipeline.items.append(preprocessing.ExtractPatches(
+        patch_shape=(6, 6), num_patches=2*1000*1000,
+        destination=patch_dir + '/data.npy'))
     pipeline.items.append(
         preprocessing.GlobalContrastNormalization(sqrt_bias=10., use_std=True))
     pipeline.items.append(preprocessing.ZCA())
     data.apply_preprocessor(preprocessor=pipeline, can_fit=True)
+    # Reapplying the saved pipeline to other data must not overwrite
+    # data.npy, which data.pkl memory-maps
+    pipeline.items[0].destination = None
 
     data.use_design_loc(patch_dir + '/data.npy')
 
@@ -5,6 +5,10 @@ whitened CIFAR-10 images.
 
 from __future__ import print_function
 
+import multiprocessing
+
+from theano import config
+
 from pylearn2.utils import serial
 from pylearn2.datasets import preprocessing
 from pylearn2.utils import string_utils
@@ -16,7 +20,7 @@ def main():
     data_dir = string_utils.preprocess('${PYLEARN2_DATA_PATH}/cifar10')
 
     print('Loading CIFAR-10 train dataset...')
-    train = CIFAR10(which_set='train', gcn=55.)
+    train = CIFAR10(which_set='train')
 
     print("Preparing output directory...")
     output_dir = data_dir + '/pylearn2_gcn_whitened'
@@ -48,17 +52,30 @@ def main():
     print("Learning the preprocessor and \
           preprocessing the unsupervised train data...")
     preprocessor = preprocessing.ZCA()
-    train.apply_preprocessor(preprocessor=preprocessor, can_fit=True)
+    # Contrast normalize and whiten by chunks, in a single pass over the
+    # data. Workers are forked processes, which cannot share the CUDA
+    # context of this one, so they are only used when Theano runs on
+    # the CPU
+    num_workers = None
+    if config.device.startswith('cpu'):
+        num_workers = multiprocessing.cpu_count()
+    pipeline = preprocessing.Pipeline(
+        [preprocessing.GlobalContrastNormalization(scale=55.), preprocessor],
+        batch_size=5000, num_workers=num_workers)
+    train.apply_preprocessor(preprocessor=pipeline, can_fit=True)
+    # Same as CIFAR10(gcn=55.), for viewing and get_test_set
+    train.gcn = 55.
 
     print('Saving the unsupervised data')
     train.use_design_loc(output_dir+'/train.npy')
     serial.save(output_dir + '/train.pkl', train)
 
     print("Loading the test data")
-    test = CIFAR10(which_set='test', gcn=55.)
+    test = CIFAR10(which_set='test')
 
     print("Preprocessing the test data")
-    test.apply_preprocessor(preprocessor=preprocessor, can_fit=False)
+    test.apply_preprocessor(preprocessor=pipeline, can_fit=False)
+    test.gcn = 55.
 
     print("Saving the test data")
     test.use_design_loc(output_dir+'/test.npy')
@@ -8,6 +8,10 @@ which downsamples the STL-10 images to 1/3 of their original resolution.
 
 from __future__ import print_function
 
+import multiprocessing
+
+from theano import config
+
 from pylearn2.utils import serial
 from pylearn2.datasets import preprocessing
 from pylearn2.utils import string_utils as string
@@ -60,7 +64,15 @@ def main():
     print("Learning the preprocessor \
           and preprocessing the unsupervised train data...")
     preprocessor = preprocessing.ZCA()
-    data.apply_preprocessor(preprocessor=preprocessor, can_fit=True)
+    # Fit and apply the ZCA by chunks. Workers are forked processes,
+    # which cannot share the CUDA context of this one, so they are only
+    # used when Theano runs on the CPU
+    num_workers = None
+    if config.device.startswith('cpu'):
+        num_workers = multiprocessing.cpu_count()
+    pipeline = preprocessing.Pipeline([preprocessor], batch_size=5000,
+                                      num_workers=num_workers)
+    data.apply_preprocessor(preprocessor=pipeline, can_fit=True)
 
     print('Saving the unsupervised data')
     data.use_design_loc(output_dir+'/unsupervised.npy')
@@ -89,7 +101,7 @@ def main():
     test = serial.load(downsampled_dir + '/test.pkl')
 
     print("Preprocessing the test data")
-    test.apply_preprocessor(preprocessor=preprocessor, can_fit=False)
+    test.apply_preprocessor(preprocessor=pipeline, can_fit=False)
 
     print("Saving the test data")
     test.use_design_loc(output_dir+'/test.npy')
@@ -145,7 +145,7 @@ def neg_sampling(W_list, b_list, nsamples, beta=1.0, pa_bias=None,
     for i in xrange(not marginalize_odd, depth, 2):
         new_nsamples[i] = T.nnet.sigmoid(new_nsamples[i])
         new_nsamples[i] = theano_rng.binomial(
-            size=nsamples[i].get_value().shape, n=1, p=new_nsamples[i],
+            size=nsamples[i].shape, n=1, p=new_nsamples[i],
             dtype=floatX
         )
 
@@ -202,7 +202,8 @@ def free_energy_at_beta(W_list, b_list, samples, beta, pa_bias=None,
     return fe
 
 
-def compute_log_ais_weights(batch_size, free_energy_fn, sample_fn, betas):
+def compute_log_ais_weights(batch_size, free_energy_fn, sample_fn, betas,
+                            chunk_fn=None, steps_per_call=100, log_int=1000):
     """
     Compute log of the AIS weights
 
@@ -219,6 +220,16 @@ def compute_log_ais_weights(batch_size, free_energy_fn, sample_fn, betas):
         p_k(h1).
     betas : array-like object of scalars
         Inverse temperature parameters for which to compute the log_ais weights
+    chunk_fn : theano.function, optional
+        Function which, given a vector of consecutive temperatures, performs
+        the AIS steps between them on the samples stored in model.samples,
+        and returns the increment of the log ais-weights. If given, it is
+        used instead of `free_energy_fn` and `sample_fn`.
+    steps_per_call : int, optional
+        Maximum number of temperatures passed to each call of `chunk_fn`.
+    log_int : int, optional
+        Log the running estimate of log(Z_beta / Z_A) every `log_int`
+        temperatures, and at the last one.
 
     Returns
     -------
@@ -229,12 +240,28 @@ def compute_log_ais_weights(batch_size, free_energy_fn, sample_fn, betas):
     log_ais_w = numpy.zeros(batch_size, dtype=floatX)
 
     # Iterate from inverse  temperature beta_k=0 to beta_k=1...
-    for i in range(len(betas) - 1):
-        bp, bp1 = betas[i], betas[i+1]
-        log_ais_w += free_energy_fn(bp) - free_energy_fn(bp1)
-        sample_fn(bp1)
-        if i % 1e3 == 0:
-            logging.info('Temperature %f ' % bp1)
+    i = 0
+    while i < len(betas) - 1:
+        if chunk_fn is None:
+            j = i + 1
+            bp, bp1 = betas[i], betas[j]
+            log_ais_w += free_energy_fn(bp) - free_energy_fn(bp1)
+            sample_fn(bp1)
+        else:
+            j = min(i + steps_per_call, len(betas) - 1,
+                    (i // log_int + 1) * log_int)
+            log_ais_w += chunk_fn(numpy.asarray(betas[i:j + 1],
+                                                dtype=floatX))
+        i = j
+        if i % log_int == 0 or i == len(betas) - 1:
+            # Running estimate of log(Z_beta / Z_A) and of its variance
+            m = numpy.max(log_ais_w)
+            ais_w = numpy.exp(log_ais_w - m)
+            dlogz = numpy.log(numpy.mean(ais_w)) + m
+            var_dlogz = (batch_size * numpy.sum(ais_w ** 2) /
+                         numpy.sum(ais_w) ** 2 - 1.)
+            logging.info('Temperature %f: dlogz = %f, var_dlogz = %f' %
+                         (betas[i], dlogz, var_dlogz))
 
     return log_ais_w
 
@@ -511,7 +538,8 @@ def _e_step(psamples, W_list, b_list, n_steps=100, eps=1e-5):
 
 def estimate_likelihood(W_list, b_list, trainset, testset, free_energy_fn=None,
                         batch_size=100, large_ais=False, log_z=None,
-                        pos_mf_steps=50, pos_sample_steps=0):
+                        pos_mf_steps=50, pos_sample_steps=0,
+                        steps_per_call=100):
     """
     Compute estimate of log-partition function and likelihood of trainset and
     testset
@@ -538,6 +566,11 @@ def estimate_likelihood(W_list, b_list, trainset, testset, free_energy_fn=None,
     pos_sample_steps: same thing as pos_mf_steps
         when both pos_mf_steps > 0 and pos_sample_steps > 0,
         pos_mf_steps has a priority
+    steps_per_call : integer
+        Number of temperatures processed by each call to the compiled AIS
+        function, which runs the sampling and accumulates the log
+        ais-weights in a scan. If 1, the sampling and free-energy
+        functions are called once per temperature.
 
     Returns
     -------
@@ -622,6 +655,30 @@ def estimate_likelihood(W_list, b_list, trainset, testset, free_energy_fn=None,
                                    pa_bias, marginalize_odd=marginalize_odd)
     free_energy_fn = theano.function([beta], fe_bp_h1)
 
+    # Build function running AIS for a vector of temperatures.
+    chunk_fn = None
+    if steps_per_call > 1:
+        betas_var = T.vector('betas')
+
+        def ais_step(bp, bp1, log_ais_w, *samples):
+            log_ais_w += free_energy_at_beta(W_list, b_list, samples, bp,
+                                             pa_bias, marginalize_odd)
+            log_ais_w -= free_energy_at_beta(W_list, b_list, samples, bp1,
+                                             pa_bias, marginalize_odd)
+            new_samples = neg_sampling(W_list, b_list, samples, beta=bp1,
+                                       pa_bias=pa_bias,
+                                       marginalize_odd=marginalize_odd,
+                                       theano_rng=theano_rng)
+            return [T.cast(x, floatX) for x in [log_ais_w] + new_samples]
+
+        outputs, updates = theano.scan(
+            ais_step, sequences=[betas_var[:-1], betas_var[1:]],
+            outputs_info=[T.zeros((batch_size,), dtype=floatX)] + nsamples)
+        for (nsample, new_nsample) in zip(nsamples, outputs[1:]):
+            updates[nsample] = new_nsample[-1]
+        chunk_fn = theano.function([betas_var], outputs[0][-1],
+                                   updates=updates, name='ais_chunk_func')
+
     ###########
     ## RUN AIS
     ###########
@@ -649,7 +706,9 @@ def estimate_likelihood(W_list, b_list, trainset, testset, free_energy_fn=None,
 
     if log_z is None:
         log_ais_w = compute_log_ais_weights(batch_size, free_energy_fn,
-                                            sample_fn, betas)
+                                            sample_fn, betas,
+                                            chunk_fn=chunk_fn,
+                                            steps_per_call=steps_per_call)
         dlogz, var_dlogz = estimate_from_weights(log_ais_w)
         log_za = compute_log_za(b_list, pa_bias, marginalize_odd)
         log_z = log_za + dlogz
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+Script to draw samples from a trained DBM and write them to a file.
+
+Basic usage:
+
+.. code-block:: none
+
+    save_samples.py model.pkl samples.npy --num-samples 10000
+
+A batch of independent Gibbs chains is run from a random initial state.
+After the burn-in sweeps, the state of the visible layer of every chain
+is recorded every `--thinning` sweeps, so that `--num-chains` times
+`--num-samples` samples are written to the output file (.npy, .h5, .hdf5
+or .csv). The sweeps between two writes are run by a single call of the
+compiled sampling function, and the samples are written as they are
+drawn, so that they do not have to fit in memory.
+"""
+from __future__ import print_function
+
+import argparse
+import sys
+import time
+
+from theano.sandbox.rng_mrg import MRG_RandomStreams
+
+from pylearn2.utils import serial
+
+
+def make_argument_parser():
+    """
+    Creates an ArgumentParser to read the options for this script from
+    sys.argv
+    """
+    parser = argparse.ArgumentParser(
+        description="Draw samples from a DBM with batched Gibbs chains, "
+                    "and write them to a NPY, HDF5 or CSV file.")
+    parser.add_argument('model_filename',
+                        help='The pkl file of the DBM')
+    parser.add_argument('output_filename',
+                        help='The .npy, .h5, .hdf5 or .csv file to write')
+    parser.add_argument('--num-samples', '-n', dest='num_samples', type=int,
+                        default=1000,
+                        help='Number of samples recorded from each chain')
+    parser.add_argument('--num-chains', '-c', dest='num_chains', type=int,
+                        default=100,
+                        help='Number of independent chains')
+    parser.add_argument('--burn-in', '-b', dest='burn_in', type=int,
+                        default=1000,
+                        help='Number of sweeps before the first sample')
+    parser.add_argument('--thinning', '-t', type=int, default=1,
+                        help='Number of sweeps between two samples of a '
+                             'chain')
+    parser.add_argument('--samples-per-call', dest='samples_per_call',
+                        type=int, default=100,
+                        help='Number of samples of each chain drawn by '
+                             'each call of the sampling function')
+    parser.add_argument('--output-key', dest='output_key', default='samples',
+                        help='Name of the samples in an HDF5 file')
+    parser.add_argument('--seed', type=int, default=2015,
+                        help='Seed of the random number generator')
+    return parser
+
+
+def save_samples(model_path, output_path, num_samples=1000, num_chains=100,
+                 burn_in=1000, thinning=1, samples_per_call=100,
+                 output_key='samples', seed=2015):
+    """
+    Draws samples from a DBM and writes them to a file.
+
+    Parameters
+    ----------
+    model_path : str
+        The pkl file of the DBM.
+    output_path : str
+        The .npy, .h5, .hdf5 or .csv file to write.
+    num_samples : int, optional
+        The number of samples recorded from each chain.
+    num_chains : int, optional
+        The number of independent chains.
+    burn_in : int, optional
+        The number of sweeps before the first sample.
+    thinning : int, optional
+        The number of sweeps between two samples of a chain.
+    samples_per_call : int, optional
+        The number of samples of each chain drawn by each call of the
+        sampling function.
+    output_key : str, optional
+        The name of the samples in an HDF5 file.
+    seed : int, optional
+        The seed of the random number generator.
+
+    Returns
+    -------
+    num_rows : int
+        The number of samples written.
+    """
+    print("loading the model...")
+    model = serial.load(model_path)
+    if not hasattr(model, 'make_sampling_chains'):
+        raise TypeError("%s does not contain a DBM, but a %s" %
+                        (model_path, type(model)))
+    model.set_batch_size(num_chains)
+    layer_to_state = model.make_layer_to_state(num_chains)
+    chains = model.make_sampling_chains(layer_to_state,
+                                        MRG_RandomStreams(seed),
+                                        thinning=thinning,
+                                        samples_per_call=samples_per_call)
+    print("compiling the sampling function...")
+    chains.compile()
+    start_time = time.time()
+    num_rows = chains.save(output_path, num_samples, burn_in=burn_in,
+                           key=output_key)
+    elapsed = max(time.time() - start_time, 1e-6)
+    print("wrote %d samples to %s in %.1f s (%.1f samples/s)" %
+          (num_rows, output_path, elapsed, num_rows / elapsed))
+    return num_rows
+
+
+if __name__ == "__main__":
+    """
+    See module-level docstring for a description of the script.
+    """
+    parser = make_argument_parser()
+    args = parser.parse_args()
+    try:
+        save_samples(args.model_filename, args.output_filename,
+                     num_samples=args.num_samples,
+                     num_chains=args.num_chains, burn_in=args.burn_in,
+                     thinning=args.thinning,
+                     samples_per_call=args.samples_per_call,
+                     output_key=args.output_key, seed=args.seed)
+    except (IOError, ValueError, TypeError) as e:
+        print(e)
+        sys.exit(-1)
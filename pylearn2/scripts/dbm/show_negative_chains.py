@@ -1,4 +1,9 @@
 #!/usr/bin/env python
+"""
+Usage: python show_negative_chains.py <path_to_a_saved_DBM.pkl> [num_steps]
+Displays the negative chains of a DBM, after running them for num_steps
+more Gibbs steps (0 by default).
+"""
 from __future__ import print_function
 
 __authors__ = "Ian Goodfellow"
@@ -13,9 +18,15 @@ from pylearn2.datasets import control
 from pylearn2.config import yaml_parse
 import numpy as np
 from theano.compat.six.moves import xrange
+from theano.sandbox.rng_mrg import MRG_RandomStreams
 from pylearn2.gui.patch_viewer import PatchViewer
 
-ignore, model_path = sys.argv
+if len(sys.argv) not in (2, 3):
+    print("Usage: show_negative_chains.py <path_to_a_saved_DBM.pkl> "
+          "[num_steps]")
+    quit(-1)
+model_path = sys.argv[1]
+num_steps = int(sys.argv[2]) if len(sys.argv) == 3 else 0
 model = serial.load(model_path)
 
 control.push_load_data(False)
@@ -28,6 +39,11 @@ except AttributeError:
     print("This model doesn't have negative chains.")
     quit(-1)
 
+if num_steps > 0:
+    chains = model.make_sampling_chains(layer_to_chains,
+                                        MRG_RandomStreams(2012+9+18))
+    chains.advance(num_steps)
+
 vis_chains = layer_to_chains[model.visible_layer]
 vis_chains = vis_chains.get_value()
 if vis_chains.ndim == 2:
@@ -21,7 +21,6 @@ from pylearn2.config import yaml_parse
 from pylearn2.gui.patch_viewer import PatchViewer
 import time
 from theano.compat.six.moves import input, xrange
-from theano import function
 from theano.sandbox.rng_mrg import MRG_RandomStreams
 import numpy as np
 from pylearn2.expr.basic import is_binary
@@ -137,22 +136,22 @@ validate_all_samples()
 theano_rng = MRG_RandomStreams(2012+9+18)
 
 if x > 0:
-    sampling_updates = model.get_sampling_updates(layer_to_state, theano_rng,
-            layer_to_clamp = { model.visible_layer : True }, num_steps = x)
+    # All the Gibbs steps are run by a single call of the compiled function
+    clamped_chains = model.make_sampling_chains(layer_to_state, theano_rng,
+            layer_to_clamp = { model.visible_layer : True })
 
     t1 = time.time()
-    sample_func = function([], updates=sampling_updates)
+    clamped_chains.compile()
     t2 = time.time()
     print('Clamped sampling function compilation took',t2-t1)
-    sample_func()
+    clamped_chains.advance(x)
 
 
-# Now compile the full sampling update
-sampling_updates = model.get_sampling_updates(layer_to_state, theano_rng)
-assert layer_to_state[model.visible_layer] in sampling_updates
+# Now compile the full sampling function
+chains = model.make_sampling_chains(layer_to_state, theano_rng)
 
 t1 = time.time()
-sample_func = function([], updates=sampling_updates)
+chains.compile()
 t2 = time.time()
 
 print('Sampling function compilation took',t2-t1)
@@ -173,9 +172,7 @@ while True:
             except ValueError:
                 print('Invalid input, try again')
 
-    for i in xrange(x):
-        print(i)
-        sample_func()
+    chains.advance(x)
 
     validate_all_samples()
 
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+"""
+Script to compute the outputs of a trained MLP on a large input file.
+
+Basic usage:
+
+.. code-block:: none
+
+    predict.py model.pkl inputs.npy outputs.h5
+
+The inputs can be a CSV (.csv), NumPy (.npy) or HDF5 (.h5 or .hdf5) file,
+and the outputs are written to a file of any of these formats. The inputs
+are read in batches of fixed size, the next batch being read while the
+current one is processed, and the outputs are written as they are
+computed, so that neither the inputs nor the outputs have to fit in
+memory. The throughput is reported as the outputs are written.
+
+The prediction function is compiled once and saved next to the model
+file (in `model.pkl.predict-raw.pkl` or `model.pkl.predict-argmax.pkl`),
+so that later runs do not need to compile it again. It is compiled again
+when the model file is newer.
+"""
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+from pylearn2.datasets.csv_dataset import iter_csv_chunks
+from pylearn2.utils import serial
+from pylearn2.utils.iteration import prefetch
+from pylearn2.utils.output_writer import OutputWriter, is_hdf5
+
+
+logger = logging.getLogger(__name__)
+
+
+def make_argument_parser():
+    """
+    Creates an ArgumentParser to read the options for this script from
+    sys.argv
+    """
+    parser = argparse.ArgumentParser(
+        description="Compute the outputs of a trained MLP on a CSV, NPY or "
+                    "HDF5 file, one batch at a time.")
+    parser.add_argument('model_filename',
+                        help='The pkl file of the model')
+    parser.add_argument('input_filename',
+                        help='The .csv, .npy, .h5 or .hdf5 file of inputs')
+    parser.add_argument('output_filename',
+                        help='The .csv, .npy, .h5 or .hdf5 file to write')
+    parser.add_argument('--batch-size', '-b', dest='batch_size', type=int,
+                        default=10000,
+                        help='Number of inputs processed at a time')
+    parser.add_argument('--argmax', '-a', action='store_true',
+                        help='Output the index of the largest output (e.g. '
+                             'the predicted class) instead of the outputs')
+    parser.add_argument('--input-key', dest='input_key', default='X',
+                        help='Name of the input dataset in an HDF5 file')
+    parser.add_argument('--output-key', dest='output_key', default='y',
+                        help='Name of the output dataset in an HDF5 file')
+    parser.add_argument('--has-headers', '-H', dest='has_headers',
+                        action='store_true',
+                        help='The first row of the CSV input file is '
+                             'feature labels')
+    parser.add_argument('--has-row-label', '-L', dest='has_row_label',
+                        action='store_true',
+                        help='The first column of the CSV input file is row '
+                             'labels')
+    parser.add_argument('--delimiter', '-D', default=',',
+                        help='The delimiter of the CSV input file')
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help='Do not load or save the compiled prediction '
+                             'function')
+    parser.add_argument('--report-every', dest='report_every', type=float,
+                        default=10.,
+                        help='Seconds between throughput reports')
+    return parser
+
+
+def load_predictor(model_path, output='raw', cache=True):
+    """
+    Loads a model and its prediction function. The function is loaded
+    from its cache file if it is up to date, or compiled and saved
+    there.
+
+    Parameters
+    ----------
+    model_path : str
+        The pkl file of the model.
+    output : str, optional
+        See `MLP.get_predict_function`.
+    cache : bool, optional
+        Whether to load and save the compiled function.
+
+    Returns
+    -------
+    model : MLP
+        The model, whose `get_predict_function(output)` returns the
+        prediction function without compiling it.
+    """
+    model = serial.load(model_path)
+    if not hasattr(model, 'get_predict_function'):
+        raise TypeError("%s does not contain an MLP, but a %s" %
+                        (model_path, type(model)))
+    cache_path = '%s.predict-%s.pkl' % (model_path, output)
+    if (cache and os.path.exists(cache_path) and
+            os.path.getmtime(cache_path) >= os.path.getmtime(model_path)):
+        try:
+            model.set_predict_function(serial.load(cache_path), output)
+            return model
+        except Exception as e:
+            logger.warning("Could not load the compiled function from %s, "
+                           "compiling it again: %s", cache_path, e)
+    f = model.get_predict_function(output)
+    if cache:
+        try:
+            serial.save(cache_path, f)
+        except Exception as e:
+            logger.warning("Could not save the compiled function to %s: %s",
+                           cache_path, e)
+    return model
+
+
+def read_batches(path, batch_size, input_key='X', headers=False,
+                 first_col_label=False, delimiter=','):
+    """
+    Reads the inputs in batches.
+
+    Parameters
+    ----------
+    path : str
+        A .csv, .npy, .h5 or .hdf5 file.
+    batch_size : int
+        The number of rows per batch.
+    input_key : str, optional
+        The name of the inputs in an HDF5 file.
+    headers : bool, optional
+        Whether the first row of a CSV file is feature labels.
+    first_col_label : bool, optional
+        Whether the first column of a CSV file is row labels.
+    delimiter : str, optional
+        The delimiter of a CSV file.
+
+    Returns
+    -------
+    num_rows : int or None
+        The number of inputs, or None if it is not known in advance
+        (for CSV files).
+    batches : generator
+        Yields the batches, as arrays.
+    """
+    if path.endswith('.csv'):
+        def csv_batches():
+            for batch in iter_csv_chunks(path, delimiter=delimiter,
+                                         skiprows=1 if headers else 0,
+                                         chunk_size=batch_size):
+                if first_col_label:
+                    batch = batch[:, 1:]
+                yield batch
+        return None, csv_batches()
+
+    if path.endswith('.npy'):
+        X = np.load(path, mmap_mode='r')
+        f = None
+    elif is_hdf5(path):
+        import h5py
+        f = h5py.File(path, 'r')
+        X = f[input_key]
+    else:
+        raise ValueError("Unknown input file format: %s" % path)
+
+    def array_batches():
+        try:
+            for start in range(0, X.shape[0], batch_size):
+                yield np.array(X[start:start + batch_size])
+        finally:
+            if f is not None:
+                f.close()
+    return X.shape[0], array_batches()
+
+
+def predict(model_path, input_path, output_path, batch_size=10000,
+            output='raw', input_key='X', output_key='y', headers=False,
+            first_col_label=False, delimiter=',', cache=True,
+            report_every=10.):
+    """
+    Computes the outputs of a model on a file of inputs, writing them
+    to another file.
+
+    Parameters
+    ----------
+    model_path : str
+        The pkl file of the model.
+    input_path : str
+        The .csv, .npy, .h5 or .hdf5 file of inputs.
+    output_path : str
+        The .csv, .npy, .h5 or .hdf5 file to write.
+    batch_size : int, optional
+        The number of inputs processed at a time.
+    output : str, optional
+        'raw' or 'argmax' (see `MLP.get_predict_function`).
+    input_key : str, optional
+        The name of the inputs in an HDF5 file.
+    output_key : str, optional
+        The name of the outputs in an HDF5 file.
+    headers : bool, optional
+        Whether the first row of a CSV input file is feature labels.
+    first_col_label : bool, optional
+        Whether the first column of a CSV input file is row labels.
+    delimiter : str, optional
+        The delimiter of a CSV input file.
+    cache : bool, optional
+        Whether to load and save the compiled prediction function.
+    report_every : float, optional
+        Seconds between throughput reports.
+
+    Returns
+    -------
+    num_rows : int
+        The number of outputs written.
+    """
+    print("loading the model...")
+    model = load_predictor(model_path, output, cache)
+
+    num_rows, batches = read_batches(input_path, batch_size, input_key,
+                                     headers, first_col_label, delimiter)
+    # Read the next batch while the current one is processed
+    batches = prefetch(batches, depth=1)
+    writer = OutputWriter(output_path, num_rows, output_key)
+    start_time = last_report = time.time()
+    try:
+        for Y in model.predict_batches(batches, output):
+            writer.write(Y)
+            now = time.time()
+            if now - last_report >= report_every:
+                last_report = now
+                print("%d rows, %.1f rows/s" %
+                      (writer.written, writer.written / (now - start_time)))
+    finally:
+        batches.close()
+        writer.close()
+    elapsed = max(time.time() - start_time, 1e-6)
+    print("wrote %d rows to %s in %.1f s (%.1f rows/s)" %
+          (writer.written, output_path, elapsed, writer.written / elapsed))
+    return writer.written
+
+
+if __name__ == "__main__":
+    """
+    See module-level docstring for a description of the script.
+    """
+    parser = make_argument_parser()
+    args = parser.parse_args()
+    try:
+        predict(args.model_filename, args.input_filename,
+                args.output_filename, batch_size=args.batch_size,
+                output='argmax' if args.argmax else 'raw',
+                input_key=args.input_key, output_key=args.output_key,
+                headers=args.has_headers, first_col_label=args.has_row_label,
+                delimiter=args.delimiter, cache=args.cache,
+                report_every=args.report_every)
+    except (IOError, ValueError, TypeError) as e:
+        print(e)
+        sys.exit(-1)
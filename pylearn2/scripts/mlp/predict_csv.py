@@ -15,8 +15,9 @@ Optionally it is possible to specify if the prediction is regression or
 classification (default is classification). The predicted variables are
 integer by default.
 Based on this script: http://fastml.com/how-to-get-predictions-from-pylearn2/.
-This script doesn't use batches. If you run out of memory it could be 
-resolved by implementing a batch version.
+The input file is read, and the predictions are written, a chunk of rows
+at a time (see --chunk-size), so the input does not have to fit in
+memory.
 
 """
 from __future__ import print_function
@@ -29,6 +30,7 @@ import os
 import argparse
 import numpy as np
 
+from pylearn2.datasets.csv_dataset import CHUNK_SIZE, iter_csv_chunks
 from pylearn2.utils import serial
 from theano import tensor as T
 from theano import function
@@ -66,10 +68,16 @@ def make_argument_parser():
                         default=',',
                         help="Specifies the CSV delimiter for the test file. Usual values are \
                              comma (default) ',' semicolon ';' colon ':' tabulation '\\t' and space ' '")
+    parser.add_argument('--chunk-size', '-C',
+                        dest='chunk_size',
+                        type=int,
+                        default=CHUNK_SIZE,
+                        help='Number of rows of the input file predicted at a time')
     return parser
 
 def predict(model_path, test_path, output_path, predictionType="classification", outputType="int",
-            headers=False, first_col_label=False, delimiter=","):
+            headers=False, first_col_label=False, delimiter=",",
+            chunk_size=CHUNK_SIZE):
     """
     Predict from a pkl file.
 
@@ -89,6 +97,10 @@ def predict(model_path, test_path, output_path, predictionType="classification",
         Indicates whether the first row in the input file is feature labels
     first_col_label : bool, optional
         Indicates whether the first column in the input file is row labels (e.g. row numbers)
+    delimiter : str, optional
+        The CSV delimiter of the input file.
+    chunk_size : int, optional
+        Number of rows of the input file read and predicted at a time.
     """
 
     print("loading model...")
@@ -112,23 +124,20 @@ def predict(model_path, test_path, output_path, predictionType="classification",
 
     print("loading data and predicting...")
 
-    # x is a numpy array
-    # x = pickle.load(open(test_path, 'rb'))
-    skiprows = 1 if headers else 0
-    x = np.loadtxt(test_path, delimiter=delimiter, skiprows=skiprows)
-
-    if first_col_label:
-        x = x[:,1:]
-
-    y = f(x)
-
-    print("writing predictions...")
-
     variableType = "%d"
     if outputType != "int":
         variableType = "%f"
 
-    np.savetxt(output_path, y, fmt=variableType)
+    skiprows = 1 if headers else 0
+    with open(output_path, 'wb') as output:
+        for x in iter_csv_chunks(test_path, delimiter=delimiter,
+                                 skiprows=skiprows, chunk_size=chunk_size):
+            if first_col_label:
+                x = x[:,1:]
+
+            y = f(x)
+            np.savetxt(output, y, fmt=variableType)
+
     return True
 
 if __name__ == "__main__":
@@ -139,7 +148,7 @@ if __name__ == "__main__":
     args = parser.parse_args()
     ret = predict(args.model_filename, args.test_filename, args.output_filename,
         args.prediction_type, args.output_type,
-        args.has_headers, args.has_row_label, args.delimiter)
+        args.has_headers, args.has_row_label, args.delimiter, args.chunk_size)
     if not ret:
         sys.exit(-1)
 
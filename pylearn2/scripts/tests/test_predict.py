@@ -0,0 +1,46 @@
+"""
+A unit test for the mlp/predict.py script
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from theano import config
+
+from pylearn2.models.mlp import MLP, Softmax
+from pylearn2.scripts.mlp.predict import predict
+from pylearn2.utils import serial
+
+
+def test_predict():
+    """
+    Computes the outputs of a pickled MLP on a .npy file, writing them
+    to a .npy and a .csv file, with and without the cached function.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        mlp = MLP(nvis=4, layers=[Softmax(n_classes=3, layer_name='y',
+                                          irange=0.5)])
+        model_path = os.path.join(tmp_dir, 'model.pkl')
+        serial.save(model_path, mlp)
+        X = np.random.RandomState(0).normal(size=(17, 4)).astype(config.floatX)
+        input_path = os.path.join(tmp_dir, 'X.npy')
+        np.save(input_path, X)
+        expected = mlp.predict(X)
+
+        output_path = os.path.join(tmp_dir, 'y.npy')
+        for i in range(2):
+            assert predict(model_path, input_path, output_path,
+                           batch_size=5) == 17
+            np.testing.assert_allclose(np.load(output_path), expected,
+                                       rtol=1e-5)
+        assert os.path.exists(model_path + '.predict-raw.pkl')
+
+        output_path = os.path.join(tmp_dir, 'y.csv')
+        predict(model_path, input_path, output_path, batch_size=5,
+                output='argmax')
+        np.testing.assert_equal(np.loadtxt(output_path),
+                                expected.argmax(axis=1))
+    finally:
+        shutil.rmtree(tmp_dir)
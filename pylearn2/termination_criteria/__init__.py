@@ -54,6 +54,16 @@ class MonitorBased(TerminationCriterion):
         Name of the channel to examine. If None and the monitor
         has only one channel, this channel will be used; otherwise, an
         error will be raised.
+
+    Notes
+    -----
+    Each value of the channel is examined exactly once. This matters
+    when the monitoring runs asynchronously (see the `monitoring_lag`
+    argument of `pylearn2.train.Train`): `continue_learning` can then be
+    called when no new value is available yet, in which case the
+    countdown does not change, or after several new values arrived, in
+    which case they are all examined, in order. N is thus a number of
+    monitoring steps rather than a number of calls.
     """
     def __init__(self, prop_decrease=.01, N=5, channel_name=None):
         self._channel_name = channel_name
@@ -61,6 +71,7 @@ class MonitorBased(TerminationCriterion):
         self.N = N
         self.countdown = N
         self.best_value = np.inf
+        self._values_seen = None
 
     def continue_learning(self, model):
         """
@@ -88,17 +99,24 @@ class MonitorBased(TerminationCriterion):
         else:
             v = monitor.channels[self._channel_name].val_record
 
-        # The countdown decreases every time the termination criterion is
-        # called unless the channel value is lower than the best value times
-        # the prop_decrease factor, in which case the countdown is reset to N
-        # and the best value is updated
-        if v[-1] < (1. - self.prop_decrease) * self.best_value:
-            self.countdown = self.N
-        else:
-            self.countdown = self.countdown - 1
+        # The first time, only the latest value is examined
+        values_seen = getattr(self, '_values_seen', None)
+        if values_seen is None:
+            values_seen = max(len(v) - 1, 0)
+        self._values_seen = len(v)
 
-        if v[-1] < self.best_value:
-            self.best_value = v[-1]
+        # The countdown decreases for every new value of the channel
+        # unless the value is lower than the best value times the
+        # prop_decrease factor, in which case the countdown is reset to N
+        # and the best value is updated
+        for value in v[values_seen:]:
+            if value < (1. - self.prop_decrease) * self.best_value:
+                self.countdown = self.N
+            else:
+                self.countdown = self.countdown - 1
+
+            if value < self.best_value:
+                self.best_value = value
 
         # The optimization continues until the countdown has reached 0,
         # meaning that N epochs have passed without the model improving
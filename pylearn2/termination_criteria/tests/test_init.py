@@ -3,7 +3,7 @@ Tests for pylearn2.termination_criteria.__init__ functions and classes.
 """
 
 
-from pylearn2.termination_criteria import EpochCounter
+from pylearn2.termination_criteria import EpochCounter, MonitorBased
 
 from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
 from pylearn2.models.mlp import MLP, Softmax
@@ -66,3 +66,30 @@ def test_epoch_counter():
     train_obj = produce_train_obj(new_epochs=False, model=train_obj.model)
     train_obj.main_loop()
     test_epochs(train_obj.model.monitor.get_epochs_seen(), N+1)
+
+
+def test_monitor_based_delayed_values():
+    """
+    Test that MonitorBased examines each value once, even when the
+    values arrive late (asynchronous monitoring).
+    """
+    class Channel(object):
+        val_record = []
+
+    class Monitor(object):
+        channels = {'objective': Channel()}
+
+    class Model(object):
+        monitor = Monitor()
+
+    model = Model()
+    val_record = Model.monitor.channels['objective'].val_record
+    criterion = MonitorBased(N=2)
+    val_record.append(1.)
+    assert criterion.continue_learning(model)
+    # No new value: nothing changes
+    assert criterion.continue_learning(model)
+    assert criterion.continue_learning(model)
+    # Two values without improvement arrive at once
+    val_record.extend([1., 1.])
+    assert not criterion.continue_learning(model)
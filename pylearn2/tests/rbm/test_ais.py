@@ -99,3 +99,38 @@ def test_ais():
 
     # Estimate can be off when using the wrong base-rate model.
     ais_nodata('mnistvh.mat', do_exact=do_exact, betas=betas)
+
+
+def test_ais_small_rbm():
+    """
+    Tests the fused and sharded AIS against the exact log partition
+    function of a small RBM.
+    """
+    rng = numpy.random.RandomState(20150401)
+    rbm_params = [numpy.asarray(0.5 * rng.randn(8, 5), dtype=config.floatX),
+                  numpy.asarray(rng.randn(8), dtype=config.floatX),
+                  numpy.asarray(rng.randn(5), dtype=config.floatX)]
+    exact_logz = compute_logz(rbm_params)
+
+    # Enumerating the states a few at a time gives the same result
+    model = rbm.RBM(8, 5)
+    model.transformer.get_params()[0].set_value(rbm_params[0])
+    model.bias_vis.set_value(rbm_params[1])
+    model.bias_hid.set_value(rbm_params[2])
+    hid = T.matrix('hid')
+    free_energy_fn = theano.function([hid], model.free_energy_given_h(hid))
+    numpy.testing.assert_allclose(
+        rbm_tools.compute_log_z(model, free_energy_fn, max_bits=2),
+        exact_logz, rtol=1e-5)
+
+    betas = numpy.linspace(0, 1, 1001).astype(config.floatX)
+    for steps_per_call, n_jobs in [(1, 1), (100, 1), (100, 2)]:
+        (logz, var_dlogz), ais = rbm_tools.rbm_ais(
+            rbm_params, n_runs=100, seed=123, betas=betas,
+            key_betas=numpy.asarray([0.55], dtype=config.floatX),
+            steps_per_call=steps_per_call, n_jobs=n_jobs)
+        assert abs(logz - exact_logz) < 0.1
+        assert len(ais.logz_beta) == 1
+        assert len(ais.log_ais_w) == 100
+        if n_jobs == 1:
+            assert ais.logz_trace[-1][0] == betas[-1]
@@ -0,0 +1,106 @@
+"""
+Tests for pylearn2.corruption
+"""
+import numpy as np
+import theano
+from theano import config, tensor as T
+from theano.compat.six.moves import cPickle
+
+from pylearn2 import corruption
+
+
+def corrupt(corruptor, X):
+    """
+    Returns a corrupted copy of X.
+
+    Parameters
+    ----------
+    corruptor : Corruptor
+        The corruptor.
+    X : ndarray
+        A minibatch of inputs.
+    """
+    x = T.matrix()
+    return theano.function([x], corruptor(x))(X)
+
+
+def test_binomial_pool():
+    """
+    Tests that BinomialCorruptor drops the same fraction of inputs with
+    and without a noise pool.
+    """
+    X = np.ones((200, 50), dtype=config.floatX)
+    for pool_size in [None, 10 ** 5]:
+        corruptor = corruption.BinomialCorruptor(0.3, pool_size=pool_size)
+        Y = corrupt(corruptor, X)
+        assert np.all((Y == 0) | (Y == 1))
+        assert abs((Y == 0).mean() - 0.3) < 0.02
+
+
+def test_gaussian_pool():
+    """
+    Tests the statistics of the pooled Gaussian noise, and that the
+    pool can be refreshed.
+    """
+    X = np.zeros((200, 50), dtype=config.floatX)
+    corruptor = corruption.GaussianCorruptor(2., pool_size=10 ** 5)
+    x = T.matrix()
+    f = theano.function([x], corruptor(x))
+    Y = f(X)
+    assert abs(Y.mean()) < 0.1
+    assert abs(Y.std() - 2.) < 0.1
+
+    # Refreshing the pool changes the noise of compiled functions
+    values = corruptor._pool.values.get_value()
+    corruptor.refresh_pool()
+    assert not np.all(corruptor._pool.values.get_value() == values)
+    f(X)
+
+    # The pool is not pickled
+    corruptor = cPickle.loads(cPickle.dumps(corruptor))
+    assert corruptor._pool is None
+    assert corrupt(corruptor, X).shape == X.shape
+
+
+def test_salt_pepper_pool():
+    """
+    Tests that SaltPepperCorruptor sets the same fractions of inputs to
+    0 and to 1 with and without a noise pool.
+    """
+    X = 0.5 * np.ones((200, 50), dtype=config.floatX)
+    for pool_size in [None, 10 ** 5]:
+        corruptor = corruption.SaltPepperCorruptor(0.4, pool_size=pool_size)
+        Y = corrupt(corruptor, X)
+        assert abs((Y == 0).mean() - 0.2) < 0.02
+        assert abs((Y == 1).mean() - 0.2) < 0.02
+        assert abs((Y == 0.5).mean() - 0.6) < 0.02
+
+
+def test_one_hot_pool():
+    """
+    Tests that OneHotCorruptor changes the same fraction of rows, and
+    draws the new active elements uniformly, with and without a noise
+    pool.
+    """
+    X = np.zeros((5000, 4), dtype=config.floatX)
+    X[:, 0] = 1
+    for pool_size in [None, 10 ** 5]:
+        corruptor = corruption.OneHotCorruptor(0.5, pool_size=pool_size)
+        Y = corrupt(corruptor, X)
+        assert np.all(Y.sum(axis=1) == 1)
+        counts = Y.sum(axis=0) / len(Y)
+        assert abs(counts[0] - 0.625) < 0.03
+        assert np.all(abs(counts[1:] - 0.125) < 0.02)
+
+
+def test_pool_not_supported():
+    """
+    Tests that corruptors without a pooled implementation refuse a
+    pool size.
+    """
+    try:
+        corruption.SmoothOneHotCorruptor(0.5, pool_size=1000)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("SmoothOneHotCorruptor accepted a pool")
@@ -18,10 +18,11 @@ from pylearn2.monitor import _err_ambig_data
 from pylearn2.monitor import _err_no_data
 from pylearn2.monitor import Monitor
 from pylearn2.monitor import push_monitor
-from pylearn2.space import VectorSpace
+from pylearn2.space import NullSpace, VectorSpace
 from pylearn2.testing.datasets import ArangeDataset
 from pylearn2.training_algorithms.default import DefaultTrainingAlgorithm
 from pylearn2.utils.iteration import _iteration_schemes, has_uniform_batch_size
+from pylearn2.utils.iteration import PrefetchingIterator
 from pylearn2.utils import py_integer_types
 from pylearn2.utils.serial import from_string
 from pylearn2.utils.serial import to_string
@@ -32,6 +33,7 @@ from pylearn2.testing.prereqs import ReadVerifyPrereq
 class DummyModel(Model):
     def  __init__(self, num_features):
         self.input_space = VectorSpace(num_features)
+        self._params = []
 
     def get_default_cost(self):
         return DummyCost()
@@ -109,6 +111,84 @@ def test_channel_scaling_sequential():
     # Specifying both, uneven split, non-exhaustive
     yield channel_scaling_checker, 10, 'sequential', 3, 3
 
+def test_index_plans():
+    # Tests that replaying the batches gives the same values, and that
+    # the budget restricts monitoring to a subset of the examples
+    num_examples = 10
+    num_features = 2
+    dataset = DummyDataset(num_examples, num_features)
+    X = dataset.get_design_matrix()
+    for budget in [None, 6]:
+        monitor = Monitor(DummyModel(num_features))
+        monitor.set_index_plans(budget=budget, seed=[2015, 3, 10])
+        monitor.add_dataset(dataset=dataset, mode='shuffled_sequential',
+                            batch_size=4, seed=[[2015, 3, 10]])
+        vis_batch = T.matrix()
+        data_specs = (monitor.model.get_input_space(),
+                      monitor.model.get_input_source())
+        monitor.add_channel(name='mean', ipt=vis_batch, val=vis_batch.mean(),
+                            dataset=dataset, data_specs=data_specs)
+        monitor()
+        monitor()
+        if budget is None:
+            expected = X.mean()
+        else:
+            assert monitor.num_examples[0] == budget
+            subset = np.concatenate(list(monitor._index_plans[0]()))
+            assert len(np.unique(subset)) == budget
+            expected = X[subset].mean()
+        val_record = monitor.channels['mean'].val_record
+        assert np.allclose(val_record, [expected, expected])
+
+
+def test_async():
+    # Tests that asynchronous monitoring records the values computed on
+    # the snapshot, with the counters and parameters of the snapshot
+    num_features = 2
+    dataset = DummyDataset(10, num_features)
+    model = DummyModel(num_features)
+    param = sharedX(1.)
+    model._params = [param]
+    monitor = Monitor(model)
+    monitor.add_dataset(dataset=dataset, mode='sequential', batch_size=5)
+    monitor.add_channel(name='param', ipt=None, val=param,
+                        dataset=dataset, data_specs=(NullSpace(), ''))
+    monitor.start_async()
+    monitor.report_batch(5)
+    param.set_value(2.)
+    monitor.start_async()
+    assert len(monitor.channels['param'].val_record) == 0
+    param.set_value(3.)
+    counters = []
+    snapshots = []
+    for counter in monitor.collect_async(block=True):
+        counters.append(counter)
+        snapshots.append(float(monitor.get_snapshot_param_values()[0]))
+    assert counters == [(0, 0, 0), (0, 1, 5)]
+    assert snapshots == [1., 2.]
+    assert monitor.get_snapshot_param_values() is None
+    assert param.get_value() == 3.
+    channel = monitor.channels['param']
+    assert np.allclose(channel.val_record, [1., 2.])
+    assert channel.batch_record == [0, 1]
+
+
+def test_async_prefetch_thread():
+    # Tests that asynchronous monitoring refuses to fork while a
+    # prefetching thread is running
+    num_features = 2
+    dataset = DummyDataset(10, num_features)
+    monitor = Monitor(DummyModel(num_features))
+    monitor.add_dataset(dataset=dataset, mode='sequential', batch_size=5)
+    monitor.add_channel(name='param', ipt=None, val=sharedX(1.),
+                        dataset=dataset, data_specs=(NullSpace(), ''))
+    iterator = PrefetchingIterator(iter(xrange(100)), depth=1)
+    assert_raises(RuntimeError, monitor.start_async, prefetchers=[iterator])
+    iterator.close()
+    monitor.start_async(prefetchers=[iterator])
+    assert list(monitor.collect_async(block=True)) == [(0, 0, 0)]
+
+
 def test_counting():
     BATCH_SIZE = 2
     BATCHES = 3
@@ -86,6 +86,48 @@ def test_execution_order():
 
     train.main_loop()
 
+class RecordingCheckpointer(object):
+    """
+    Mock checkpointer recording the calls to `wait`
+    """
+
+    def __init__(self):
+        self.waited = False
+
+    def wait(self):
+        """
+        Record that training waited for the checkpoints
+        """
+        self.waited = True
+
+def test_wait_extension_checkpointers():
+
+    # tests that Train waits for the checkpoints of the extensions to be
+    # written at the end of training
+
+    model = MLP(layers=[Softmax(layer_name='y',
+                                n_classes=2,
+                                irange=0.)],
+                nvis=3)
+
+    dataset = DenseDesignMatrix(X=np.random.normal(size=(6, 3)),
+                                y=np.random.normal(size=(6, 2)))
+
+    algorithm = SGD(batch_size=2, learning_rate=0.1,
+                    termination_criterion=EpochCounter(max_epochs=1))
+
+    extension = TrainExtension()
+    extension.checkpointer = RecordingCheckpointer()
+
+    train = Train(dataset=dataset,
+                  model=model,
+                  algorithm=algorithm,
+                  extensions=[extension])
+
+    train.main_loop()
+
+    assert extension.checkpointer.waited
+
 def test_serialization_guard():
 
     # tests that Train refuses to serialize the dataset
@@ -52,11 +52,36 @@ class Train(object):
         If `True`, will save the model to save_path even if there is
         already something there. Otherwise, will raise an error if the
         `save_path` is already occupied.
+    checkpointer : `pylearn2.utils.checkpoint.Checkpointer`, optional
+        If given, it is used to save the model to `save_path` in the
+        background, instead of pickling the whole model with
+        `serial.save` before resuming training. The result can still be
+        loaded with `serial.load`.
+    monitoring_lag : int, optional
+        If specified, the monitoring channels are computed in a worker
+        process on a snapshot of the model while training continues (see
+        `Monitor.start_async`), instead of pausing training. At most
+        `monitoring_lag` monitoring steps can be running at the same
+        time: training waits for the oldest one before starting a new
+        one when needed. The `on_monitor` method of the extensions is
+        called once for each new data point, when it becomes available,
+        so the channels may lag behind the model by up to
+        `monitoring_lag` epochs: during that call, the channels describe
+        the parameters returned by `monitor.get_snapshot_param_values()`
+        rather than the current parameters of the model (see
+        `TrainExtension.on_monitor`). Only supported when Theano runs on
+        the CPU.
     """
 
     def __init__(self, dataset, model, algorithm=None, save_path=None,
-                 save_freq=0, extensions=None, allow_overwrite=True):
+                 save_freq=0, extensions=None, allow_overwrite=True,
+                 checkpointer=None, monitoring_lag=None):
         self.allow_overwrite = allow_overwrite
+        self.checkpointer = checkpointer
+        if monitoring_lag is not None and monitoring_lag < 1:
+            raise ValueError("monitoring_lag must be at least 1, got %d" %
+                             monitoring_lag)
+        self.monitoring_lag = monitoring_lag
         self.first_save = True
         self.dataset = dataset
         self.model = model
@@ -224,22 +249,69 @@ already been reported."""
                 if not continue_learning:
                     break
 
+        if self.monitoring_lag is not None:
+            # Wait for the last monitoring steps
+            for _ in self.model.monitor.collect_async(block=True):
+                self.run_callbacks()
+
         self.model.monitor.training_succeeded = True
 
         if self.save_freq > 0:
             self.save()
+        # Make sure the checkpoints written in the background by this
+        # object and by the extensions are on disk
+        for checkpointer in self._checkpointers():
+            checkpointer.wait()
 
     def run_callbacks_and_monitoring(self):
         """
         Runs the monitor, then calls Extension.on_monitor for all extensions.
 
+        If `monitoring_lag` is set, starts a new monitoring step in the
+        background instead, and calls Extension.on_monitor for each of
+        the previous steps that are done.
+
+        Returns
+        -------
+        continue_learning : bool
+            If `False`, signals that at least one train
+            extension wants to stop learning.
+        """
+        monitor = self.model.monitor
+        if self.monitoring_lag is None:
+            monitor()
+            return self.run_callbacks()
+        continue_learning = True
+        for _ in monitor.collect_async(max_pending=self.monitoring_lag - 1):
+            continue_learning = self.run_callbacks() and continue_learning
+        prefetcher = getattr(self.algorithm, 'prefetcher', None)
+        monitor.start_async(
+            checkpointers=self._checkpointers(),
+            prefetchers=[prefetcher] if prefetcher is not None else [])
+        return continue_learning
+
+    def _checkpointers(self):
+        """
+        Returns the checkpointers of this object and of the extensions,
+        which may be writing checkpoints in the background.
+        """
+        rval = []
+        for obj in [self] + list(self.extensions):
+            checkpointer = getattr(obj, 'checkpointer', None)
+            if checkpointer is not None and checkpointer not in rval:
+                rval.append(checkpointer)
+        return rval
+
+    def run_callbacks(self):
+        """
+        Calls Extension.on_monitor for all extensions.
+
         Returns
         -------
         continue_learning : bool
             If `False`, signals that at least one train
             extension wants to stop learning.
         """
-        self.model.monitor()
         continue_learning = True
         for extension in self.extensions:
             try:
@@ -272,8 +344,11 @@ already been reported."""
                 try:
                     # Make sure that saving does not serialize the dataset
                     self.dataset._serialization_guard = SerializationGuard()
-                    serial.save(self.save_path, self.model,
-                                on_overwrite='backup')
+                    if self.checkpointer is None:
+                        serial.save(self.save_path, self.model,
+                                    on_overwrite='backup')
+                    else:
+                        self.checkpointer.save(self.save_path, self.model)
                 finally:
                     self.dataset._serialization_guard = None
             self.first_save = False
@@ -47,6 +47,14 @@ class TrainExtension(object):
         Train calls this immediately after each call to the Monitor
         (i.e., when training begins, and at the end of each epoch).
 
+        If `Train.monitoring_lag` is set, this is instead called when
+        each data point computed in the background becomes available,
+        and the channels may describe an earlier snapshot of the model.
+        Extensions that act on the model based on the channels (e.g. to
+        save the best model) should then use the parameters of that
+        snapshot, given by `model.monitor.get_snapshot_param_values()`
+        (None when the channels describe the current parameters).
+
         Parameters
         ----------
         model : pylearn2.models.Model
@@ -103,6 +103,10 @@ class MonitorBasedSaveBest(TrainExtension):
     minimal value of a monitoring channel. Also stores the best model in
     memory.
 
+    When the monitor runs asynchronously (see `Train.monitoring_lag`), the
+    parameters that produced the channel value are saved, not the current
+    parameters of the model.
+
     Parameters
     ----------
     channel_name : str
@@ -118,9 +122,12 @@ class MonitorBasedSaveBest(TrainExtension):
     tag_key : str, optional
         A unique key to use for storing diagnostic information in
         `model.tag`. If `None`, use the class name (default).
+    checkpointer : `pylearn2.utils.checkpoint.Checkpointer`, optional
+        If given, it is used to save the best model to `save_path` in the
+        background instead of `serial.save`.
     """
     def __init__(self, channel_name, save_path=None, store_best_model=False,
-                 higher_is_better=False, tag_key=None):
+                 higher_is_better=False, tag_key=None, checkpointer=None):
         self.channel_name = channel_name
         assert save_path is not None or store_best_model, (
             "Either save_path must be defined or store_best_model must be " +
@@ -128,6 +135,7 @@ class MonitorBasedSaveBest(TrainExtension):
         self.save_path = save_path
         self.store_best_model = store_best_model
         self.higher_is_better = higher_is_better
+        self.checkpointer = checkpointer
         if higher_is_better:
             self.coeff = -1.
         else:
@@ -195,11 +203,26 @@ class MonitorBasedSaveBest(TrainExtension):
             self.best_cost = new_cost
             # Update the tag of the model object before saving it.
             self._update_tag(model)
-            if self.store_best_model:
-                self.best_model = deepcopy(model)
-            if self.save_path is not None:
-                with log_timing(log, 'Saving to ' + self.save_path):
-                    serial.save(self.save_path, model, on_overwrite='backup')
+            # With asynchronous monitoring, the channels were computed on
+            # an earlier snapshot of the parameters, which are saved
+            # instead of the current ones
+            snapshot = monitor.get_snapshot_param_values()
+            if snapshot is not None:
+                current = model.get_param_values()
+                model.set_param_values(snapshot)
+            try:
+                if self.store_best_model:
+                    self.best_model = deepcopy(model)
+                if self.save_path is not None:
+                    with log_timing(log, 'Saving to ' + self.save_path):
+                        if self.checkpointer is None:
+                            serial.save(self.save_path, model,
+                                        on_overwrite='backup')
+                        else:
+                            self.checkpointer.save(self.save_path, model)
+            finally:
+                if snapshot is not None:
+                    model.set_param_values(current)
 
     def _update_tag(self, model):
         """
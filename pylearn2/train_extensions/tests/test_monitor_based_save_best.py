@@ -30,6 +30,10 @@ class MockMonitor(object):
     def __init__(self):
         self.channels = {}
 
+    def get_snapshot_param_values(self):
+        """The channels always describe the current parameters."""
+        return None
+
 
 def test_tagging():
     """Test the tagging functionality of this extension."""
@@ -68,6 +68,11 @@ class WindowAndFlip(TrainExtension):
     An extension that allows an image dataset to be flipped and
     windowed after each epoch of training.
 
+    This keeps a zero-padded copy of each randomized dataset, and
+    rewrites its whole topological view after each epoch. To window and
+    flip the images of each batch as they are requested instead, wrap the
+    dataset in a `pylearn2.datasets.window_flip.WindowAndFlipDataset`.
+
     Parameters
     ----------
     window_shape : WRITEME
@@ -21,6 +21,8 @@ from pylearn2.compat import OrderedDict, first_value
 from pylearn2.monitor import Monitor
 from pylearn2.optimization.batch_gradient_descent import BatchGradientDescent
 from pylearn2.utils.iteration import is_stochastic
+from pylearn2.utils.iteration import FiniteDatasetIterator
+from pylearn2.utils.iteration import PrefetchingIterator, prefetch
 from pylearn2.training_algorithms.training_algorithm import TrainingAlgorithm
 from pylearn2.utils import safe_zip
 from pylearn2.train_extensions import TrainExtension
@@ -88,6 +90,23 @@ class BGD(TrainingAlgorithm):
     theano_function_mode : WRITEME
     init_alpha : WRITEME
     seed : WRITEME
+    prefetch : int, optional
+        If specified, the training and monitoring dataset iterators are
+        wrapped in a `pylearn2.utils.iteration.PrefetchingIterator` that
+        loads up to this many batches ahead in the background.
+    prefetch_backend : str, optional
+        Either 'thread' (default) or 'process'. See
+        `pylearn2.utils.iteration.PrefetchingIterator`.
+    reuse_batch_buffers : bool, optional
+        If True (default), shuffled training batches are gathered into
+        preallocated buffers that are overwritten by later batches,
+        instead of being allocated anew for every batch. Set it to
+        False if an `on_load_batch` callback of the cost keeps
+        references to the batches it receives.
+    monitoring_budget : int, optional
+        If specified, the monitor replays precomputed batches and
+        evaluates each monitoring dataset on a fixed, stratified subset
+        of at most this many examples. See `Monitor.set_index_plans`.
     """
 
     def __init__(self, cost=None, batch_size=None, batches_per_iter=None,
@@ -97,10 +116,14 @@ class BGD(TrainingAlgorithm):
                  reset_alpha=True, conjugate=False, min_init_alpha=.001,
                  reset_conjugate=True, line_search_mode=None,
                  verbose_optimization=False, scale_step=1.,
-                 theano_function_mode=None, init_alpha=None, seed=None):
+                 theano_function_mode=None, init_alpha=None, seed=None,
+                 prefetch=None, prefetch_backend='thread',
+                 reuse_batch_buffers=True, monitoring_budget=None):
 
         self.__dict__.update(locals())
         del self.self
+        # The PrefetchingIterator of the epoch being trained, if any
+        self.prefetcher = None
 
         if monitoring_dataset is None:
             assert monitoring_batches is None
@@ -158,6 +181,9 @@ class BGD(TrainingAlgorithm):
 
         self.monitor = Monitor.get_monitor(model)
         self.monitor.set_theano_function_mode(self.theano_function_mode)
+        self.monitor.set_prefetch(self.prefetch, self.prefetch_backend)
+        if self.monitoring_budget is not None:
+            self.monitor.set_index_plans(budget=self.monitoring_budget)
 
         data_specs = self.cost.get_data_specs(model)
         mapping = DataSpecsMapping(data_specs)
@@ -296,23 +322,34 @@ class BGD(TrainingAlgorithm):
                                     data_specs=flat_data_specs,
                                     return_tuple=True,
                                     rng=rng)
+        if (self.reuse_batch_buffers and
+                isinstance(iterator, FiniteDatasetIterator)):
+            iterator.reuse_buffers(2)
+        iterator = prefetch(iterator, self.prefetch, self.prefetch_backend)
+        if isinstance(iterator, PrefetchingIterator):
+            self.prefetcher = iterator
 
         mode = self.theano_function_mode
-        for data in iterator:
-            if ('targets' in source_tuple and mode is not None
-                    and hasattr(mode, 'record')):
-                Y = data[source_tuple.index('targets')]
-                stry = str(Y).replace('\n', ' ')
-                mode.record.handle_line('data Y ' + stry + '\n')
-
-            for on_load_batch in self.on_load_batch:
-                on_load_batch(mapping.nest(data))
-
-            self.before_step(model)
-            self.optimizer.minimize(*data)
-            self.after_step(model)
-            actual_batch_size = flat_data_specs[0].np_batch_size(data)
-            model.monitor.report_batch(actual_batch_size)
+        try:
+            for data in iterator:
+                if ('targets' in source_tuple and mode is not None
+                        and hasattr(mode, 'record')):
+                    Y = data[source_tuple.index('targets')]
+                    stry = str(Y).replace('\n', ' ')
+                    mode.record.handle_line('data Y ' + stry + '\n')
+
+                for on_load_batch in self.on_load_batch:
+                    on_load_batch(mapping.nest(data))
+
+                self.before_step(model)
+                self.optimizer.minimize(*data)
+                self.after_step(model)
+                actual_batch_size = flat_data_specs[0].np_batch_size(data)
+                model.monitor.report_batch(actual_batch_size)
+        finally:
+            if isinstance(iterator, PrefetchingIterator):
+                iterator.close()
+            self.prefetcher = None
 
     def continue_learning(self, model):
         """
@@ -17,7 +17,6 @@ import warnings
 import numpy as np
 from theano.compat import six
 from theano import config
-from theano import function
 from theano.gof.op import get_debug_values
 
 from pylearn2.compat import OrderedDict, first_key
@@ -29,6 +28,9 @@ from pylearn2.training_algorithms.learning_rule import Momentum
 from pylearn2.training_algorithms.learning_rule import (
     MomentumAdjustor as LRMomentumAdjustor)
 from pylearn2.utils.iteration import is_stochastic, has_uniform_batch_size
+from pylearn2.utils.iteration import FiniteDatasetIterator
+from pylearn2.utils.iteration import PrefetchingIterator, prefetch
+from pylearn2.utils import function
 from pylearn2.utils import py_integer_types, py_float_types
 from pylearn2.utils import safe_zip
 from pylearn2.utils import serial
@@ -149,6 +151,24 @@ class SGD(TrainingAlgorithm):
     seed : valid argument to np.random.RandomState, optional
         The seed used for the random number generate to be passed to the
         training dataset iterator (if any)
+    prefetch : int, optional
+        If specified, the training and monitoring dataset iterators are
+        wrapped in a `pylearn2.utils.iteration.PrefetchingIterator` that
+        loads up to this many batches ahead in the background, while
+        `sgd_update` runs on the current batch.
+    prefetch_backend : str, optional
+        Either 'thread' (default) or 'process'. See
+        `pylearn2.utils.iteration.PrefetchingIterator`.
+    reuse_batch_buffers : bool, optional
+        If True (default), shuffled training batches are gathered into
+        preallocated buffers that are overwritten by later batches,
+        instead of being allocated anew for every batch. Set it to
+        False if an `on_load_batch` callback of the cost keeps
+        references to the batches it receives.
+    monitoring_budget : int, optional
+        If specified, the monitor replays precomputed batches and
+        evaluates each monitoring dataset on a fixed, stratified subset
+        of at most this many examples. See `Monitor.set_index_plans`.
     """
     def __init__(self, learning_rate, cost=None, batch_size=None,
                  monitoring_batch_size=None, monitoring_batches=None,
@@ -158,7 +178,9 @@ class SGD(TrainingAlgorithm):
                  learning_rule=None, set_batch_size=False,
                  train_iteration_mode=None, batches_per_iter=None,
                  theano_function_mode=None, monitoring_costs=None,
-                 seed=[2012, 10, 5]):
+                 seed=[2012, 10, 5], prefetch=None,
+                 prefetch_backend='thread', reuse_batch_buffers=True,
+                 monitoring_budget=None):
 
         if isinstance(cost, (list, tuple, set)):
             raise TypeError("SGD no longer supports using collections of " +
@@ -192,6 +214,12 @@ class SGD(TrainingAlgorithm):
         self.rng = make_np_rng(seed, which_method=["randn", "randint"])
         self.theano_function_mode = theano_function_mode
         self.monitoring_costs = monitoring_costs
+        self.prefetch = prefetch
+        self.prefetch_backend = prefetch_backend
+        self.reuse_batch_buffers = reuse_batch_buffers
+        self.monitoring_budget = monitoring_budget
+        # The PrefetchingIterator of the epoch being trained, if any
+        self.prefetcher = None
 
     def _setup_monitor(self):
         """
@@ -208,6 +236,9 @@ class SGD(TrainingAlgorithm):
                     self.monitoring_batches is None):
                 self.monitoring_batch_size = self.batch_size
                 self.monitoring_batches = self.batches_per_iter
+            self.monitor.set_prefetch(self.prefetch, self.prefetch_backend)
+            if self.monitoring_budget is not None:
+                self.monitor.set_index_plans(budget=self.monitoring_budget)
             self.monitor.setup(dataset=self.monitoring_dataset,
                                cost=self.cost,
                                batch_size=self.monitoring_batch_size,
@@ -399,7 +430,6 @@ class SGD(TrainingAlgorithm):
             self.sgd_update = function(theano_args,
                                        updates=updates,
                                        name='sgd_update',
-                                       on_unused_input='ignore',
                                        mode=self.theano_function_mode)
         self.params = params
 
@@ -447,21 +477,33 @@ class SGD(TrainingAlgorithm):
                                     data_specs=flat_data_specs,
                                     return_tuple=True, rng=rng,
                                     num_batches=self.batches_per_iter)
+        if (self.reuse_batch_buffers and
+                isinstance(iterator, FiniteDatasetIterator)):
+            iterator.reuse_buffers(2)
+        iterator = prefetch(iterator, self.prefetch, self.prefetch_backend)
+        if isinstance(iterator, PrefetchingIterator):
+            self.prefetcher = iterator
 
         on_load_batch = self.on_load_batch
-        for batch in iterator:
-            for callback in on_load_batch:
-                callback(*batch)
-            self.sgd_update(*batch)
-            # iterator might return a smaller batch if dataset size
-            # isn't divisible by batch_size
-            # Note: if data_specs[0] is a NullSpace, there is no way to know
-            # how many examples would actually have been in the batch,
-            # since it was empty, so actual_batch_size would be reported as 0.
-            actual_batch_size = flat_data_specs[0].np_batch_size(batch)
-            self.monitor.report_batch(actual_batch_size)
-            for callback in self.update_callbacks:
-                callback(self)
+        try:
+            for batch in iterator:
+                for callback in on_load_batch:
+                    callback(*batch)
+                self.sgd_update(*batch)
+                # iterator might return a smaller batch if dataset size
+                # isn't divisible by batch_size
+                # Note: if data_specs[0] is a NullSpace, there is no way to
+                # know how many examples would actually have been in the
+                # batch, since it was empty, so actual_batch_size would be
+                # reported as 0.
+                actual_batch_size = flat_data_specs[0].np_batch_size(batch)
+                self.monitor.report_batch(actual_batch_size)
+                for callback in self.update_callbacks:
+                    callback(self)
+        finally:
+            if isinstance(iterator, PrefetchingIterator):
+                iterator.close()
+            self.prefetcher = None
 
         # Make sure none of the parameters have bad values
         for param in self.params:
@@ -1386,6 +1386,53 @@ def test_sgd_sequential():
     assert all(visited)
 
 
+def test_sgd_prefetch():
+
+    # tests that prefetching batches in the background visits every
+    # example exactly once per epoch, in the sequential order
+
+    dim = 1
+    batch_size = 5
+    m = 5 * batch_size
+
+    dataset = ArangeDataset(m)
+
+    model = SoftmaxModel(dim)
+
+    learning_rate = 1e-3
+
+    for backend in ['thread', 'process']:
+        visited = [False] * m
+
+        def visit(X):
+            start = int(X[0, 0])
+            if start > 0:
+                assert visited[start - 1]
+            for i in xrange(X.shape[0]):
+                assert not visited[start + i]
+                visited[start + i] = True
+
+        data_specs = (model.get_input_space(), model.get_input_source())
+        cost = CallbackCost(visit, data_specs)
+
+        algorithm = SGD(learning_rate,
+                        cost,
+                        batch_size=batch_size,
+                        train_iteration_mode='sequential',
+                        monitoring_dataset=dataset,
+                        termination_criterion=EpochCounter(1),
+                        prefetch=2,
+                        prefetch_backend=backend)
+
+        algorithm.setup(dataset=dataset, model=model)
+        assert model.monitor.prefetch == 2
+
+        algorithm.train(dataset)
+
+        assert all(visited)
+        del model.monitor
+
+
 def test_determinism():
 
     # Verifies that running SGD twice results in the same examples getting
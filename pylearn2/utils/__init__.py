@@ -377,8 +377,12 @@ def function(*args, **kwargs):
     A wrapper around theano.function that disables the on_unused_input error.
     Almost no part of pylearn2 can assume that an unused input is an error, so
     the default from theano is inappropriate for this project.
+
+    The function is loaded from the on-disk cache of compiled functions
+    when it is enabled (see `pylearn2.utils.compile`).
     """
-    return theano.function(*args, on_unused_input='ignore', **kwargs)
+    from pylearn2.utils.compile import cached_function
+    return cached_function(*args, on_unused_input='ignore', **kwargs)
 
 
 def grad(*args, **kwargs):
@@ -99,19 +99,22 @@ def random_window_and_flip_c01b(np.ndarray[np.float32_t, ndim=4] images,
         out = np.empty((channels, window_r, window_c, batch),
                        dtype='float32')
     seed = rng.random_integers(4294967295)
-    for example in range(batch):
-        offset_r = rand_r(&seed) % (row_offset_max + 1)
-        offset_c = rand_r(&seed) % (col_offset_max + 1)
-        flip_this = (rand_r(&seed) % 2) & flip
-        for i in range(channels):
-            for j in range(offset_r, offset_r + window_r):
-                for k in range(offset_c, offset_c + window_c):
-                    o_j = j - offset_r
-                    if flip_this:
-                        o_k = window_c - (k - offset_c) - 1
-                    else:
-                        o_k = k - offset_c
-                    out[i, o_j, o_k, example] = images[i, j, k, example]
+    # Release the GIL so that several batches (or parts of a batch)
+    # can be processed concurrently by threads
+    with nogil:
+        for example in range(batch):
+            offset_r = rand_r(&seed) % (row_offset_max + 1)
+            offset_c = rand_r(&seed) % (col_offset_max + 1)
+            flip_this = (rand_r(&seed) % 2) & flip
+            for i in range(channels):
+                for j in range(offset_r, offset_r + window_r):
+                    for k in range(offset_c, offset_c + window_c):
+                        o_j = j - offset_r
+                        if flip_this:
+                            o_k = window_c - (k - offset_c) - 1
+                        else:
+                            o_k = k - offset_c
+                        out[i, o_j, o_k, example] = images[i, j, k, example]
     return out
 
 
@@ -169,17 +172,20 @@ def random_window_and_flip_b01c(np.ndarray[np.float32_t, ndim=4] images,
         out = np.empty((batch, window_r, window_c, channels),
                        dtype='float32')
     seed = rng.random_integers(4294967295)
-    for example in range(batch):
-        offset_r = rand_r(&seed) % (row_offset_max + 1)
-        offset_c = rand_r(&seed) % (col_offset_max + 1)
-        flip_this = (rand_r(&seed) % 2) & flip
-        for j in range(offset_r, offset_r + window_r):
-            for k in range(offset_c, offset_c + window_c):
-                for i in range(channels):
-                    o_j = j - offset_r
-                    if flip_this:
-                        o_k = window_c - (k - offset_c) - 1
-                    else:
-                        o_k = k - offset_c
-                    out[example, o_j, o_k, i] = images[example, j, k, i]
+    # Release the GIL so that several batches (or parts of a batch)
+    # can be processed concurrently by threads
+    with nogil:
+        for example in range(batch):
+            offset_r = rand_r(&seed) % (row_offset_max + 1)
+            offset_c = rand_r(&seed) % (col_offset_max + 1)
+            flip_this = (rand_r(&seed) % 2) & flip
+            for j in range(offset_r, offset_r + window_r):
+                for k in range(offset_c, offset_c + window_c):
+                    for i in range(channels):
+                        o_j = j - offset_r
+                        if flip_this:
+                            o_k = window_c - (k - offset_c) - 1
+                        else:
+                            o_k = k - offset_c
+                        out[example, o_j, o_k, i] = images[example, j, k, i]
     return out
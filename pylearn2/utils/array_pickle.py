@@ -0,0 +1,245 @@
+"""
+An array-aware serialization format, used by `pylearn2.utils.serial` for
+files with the '.apkl' extension.
+
+The object is pickled as usual, except that numpy arrays are replaced by
+references to raw blobs stored after the pickle, in the same file. This
+avoids the copies pickle makes when (de)serializing big arrays, and
+allows loading the arrays lazily by memory-mapping them: loading a model
+only to look at its monitor or its structure does not read its
+parameters from disk.
+
+File layout (all integers are little-endian uint64):
+
+    magic | table offset | pickle length | pickle | blobs | table
+
+Each blob starts on a `ALIGNMENT`-byte boundary. The table is a pickled
+list with, for each array: its offset, its size in bytes in the file,
+its dtype, shape and memory layout, the compression used (if any) and a
+CRC32 checksum of the stored bytes.
+"""
+import os
+import struct
+import zlib
+
+import numpy as np
+from theano.compat import six
+from theano.compat.six.moves import cPickle
+
+MAGIC = b'\x93PL2APKL'
+ALIGNMENT = 64
+# Arrays smaller than this (in bytes) are stored inside the pickle
+MIN_SIZE = 1024
+
+
+def _is_blob(obj, min_size):
+    """
+    Returns True if `obj` is an array that should be stored as a blob.
+    """
+    return (type(obj) in (np.ndarray, np.memmap) and
+            obj.nbytes >= max(min_size, 1) and
+            not obj.dtype.hasobject and obj.dtype.fields is None)
+
+
+def _crc32(data):
+    """
+    Returns the CRC32 checksum of a buffer, as an unsigned int.
+    """
+    return zlib.crc32(data) & 0xffffffff
+
+
+def dump(obj, filepath, compress=False, min_size=MIN_SIZE):
+    """
+    Serializes `obj` to `filepath`.
+
+    The file is first written to a temporary file, which is then
+    renamed, so that arrays memory-mapped from a previous version of the
+    file remain valid.
+
+    Parameters
+    ----------
+    obj : object
+        A picklable object.
+    filepath : str
+        The file to write.
+    compress : bool or int, optional
+        If True, or a zlib compression level, arrays are compressed with
+        zlib. Compressed arrays cannot be memory-mapped when loading.
+    min_size : int, optional
+        Arrays smaller than this many bytes are pickled as usual.
+    """
+    from pylearn2.utils.serial import get_pickle_protocol
+    if compress is True:
+        compress = 6
+
+    arrays = []
+    ids = {}
+
+    def persistent_id(o):
+        if not _is_blob(o, min_size):
+            return None
+        if id(o) not in ids:
+            ids[id(o)] = len(arrays)
+            arrays.append(o)
+        return str(ids[id(o)])
+
+    skeleton = six.BytesIO()
+    pickler = cPickle.Pickler(skeleton, get_pickle_protocol())
+    pickler.persistent_id = persistent_id
+    pickler.dump(obj)
+    skeleton = skeleton.getvalue()
+
+    tmp_path = filepath + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<QQ', 0, len(skeleton)))
+        f.write(skeleton)
+        table = []
+        for array in arrays:
+            fortran_order = (array.flags.f_contiguous and
+                             not array.flags.c_contiguous)
+            if fortran_order:
+                array = array.T
+            data = np.ascontiguousarray(array).data
+            if compress:
+                data = zlib.compress(data, compress)
+            offset = f.tell() + (-f.tell()) % ALIGNMENT
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(data)
+            table.append({'offset': offset,
+                          'nbytes': f.tell() - offset,
+                          'dtype': array.dtype.str,
+                          'shape': array.T.shape if fortran_order
+                          else array.shape,
+                          'fortran_order': fortran_order,
+                          'compression': 'zlib' if compress else None,
+                          'crc32': _crc32(data)})
+        table_offset = f.tell()
+        cPickle.dump(table, f, get_pickle_protocol())
+        f.seek(len(MAGIC))
+        f.write(struct.pack('<Q', table_offset))
+    if os.name == 'nt' and os.path.exists(filepath):
+        os.remove(filepath)
+    os.rename(tmp_path, filepath)
+
+
+def load(filepath, mmap_mode='c', verify=False):
+    """
+    Loads an object saved with `dump`.
+
+    Parameters
+    ----------
+    filepath : str
+        The file to read.
+    mmap_mode : str or None, optional
+        The mode used to memory-map the arrays that are not compressed
+        (see `numpy.memmap`). The default, 'c' (copy-on-write), reads
+        the arrays from disk only when they are accessed, and allows
+        modifying them in memory without changing the file. If None,
+        the arrays are read into memory.
+    verify : bool, optional
+        If True, the checksums of the memory-mapped arrays are verified
+        too, which reads them from disk once.
+
+    Returns
+    -------
+    obj : object
+        The unpickled object.
+
+    Notes
+    -----
+    Checksums are always verified for the arrays that are read into
+    memory: compressed arrays, and all arrays if `mmap_mode` is None.
+    A corrupted array raises a ValueError.
+    """
+    # for loading PY2 pickle in PY3
+    encoding = {'encoding': 'latin-1'} if six.PY3 else {}
+
+    with open(filepath, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not an array pickle file" % filepath)
+        table_offset, skeleton_size = struct.unpack('<QQ', f.read(16))
+        skeleton = f.read(skeleton_size)
+        f.seek(table_offset)
+        table = cPickle.load(f, **encoding)
+
+        arrays = {}
+
+        def persistent_load(pid):
+            if pid not in arrays:
+                arrays[pid] = _load_array(f, filepath, table[int(pid)],
+                                          mmap_mode, verify)
+            return arrays[pid]
+
+        unpickler = cPickle.Unpickler(six.BytesIO(skeleton), **encoding)
+        unpickler.persistent_load = persistent_load
+        return unpickler.load()
+
+
+def _load_array(f, filepath, entry, mmap_mode, verify):
+    """
+    Loads one of the arrays of an array pickle file.
+
+    Parameters
+    ----------
+    f : file
+        The array pickle file, opened for reading.
+    filepath : str
+        The path of `f`.
+    entry : dict
+        The table entry describing the array.
+    mmap_mode : str or None
+        See `load`.
+    verify : bool
+        See `load`.
+    """
+    dtype = np.dtype(entry['dtype'])
+    shape = entry['shape']
+    order = 'F' if entry['fortran_order'] else 'C'
+    if entry['compression'] is None and mmap_mode is not None:
+        if verify:
+            data = np.memmap(filepath, dtype=np.uint8, mode='r',
+                             offset=entry['offset'],
+                             shape=(entry['nbytes'],))
+            _check_crc32(data, entry, filepath)
+        # Return a plain ndarray (still backed by the memory map) since
+        # some code, like theano's, checks for that exact type
+        return np.memmap(filepath, dtype=dtype, mode=mmap_mode,
+                         offset=entry['offset'], shape=shape,
+                         order=order).view(np.ndarray)
+
+    f.seek(entry['offset'])
+    if entry['compression'] is None:
+        data = np.fromfile(f, dtype=np.uint8, count=entry['nbytes'])
+    else:
+        data = f.read(entry['nbytes'])
+    _check_crc32(data, entry, filepath)
+    if entry['compression'] == 'zlib':
+        data = np.frombuffer(zlib.decompress(data), dtype=np.uint8).copy()
+    elif entry['compression'] is not None:
+        raise ValueError("Unknown compression %s in %s" %
+                         (entry['compression'], filepath))
+    # Arrays in Fortran order are stored transposed
+    rows = shape[::-1] if order == 'F' else shape
+    array = data.view(dtype).reshape(rows)
+    return array.T if order == 'F' else array
+
+
+def _check_crc32(data, entry, filepath):
+    """
+    Raises a ValueError if the checksum of the stored bytes of an array
+    does not match its table entry.
+
+    Parameters
+    ----------
+    data : buffer
+        The bytes of the array, as stored in the file.
+    entry : dict
+        The table entry describing the array.
+    filepath : str
+        The path of the file, for the error message.
+    """
+    if _crc32(data) != entry['crc32']:
+        raise ValueError("Checksum mismatch for an array at offset %d of "
+                         "%s, the file is corrupted" %
+                         (entry['offset'], filepath))
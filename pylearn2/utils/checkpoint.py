@@ -0,0 +1,233 @@
+"""
+Asynchronous, incremental checkpointing of models.
+
+`serial.save` pickles the whole model on the training thread, which can
+block training for a long time for large models. A `Checkpointer` only
+copies the parameter values (`Model.get_param_values`) and pickles the
+rest of the model on the calling thread. The parameters are then written
+on a background thread as .npy files named after their content, so that
+tensors that did not change since a previous checkpoint are not written
+again.
+
+The file written at the requested path is a small pickled `Checkpoint`
+manifest. `pylearn2.utils.serial.load` recognizes it and returns the
+fully restored model.
+"""
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+from theano.compat import six
+from theano.compat.six.moves import cPickle, xrange
+
+from pylearn2.utils.serial import get_pickle_protocol
+from pylearn2.utils.string_utils import preprocess
+
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint(object):
+
+    """
+    The manifest of a model checkpoint written by a `Checkpointer`.
+
+    Parameters
+    ----------
+    model_pickle : bytes
+        The pickled model, in which the values of the parameters have
+        been replaced by persistent ids (their index in
+        `model.get_params()`).
+    params : list of str
+        The paths of the .npy files holding the values of the parameters,
+        relative to the directory containing the manifest.
+    """
+
+    def __init__(self, model_pickle, params):
+        self.model_pickle = model_pickle
+        self.params = params
+
+    def restore(self, directory):
+        """
+        Rebuilds the checkpointed model.
+
+        Parameters
+        ----------
+        directory : str
+            The directory containing the manifest.
+
+        Returns
+        -------
+        model : Model
+            The model, with the values of its parameters loaded from
+            the .npy files.
+        """
+        values = [np.load(os.path.join(directory, path))
+                  for path in self.params]
+        # for loading PY2 pickle in PY3
+        encoding = {'encoding': 'latin-1'} if six.PY3 else {}
+        unpickler = cPickle.Unpickler(six.BytesIO(self.model_pickle),
+                                      **encoding)
+        unpickler.persistent_load = lambda pid: values[int(pid)]
+        model = unpickler.load()
+        # The parameters are unpickled as numpy arrays, set them again so
+        # that they end up on the right device.
+        model.set_param_values(values, borrow=True)
+        return model
+
+
+class Checkpointer(object):
+
+    """
+    Saves models to disk in the background.
+
+    Each call to `save` snapshots the parameters of the model in host
+    memory and returns as soon as the rest of the model has been pickled
+    (without the parameters). The parameters are then written by a
+    background thread to a `<path>.params` directory, one .npy file per
+    tensor, named after a hash of its content. Only the tensors that do
+    not already exist there are written. Finally, a `Checkpoint` manifest
+    is atomically moved to `path`.
+
+    At most one checkpoint is written at a time: `save` first waits for
+    the previous one to be done. Errors raised while writing are
+    re-raised by the next call to `save` or `wait`.
+
+    Parameters
+    ----------
+    keep : int, optional
+        Number of checkpoints to keep for each path. The most recent one
+        is always at `path`, the older ones are rotated to `path.1`,
+        `path.2`, etc. The parameter files written by this object that
+        are no longer used by a kept checkpoint are removed.
+    background : bool, optional
+        If False, checkpoints are written synchronously by `save`.
+    """
+
+    def __init__(self, keep=1, background=True):
+        if keep < 1:
+            raise ValueError("keep must be at least 1, got %d" % keep)
+        self.keep = keep
+        self.background = background
+        self._thread = None
+        self._error = None
+        # For each path, the parameter files of the kept checkpoints
+        # (most recent first), and all the parameter files written by
+        # this object.
+        self._kept = {}
+        self._written = {}
+
+    def save(self, path, model):
+        """
+        Checkpoints `model` to `path`.
+
+        Parameters
+        ----------
+        path : str
+            The path of the checkpoint. It can later be loaded with
+            `pylearn2.utils.serial.load`.
+        model : Model
+            The model to save.
+        """
+        self.wait()
+        path = os.path.abspath(preprocess(path))
+        params = model.get_params()
+        param_ids = dict(
+            (id(param.get_value(borrow=True, return_internal_type=True)), i)
+            for i, param in enumerate(params))
+        values = model.get_param_values()
+
+        def persistent_id(obj):
+            i = param_ids.get(id(obj))
+            if i is None:
+                return None
+            return str(i)
+
+        model_file = six.BytesIO()
+        pickler = cPickle.Pickler(model_file, get_pickle_protocol())
+        pickler.persistent_id = persistent_id
+        pickler.dump(model)
+        model_pickle = model_file.getvalue()
+
+        if self.background:
+            self._thread = threading.Thread(
+                target=self._run, args=(path, model_pickle, values))
+            self._thread.start()
+        else:
+            self._write(path, model_pickle, values)
+
+    def wait(self):
+        """
+        Waits until the checkpoint being written, if any, is on disk.
+        """
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self, path, model_pickle, values):
+        """
+        Writes a checkpoint on the background thread, storing the error
+        to re-raise it on the main thread.
+        """
+        try:
+            self._write(path, model_pickle, values)
+        except Exception as e:
+            logger.exception("Failed to write checkpoint %s", path)
+            self._error = e
+
+    def _write(self, path, model_pickle, values):
+        """
+        Writes the parameter files and the manifest of a checkpoint.
+        """
+        directory, name = os.path.split(path)
+        params_dir = name + '.params'
+        if not os.path.isdir(os.path.join(directory, params_dir)):
+            os.makedirs(os.path.join(directory, params_dir))
+        written = self._written.setdefault(path, set())
+
+        files = []
+        for i, value in enumerate(values):
+            value = np.ascontiguousarray(value)
+            digest = hashlib.sha1(
+                ('%s%s' % (value.dtype.str, value.shape)).encode('ascii'))
+            digest.update(value.data if value.size else b'')
+            fname = os.path.join(params_dir,
+                                 'param%d-%s.npy' % (i, digest.hexdigest()))
+            full_name = os.path.join(directory, fname)
+            if not os.path.exists(full_name):
+                with open(full_name + '.tmp', 'wb') as f:
+                    np.save(f, value)
+                _replace(full_name + '.tmp', full_name)
+                written.add(fname)
+            files.append(fname)
+
+        with open(path + '.tmp', 'wb') as f:
+            cPickle.dump(Checkpoint(model_pickle, files), f,
+                         get_pickle_protocol())
+        for i in xrange(self.keep - 1, 0, -1):
+            src = path if i == 1 else '%s.%d' % (path, i - 1)
+            if os.path.exists(src):
+                _replace(src, '%s.%d' % (path, i))
+        _replace(path + '.tmp', path)
+
+        kept = self._kept.setdefault(path, [])
+        kept.insert(0, files)
+        del kept[self.keep:]
+        used = set(fname for files in kept for fname in files)
+        for fname in written - used:
+            os.remove(os.path.join(directory, fname))
+        written &= used
+
+
+def _replace(src, dst):
+    """
+    Renames `src` to `dst`, overwriting it if it exists.
+    """
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
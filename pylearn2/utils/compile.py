@@ -1,12 +1,56 @@
-"""Utilities related to the compilation of Theano functions."""
+"""
+Utilities related to the compilation of Theano functions.
+
+This module also implements an on-disk cache of compiled functions, used
+by `pylearn2.utils.function` (and so by the training algorithms and the
+monitor) when the `PYLEARN2_FUNCTION_CACHE_PATH` environment variable is
+set to the cache directory. A function is cached under a signature of
+its graph: the ops and the structure of the graph, the types and names
+of its shared variables (but not their values), the values of its
+constants, the arguments of `theano.function`, and the Theano version
+and configuration flags. Later runs building a graph with the same
+signature, e.g. the same model trained with different initial
+parameters or learning rates, load the compiled function from the cache
+and rebind it to their own shared variables instead of compiling it
+again. Hyperparameters that are Python numbers (rather than shared
+variables) become constants of the graph, and changing them does change
+the signature.
+
+When the cache is enabled, every function compiled or loaded through
+`cached_function` is logged along with the time it took, and recorded in
+`compile_stats`.
+"""
 import functools
+import hashlib
+import logging
+import os
+import time
+
+import numpy as np
+import theano
+from theano.compat.six.moves import cPickle
+from theano.gof import graph
+from theano.compile.sharedvalue import SharedVariable
 
 __author__ = "David Warde-Farley"
 __copyright__ = "Copyright 2012, David Warde-Farley / Universite de Montreal"
 __license__ = "3-clause BSD"
 __maintainer__ = "David Warde-Farley"
 __email__ = "wardefar@iro"
-__all__ = ["compiled_theano_function", "HasCompiledFunctions"]
+__all__ = ["compiled_theano_function", "HasCompiledFunctions",
+           "cached_function", "graph_signature"]
+
+
+log = logging.getLogger(__name__)
+
+# (name, loaded from the cache, seconds) for each function compiled or
+# loaded by cached_function
+compile_stats = []
+
+# Theano flags that affect compiled functions
+CONFIG_FLAGS = ['floatX', 'device', 'mode', 'linker', 'optimizer',
+                'optimizer_excluding', 'optimizer_including', 'cxx',
+                'gcc.cxxflags', 'cast_policy', 'int_division']
 
 
 def compiled_theano_function(fn):
@@ -82,3 +126,236 @@ class HasCompiledFunctions(object):
         if '_compiled_functions' in state:
             del state['_compiled_functions']
         return state
+
+
+def _config_signature():
+    """
+    Returns the Theano version and the Theano flags that affect
+    compiled functions.
+    """
+    flags = []
+    for flag in CONFIG_FLAGS:
+        value = theano.config
+        try:
+            for part in flag.split('.'):
+                value = getattr(value, part)
+        except AttributeError:
+            value = None
+        flags.append((flag, str(value)))
+    return (getattr(theano, '__version__', None), tuple(flags))
+
+
+def _as_list(x):
+    """
+    Returns `x` as a list of variables or of (variable, variable) pairs.
+    """
+    if x is None:
+        return []
+    if isinstance(x, dict):
+        return list(x.items())
+    if isinstance(x, (list, tuple)):
+        return list(x)
+    return [x]
+
+
+def graph_signature(inputs, outputs=None, updates=None, givens=None,
+                    **kwargs):
+    """
+    Returns a signature of the function `theano.function` would compile
+    from the same arguments, which does not depend on the values of the
+    shared variables.
+
+    Parameters
+    ----------
+    inputs, outputs, updates, givens : see `theano.function`
+    kwargs : dict
+        The other arguments of `theano.function`.
+
+    Returns
+    -------
+    signature : str or None
+        A hexadecimal hash, or None if the function cannot be cached
+        (e.g. it uses `In`/`Out` objects, a custom mode or ops that
+        cannot be pickled).
+    shared : list
+        The shared variables of the graph, in a deterministic order.
+    """
+    mode = kwargs.get('mode')
+    if mode is not None and not isinstance(mode, str):
+        return None, []
+    if isinstance(outputs, dict):
+        return None, []
+    inputs = _as_list(inputs)
+    outputs = _as_list(outputs)
+    updates = _as_list(updates)
+    givens = _as_list(givens)
+    if not all(isinstance(v, theano.Variable) for v in inputs + outputs):
+        return None, []
+
+    roots = list(outputs)
+    for pair in updates + givens:
+        roots.extend(pair)
+    leaves = graph.inputs(roots)
+    # Include the default updates of shared variables (e.g. of random
+    # number generator states), which theano.function applies
+    defaults = []
+    if not kwargs.get('no_default_updates'):
+        defaults = [v.default_update for v in leaves
+                    if getattr(v, 'default_update', None) is not None]
+    if defaults:
+        roots.extend(defaults)
+        leaves = graph.inputs(roots)
+
+    input_positions = dict((v, i) for i, v in enumerate(inputs))
+    index = {}
+    shared = []
+    description = []
+    for v in leaves:
+        index[v] = len(index)
+        if isinstance(v, SharedVariable):
+            shared.append(v)
+            description.append(('shared', str(v.type), v.name))
+        elif isinstance(v, graph.Constant):
+            data = np.asarray(v.data)
+            digest = hashlib.sha1(np.ascontiguousarray(data).tobytes())
+            description.append(('constant', str(v.type), data.dtype.str,
+                                data.shape, digest.hexdigest()))
+        elif v in input_positions:
+            description.append(('input', input_positions[v], str(v.type)))
+        else:
+            description.append(('variable', str(v.type), v.name))
+    try:
+        for node in graph.io_toposort(leaves, roots):
+            op = hashlib.sha1(cPickle.dumps(node.op, 2)).hexdigest()
+            description.append(('apply', op,
+                                tuple(index[i] for i in node.inputs),
+                                tuple(str(o.type) for o in node.outputs)))
+            for o in node.outputs:
+                index[o] = len(index)
+    except (TypeError, AttributeError, cPickle.PicklingError):
+        return None, []
+
+    description.append(('inputs', tuple(index.get(v) for v in inputs)))
+    description.append(('outputs', tuple(index[v] for v in outputs)))
+    description.append(('updates',
+                        tuple((index[k], index[v]) for k, v in updates)))
+    description.append(('givens',
+                        tuple((index[k], index[v]) for k, v in givens)))
+    description.append(('kwargs', tuple(sorted(
+        (key, repr(value)) for key, value in kwargs.items()
+        if key not in ('name', 'profile')))))
+    description.append(('config', _config_signature()))
+    signature = hashlib.sha1(cPickle.dumps(description, 2)).hexdigest()
+    return signature, shared
+
+
+def get_function_cache_dir():
+    """
+    Returns the directory of the function cache, or None if the cache is
+    disabled.
+    """
+    directory = os.environ.get('PYLEARN2_FUNCTION_CACHE_PATH')
+    if not directory:
+        return None
+    return os.path.expanduser(os.path.expandvars(directory))
+
+
+def _load(path, shared, name):
+    """
+    Loads a cached function and rebinds it to the shared variables
+    `shared`. Returns None if this fails.
+    """
+    try:
+        with open(path, 'rb') as f:
+            entry = cPickle.load(f)
+        cached = entry['function']
+        cached_inputs = [i.variable for i in cached.maker.inputs]
+        swap = {}
+        for variable, position in zip(shared, entry['shared_positions']):
+            if position is None:
+                continue
+            old = cached_inputs[position]
+            if str(old.type) != str(variable.type):
+                return None
+            swap[old] = variable
+        for old in cached_inputs:
+            if isinstance(old, SharedVariable) and old not in swap:
+                # The function would keep using a copy of this variable
+                return None
+        return cached.copy(swap=swap, name=name)
+    except Exception as e:
+        # Unreadable entry, or a Theano version without Function.copy
+        log.debug("Could not load the cached function %s: %s", path, e)
+        return None
+
+
+def _store(path, fn, shared):
+    """
+    Pickles a function along with the positions of the shared variables
+    `shared` among its inputs.
+    """
+    inputs = [i.variable for i in fn.maker.inputs]
+    positions = []
+    for variable in shared:
+        matches = [i for i, v in enumerate(inputs) if v is variable]
+        positions.append(matches[0] if matches else None)
+    tmp_path = '%s.%d' % (path, os.getpid())
+    try:
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(tmp_path, 'wb') as f:
+            cPickle.dump({'function': fn, 'shared_positions': positions}, f,
+                         cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+    except Exception as e:
+        log.warning("Could not store the compiled function %s: %s", path, e)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def cached_function(inputs, outputs=None, mode=None, updates=None,
+                    givens=None, **kwargs):
+    """
+    Compiles a Theano function like `theano.function`, or loads it from
+    the function cache if it is enabled and holds a function with the
+    same signature (see the module docstring).
+
+    Parameters
+    ----------
+    inputs, outputs, mode, updates, givens, kwargs : see `theano.function`
+
+    Returns
+    -------
+    fn : theano function
+        The compiled function.
+    """
+    name = kwargs.get('name')
+    directory = get_function_cache_dir()
+    signature = None
+    if directory is not None:
+        signature, shared = graph_signature(inputs, outputs, mode=mode,
+                                            updates=updates, givens=givens,
+                                            **kwargs)
+    t0 = time.time()
+    if signature is not None:
+        path = os.path.join(directory, signature + '.pkl')
+        if os.path.exists(path):
+            fn = _load(path, shared, name)
+            if fn is not None:
+                elapsed = time.time() - t0
+                compile_stats.append((name, True, elapsed))
+                log.info("Loaded %s from the function cache in %.2f s",
+                         name, elapsed)
+                return fn
+
+    fn = theano.function(inputs, outputs, mode=mode, updates=updates,
+                         givens=givens, **kwargs)
+    elapsed = time.time() - t0
+    if directory is not None:
+        compile_stats.append((name, False, elapsed))
+        log.info("Compiled %s in %.2f s%s", name, elapsed,
+                 "" if signature is not None else " (not cacheable)")
+    if signature is not None:
+        _store(path, fn, shared)
+    return fn
@@ -14,9 +14,14 @@ Presets:
 - random_uniform: on each call to next, returns a random subset of the
   dataset. Samples with replacement, but still reports that
   container is empty after num_examples / batch_size calls
+- chunk_shuffled: shuffles the order of chunks of contiguous examples,
+  then the examples of a few chunks at a time, to iterate randomly over
+  datasets that are read from disk in chunks
 """
 from __future__ import division
 
+import multiprocessing
+import threading
 import warnings
 import numpy as np
 from theano.compat import six
@@ -639,12 +644,197 @@ class BatchwiseShuffledSequentialIterator(SequentialSubsetIterator):
     uniform_batch_size = False
 
 
+class ChunkShuffledSubsetIterator(ShuffledSequentialSubsetIterator):
+    """
+    Shuffles the dataset at the granularity of chunks of contiguous
+    examples, for datasets stored on disk in chunks (e.g. HDF5).
+
+    The order of the chunks is shuffled, then the examples of each group
+    of `buffer_chunks` consecutive chunks (in the shuffled order) are
+    shuffled together. Iterating over an epoch thus only needs to read
+    each chunk once, provided that `buffer_chunks` chunks can be kept in
+    memory.
+
+    Use `as_chunk_shuffled` to set the chunk size and the number of
+    chunks shuffled together. By default, the chunks contain
+    `batch_size` examples and `buffer_chunks` of them are shuffled
+    together.
+
+    Notes
+    -----
+    Returns lists of indices (`fancy = True`).
+
+    See :py:class:`SubsetIterator` for detailed constructor parameter
+    and attribute documentation.
+    """
+    # Number of examples per chunk, defaults to the batch size.
+    # Can be set before initialization, see as_chunk_shuffled
+    chunk_size = None
+    # Number of chunks whose examples are shuffled together
+    buffer_chunks = 8
+
+    def __init__(self, dataset_size, batch_size, num_batches, rng=None):
+        SequentialSubsetIterator.__init__(self, dataset_size, batch_size,
+                                          num_batches, None)
+        self._rng = make_np_rng(rng, which_method=["random_integers",
+                                                   "shuffle"])
+        if self.chunk_size is None:
+            self.chunk_size = self._batch_size
+        chunks = np.arange(0, self._dataset_size, self.chunk_size)
+        self._rng.shuffle(chunks)
+        buffers = []
+        for i in six.moves.xrange(0, len(chunks), self.buffer_chunks):
+            buffer = np.concatenate([
+                np.arange(start, min(start + self.chunk_size,
+                                     self._dataset_size))
+                for start in chunks[i:i + self.buffer_chunks]])
+            self._rng.shuffle(buffer)
+            buffers.append(buffer)
+        if buffers:
+            self._shuffled = np.concatenate(buffers)
+        else:
+            self._shuffled = np.arange(0)
+
+
+def as_chunk_shuffled(chunk_size, buffer_chunks=8):
+    """
+    Returns a class iterating over a dataset stored in chunks of
+    `chunk_size` examples, shuffling `buffer_chunks` chunks at a time.
+
+    Parameters
+    ----------
+    chunk_size : int
+        Number of examples per chunk.
+    buffer_chunks : int, optional
+        Number of chunks whose examples are shuffled together.
+
+    Returns
+    -------
+    class
+        An iterator class based on `ChunkShuffledSubsetIterator`.
+    """
+    if chunk_size < 1 or buffer_chunks < 1:
+        raise ValueError("chunk_size and buffer_chunks must be positive, "
+                         "got %d and %d" % (chunk_size, buffer_chunks))
+    dct = {"chunk_size": chunk_size,
+           "buffer_chunks": buffer_chunks}
+    return type("ChunkShuffled%d" % chunk_size,
+                (ChunkShuffledSubsetIterator,), dct)
+
+
+class IndexPlanIterator(SubsetIterator):
+    """
+    Replays a precomputed sequence of batches (an "index plan"), for
+    instance to iterate several times over the same batches without
+    drawing them again, or to iterate over a subset of a dataset.
+    This class needs to be completed using type() metaclass, use
+    `as_index_plan` to do it.
+
+    Parameters
+    ----------
+    dataset_size : int
+        Not used, the batches are already known.
+    batch_size : int, optional
+        Not used, the batches are already known.
+    num_batches : int, optional
+        Not used, the batches are already known.
+    rng : object, optional
+        Not used, the batches are already known.
+    """
+
+    def __init__(self, dataset_size=None, batch_size=None, num_batches=None,
+                 rng=None):
+        if self._batches is None:
+            raise ValueError("You must pre-define the batches by creating a "
+                             "new class using as_index_plan().")
+        self._next_batch_no = 0
+
+    # The batches to replay, and their sizes.
+    # Needs to be set before initialization, see as_index_plan
+    _batches = None
+    _batch_sizes = None
+
+    # Needs to be set before initialization, see as_index_plan
+    fancy = None
+
+    stochastic = False
+    uniform_batch_size = False
+
+    @property
+    def _batch_size(self):
+        return max(self._batch_sizes) if self._batch_sizes else 0
+
+    @property
+    def _num_batches(self):
+        return len(self._batches)
+
+    @property
+    def num_examples(self):
+        """
+        Number of examples that will be visited by the iterator.
+        """
+        return sum(self._batch_sizes)
+
+    @property
+    def uneven(self):
+        """
+        Whether the batches have different sizes.
+        """
+        return len(set(self._batch_sizes)) > 1
+
+    @wraps(SubsetIterator.next)
+    def next(self):
+        if self._next_batch_no >= len(self._batches):
+            raise StopIteration()
+        batch = self._batches[self._next_batch_no]
+        self._next_batch_no += 1
+        return batch
+
+    def __next__(self):
+        return self.next()
+
+
+def as_index_plan(batches, dataset_size):
+    """
+    Returns a class that iterates over a fixed sequence of batches.
+
+    Parameters
+    ----------
+    batches : list
+        The batches, as returned by a `SubsetIterator`: slices or lists
+        (or arrays) of indices.
+    dataset_size : int
+        The number of examples in the dataset the batches index.
+
+    Returns
+    -------
+    class
+        An iterator class based on `IndexPlanIterator`, that can be
+        passed as the `mode` of `Dataset.iterator`.
+    """
+    batches = list(batches)
+    batch_sizes = []
+    for batch in batches:
+        if isinstance(batch, slice):
+            batch_sizes.append(len(range(*batch.indices(dataset_size))))
+        else:
+            batch_sizes.append(len(batch))
+
+    dct = IndexPlanIterator.__dict__.copy()
+    dct["_batches"] = batches
+    dct["_batch_sizes"] = batch_sizes
+    dct["fancy"] = not all(isinstance(batch, slice) for batch in batches)
+
+    return type("IndexPlan", IndexPlanIterator.__bases__, dct)
+
+
 _iteration_schemes = {
     'sequential': SequentialSubsetIterator,
     'shuffled_sequential': ShuffledSequentialSubsetIterator,
     'random_slice': RandomSliceSubsetIterator,
     'random_uniform': RandomUniformSubsetIterator,
     'batchwise_shuffled_sequential': BatchwiseShuffledSequentialIterator,
+    'chunk_shuffled': ChunkShuffledSubsetIterator,
     'even_sequential': as_even(SequentialSubsetIterator),
     'even_shuffled_sequential': as_even(ShuffledSequentialSubsetIterator),
     'even_batchwise_shuffled_sequential':
@@ -729,6 +919,15 @@ class FiniteDatasetIterator(object):
         A list of callables, in the same order as the sources
         in `data_specs`, that will be called on the individual
         source batches prior to any further processing.
+    num_buffers : int, optional
+        If specified, batches selected with fancy indices (e.g. in
+        'shuffled_sequential' mode) are gathered with `np.take` into a
+        ring of `num_buffers` preallocated arrays per source instead of
+        a freshly allocated array per batch. A returned batch is then
+        only valid until `num_buffers` more batches have been drawn,
+        so leave this unset if the consumer keeps references to
+        batches. Batches selected with slices are always views of the
+        underlying data. See also `reuse_buffers`.
 
     Notes
     -----
@@ -742,7 +941,7 @@ class FiniteDatasetIterator(object):
     """
 
     def __init__(self, dataset, subset_iterator, data_specs=None,
-                 return_tuple=False, convert=None):
+                 return_tuple=False, convert=None, num_buffers=None):
         self._data_specs = data_specs
         self._dataset = dataset
         self._subset_iterator = subset_iterator
@@ -832,6 +1031,28 @@ class FiniteDatasetIterator(object):
 
             self._convert[i] = fn
 
+        self.reuse_buffers(num_buffers)
+
+    def reuse_buffers(self, num_buffers):
+        """
+        Sets the number of preallocated buffers, per source, into which
+        fancy-indexed batches are gathered.
+
+        Parameters
+        ----------
+        num_buffers : int or None
+            Size of the ring of output buffers. A batch returned by
+            `next` is overwritten `num_buffers` calls later. None or 0
+            makes every batch a new array, which is the safe choice
+            for consumers that keep references to batches.
+        """
+        if num_buffers is not None and num_buffers < 0:
+            raise ValueError("num_buffers must be positive, got %d" %
+                             num_buffers)
+        self._num_buffers = num_buffers
+        self._buffers = [[None] * (num_buffers or 0) for s in self._source]
+        self._next_buffer = 0
+
     def __iter__(self):
         return self
 
@@ -874,12 +1095,40 @@ class FiniteDatasetIterator(object):
         )
 
     def _fallback_next(self, next_index):
-        # TODO: handle fancy-index copies by allocating a buffer and
-        # using np.take()
-        return tuple(
-            fn(data[next_index]) if fn else data[next_index]
-            for data, fn in safe_izip(self._raw_data, self._convert)
-        )
+        if not self._num_buffers or isinstance(next_index, slice):
+            # Slices of numpy arrays are views, there is nothing to copy
+            return tuple(
+                fn(data[next_index]) if fn else data[next_index]
+                for data, fn in safe_izip(self._raw_data, self._convert)
+            )
+        slot = self._next_buffer
+        self._next_buffer = (slot + 1) % self._num_buffers
+        rval = []
+        for data, fn, ring in safe_izip(self._raw_data, self._convert,
+                                        self._buffers):
+            batch = self._take(data, next_index, ring, slot)
+            rval.append(fn(batch) if fn else batch)
+        return tuple(rval)
+
+    @staticmethod
+    def _take(data, next_index, ring, slot):
+        """
+        Gathers `data[next_index]` into `ring[slot]`, (re)allocating the
+        buffer if it does not have the right shape. Falls back to
+        regular indexing for containers that are not numpy arrays
+        (sparse matrices, PyTables or h5py arrays, ...).
+        """
+        if not isinstance(data, np.ndarray):
+            return data[next_index]
+        shape = (len(next_index),) + data.shape[1:]
+        buf = ring[slot]
+        if buf is None or buf.shape != shape or buf.dtype != data.dtype:
+            buf = np.empty(shape, dtype=data.dtype)
+            ring[slot] = buf
+        # Subset iterators only produce valid indices. mode='raise' would
+        # make np.take use an intermediate buffer, defeating the purpose.
+        np.take(data, next_index, axis=0, out=buf, mode='clip')
+        return buf
 
     def __next__(self):
         return self.next()
@@ -908,3 +1157,230 @@ class FiniteDatasetIterator(object):
     @wraps(SubsetIterator.stochastic, assigned=(), updated=())
     def stochastic(self):
         return self._subset_iterator.stochastic
+
+
+class PrefetchingIterator(object):
+    """
+    A wrapper around data iterators (typically `FiniteDatasetIterator`)
+    that materializes upcoming batches in the background, so that
+    batch N+1 is loaded while the training function runs on batch N.
+
+    Parameters
+    ----------
+    iterator : object
+        The iterator to wrap. It must be exhausted by raising
+        `StopIteration`, and may expose the usual `batch_size`,
+        `num_batches`, `num_examples`, `uneven` and `stochastic`
+        attributes, which are forwarded.
+    depth : int, optional
+        Maximum number of batches held in the queue ahead of the
+        consumer. Defaults to 2.
+    backend : str, optional
+        Either 'thread' (default) or 'process'. The thread backend is
+        cheap and works with any iterator; it helps whenever batch
+        loading releases the GIL (HDF5 reads, NumPy copies). The
+        process backend forks a worker that owns the wrapped iterator
+        and sends batches back through a pipe, which pays off when
+        loading is dominated by Python code.
+
+    Notes
+    -----
+    With the process backend, the wrapped iterator is consumed in the
+    worker, so the random number generator of its subset iterator is
+    not advanced in the parent process by the draws made in `next`
+    (e.g. in 'random_uniform' mode). To avoid replaying the same
+    batches every epoch, a seed is drawn from that generator in the
+    parent, and the worker's copy of the generator is reseeded with it.
+    Batches must also be picklable.
+
+    Call `close` if the consumer stops before the iterator is
+    exhausted, so that the worker can be released.
+
+    If the wrapped iterator reuses its output buffers (see
+    `FiniteDatasetIterator.reuse_buffers`), the ring is enlarged so
+    that queued batches are not overwritten.
+    """
+
+    _sentinel = '__pylearn2_prefetch_end__'
+
+    def __init__(self, iterator, depth=2, backend='thread'):
+        if depth < 1:
+            raise ValueError("PrefetchingIterator needs a depth of at "
+                             "least 1, got %s" % str(depth))
+        if backend not in ('thread', 'process'):
+            raise ValueError("Unknown prefetching backend: %s. Expected "
+                             "'thread' or 'process'." % str(backend))
+        self._iterator = iterator
+        self._depth = depth
+        self._backend = backend
+        self._done = False
+
+        # With the thread backend, up to depth + 2 batches are alive at
+        # once (queued, being consumed and waiting to be queued), so a
+        # ring of reused output buffers must be at least that large.
+        num_buffers = getattr(iterator, '_num_buffers', None)
+        if backend == 'thread' and num_buffers:
+            iterator.reuse_buffers(max(num_buffers, depth + 2))
+
+        # The worker's copy of the subset iterator's rng is reseeded from
+        # the parent's, which this draw advances
+        self._rng = self._seed = None
+        if backend == 'process':
+            subset_iterator = getattr(iterator, '_subset_iterator', iterator)
+            self._rng = getattr(subset_iterator, '_rng', None)
+            if self._rng is not None:
+                self._seed = int(self._rng.randint(2 ** 30))
+
+        if backend == 'thread':
+            self._stop = threading.Event()
+            self._queue = six.moves.queue.Queue(maxsize=depth)
+            self._worker = threading.Thread(target=self._produce,
+                                            args=(self._queue.put,))
+        else:
+            self._stop = multiprocessing.Event()
+            self._queue = multiprocessing.Queue(maxsize=depth)
+            self._worker = multiprocessing.Process(target=self._produce,
+                                                   args=(self._queue.put,))
+        self._worker.daemon = True
+        self._worker.start()
+
+    def _produce(self, put):
+        """
+        Body of the worker: fills the queue until the wrapped iterator
+        is exhausted, an error occurs or `close` is called.
+
+        Parameters
+        ----------
+        put : callable
+            The `put` method of the queue shared with the consumer.
+        """
+        if self._rng is not None:
+            self._rng.seed(self._seed)
+        try:
+            for batch in self._iterator:
+                if not self._put(put, (None, batch)):
+                    return
+        except Exception as e:
+            self._put(put, (e, None))
+            return
+        self._put(put, (self._sentinel, None))
+
+    def _put(self, put, item):
+        """
+        Puts `item` on the queue, periodically checking whether the
+        consumer asked us to stop. Returns False if it did.
+        """
+        while not self._stop.is_set():
+            try:
+                put(item, timeout=0.1)
+                return True
+            except six.moves.queue.Full:
+                pass
+        return False
+
+    def thread_alive(self):
+        """
+        Returns True if batches are being loaded by a background thread
+        of this process, which is still running.
+        """
+        return self._backend == 'thread' and self._worker.is_alive()
+
+    def __iter__(self):
+        return self
+
+    @wraps(SubsetIterator.next)
+    def next(self):
+        if self._done:
+            raise StopIteration()
+        while True:
+            try:
+                error, batch = self._queue.get(timeout=1.)
+                break
+            except six.moves.queue.Empty:
+                if not self._worker.is_alive():
+                    self.close()
+                    raise RuntimeError("The prefetching worker died "
+                                       "without signaling the end of the "
+                                       "iteration.")
+        if error is None:
+            return batch
+        self.close()
+        if isinstance(error, six.string_types) and error == self._sentinel:
+            raise StopIteration()
+        raise error
+
+    def __next__(self):
+        return self.next()
+
+    def close(self):
+        """
+        Stops the background worker and releases the queue. Safe to
+        call several times.
+        """
+        if self._done:
+            return
+        self._done = True
+        self._stop.set()
+        # Unblock a worker waiting on a full queue
+        try:
+            while True:
+                self._queue.get_nowait()
+        except six.moves.queue.Empty:
+            pass
+        self._worker.join(timeout=5.)
+        if self._backend == 'process' and self._worker.is_alive():
+            self._worker.terminate()
+
+    def __del__(self):
+        # __init__ may have failed before the worker was created
+        if hasattr(self, '_worker'):
+            self.close()
+
+    @property
+    @wraps(SubsetIterator.batch_size, assigned=(), updated=())
+    def batch_size(self):
+        return self._iterator.batch_size
+
+    @property
+    @wraps(SubsetIterator.num_batches, assigned=(), updated=())
+    def num_batches(self):
+        return self._iterator.num_batches
+
+    @property
+    @wraps(SubsetIterator.num_examples, assigned=(), updated=())
+    def num_examples(self):
+        return self._iterator.num_examples
+
+    @property
+    @wraps(SubsetIterator.uneven, assigned=(), updated=())
+    def uneven(self):
+        return self._iterator.uneven
+
+    @property
+    @wraps(SubsetIterator.stochastic, assigned=(), updated=())
+    def stochastic(self):
+        return self._iterator.stochastic
+
+
+def prefetch(iterator, depth=None, backend='thread'):
+    """
+    Wraps `iterator` in a `PrefetchingIterator` if `depth` is set.
+
+    Parameters
+    ----------
+    iterator : object
+        A data iterator, e.g. the return value of `Dataset.iterator`.
+    depth : int, optional
+        Number of batches to prefetch. If None or 0, `iterator` is
+        returned unchanged.
+    backend : str, optional
+        See `PrefetchingIterator`.
+
+    Returns
+    -------
+    iterator : object
+        `iterator` itself, or a `PrefetchingIterator` wrapping it.
+    """
+    if not depth:
+        return iterator
+    return PrefetchingIterator(iterator, depth=depth, backend=backend)
@@ -0,0 +1,107 @@
+"""
+Writing arrays to CSV, NumPy or HDF5 files a batch at a time.
+"""
+import os
+
+import numpy as np
+
+
+HDF5_EXTENSIONS = ('.h5', '.hdf5')
+
+
+def is_hdf5(path):
+    """
+    Returns True if `path` has an HDF5 extension.
+
+    Parameters
+    ----------
+    path : str
+        A file name.
+    """
+    return os.path.splitext(path)[1].lower() in HDF5_EXTENSIONS
+
+
+class OutputWriter(object):
+
+    """
+    Writes the outputs to a file, one batch at a time.
+
+    Parameters
+    ----------
+    path : str
+        A .csv, .npy, .h5 or .hdf5 file.
+    num_rows : int or None
+        The number of outputs, if known in advance. Required for .npy
+        files.
+    output_key : str, optional
+        The name of the outputs in an HDF5 file.
+    """
+
+    def __init__(self, path, num_rows, output_key='y'):
+        self.path = path
+        self.num_rows = num_rows
+        self.output_key = output_key
+        self.written = 0
+        self._file = None
+        self._data = None
+        if path.endswith('.csv'):
+            self._file = open(path, 'wb')
+        elif path.endswith('.npy'):
+            if num_rows is None:
+                raise ValueError("Writing a .npy file requires the number "
+                                 "of inputs to be known: use a .npy or HDF5 "
+                                 "input, or a .csv or HDF5 output.")
+        elif is_hdf5(path):
+            import h5py
+            self._file = h5py.File(path, 'w')
+        else:
+            raise ValueError("Unknown output file format: %s" % path)
+
+    def write(self, Y):
+        """
+        Writes the next batch of outputs.
+
+        Parameters
+        ----------
+        Y : ndarray
+            The outputs.
+        """
+        start = self.written
+        if self.path.endswith('.csv'):
+            fmt = '%d' if Y.dtype.kind in 'iu' else '%.8g'
+            np.savetxt(self._file, Y, fmt=fmt)
+        else:
+            if self._data is None:
+                self._create(Y)
+            elif is_hdf5(self.path) and self.num_rows is None:
+                self._data.resize(start + len(Y), axis=0)
+            self._data[start:start + len(Y)] = Y
+        self.written += len(Y)
+
+    def _create(self, Y):
+        """
+        Creates the output array, given the first batch of outputs.
+        """
+        if self.num_rows is not None:
+            shape = (self.num_rows,) + Y.shape[1:]
+        else:
+            shape = Y.shape
+        if self.path.endswith('.npy'):
+            self._data = np.lib.format.open_memmap(self.path, mode='w+',
+                                                   dtype=Y.dtype, shape=shape)
+        else:
+            maxshape = (None,) + Y.shape[1:]
+            self._data = self._file.create_dataset(
+                self.output_key, shape=shape, maxshape=maxshape,
+                dtype=Y.dtype, chunks=(min(len(Y), 65536),) + Y.shape[1:])
+
+    def close(self):
+        """
+        Flushes and closes the output file.
+        """
+        if isinstance(self._data, np.memmap):
+            self._data.flush()
+        self._data = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
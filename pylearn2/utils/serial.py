@@ -16,6 +16,7 @@ import os
 import time
 import warnings
 import sys
+from pylearn2.utils import array_pickle
 from pylearn2.utils.string_utils import preprocess
 from pylearn2.utils.mem import improve_memory_error_message
 io = None
@@ -65,7 +66,7 @@ def raise_cannot_open(path):
     assert False
 
 
-def load(filepath, recurse_depth=0, retry=True):
+def load(filepath, recurse_depth=0, retry=True, verify=False):
     """
     Loads object(s) from file specified by 'filepath'.
 
@@ -77,7 +78,11 @@ def load(filepath, recurse_depth=0, retry=True):
     ----------
     filepath : str
         A path to a file to load. Should be a pickle, Matlab, or NumPy
-        file; or a .txt or .amat file that numpy.loadtxt can load.
+        file; or a .txt or .amat file that numpy.loadtxt can load. If it
+        is a checkpoint written by `pylearn2.utils.checkpoint.Checkpointer`,
+        the model is restored from it. Files with the '.apkl' extension
+        are loaded with `pylearn2.utils.array_pickle`, which memory-maps
+        the arrays they contain.
     recurse_depth : int, optional
         End users should not use this argument. It is used by the function
         itself to implement the `retry` option recursively.
@@ -88,7 +93,13 @@ def load(filepath, recurse_depth=0, retry=True):
         training script--sometimes the load attempt might fail if the
         training script writes at the same time show_weights tries to
         read, but if you try again after a few seconds you should be able
-        to open the file.
+        to open the file. Files with the '.apkl' extension are never
+        retried, since array pickle files are renamed into place once
+        fully written.
+    verify : bool, optional
+        Only used for '.apkl' files. If True, the checksums of the
+        memory-mapped arrays are verified when loading the file (see
+        `pylearn2.utils.array_pickle.load`).
 
     Returns
     -------
@@ -149,6 +160,12 @@ def load(filepath, recurse_depth=0, retry=True):
             time.sleep(nsec)
             return load(filepath, recurse_depth + 1, retry)
 
+    if filepath.endswith('.apkl'):
+        # A bad magic number or checksum means the file is corrupted, so
+        # the errors are not caught to retry
+        obj = array_pickle.load(filepath, verify=verify)
+        return _restore_loaded(filepath, obj)
+
     try:
         if not joblib_available:
             with open(filepath, 'rb') as f:
@@ -192,6 +209,31 @@ def load(filepath, recurse_depth=0, retry=True):
         #assert False
         reraise_as("Couldn't open {0}".format(filepath))
 
+    return _restore_loaded(filepath, obj)
+
+
+def _restore_loaded(filepath, obj):
+    """
+    Restores the model of a checkpoint, and records where the object was
+    loaded from.
+
+    Parameters
+    ----------
+    filepath : str
+        The file the object was loaded from.
+    obj : object
+        The loaded object.
+
+    Returns
+    -------
+    obj : object
+        The object, or the model restored from it if it is a checkpoint.
+    """
+    # Imported here to avoid a circular import
+    from pylearn2.utils.checkpoint import Checkpoint
+    if isinstance(obj, Checkpoint):
+        obj = obj.restore(os.path.dirname(os.path.abspath(filepath)))
+
     #if the object has no yaml_src, we give it one that just says it
     #came from this file. could cause trouble if you save obj again
     #to a different location
@@ -203,7 +245,7 @@ def load(filepath, recurse_depth=0, retry=True):
 
     return obj
 
-def save(filepath, obj, on_overwrite = 'ignore'):
+def save(filepath, obj, on_overwrite = 'ignore', compress=False):
     """
     Serialize `object` to a file denoted by `filepath`.
 
@@ -214,8 +256,10 @@ def save(filepath, obj, on_overwrite = 'ignore'):
         imported, `joblib.dump` is used in place of the regular
         pickling mechanisms; this results in much faster saves by
         saving arrays as separate .npy files on disk. If the file
-        suffix is `.npy` than `numpy.save` is attempted on `obj`.
-        Otherwise, (c)pickle is used.
+        suffix is `.npy` than `numpy.save` is attempted on `obj`. If the
+        suffix is `.apkl`, `pylearn2.utils.array_pickle.dump` is used,
+        which stores arrays as raw blobs that can be memory-mapped when
+        loading. Otherwise, (c)pickle is used.
 
     obj : object
         A Python object to be serialized.
@@ -229,6 +273,11 @@ def save(filepath, obj, on_overwrite = 'ignore'):
           Save the new copy. Then delete the backup copy. This allows
           recovery of the old version of the file if saving the new one
           fails.
+
+    compress : bool or int, optional
+        Only used for '.apkl' files. If True, or a zlib compression
+        level, the arrays are compressed (see
+        `pylearn2.utils.array_pickle.dump`).
     """
     filepath = preprocess(filepath)
 
@@ -236,7 +285,7 @@ def save(filepath, obj, on_overwrite = 'ignore'):
         if on_overwrite == 'backup':
             backup = filepath + '.bak'
             shutil.move(filepath, backup)
-            save(filepath, obj)
+            save(filepath, obj, compress=compress)
             try:
                 os.remove(backup)
             except Exception as e:
@@ -247,7 +296,7 @@ def save(filepath, obj, on_overwrite = 'ignore'):
 
 
     try:
-        _save(filepath, obj)
+        _save(filepath, obj, compress)
     except RuntimeError as e:
         """ Sometimes for large theano graphs, pickle/cPickle exceed the
             maximum recursion depth. This seems to me like a fundamental
@@ -269,7 +318,7 @@ def save(filepath, obj, on_overwrite = 'ignore'):
             old_limit = sys.getrecursionlimit()
             try:
                 sys.setrecursionlimit(50000)
-                _save(filepath, obj)
+                _save(filepath, obj, compress)
             finally:
                 sys.setrecursionlimit(old_limit)
 
@@ -293,7 +342,7 @@ def get_pickle_protocol():
         return pickle.HIGHEST_PROTOCOL
     return int(protocol_str)
 
-def _save(filepath, obj):
+def _save(filepath, obj, compress=False):
     """
     .. todo::
 
@@ -320,7 +369,9 @@ def _save(filepath, obj):
     elif not os.access(save_dir, os.W_OK):
         raise IOError("permission error creating %s" % filepath)
     try:
-        if joblib_available and filepath.endswith('.joblib'):
+        if filepath.endswith('.apkl'):
+            array_pickle.dump(obj, filepath, compress=compress)
+        elif joblib_available and filepath.endswith('.joblib'):
             joblib.dump(obj, filepath)
         else:
             if filepath.endswith('.joblib'):
@@ -0,0 +1,74 @@
+"""
+Tests for pylearn2.utils.array_pickle
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from pylearn2.utils import array_pickle
+from pylearn2.utils import serial
+
+
+def test_array_pickle():
+    """
+    Tests saving and loading arrays with all the options.
+    """
+    rng = np.random.RandomState([2015, 3, 10])
+    big = rng.randn(100, 30)
+    obj = {'big': big,
+           'same': big,
+           'fortran': np.asfortranarray(rng.randn(40, 50).astype('float32')),
+           'strided': big[:, ::2],
+           'small': np.arange(3),
+           'int': rng.randint(0, 10, (300, 7)).astype('int16'),
+           'str': 'hello'}
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'obj.apkl')
+        for compress in [False, True]:
+            array_pickle.dump(obj, path, compress=compress)
+            for mmap_mode in ['c', None]:
+                loaded = array_pickle.load(path, mmap_mode=mmap_mode)
+                assert loaded['str'] == obj['str']
+                assert loaded['same'] is loaded['big']
+                assert loaded['fortran'].flags.f_contiguous
+                for key in ['big', 'fortran', 'strided', 'small', 'int']:
+                    assert type(loaded[key]) is np.ndarray
+                    assert loaded[key].dtype == obj[key].dtype
+                    assert np.all(loaded[key] == obj[key])
+
+        # serial picks the format from the extension
+        for compress in [False, True]:
+            serial.save(path, obj, compress=compress)
+            loaded = serial.load(path, verify=True)
+            assert np.all(loaded['big'] == big)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_array_pickle_checksum():
+    """
+    Tests that corrupted arrays are detected.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'obj.apkl')
+        array_pickle.dump(np.zeros((100, 100)), path)
+        with open(path, 'r+b') as f:
+            f.seek(1000)
+            f.write(b'\1')
+        # The memory-mapped arrays are only checked with verify=True
+        array_pickle.load(path)
+        for load in [lambda: array_pickle.load(path, mmap_mode=None),
+                     lambda: array_pickle.load(path, verify=True),
+                     lambda: serial.load(path, verify=True)]:
+            try:
+                load()
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("The corruption was not detected")
+    finally:
+        shutil.rmtree(tmp_dir)
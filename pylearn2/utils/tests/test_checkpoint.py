@@ -0,0 +1,58 @@
+"""
+Tests for pylearn2.utils.checkpoint
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from pylearn2.models.mlp import MLP, Softmax
+from pylearn2.utils import serial
+from pylearn2.utils.checkpoint import Checkpointer
+
+
+def test_checkpointer():
+    """
+    Tests that checkpoints can be loaded with serial.load, are rotated
+    and do not rewrite parameters that did not change.
+    """
+    model = MLP(layers=[Softmax(n_classes=3, layer_name='y', irange=0.1)],
+                nvis=5)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'model.pkl')
+        params_dir = path + '.params'
+        checkpointer = Checkpointer(keep=2)
+        old_values = model.get_param_values()
+        checkpointer.save(path, model)
+        checkpointer.wait()
+        assert len(os.listdir(params_dir)) == 2
+
+        # Only change the weights
+        W, = [param for param in model.get_params() if param.ndim == 2]
+        W.set_value(W.get_value() + 1.)
+        new_values = model.get_param_values()
+        checkpointer.save(path, model)
+        checkpointer.wait()
+        assert len(os.listdir(params_dir)) == 3
+
+        loaded = serial.load(path)
+        assert isinstance(loaded, MLP)
+        for value, loaded_value in zip(new_values,
+                                       loaded.get_param_values()):
+            assert np.all(value == loaded_value)
+        loaded = serial.load(path + '.1')
+        for value, loaded_value in zip(old_values,
+                                       loaded.get_param_values()):
+            assert np.all(value == loaded_value)
+
+        # The first checkpoint is no longer kept, so the weights it used
+        # are removed
+        W.set_value(W.get_value() + 1.)
+        checkpointer.save(path, model)
+        checkpointer.wait()
+        assert len(os.listdir(params_dir)) == 3
+        assert not os.path.exists(path + '.2')
+    finally:
+        shutil.rmtree(tmp_dir)
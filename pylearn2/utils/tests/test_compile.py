@@ -1,7 +1,13 @@
 """Tests for compilation utilities."""
-import theano
+import os
 import pickle
+import shutil
+import tempfile
+
+import numpy as np
+import theano
 
+from pylearn2.utils import compile, sharedX
 from pylearn2.utils.compile import (
     compiled_theano_function, HasCompiledFunctions
 )
@@ -32,3 +38,36 @@ def test_pickling():
     assert not hasattr(b, '_compiled_functions')
     assert abs(b.func() - Dummy.const) < 1e-6
     assert not (a.func is b.func)
+
+
+def test_cached_function():
+    """
+    Tests that a function with the same graph is loaded from the cache and
+    uses the values of the new shared variables.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    os.environ['PYLEARN2_FUNCTION_CACHE_PATH'] = tmp_dir
+    try:
+        del compile.compile_stats[:]
+        results = []
+        for value in [2., 3.]:
+            x = theano.tensor.vector('x')
+            W = sharedX(value, name='W')
+            f = compile.cached_function([x], x * W, updates=[(W, W + 1.)],
+                                        name='f')
+            results.append(f(np.ones(2, dtype=theano.config.floatX)))
+            assert np.allclose(W.get_value(), value + 1.)
+        assert [loaded for name, loaded, t in compile.compile_stats] == \
+            [False, True]
+        assert np.allclose(results[0], 2.)
+        assert np.allclose(results[1], 3.)
+
+        # A different constant is a different graph
+        x = theano.tensor.vector('x')
+        compile.cached_function([x], x * 2.)
+        compile.cached_function([x], x * 3.)
+        assert [loaded for name, loaded, t in compile.compile_stats[2:]] == \
+            [False, False]
+    finally:
+        del os.environ['PYLEARN2_FUNCTION_CACHE_PATH']
+        shutil.rmtree(tmp_dir)
@@ -5,7 +5,8 @@ from nose.tools import assert_raises
 import numpy as np
 import theano
 from pylearn2.datasets.dense_design_matrix import DenseDesignMatrix
-from pylearn2.space import VectorSpace
+from pylearn2.space import CompositeSpace, VectorSpace
+from pylearn2.utils import safe_izip
 from pylearn2.utils.iteration import (
     SubsetIterator,
     SequentialSubsetIterator,
@@ -13,7 +14,10 @@ from pylearn2.utils.iteration import (
     RandomSliceSubsetIterator,
     RandomUniformSubsetIterator,
     BatchwiseShuffledSequentialIterator,
-    as_even
+    PrefetchingIterator,
+    as_chunk_shuffled,
+    as_even,
+    prefetch
 )
 
 
@@ -149,6 +153,32 @@ def test_batchwise_shuffled_sequential():
         assert iter_slice.step is None or iter_slice.step == 1
 
 
+def test_chunk_shuffled():
+
+    dataset_size = 103
+    chunk_size = 10
+    iterator = as_chunk_shuffled(chunk_size, buffer_chunks=3)(
+        dataset_size, batch_size=7, num_batches=None, rng=1)
+    visited = np.concatenate(list(iterator))
+    assert np.all(np.sort(visited) == np.arange(dataset_size))
+    assert np.any(visited != np.arange(dataset_size))
+
+    # Each group of 3 chunks is visited before moving on to the next one.
+    # The last chunk is shorter, so the group boundaries are computed
+    # from the chunks in the order the iterator shuffles them.
+    starts = np.arange(0, dataset_size, chunk_size)
+    np.random.RandomState(1).shuffle(starts)
+    sizes = np.minimum(starts + chunk_size, dataset_size) - starts
+    bounds = np.append(np.cumsum(sizes)[2::3], dataset_size)
+    chunks = visited // chunk_size
+    start = 0
+    for i, stop in enumerate(bounds):
+        group = set(chunks[start:stop])
+        assert len(group) <= 3
+        assert group == set(starts[3 * i:3 * i + 3] // chunk_size)
+        start = stop
+
+
 def test_uneven_batches():
     dataset_size = 50
     batch_size = 20
@@ -205,3 +235,122 @@ def test_finitedataset_source_check():
                          data_specs=(VectorSpace(15),'featuresX'))
     except ValueError as e:
         assert 'featuresX' in str(e)
+
+
+def test_prefetching_iterator():
+    """
+    Check that PrefetchingIterator yields the same batches, in the same
+    order, as the iterator it wraps, with both backends.
+    """
+    X = np.random.rand(23, 7).astype(theano.config.floatX)
+    y = np.random.rand(23, 2).astype(theano.config.floatX)
+    dataset = DenseDesignMatrix(X=X, y=y)
+    data_specs = (CompositeSpace((VectorSpace(7), VectorSpace(2))),
+                  ('features', 'targets'))
+
+    def make_iterator():
+        return dataset.iterator(mode='shuffled_sequential', batch_size=5,
+                                data_specs=data_specs, return_tuple=True,
+                                rng=np.random.RandomState(3))
+
+    expected = list(make_iterator())
+    for backend in ['thread', 'process']:
+        iterator = PrefetchingIterator(make_iterator(), depth=2,
+                                       backend=backend)
+        assert iterator.num_examples == 23
+        assert iterator.stochastic
+        batches = list(iterator)
+        assert len(batches) == len(expected)
+        for batch, expected_batch in safe_izip(batches, expected):
+            for b, e in safe_izip(batch, expected_batch):
+                assert np.all(b == e)
+
+
+def test_prefetching_iterator_process_rng():
+    """
+    Check that the process backend does not replay the same random
+    batches every epoch, and that it advances the parent's rng.
+    """
+    X = np.arange(100, dtype=theano.config.floatX).reshape(50, 2)
+    dataset = DenseDesignMatrix(X=X)
+    rng = np.random.RandomState(5)
+    epochs = []
+    for epoch in range(2):
+        state = rng.get_state()[1].copy()
+        iterator = dataset.iterator(mode='random_uniform', batch_size=5,
+                                    num_batches=4,
+                                    data_specs=(VectorSpace(2), 'features'),
+                                    rng=rng)
+        epochs.append(np.concatenate(list(
+            PrefetchingIterator(iterator, backend='process'))))
+        assert not np.all(rng.get_state()[1] == state)
+    assert not np.all(epochs[0] == epochs[1])
+
+
+def test_prefetching_iterator_close():
+    """
+    Check that closing a PrefetchingIterator early stops iteration and
+    that prefetch() only wraps iterators when a depth is given.
+    """
+    iterator = PrefetchingIterator(iter(range(1000)), depth=1)
+    assert iterator.next() == 0
+    iterator.close()
+    assert_raises(StopIteration, iterator.next)
+
+    base = iter(range(3))
+    assert prefetch(base, None) is base
+    assert prefetch(base, 0) is base
+    assert isinstance(prefetch(base, 1), PrefetchingIterator)
+    assert_raises(ValueError, PrefetchingIterator, base, 0)
+    assert_raises(ValueError, PrefetchingIterator, base, 1, 'gpu')
+
+
+def test_prefetching_iterator_error():
+    """
+    Check that errors raised while loading a batch are reraised
+    in the consumer.
+    """
+    def failing():
+        yield 1
+        raise ValueError("loading failed")
+
+    for backend in ['thread', 'process']:
+        iterator = PrefetchingIterator(failing(), backend=backend)
+        assert iterator.next() == 1
+        assert_raises(ValueError, iterator.next)
+
+
+def test_finitedataset_reuse_buffers():
+    """
+    Check that FiniteDatasetIterator gathers fancy-indexed batches into a
+    ring of reused buffers, and keeps returning views for slices.
+    """
+    X = np.random.rand(20, 3).astype(theano.config.floatX)
+    dataset = DenseDesignMatrix(X=X)
+    data_specs = (VectorSpace(3), 'features')
+
+    iterator = dataset.iterator(mode='shuffled_sequential', batch_size=6,
+                                data_specs=data_specs,
+                                rng=np.random.RandomState(0))
+    expected = [X[idx] for idx in
+                ShuffledSequentialSubsetIterator(20, 6, None,
+                                                 np.random.RandomState(0))]
+    iterator.reuse_buffers(2)
+    batches = []
+    # Compare each batch before the next one overwrites a reused buffer
+    for i, batch in enumerate(iterator):
+        assert np.all(batch == expected[i])
+        batches.append(batch)
+    assert len(batches) == len(expected)
+    assert batches[0] is batches[2]
+    assert batches[1] is not batches[0]
+    # The uneven last batch needs a buffer of its own size
+    assert batches[3].shape == (2, 3)
+
+    iterator = dataset.iterator(mode='sequential', batch_size=6,
+                                data_specs=data_specs)
+    iterator.reuse_buffers(2)
+    batch = iterator.next()
+    assert np.may_share_memory(batch, X)
+
+    assert_raises(ValueError, iterator.reuse_buffers, -1)